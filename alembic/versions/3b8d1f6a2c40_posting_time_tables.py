@@ -0,0 +1,405 @@
+"""Posting-time tables and constraints
+
+Adds the tables maintained at posting time (movement cube, KPI counters,
+item totals, serial registry, receipt layers, genealogy, reservations,
+posting journal and runs, period close, ledger archive, classification,
+forecast and cycle count statistics) and the constraints added to existing tables: one sequence per
+company and document type, and the ledger lot index.
+
+The application creates missing tables at startup, so tables that already
+exist are skipped. After upgrading a database that already holds postings,
+fill the new tables with: python -m services.derived_tables
+
+Revision ID: 3b8d1f6a2c40
+Revises:
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b8d1f6a2c40'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# The documenttype enum already exists on PostgreSQL (documents_header)
+DOCUMENT_TYPE = postgresql.ENUM(
+    'GRN_RECEIPT', 'RETURN_IN', 'ISSUE', 'RETURN_OUT', 'TRANSFER', 'ADJUSTMENT',
+    'STOCK_COUNT', 'PRODUCTION_ORDER', 'PRODUCTION_ISSUE', 'PRODUCTION_RECEIPT', 'SCRAP',
+    name='documenttype', create_type=False
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+
+    if 'inventory_ledger_archive' not in tables:
+        op.create_table('inventory_ledger_archive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('posting_date', sa.Date(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('warehouse_id', sa.Integer(), nullable=False),
+        sa.Column('location_id', sa.Integer(), nullable=True),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('qty_in', sa.Numeric(precision=18, scale=4), nullable=True),
+        sa.Column('qty_out', sa.Numeric(precision=18, scale=4), nullable=True),
+        sa.Column('unit_cost', sa.Numeric(precision=18, scale=4), nullable=True),
+        sa.Column('value_in', sa.Numeric(precision=18, scale=2), nullable=True),
+        sa.Column('value_out', sa.Numeric(precision=18, scale=2), nullable=True),
+        sa.Column('lot_id', sa.Integer(), nullable=True),
+        sa.Column('serial_id', sa.Integer(), nullable=True),
+        sa.Column('doc_type', DOCUMENT_TYPE, nullable=False),
+        sa.Column('doc_id', sa.Integer(), nullable=False),
+        sa.Column('doc_no', sa.String(length=50), nullable=False),
+        sa.Column('line_no', sa.Integer(), nullable=False),
+        sa.Column('created_by', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id', 'posting_date'),
+        postgresql_partition_by='RANGE (posting_date)'
+        )
+        op.create_index('idx_ledger_archive_company_item', 'inventory_ledger_archive', ['company_id', 'item_id', 'posting_date'], unique=False)
+        op.create_index('idx_ledger_archive_lot', 'inventory_ledger_archive', ['lot_id'], unique=False)
+    if 'closed_periods' not in tables:
+        op.create_table('closed_periods',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('period_start', sa.Date(), nullable=False),
+        sa.Column('period_end', sa.Date(), nullable=False),
+        sa.Column('closed_by', sa.Integer(), nullable=True),
+        sa.Column('closed_at', sa.DateTime(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['closed_by'], ['users.id'], ),
+        sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('company_id', 'period_end', name='uq_closed_period')
+        )
+    if 'kpi_counters' not in tables:
+        op.create_table('kpi_counters',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('scope_id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('period', sa.String(length=10), nullable=False),
+        sa.Column('value', sa.Numeric(precision=18, scale=4), nullable=True),
+        sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('company_id', 'scope_id', 'name', 'period', name='uq_kpi_counter')
+        )
+    if 'posting_runs' not in tables:
+        op.create_table('posting_runs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=True),
+        sa.Column('token', sa.String(length=64), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('posting_date', sa.Date(), nullable=False),
+        sa.Column('document_ids', sa.Text(), nullable=False),
+        sa.Column('total', sa.Integer(), nullable=False),
+        sa.Column('next_index', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(length=10), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('token', name='uq_posting_run_token')
+        )
+    if 'below_reorder_items' not in tables:
+        op.create_table('below_reorder_items',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('since', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+        sa.ForeignKeyConstraint(['item_id'], ['items.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('company_id', 'item_id', name='uq_below_reorder_item')
+        )
+    if 'daily_movements' not in tables:
+        op.create_table('daily_movements',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('warehouse_id', sa.Integer(), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('doc_type', DOCUMENT_TYPE, nullable=False),
+        sa.Column('movement_date', sa.Date(), nullable=False),
+        sa.Column('qty_in', sa.Numeric(precision=18, scale=4), nullable=True),
+        sa.Column('qty_out', sa.Numeric(precision=18, scale=4), nullable=True),
+        sa.Column('value_in', sa.Numeric(precision=18, scale=2), nullable=True),
+        sa.Column('value_out', sa.Numeric(precision=18, scale=2), nullable=True),
+        sa.Column('line_count', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+        sa.ForeignKeyConstraint(['item_id'], ['items.id'], ),
+        sa.ForeignKeyConstraint(['warehouse_id'], ['warehouses.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('company_id', 'warehouse_id', 'item_id', 'doc_type', 'movement_date', name='uq_daily_movement')
+        )
+        op.create_index('idx_daily_movement_date', 'daily_movements', ['company_id', 'movement_date'], unique=False)
+    if 'demand_forecasts' not in tables:
+        op.create_table('demand_forecasts',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('model', sa.String(length=20), nullable=False),
+        sa.Column('weekly_demand', sa.Numeric(precision=18, scale=4), nullable=True),
+        sa.Column('demand_sigma', sa.Numeric(precision=18, scale=4), nullable=True),
+        sa.Column('safety_stock', sa.Numeric(precision=18, scale=4), nullable=True),
+        sa.Column('reorder_point', sa.Numeric(precision=18, scale=4), nullable=True),
+        sa.Column('min_qty', sa.Numeric(precision=18, scale=4), nullable=True),
+        sa.Column('max_qty', sa.Numeric(precision=18, scale=4), nullable=True),
+        sa.Column('weeks', sa.Integer(), nullable=False),
+        sa.Column('forecast_at', sa.DateTime(), nullable=True),
+        sa.Column('applied_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+        sa.ForeignKeyConstraint(['item_id'], ['items.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('company_id', 'item_id', name='uq_demand_forecast')
+        )
+    if 'genealogy_links' not in tables:
+        op.create_table('genealogy_links',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('from_type', sa.String(length=20), nullable=False),
+        sa.Column('from_id', sa.Integer(), nullable=False),
+        sa.Column('to_type', sa.String(length=20), nullable=False),
+        sa.Column('to_id', sa.Integer(), nullable=False),
+        sa.Column('doc_id', sa.Integer(), nullable=False),
+        sa.Column('qty', sa.Numeric(precision=18, scale=4), nullable=True),
+        sa.Column('posting_date', sa.Date(), nullable=False),
+        sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+        sa.ForeignKeyConstraint(['doc_id'], ['documents_header.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('idx_genealogy_from', 'genealogy_links', ['company_id', 'from_type', 'from_id'], unique=False)
+        op.create_index('idx_genealogy_to', 'genealogy_links', ['company_id', 'to_type', 'to_id'], unique=False)
+    if 'item_classifications' not in tables:
+        op.create_table('item_classifications',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('abc_class', sa.String(length=1), nullable=False),
+        sa.Column('xyz_class', sa.String(length=1), nullable=False),
+        sa.Column('consumption_qty', sa.Numeric(precision=18, scale=4), nullable=True),
+        sa.Column('consumption_value', sa.Numeric(precision=18, scale=2), nullable=True),
+        sa.Column('value_share', sa.Numeric(precision=9, scale=6), nullable=True),
+        sa.Column('demand_cv', sa.Numeric(precision=12, scale=4), nullable=True),
+        sa.Column('period_from', sa.Date(), nullable=False),
+        sa.Column('period_to', sa.Date(), nullable=False),
+        sa.Column('classified_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+        sa.ForeignKeyConstraint(['item_id'], ['items.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('company_id', 'item_id', name='uq_item_classification')
+        )
+        op.create_index('idx_item_classification_class', 'item_classifications', ['company_id', 'abc_class', 'xyz_class'], unique=False)
+    if 'item_count_stats' not in tables:
+        op.create_table('item_count_stats',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('warehouse_id', sa.Integer(), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('last_count_date', sa.Date(), nullable=False),
+        sa.Column('count_times', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+        sa.ForeignKeyConstraint(['item_id'], ['items.id'], ),
+        sa.ForeignKeyConstraint(['warehouse_id'], ['warehouses.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('company_id', 'warehouse_id', 'item_id', name='uq_item_count_stat')
+        )
+    if 'item_stock_totals' not in tables:
+        op.create_table('item_stock_totals',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('on_hand_qty', sa.Numeric(precision=18, scale=4), nullable=True),
+        sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+        sa.ForeignKeyConstraint(['item_id'], ['items.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('company_id', 'item_id', name='uq_item_stock_total')
+        )
+    if 'posting_journal' not in tables:
+        op.create_table('posting_journal',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('doc_id', sa.Integer(), nullable=False),
+        sa.Column('attempt', sa.Integer(), nullable=False),
+        sa.Column('token', sa.String(length=64), nullable=True),
+        sa.Column('run_id', sa.Integer(), nullable=True),
+        sa.Column('status', sa.String(length=10), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+        sa.ForeignKeyConstraint(['doc_id'], ['documents_header.id'], ),
+        sa.ForeignKeyConstraint(['run_id'], ['posting_runs.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('doc_id', 'attempt', name='uq_posting_journal_attempt'),
+        sa.UniqueConstraint('token', name='uq_posting_journal_token')
+        )
+        op.create_index('idx_posting_journal_run', 'posting_journal', ['run_id'], unique=False)
+    if 'receipt_layers' not in tables:
+        op.create_table('receipt_layers',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('warehouse_id', sa.Integer(), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('receipt_date', sa.Date(), nullable=False),
+        sa.Column('doc_id', sa.Integer(), nullable=True),
+        sa.Column('qty_remaining', sa.Numeric(precision=18, scale=4), nullable=False),
+        sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+        sa.ForeignKeyConstraint(['doc_id'], ['documents_header.id'], ),
+        sa.ForeignKeyConstraint(['item_id'], ['items.id'], ),
+        sa.ForeignKeyConstraint(['warehouse_id'], ['warehouses.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('idx_receipt_layer_stock', 'receipt_layers', ['company_id', 'warehouse_id', 'item_id', 'receipt_date'], unique=False)
+    if 'reorder_events' not in tables:
+        op.create_table('reorder_events',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('threshold', sa.String(length=20), nullable=False),
+        sa.Column('direction', sa.String(length=10), nullable=False),
+        sa.Column('threshold_qty', sa.Numeric(precision=18, scale=4), nullable=False),
+        sa.Column('qty_before', sa.Numeric(precision=18, scale=4), nullable=False),
+        sa.Column('qty_after', sa.Numeric(precision=18, scale=4), nullable=False),
+        sa.Column('document_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('processed_at', sa.DateTime(), nullable=True),
+        sa.Column('processed_by', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+        sa.ForeignKeyConstraint(['document_id'], ['documents_header.id'], ),
+        sa.ForeignKeyConstraint(['item_id'], ['items.id'], ),
+        sa.ForeignKeyConstraint(['processed_by'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('idx_reorder_event_pending', 'reorder_events', ['company_id', 'processed_at'], unique=False)
+    if 'reserved_stock' not in tables:
+        op.create_table('reserved_stock',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('warehouse_id', sa.Integer(), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('lot_key', sa.Integer(), nullable=False),
+        sa.Column('reserved_qty', sa.Numeric(precision=18, scale=4), nullable=False),
+        sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+        sa.ForeignKeyConstraint(['item_id'], ['items.id'], ),
+        sa.ForeignKeyConstraint(['warehouse_id'], ['warehouses.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('company_id', 'warehouse_id', 'item_id', 'lot_key', name='uq_reserved_stock')
+        )
+    if 'stock_reservations' not in tables:
+        op.create_table('stock_reservations',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('doc_id', sa.Integer(), nullable=False),
+        sa.Column('warehouse_id', sa.Integer(), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('lot_key', sa.Integer(), nullable=False),
+        sa.Column('qty', sa.Numeric(precision=18, scale=4), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+        sa.ForeignKeyConstraint(['doc_id'], ['documents_header.id'], ),
+        sa.ForeignKeyConstraint(['item_id'], ['items.id'], ),
+        sa.ForeignKeyConstraint(['warehouse_id'], ['warehouses.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('idx_stock_reservation_doc', 'stock_reservations', ['doc_id'], unique=False)
+    if 'period_balances' not in tables:
+        op.create_table('period_balances',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('period_end', sa.Date(), nullable=False),
+        sa.Column('warehouse_id', sa.Integer(), nullable=False),
+        sa.Column('location_id', sa.Integer(), nullable=True),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('lot_id', sa.Integer(), nullable=True),
+        sa.Column('serial_id', sa.Integer(), nullable=True),
+        sa.Column('qty', sa.Numeric(precision=18, scale=4), nullable=True),
+        sa.Column('value', sa.Numeric(precision=18, scale=2), nullable=True),
+        sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+        sa.ForeignKeyConstraint(['item_id'], ['items.id'], ),
+        sa.ForeignKeyConstraint(['location_id'], ['locations.id'], ),
+        sa.ForeignKeyConstraint(['lot_id'], ['lots.id'], ),
+        sa.ForeignKeyConstraint(['serial_id'], ['serials.id'], ),
+        sa.ForeignKeyConstraint(['warehouse_id'], ['warehouses.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('idx_period_balance_company', 'period_balances', ['company_id', 'period_end', 'item_id'], unique=False)
+        op.create_index('idx_period_balance_warehouse', 'period_balances', ['warehouse_id', 'period_end', 'item_id'], unique=False)
+    if 'serial_status' not in tables:
+        op.create_table('serial_status',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=False),
+        sa.Column('serial_id', sa.Integer(), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('in_stock', sa.Boolean(), nullable=False),
+        sa.Column('warehouse_id', sa.Integer(), nullable=True),
+        sa.Column('location_id', sa.Integer(), nullable=True),
+        sa.Column('last_doc_id', sa.Integer(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+        sa.ForeignKeyConstraint(['item_id'], ['items.id'], ),
+        sa.ForeignKeyConstraint(['last_doc_id'], ['documents_header.id'], ),
+        sa.ForeignKeyConstraint(['location_id'], ['locations.id'], ),
+        sa.ForeignKeyConstraint(['serial_id'], ['serials.id'], ),
+        sa.ForeignKeyConstraint(['warehouse_id'], ['warehouses.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('serial_id', name='uq_serial_status_serial')
+        )
+        op.create_index('idx_serial_status_warehouse', 'serial_status', ['company_id', 'warehouse_id', 'in_stock'], unique=False)
+
+    if 'uq_doc_sequence' not in {
+        constraint['name'] for constraint in inspector.get_unique_constraints('doc_sequences')
+    }:
+        duplicates = op.get_bind().execute(sa.text(
+            'SELECT company_id, doc_type FROM doc_sequences '
+            'GROUP BY company_id, doc_type HAVING COUNT(*) > 1'
+        )).fetchall()
+        if duplicates:
+            raise RuntimeError(
+                'تسلسلات مستندات مكررة لنفس الشركة ونوع المستند: '
+                + ', '.join(f'{row.company_id}/{row.doc_type}' for row in duplicates)
+            )
+        with op.batch_alter_table('doc_sequences') as batch_op:
+            batch_op.create_unique_constraint('uq_doc_sequence', ['company_id', 'doc_type'])
+
+    if 'idx_ledger_lot' not in {index['name'] for index in inspector.get_indexes('inventory_ledger')}:
+        op.create_index('idx_ledger_lot', 'inventory_ledger', ['lot_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_ledger_lot', table_name='inventory_ledger')
+    with op.batch_alter_table('doc_sequences') as batch_op:
+        batch_op.drop_constraint('uq_doc_sequence', type_='unique')
+
+    op.drop_table('serial_status')
+    op.drop_table('period_balances')
+    op.drop_table('stock_reservations')
+    op.drop_table('reserved_stock')
+    op.drop_table('reorder_events')
+    op.drop_table('receipt_layers')
+    op.drop_table('posting_journal')
+    op.drop_table('item_stock_totals')
+    op.drop_table('item_count_stats')
+    op.drop_table('item_classifications')
+    op.drop_table('genealogy_links')
+    op.drop_table('demand_forecasts')
+    op.drop_table('daily_movements')
+    op.drop_table('below_reorder_items')
+    op.drop_table('posting_runs')
+    op.drop_table('kpi_counters')
+    op.drop_table('closed_periods')
+    op.drop_table('inventory_ledger_archive')
@@ -0,0 +1,37 @@
+"""Production order planned end date
+
+Adds production_orders.planned_end_date, written by the capacity scheduler
+so that the requested completion date is no longer overwritten.
+
+Revision ID: 7c2e5a9d4f13
+Revises: 3b8d1f6a2c40
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c2e5a9d4f13'
+down_revision: Union[str, Sequence[str], None] = '3b8d1f6a2c40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    columns = {column['name'] for column in inspector.get_columns('production_orders')}
+
+    if 'planned_end_date' not in columns:
+        with op.batch_alter_table('production_orders') as batch_op:
+            batch_op.add_column(sa.Column('planned_end_date', sa.Date(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('production_orders') as batch_op:
+        batch_op.drop_column('planned_end_date')
@@ -65,6 +65,13 @@ DOCUMENT_CONFIG = {
     'require_approval': False,  # Approval workflow disabled by default
 }
 
+# Document numbering settings
+SEQUENCE_CONFIG = {
+    'block_size': 20,  # Numbers reserved per process in one UPDATE
+    'gap_policy': 'ALLOW_GAPS',  # ALLOW_GAPS (block allocation) or NO_GAPS (locked per document)
+    'doc_type_policies': {},  # Per document type override, e.g. {'GRN_RECEIPT': 'NO_GAPS'}
+}
+
 # Logging settings
 LOGGING_CONFIG = {
     'level': 'INFO',
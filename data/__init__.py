@@ -7,8 +7,10 @@ from data.database import (
     Base,
     init_db,
     get_engine,
+    get_engine_url,
     get_session,
     session_scope,
+    upsert_increment,
     create_all_tables,
     drop_all_tables
 )
@@ -24,6 +26,11 @@ from data.models import (
 from data.documents import (
     DocumentSequence, DocumentHeader, DocumentLine,
     InventoryLedger, StockBalance,
+    DailyMovement, KPICounter, BelowReorderItem, ItemStockTotal, ReorderEvent,
+    GenealogyLink, SerialStatus, ReceiptLayer, ItemClassification,
+    DemandForecast, ItemCountStat, StockReservation, ReservedStock,
+    PostingRun, PostingJournal,
+    LedgerArchive, ClosedPeriod, PeriodBalance,
     StockCount, StockCountLine
 )
 
@@ -41,7 +48,8 @@ from data.policies import (
 
 __all__ = [
     # Database utilities
-    'Base', 'init_db', 'get_engine', 'get_session', 'session_scope',
+    'Base', 'init_db', 'get_engine', 'get_engine_url', 'get_session', 'session_scope',
+    'upsert_increment',
     'create_all_tables', 'drop_all_tables',
     
     # Enums
@@ -56,6 +64,11 @@ __all__ = [
     # Documents
     'DocumentSequence', 'DocumentHeader', 'DocumentLine',
     'InventoryLedger', 'StockBalance',
+    'DailyMovement', 'KPICounter', 'BelowReorderItem', 'ItemStockTotal', 'ReorderEvent',
+    'GenealogyLink', 'SerialStatus', 'ReceiptLayer', 'ItemClassification',
+    'DemandForecast', 'ItemCountStat', 'StockReservation', 'ReservedStock',
+    'PostingRun', 'PostingJournal',
+    'LedgerArchive', 'ClosedPeriod', 'PeriodBalance',
     'StockCount', 'StockCountLine',
     
     # Security
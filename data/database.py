@@ -18,11 +18,19 @@ _engine = None
 _session_factory = None
 
 
-def init_db(db_type='default', echo=False):
-    """Initialize database engine and session factory"""
+def init_db(db_type='default', echo=False, url=None):
+    """
+    Initialize database engine and session factory
+    
+    Args:
+        db_type: Configured database type (ignored when url is given)
+        echo: Log SQL statements
+        url: Database URL to connect to instead of the configured one
+            (e.g. the parent's database in worker processes)
+    """
     global _engine, _session_factory
     
-    db_url = get_database_url(db_type)
+    db_url = url or get_database_url(db_type)
     
     # Get echo setting from config if not specified
     if db_type == 'default':
@@ -42,6 +50,11 @@ def get_engine():
     return _engine
 
 
+def get_engine_url():
+    """URL of the current engine including its password (for worker processes)"""
+    return get_engine().url.render_as_string(hide_password=False)
+
+
 def get_session():
     """Get a new database session"""
     if _session_factory is None:
@@ -63,6 +76,34 @@ def session_scope():
         session.close()
 
 
+def upsert_increment(session, model, key_columns, rows, increment_columns):
+    """
+    Insert rows, or add their values to existing rows with the same key
+
+    Uses INSERT ... ON CONFLICT DO UPDATE (SQLite and PostgreSQL), so
+    concurrent writers never race on the first insert of a key. The key
+    columns must carry a unique constraint.
+    """
+    if not rows:
+        return
+    
+    if session.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    
+    table = model.__table__
+    statement = insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(key_columns),
+        set_={
+            column: table.c[column] + statement.excluded[column]
+            for column in increment_columns
+        }
+    )
+    session.execute(statement, rows)
+
+
 def create_all_tables():
     """Create all database tables"""
     # Import all models to register them with Base.metadata
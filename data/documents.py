@@ -6,7 +6,7 @@ Document and Ledger models
 from datetime import datetime
 from sqlalchemy import (
     Column, Integer, String, DateTime, Date, Boolean, Numeric,
-    ForeignKey, Text, Enum, Index
+    ForeignKey, Text, Enum, Index, UniqueConstraint
 )
 from sqlalchemy.orm import relationship
 
@@ -24,6 +24,10 @@ class DocumentSequence(Base):
     next_number = Column(Integer, default=1)
     padding = Column(Integer, default=6)  # Number of digits
     
+    __table_args__ = (
+        UniqueConstraint('company_id', 'doc_type', name='uq_doc_sequence'),
+    )
+    
     def get_next_doc_no(self):
         """Generate next document number"""
         doc_no = f"{self.prefix}{str(self.next_number).zfill(self.padding)}"
@@ -188,6 +192,7 @@ class InventoryLedger(Base):
         Index('idx_ledger_company_item', 'company_id', 'item_id'),
         Index('idx_ledger_warehouse_item', 'warehouse_id', 'item_id'),
         Index('idx_ledger_doc', 'doc_type', 'doc_id'),
+        Index('idx_ledger_lot', 'lot_id'),
     )
     
     def __repr__(self):
@@ -232,6 +237,430 @@ class StockBalance(Base):
         return f"<StockBalance(id={self.id}, warehouse_id={self.warehouse_id}, item_id={self.item_id}, on_hand_qty={self.on_hand_qty})>"
 
 
+class DailyMovement(Base):
+    """Ledger movements pre-aggregated per day, maintained at posting time"""
+    __tablename__ = 'daily_movements'
+
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey('companies.id'), nullable=False)
+    warehouse_id = Column(Integer, ForeignKey('warehouses.id'), nullable=False)
+    item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
+    doc_type = Column(Enum(DocumentType), nullable=False)
+    movement_date = Column(Date, nullable=False)
+
+    qty_in = Column(Numeric(18, 4), default=0)
+    qty_out = Column(Numeric(18, 4), default=0)
+    value_in = Column(Numeric(18, 2), default=0)
+    value_out = Column(Numeric(18, 2), default=0)
+    line_count = Column(Integer, default=0)  # Ledger entries aggregated
+
+    __table_args__ = (
+        UniqueConstraint('company_id', 'warehouse_id', 'item_id', 'doc_type', 'movement_date',
+                         name='uq_daily_movement'),
+        Index('idx_daily_movement_date', 'company_id', 'movement_date'),
+    )
+
+    def __repr__(self):
+        return f"<DailyMovement(movement_date={self.movement_date}, warehouse_id={self.warehouse_id}, item_id={self.item_id}, doc_type='{self.doc_type}')>"
+
+
+class KPICounter(Base):
+    """Dashboard counters maintained at posting time"""
+    __tablename__ = 'kpi_counters'
+
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey('companies.id'), nullable=False)
+    scope_id = Column(Integer, nullable=False, default=0)  # Warehouse ID, 0 = whole company
+    name = Column(String(50), nullable=False)
+    period = Column(String(10), nullable=False, default='')  # '' = running total, else YYYY-MM-DD
+    value = Column(Numeric(18, 4), default=0)
+
+    __table_args__ = (
+        UniqueConstraint('company_id', 'scope_id', 'name', 'period', name='uq_kpi_counter'),
+    )
+
+    def __repr__(self):
+        return f"<KPICounter(company_id={self.company_id}, scope_id={self.scope_id}, name='{self.name}', period='{self.period}', value={self.value})>"
+
+
+class BelowReorderItem(Base):
+    """Items whose total on-hand is at or below their reorder point"""
+    __tablename__ = 'below_reorder_items'
+
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey('companies.id'), nullable=False)
+    item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
+    since = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('company_id', 'item_id', name='uq_below_reorder_item'),
+    )
+
+    def __repr__(self):
+        return f"<BelowReorderItem(company_id={self.company_id}, item_id={self.item_id})>"
+
+
+class ItemStockTotal(Base):
+    """Total on-hand quantity of an item across all warehouses"""
+    __tablename__ = 'item_stock_totals'
+
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey('companies.id'), nullable=False)
+    item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
+    on_hand_qty = Column(Numeric(18, 4), default=0)
+
+    __table_args__ = (
+        UniqueConstraint('company_id', 'item_id', name='uq_item_stock_total'),
+    )
+
+    def __repr__(self):
+        return f"<ItemStockTotal(company_id={self.company_id}, item_id={self.item_id}, qty={self.on_hand_qty})>"
+
+
+class ReorderEvent(Base):
+    """Queued crossing of an item's stock threshold"""
+    __tablename__ = 'reorder_events'
+
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey('companies.id'), nullable=False)
+    item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
+    threshold = Column(String(20), nullable=False)  # REORDER_POINT, MIN_QTY, SAFETY_STOCK
+    direction = Column(String(10), nullable=False)  # BELOW, RECOVERED
+    threshold_qty = Column(Numeric(18, 4), nullable=False)
+    qty_before = Column(Numeric(18, 4), nullable=False)
+    qty_after = Column(Numeric(18, 4), nullable=False)
+    document_id = Column(Integer, ForeignKey('documents_header.id'))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    processed_at = Column(DateTime)
+    processed_by = Column(Integer, ForeignKey('users.id'))
+
+    __table_args__ = (
+        Index('idx_reorder_event_pending', 'company_id', 'processed_at'),
+    )
+
+    def __repr__(self):
+        return f"<ReorderEvent(item_id={self.item_id}, threshold='{self.threshold}', direction='{self.direction}')>"
+
+
+class SerialStatus(Base):
+    """Current state of a serial number (one row per serial)"""
+    __tablename__ = 'serial_status'
+
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey('companies.id'), nullable=False)
+    serial_id = Column(Integer, ForeignKey('serials.id'), nullable=False)
+    item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
+    in_stock = Column(Boolean, nullable=False, default=False)
+    warehouse_id = Column(Integer, ForeignKey('warehouses.id'))  # Last warehouse
+    location_id = Column(Integer, ForeignKey('locations.id'))
+    last_doc_id = Column(Integer, ForeignKey('documents_header.id'))
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('serial_id', name='uq_serial_status_serial'),
+        Index('idx_serial_status_warehouse', 'company_id', 'warehouse_id', 'in_stock'),
+    )
+
+    def __repr__(self):
+        return f"<SerialStatus(serial_id={self.serial_id}, in_stock={self.in_stock}, warehouse_id={self.warehouse_id})>"
+
+
+class ReceiptLayer(Base):
+    """Remaining quantity of one receipt, consumed first-in first-out"""
+    __tablename__ = 'receipt_layers'
+
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey('companies.id'), nullable=False)
+    warehouse_id = Column(Integer, ForeignKey('warehouses.id'), nullable=False)
+    item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
+    receipt_date = Column(Date, nullable=False)  # Original receipt date, kept across transfers
+    doc_id = Column(Integer, ForeignKey('documents_header.id'))
+    qty_remaining = Column(Numeric(18, 4), nullable=False)
+
+    __table_args__ = (
+        Index('idx_receipt_layer_stock', 'company_id', 'warehouse_id', 'item_id', 'receipt_date'),
+    )
+
+    def __repr__(self):
+        return f"<ReceiptLayer(warehouse_id={self.warehouse_id}, item_id={self.item_id}, receipt_date={self.receipt_date}, qty={self.qty_remaining})>"
+
+
+class ItemClassification(Base):
+    """ABC (consumption value) and XYZ (demand variability) class of an item"""
+    __tablename__ = 'item_classifications'
+
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey('companies.id'), nullable=False)
+    item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
+    abc_class = Column(String(1), nullable=False)
+    xyz_class = Column(String(1), nullable=False)
+    consumption_qty = Column(Numeric(18, 4), default=0)
+    consumption_value = Column(Numeric(18, 2), default=0)
+    value_share = Column(Numeric(9, 6), default=0)  # Cumulative share at this item
+    demand_cv = Column(Numeric(12, 4))  # Coefficient of variation, NULL when no demand
+    period_from = Column(Date, nullable=False)
+    period_to = Column(Date, nullable=False)
+    classified_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('company_id', 'item_id', name='uq_item_classification'),
+        Index('idx_item_classification_class', 'company_id', 'abc_class', 'xyz_class'),
+    )
+
+    def __repr__(self):
+        return f"<ItemClassification(item_id={self.item_id}, class='{self.abc_class}{self.xyz_class}')>"
+
+
+class DemandForecast(Base):
+    """Weekly demand forecast and proposed reorder parameters of an item"""
+    __tablename__ = 'demand_forecasts'
+
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey('companies.id'), nullable=False)
+    item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
+    model = Column(String(20), nullable=False)  # MOVING_AVERAGE, EXP_SMOOTHING, CROSTON
+    weekly_demand = Column(Numeric(18, 4), default=0)
+    demand_sigma = Column(Numeric(18, 4), default=0)  # Std. deviation of one-week forecast error
+    safety_stock = Column(Numeric(18, 4), default=0)
+    reorder_point = Column(Numeric(18, 4), default=0)
+    min_qty = Column(Numeric(18, 4), default=0)
+    max_qty = Column(Numeric(18, 4), default=0)
+    weeks = Column(Integer, nullable=False)
+    forecast_at = Column(DateTime, default=datetime.utcnow)
+    applied_at = Column(DateTime)
+
+    __table_args__ = (
+        UniqueConstraint('company_id', 'item_id', name='uq_demand_forecast'),
+    )
+
+    def __repr__(self):
+        return f"<DemandForecast(item_id={self.item_id}, model='{self.model}', weekly={self.weekly_demand})>"
+
+
+class ItemCountStat(Base):
+    """When an item was last counted in a warehouse"""
+    __tablename__ = 'item_count_stats'
+
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey('companies.id'), nullable=False)
+    warehouse_id = Column(Integer, ForeignKey('warehouses.id'), nullable=False)
+    item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
+    last_count_date = Column(Date, nullable=False)
+    count_times = Column(Integer, default=0)
+
+    __table_args__ = (
+        UniqueConstraint('company_id', 'warehouse_id', 'item_id', name='uq_item_count_stat'),
+    )
+
+    def __repr__(self):
+        return f"<ItemCountStat(warehouse_id={self.warehouse_id}, item_id={self.item_id}, last={self.last_count_date})>"
+
+
+class StockReservation(Base):
+    """Quantity held by a submitted or approved document"""
+    __tablename__ = 'stock_reservations'
+
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey('companies.id'), nullable=False)
+    doc_id = Column(Integer, ForeignKey('documents_header.id'), nullable=False)
+    warehouse_id = Column(Integer, ForeignKey('warehouses.id'), nullable=False)
+    item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
+    lot_key = Column(Integer, nullable=False, default=0)  # Lot ID, 0 when not reserved by lot
+    qty = Column(Numeric(18, 4), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('idx_stock_reservation_doc', 'doc_id'),
+    )
+
+    def __repr__(self):
+        return f"<StockReservation(doc_id={self.doc_id}, item_id={self.item_id}, qty={self.qty})>"
+
+
+class ReservedStock(Base):
+    """Total reserved quantity per warehouse, item and lot"""
+    __tablename__ = 'reserved_stock'
+
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey('companies.id'), nullable=False)
+    warehouse_id = Column(Integer, ForeignKey('warehouses.id'), nullable=False)
+    item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
+    lot_key = Column(Integer, nullable=False, default=0)  # Lot ID, 0 when not reserved by lot
+    reserved_qty = Column(Numeric(18, 4), nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint('company_id', 'warehouse_id', 'item_id', 'lot_key', name='uq_reserved_stock'),
+    )
+
+    def __repr__(self):
+        return f"<ReservedStock(warehouse_id={self.warehouse_id}, item_id={self.item_id}, reserved={self.reserved_qty})>"
+
+
+class PostingRun(Base):
+    """Batch posting run with its checkpoint"""
+    __tablename__ = 'posting_runs'
+
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey('companies.id'))
+    token = Column(String(64))  # Idempotency token of the request
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    posting_date = Column(Date, nullable=False)
+    document_ids = Column(Text, nullable=False)  # JSON list, in posting order
+    total = Column(Integer, nullable=False, default=0)
+    next_index = Column(Integer, nullable=False, default=0)  # Checkpoint
+    status = Column(String(10), nullable=False)  # RUNNING, COMPLETED, FAILED
+    error = Column(Text)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        UniqueConstraint('token', name='uq_posting_run_token'),
+    )
+
+    def __repr__(self):
+        return f"<PostingRun(id={self.id}, status='{self.status}', next_index={self.next_index}/{self.total})>"
+
+
+class PostingJournal(Base):
+    """One posting attempt of a document"""
+    __tablename__ = 'posting_journal'
+
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey('companies.id'), nullable=False)
+    doc_id = Column(Integer, ForeignKey('documents_header.id'), nullable=False)
+    attempt = Column(Integer, nullable=False)
+    token = Column(String(64))  # Idempotency token of the request
+    run_id = Column(Integer, ForeignKey('posting_runs.id'))
+    status = Column(String(10), nullable=False)  # STARTED, POSTED, FAILED
+    error = Column(Text)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        UniqueConstraint('doc_id', 'attempt', name='uq_posting_journal_attempt'),
+        UniqueConstraint('token', name='uq_posting_journal_token'),
+        Index('idx_posting_journal_run', 'run_id'),
+    )
+
+    def __repr__(self):
+        return f"<PostingJournal(doc_id={self.doc_id}, attempt={self.attempt}, status='{self.status}')>"
+
+
+class GenealogyLink(Base):
+    """Edge of the lot/serial genealogy graph"""
+    __tablename__ = 'genealogy_links'
+
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey('companies.id'), nullable=False)
+
+    # Nodes: LOT, SERIAL, PRODUCTION_ORDER or DOCUMENT (shipment)
+    from_type = Column(String(20), nullable=False)
+    from_id = Column(Integer, nullable=False)
+    to_type = Column(String(20), nullable=False)
+    to_id = Column(Integer, nullable=False)
+
+    doc_id = Column(Integer, ForeignKey('documents_header.id'), nullable=False)
+    qty = Column(Numeric(18, 4), default=0)
+    posting_date = Column(Date, nullable=False)
+
+    __table_args__ = (
+        Index('idx_genealogy_from', 'company_id', 'from_type', 'from_id'),
+        Index('idx_genealogy_to', 'company_id', 'to_type', 'to_id'),
+    )
+
+    def __repr__(self):
+        return f"<GenealogyLink({self.from_type}:{self.from_id} -> {self.to_type}:{self.to_id})>"
+
+
+class LedgerArchive(Base):
+    """Ledger rows of archived fiscal periods (same columns as inventory_ledger)"""
+    __tablename__ = 'inventory_ledger_archive'
+
+    # posting_date is part of the key so PostgreSQL can range-partition on it
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    posting_date = Column(Date, primary_key=True)
+    company_id = Column(Integer, nullable=False)
+    warehouse_id = Column(Integer, nullable=False)
+    location_id = Column(Integer)
+
+    item_id = Column(Integer, nullable=False)
+
+    qty_in = Column(Numeric(18, 4), default=0)
+    qty_out = Column(Numeric(18, 4), default=0)
+
+    unit_cost = Column(Numeric(18, 4))
+    value_in = Column(Numeric(18, 2), default=0)
+    value_out = Column(Numeric(18, 2), default=0)
+
+    lot_id = Column(Integer)
+    serial_id = Column(Integer)
+
+    doc_type = Column(Enum(DocumentType), nullable=False)
+    doc_id = Column(Integer, nullable=False)
+    doc_no = Column(String(50), nullable=False)
+    line_no = Column(Integer, nullable=False)
+
+    created_by = Column(Integer, nullable=False)
+    created_at = Column(DateTime)
+
+    __table_args__ = (
+        Index('idx_ledger_archive_company_item', 'company_id', 'item_id', 'posting_date'),
+        Index('idx_ledger_archive_lot', 'lot_id'),
+        {'postgresql_partition_by': 'RANGE (posting_date)'},
+    )
+
+    def __repr__(self):
+        return f"<LedgerArchive(id={self.id}, posting_date={self.posting_date}, item_id={self.item_id})>"
+
+
+class ClosedPeriod(Base):
+    __tablename__ = 'closed_periods'
+
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey('companies.id'), nullable=False)
+    period_start = Column(Date, nullable=False)
+    period_end = Column(Date, nullable=False)
+
+    # Audit
+    closed_by = Column(Integer, ForeignKey('users.id'))
+    closed_at = Column(DateTime, default=datetime.utcnow)
+    archived_at = Column(DateTime)  # Ledger rows moved to inventory_ledger_archive
+
+    __table_args__ = (
+        UniqueConstraint('company_id', 'period_end', name='uq_closed_period'),
+    )
+
+    def __repr__(self):
+        return f"<ClosedPeriod(company_id={self.company_id}, period_end={self.period_end})>"
+
+
+class PeriodBalance(Base):
+    """Closing balance per stock key at the end of a closed period"""
+    __tablename__ = 'period_balances'
+
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey('companies.id'), nullable=False)
+    period_end = Column(Date, nullable=False)
+    warehouse_id = Column(Integer, ForeignKey('warehouses.id'), nullable=False)
+    location_id = Column(Integer, ForeignKey('locations.id'))
+    item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
+    lot_id = Column(Integer, ForeignKey('lots.id'))
+    serial_id = Column(Integer, ForeignKey('serials.id'))
+
+    qty = Column(Numeric(18, 4), default=0)
+    value = Column(Numeric(18, 2), default=0)
+
+    __table_args__ = (
+        Index('idx_period_balance_company', 'company_id', 'period_end', 'item_id'),
+        Index('idx_period_balance_warehouse', 'warehouse_id', 'period_end', 'item_id'),
+    )
+
+    def __repr__(self):
+        return f"<PeriodBalance(period_end={self.period_end}, warehouse_id={self.warehouse_id}, item_id={self.item_id}, qty={self.qty})>"
+
+
 class StockCount(Base):
     __tablename__ = 'stock_counts'
     
@@ -218,7 +218,8 @@ class ProductionOrder(Base):
     
     # Dates
     start_date = Column(Date)
-    completion_date = Column(Date)
+    completion_date = Column(Date)  # Requested (due) date, then actual completion
+    planned_end_date = Column(Date)  # Set by the capacity scheduler
     
     notes = Column(Text)
     
@@ -4,15 +4,18 @@ Main application entry point
 """
 
 import sys
+from multiprocessing import freeze_support
 from PySide6.QtWidgets import QApplication, QMessageBox
 from PySide6.QtCore import Qt
 
 from config import APP_CONFIG
+from data import create_all_tables
 from utils.logging import setup_logging, get_logger
 from ui.styles.rtl_support import setup_rtl, load_theme
 from ui.login_dialog import LoginDialog
 from ui.company_selector import CompanySelectorDialog
 from ui.main_window import MainWindow
+from services.numbering import DocumentNumberingService
 
 
 logger = get_logger('main')
@@ -24,6 +27,11 @@ def main():
     setup_logging()
     logger.info('بدء تشغيل نظام إدارة المخزون...')
     
+    # Create tables added since the database was set up; constraints on
+    # existing tables come from 'alembic upgrade head' and the backfill of
+    # the new tables from 'python -m services.derived_tables'
+    create_all_tables()
+    
     # Create Qt application
     app = QApplication(sys.argv)
     
@@ -68,9 +76,14 @@ def main():
     # Run application event loop
     return_code = app.exec()
     
+    # Give back unused document numbers reserved by this process
+    DocumentNumberingService().release_unused()
+    
     logger.info('تم إيقاف التطبيق')
     return return_code
 
 
 if __name__ == '__main__':
+    # Worker processes of the frozen executable must not start the app again
+    freeze_support()
     sys.exit(main())
@@ -3,7 +3,8 @@ Inventory reports and queries
 تقارير المخزون
 """
 
-from datetime import date
+from collections import defaultdict
+from datetime import date, timedelta
 from decimal import Decimal
 from typing import List, Dict, Optional
 
@@ -11,9 +12,16 @@ from sqlalchemy import func, and_, or_
 from sqlalchemy.orm import Session
 
 from data import (
-    Item, StockBalance, InventoryLedger, Warehouse, Location,
-    ItemCategory, UOM, Lot, Serial
+    Item, StockBalance, DailyMovement, Warehouse, Location,
+    ItemCategory, UOM, Lot, Serial, DocumentHeader, ProductionOrder,
+    ItemClassification
 )
+from services.archival import ledger_source
+from services.expiry_aging import DEFAULT_BUCKETS, ExpiryAgingService
+from services.genealogy import GenealogyService
+from services.inventory_aging import DEFAULT_BUCKETS as AGING_BUCKETS, InventoryAgingService
+from services.period_close import PeriodCloseService
+from services.reorder_monitor import ReorderMonitorService
 
 
 class InventoryReports:
@@ -107,7 +115,7 @@ class InventoryReports:
                         item_id: Optional[int] = None,
                         warehouse_id: Optional[int] = None) -> List[Dict]:
         """
-        Movement summary by item
+        Movement summary by item (from the daily movement cube)
         ملخص حركة الأصناف
         
         Returns:
@@ -117,22 +125,22 @@ class InventoryReports:
             Item.code,
             Item.name_ar,
             Item.name_en,
-            func.sum(InventoryLedger.qty_in).label('total_in'),
-            func.sum(InventoryLedger.qty_out).label('total_out'),
-            func.sum(InventoryLedger.value_in).label('value_in'),
-            func.sum(InventoryLedger.value_out).label('value_out')
+            func.sum(DailyMovement.qty_in).label('total_in'),
+            func.sum(DailyMovement.qty_out).label('total_out'),
+            func.sum(DailyMovement.value_in).label('value_in'),
+            func.sum(DailyMovement.value_out).label('value_out')
         ).join(
-            Item, InventoryLedger.item_id == Item.id
+            Item, DailyMovement.item_id == Item.id
         ).filter(
-            InventoryLedger.company_id == company_id,
-            InventoryLedger.posting_date >= from_date,
-            InventoryLedger.posting_date <= to_date
+            DailyMovement.company_id == company_id,
+            DailyMovement.movement_date >= from_date,
+            DailyMovement.movement_date <= to_date
         ).group_by(
             Item.id, Item.code, Item.name_ar, Item.name_en
         )
         
         if warehouse_id:
-            query = query.filter(InventoryLedger.warehouse_id == warehouse_id)
+            query = query.filter(DailyMovement.warehouse_id == warehouse_id)
         
         if item_id:
             query = query.filter(Item.id == item_id)
@@ -156,6 +164,57 @@ class InventoryReports:
         
         return results
     
+    @staticmethod
+    def top_moving_items(session: Session, company_id: int,
+                         from_date: date, to_date: date,
+                         limit: int = 10,
+                         warehouse_id: Optional[int] = None) -> List[Dict]:
+        """
+        Items with the largest issued quantity in a date range
+        الأصناف الأكثر حركة
+        
+        Returns:
+            List of dict with item details and movement totals
+        """
+        total_out = func.sum(DailyMovement.qty_out)
+        
+        query = session.query(
+            Item.code,
+            Item.name_ar,
+            Item.name_en,
+            func.sum(DailyMovement.qty_in).label('total_in'),
+            total_out.label('total_out'),
+            func.sum(DailyMovement.value_out).label('value_out'),
+            func.sum(DailyMovement.line_count).label('lines')
+        ).join(
+            Item, DailyMovement.item_id == Item.id
+        ).filter(
+            DailyMovement.company_id == company_id,
+            DailyMovement.movement_date >= from_date,
+            DailyMovement.movement_date <= to_date
+        ).group_by(
+            Item.id, Item.code, Item.name_ar, Item.name_en
+        )
+        
+        if warehouse_id:
+            query = query.filter(DailyMovement.warehouse_id == warehouse_id)
+        
+        query = query.order_by(total_out.desc()).limit(limit)
+        
+        results = []
+        for row in query.all():
+            results.append({
+                'item_code': row.code,
+                'item_name_ar': row.name_ar,
+                'item_name_en': row.name_en,
+                'qty_in': float(row.total_in or 0),
+                'qty_out': float(row.total_out or 0),
+                'value_out': float(row.value_out or 0),
+                'lines': int(row.lines or 0)
+            })
+        
+        return results
+    
     @staticmethod
     def item_card(session: Session, company_id: int, item_id: int,
                  warehouse_id: Optional[int] = None,
@@ -168,39 +227,51 @@ class InventoryReports:
         Returns:
             List of all transactions for an item
         """
+        ledger = ledger_source(session, company_id, from_date, to_date)
+        
         query = session.query(
-            InventoryLedger.posting_date,
-            InventoryLedger.doc_type,
-            InventoryLedger.doc_no,
+            ledger.c.posting_date,
+            ledger.c.doc_type,
+            ledger.c.doc_no,
             Warehouse.name_ar.label('warehouse'),
-            InventoryLedger.qty_in,
-            InventoryLedger.qty_out,
-            InventoryLedger.unit_cost,
-            InventoryLedger.value_in,
-            InventoryLedger.value_out
-        ).join(
-            Warehouse, InventoryLedger.warehouse_id == Warehouse.id
+            ledger.c.qty_in,
+            ledger.c.qty_out,
+            ledger.c.unit_cost,
+            ledger.c.value_in,
+            ledger.c.value_out
+        ).select_from(ledger).join(
+            Warehouse, ledger.c.warehouse_id == Warehouse.id
         ).filter(
-            InventoryLedger.company_id == company_id,
-            InventoryLedger.item_id == item_id
+            ledger.c.company_id == company_id,
+            ledger.c.item_id == item_id
         ).order_by(
-            InventoryLedger.posting_date,
-            InventoryLedger.id
+            ledger.c.posting_date,
+            ledger.c.id
         )
         
         if warehouse_id:
-            query = query.filter(InventoryLedger.warehouse_id == warehouse_id)
+            query = query.filter(ledger.c.warehouse_id == warehouse_id)
         
         if from_date:
-            query = query.filter(InventoryLedger.posting_date >= from_date)
+            query = query.filter(ledger.c.posting_date >= from_date)
         
         if to_date:
-            query = query.filter(InventoryLedger.posting_date <= to_date)
+            query = query.filter(ledger.c.posting_date <= to_date)
         
         results = []
         running_qty = Decimal(0)
         running_value = Decimal(0)
         
+        # Opening balance from the nearest closed period
+        if from_date:
+            opening = PeriodCloseService().balances_as_of(
+                session, company_id, from_date - timedelta(days=1),
+                warehouse_id=warehouse_id, item_ids=[item_id]
+            )
+            for qty, value in opening.values():
+                running_qty += qty
+                running_value += value
+        
         for row in query.all():
             running_qty += (row.qty_in - row.qty_out)
             running_value += (row.value_in - row.value_out)
@@ -221,53 +292,190 @@ class InventoryReports:
         
         return results
     
+    @staticmethod
+    def stock_as_of(session: Session, company_id: int, as_of: date,
+                    warehouse_id: Optional[int] = None) -> List[Dict]:
+        """
+        Stock balance at a past date
+        الأرصدة في تاريخ سابق
+        
+        Returns:
+            List of dict with item, warehouse, quantity and value at the date
+        """
+        balances = PeriodCloseService().balances_as_of(
+            session, company_id, as_of, warehouse_id=warehouse_id
+        )
+        
+        item_ids = {item_id for _, item_id in balances}
+        items = {
+            row.id: row for row in session.query(
+                Item.id, Item.code, Item.name_ar, Item.name_en
+            ).filter(Item.id.in_(item_ids))
+        } if item_ids else {}
+        warehouses = dict(session.query(Warehouse.id, Warehouse.name_ar).filter(
+            Warehouse.company_id == company_id
+        ).all())
+        
+        results = []
+        for (wh_id, item_id), (qty, value) in sorted(
+            balances.items(), key=lambda entry: (items[entry[0][1]].code, entry[0][0])
+        ):
+            if qty == 0 and value == 0:
+                continue
+            
+            item = items[item_id]
+            results.append({
+                'item_code': item.code,
+                'item_name_ar': item.name_ar,
+                'item_name_en': item.name_en,
+                'warehouse': warehouses.get(wh_id),
+                'qty': float(qty),
+                'value': float(value)
+            })
+        
+        return results
+    
     @staticmethod
     def reorder_report(session: Session, company_id: int) -> List[Dict]:
         """
         Items below reorder point
         الأصناف التي وصلت لنقطة إعادة الطلب
         
+        Reads the item totals maintained by posting instead of grouping
+        stock balances.
+        
         Returns:
             List of items that need reordering
         """
+        results = []
+        for row in ReorderMonitorService().reorder_list(session, company_id):
+            shortage = float(row['max_qty'] - row['current_qty'])
+            
+            results.append({
+                'item_code': row['item_code'],
+                'item_name_ar': row['item_name_ar'],
+                'item_name_en': row['item_name_en'],
+                'uom': row['uom'],
+                'current_qty': float(row['current_qty']),
+                'reorder_point': float(row['reorder_point']),
+                'min_qty': float(row['min_qty']),
+                'max_qty': float(row['max_qty']),
+                'shortage': shortage,
+                'order_qty': shortage  # Suggested order quantity
+            })
+        
+        return results
+    
+    @staticmethod
+    def expiry_aging(session: Session, company_id: int,
+                     warehouse_id: Optional[int] = None,
+                     as_of: Optional[date] = None,
+                     buckets: Optional[List[int]] = None) -> List[Dict]:
+        """
+        Expiry aging report
+        أعمار الصلاحية
+        
+        Args:
+            buckets: Upper bounds of the day buckets (defaults to 30/60/90/180/365)
+        
+        Returns:
+            Lot stock quantity and value per days-to-expiry bucket
+        """
+        result = ExpiryAgingService().aging(
+            session, company_id, warehouse_id, as_of,
+            buckets or DEFAULT_BUCKETS
+        )
+        
+        results = []
+        for row in result['buckets']:
+            results.append({
+                'bucket': row['bucket'],
+                'qty': float(row['qty']),
+                'value': float(row['value']),
+                'lots': row['lots']
+            })
+        
+        return results
+    
+    @staticmethod
+    def inventory_aging(session: Session, company_id: int,
+                        group_by: str = 'warehouse',
+                        as_of: Optional[date] = None,
+                        buckets: Optional[List[int]] = None) -> List[Dict]:
+        """
+        Inventory aging report (days on hand)
+        أعمار المخزون
+        
+        Args:
+            group_by: 'warehouse' or 'category'
+            buckets: Upper bounds of the day buckets (defaults to 30/90/180/365)
+        
+        Returns:
+            Aged quantity and value per warehouse or category
+        """
+        rows = InventoryAgingService().aging(
+            session, company_id, group_by, as_of, buckets or AGING_BUCKETS
+        )
+        
+        model = Warehouse if group_by == 'warehouse' else ItemCategory
+        names = dict(session.query(model.id, model.name_ar).filter(
+            model.id.in_({row['group_id'] for row in rows if row['group_id']})
+        ).all())
+        
+        results = []
+        for row in rows:
+            result = {
+                'group': names.get(row['group_id'], '-'),
+                'qty': float(row['qty']),
+                'value': float(row['value'])
+            }
+            for bucket in row['buckets']:
+                result[f"qty_{bucket['bucket']}"] = float(bucket['qty'])
+                result[f"value_{bucket['bucket']}"] = float(bucket['value'])
+            results.append(result)
+        
+        return results
+    
+    @staticmethod
+    def abc_xyz_report(session: Session, company_id: int,
+                       abc_class: Optional[str] = None) -> List[Dict]:
+        """
+        ABC/XYZ classification report
+        تصنيف الأصناف ABC/XYZ
+        
+        Reads the classes stored by the last classification run.
+        
+        Returns:
+            Items with their classes, consumption and demand variability
+        """
         query = session.query(
             Item.code,
             Item.name_ar,
-            Item.name_en,
-            Item.reorder_point,
-            Item.min_qty,
-            Item.max_qty,
-            UOM.code.label('uom'),
-            func.sum(StockBalance.on_hand_qty).label('current_qty')
-        ).join(
-            StockBalance, Item.id == StockBalance.item_id
+            ItemClassification.abc_class,
+            ItemClassification.xyz_class,
+            ItemClassification.consumption_qty,
+            ItemClassification.consumption_value,
+            ItemClassification.value_share,
+            ItemClassification.demand_cv
         ).join(
-            UOM, Item.base_uom_id == UOM.id
+            Item, ItemClassification.item_id == Item.id
         ).filter(
-            Item.company_id == company_id,
-            Item.reorder_point > 0
-        ).group_by(
-            Item.id, Item.code, Item.name_ar, Item.name_en,
-            Item.reorder_point, Item.min_qty, Item.max_qty, UOM.code
-        ).having(
-            func.sum(StockBalance.on_hand_qty) <= Item.reorder_point
+            ItemClassification.company_id == company_id
         )
         
+        if abc_class:
+            query = query.filter(ItemClassification.abc_class == abc_class)
+        
         results = []
-        for row in query.all():
-            shortage = float(row.max_qty - (row.current_qty or 0))
-            
+        for row in query.order_by(ItemClassification.consumption_value.desc(), Item.code):
             results.append({
                 'item_code': row.code,
-                'item_name_ar': row.name_ar,
-                'item_name_en': row.name_en,
-                'uom': row.uom,
-                'current_qty': float(row.current_qty or 0),
-                'reorder_point': float(row.reorder_point),
-                'min_qty': float(row.min_qty),
-                'max_qty': float(row.max_qty),
-                'shortage': shortage,
-                'order_qty': shortage  # Suggested order quantity
+                'item_name': row.name_ar,
+                'class': row.abc_class + row.xyz_class,
+                'consumption_qty': float(row.consumption_qty or 0),
+                'consumption_value': float(row.consumption_value or 0),
+                'value_share': float(row.value_share or 0),
+                'demand_cv': float(row.demand_cv) if row.demand_cv is not None else None
             })
         
         return results
@@ -282,25 +490,27 @@ class InventoryReports:
         Returns:
             All transactions for a specific lot
         """
+        ledger = ledger_source(session, company_id)
+        
         query = session.query(
-            InventoryLedger.posting_date,
-            InventoryLedger.doc_type,
-            InventoryLedger.doc_no,
+            ledger.c.posting_date,
+            ledger.c.doc_type,
+            ledger.c.doc_no,
             Item.code.label('item_code'),
             Item.name_ar.label('item_name'),
             Warehouse.name_ar.label('warehouse'),
-            InventoryLedger.qty_in,
-            InventoryLedger.qty_out
-        ).join(
-            Item, InventoryLedger.item_id == Item.id
+            ledger.c.qty_in,
+            ledger.c.qty_out
+        ).select_from(ledger).join(
+            Item, ledger.c.item_id == Item.id
         ).join(
-            Warehouse, InventoryLedger.warehouse_id == Warehouse.id
+            Warehouse, ledger.c.warehouse_id == Warehouse.id
         ).filter(
-            InventoryLedger.company_id == company_id,
-            InventoryLedger.lot_id == lot_id
+            ledger.c.company_id == company_id,
+            ledger.c.lot_id == lot_id
         ).order_by(
-            InventoryLedger.posting_date,
-            InventoryLedger.id
+            ledger.c.posting_date,
+            ledger.c.id
         )
         
         results = []
@@ -317,3 +527,60 @@ class InventoryReports:
             })
         
         return results
+    
+    @staticmethod
+    def lot_genealogy(session: Session, company_id: int, lot_id: int,
+                      direction: str = 'forward') -> List[Dict]:
+        """
+        Lot genealogy report
+        شجرة التشغيلة
+        
+        Follows a lot forward into produced lots and shipments, or backward
+        into the lots it was made from.
+        
+        Returns:
+            Genealogy links reached from the lot
+        """
+        links = GenealogyService().trace(session, company_id, 'LOT', lot_id, direction)
+        
+        ids = defaultdict(set)
+        for link in links:
+            ids[link['from_type']].add(link['from_id'])
+            ids[link['to_type']].add(link['to_id'])
+            ids['DOCUMENT'].add(link['doc_id'])
+        
+        labels = {}
+        if ids['LOT']:
+            for row in session.query(Lot.id, Lot.lot_number, Item.code).join(
+                Item, Lot.item_id == Item.id
+            ).filter(Lot.id.in_(ids['LOT'])):
+                labels[('LOT', row.id)] = f'{row.code} / {row.lot_number}'
+        if ids['SERIAL']:
+            for row in session.query(Serial.id, Serial.serial_number, Item.code).join(
+                Item, Serial.item_id == Item.id
+            ).filter(Serial.id.in_(ids['SERIAL'])):
+                labels[('SERIAL', row.id)] = f'{row.code} / {row.serial_number}'
+        if ids['PRODUCTION_ORDER']:
+            for row in session.query(ProductionOrder.id, ProductionOrder.po_no).filter(
+                ProductionOrder.id.in_(ids['PRODUCTION_ORDER'])
+            ):
+                labels[('PRODUCTION_ORDER', row.id)] = row.po_no
+        for row in session.query(DocumentHeader.id, DocumentHeader.doc_no).filter(
+            DocumentHeader.id.in_(ids['DOCUMENT'])
+        ):
+            labels[('DOCUMENT', row.id)] = row.doc_no
+        
+        results = []
+        for link in links:
+            results.append({
+                'level': link['level'],
+                'from_type': link['from_type'],
+                'from': labels.get((link['from_type'], link['from_id'])),
+                'to_type': link['to_type'],
+                'to': labels.get((link['to_type'], link['to_id'])),
+                'doc_no': labels.get(('DOCUMENT', link['doc_id'])),
+                'posting_date': link['posting_date'].strftime('%Y-%m-%d'),
+                'qty': float(link['qty'])
+            })
+        
+        return results
@@ -7,6 +7,33 @@ from services.posting import PostingService, PostingError
 from services.costing import CostingService
 from services.validation import ValidationService, ValidationError
 from services.policy import PolicyService
+from services.uom import UOMConversionService, UOMConversionError
+from services.numbering import DocumentNumberingService, NumberingError
+from services.stock_count import StockCountService, StockCountError
+from services.allocation import LotAllocationService, AllocationError
+from services.bom import BOMExplosionService, BOMError
+from services.mrp import MRPService
+from services.cost_rollup import CostRollupService
+from services.scheduling import CapacitySchedulerService, SchedulingError
+from services.production import ProductionService, ProductionError
+from services.reconciliation import StockReconciliationService
+from services.archival import LedgerArchiveService, ArchivalError
+from services.period_close import PeriodCloseService, PeriodCloseError
+from services.movement_cube import MovementCubeService
+from services.kpi import KPIService
+from services.reorder_monitor import ReorderMonitorService
+from services.genealogy import GenealogyService
+from services.serial_registry import SerialRegistryService, SerialRegistryError
+from services.expiry_aging import ExpiryAgingService
+from services.inventory_aging import InventoryAgingService
+from services.classification import ItemClassificationService
+from services.forecasting import ForecastingService
+from services.cycle_count import CycleCountPlannerService
+from services.reservation import ReservationService, ReservationError
+from services.cost_replay import CostReplayService
+from services.posting_journal import PostingJournalService, PostingJournalError
+from services.posting_run import PostingRunService
+from services.derived_tables import DerivedTablesService
 
 __all__ = [
     'PostingService',
@@ -15,4 +42,43 @@ __all__ = [
     'ValidationService',
     'ValidationError',
     'PolicyService',
+    'UOMConversionService',
+    'UOMConversionError',
+    'DocumentNumberingService',
+    'NumberingError',
+    'StockCountService',
+    'StockCountError',
+    'LotAllocationService',
+    'AllocationError',
+    'BOMExplosionService',
+    'BOMError',
+    'MRPService',
+    'CostRollupService',
+    'CapacitySchedulerService',
+    'SchedulingError',
+    'ProductionService',
+    'ProductionError',
+    'StockReconciliationService',
+    'LedgerArchiveService',
+    'ArchivalError',
+    'PeriodCloseService',
+    'PeriodCloseError',
+    'MovementCubeService',
+    'KPIService',
+    'ReorderMonitorService',
+    'GenealogyService',
+    'SerialRegistryService',
+    'SerialRegistryError',
+    'ExpiryAgingService',
+    'InventoryAgingService',
+    'ItemClassificationService',
+    'ForecastingService',
+    'CycleCountPlannerService',
+    'ReservationService',
+    'ReservationError',
+    'CostReplayService',
+    'PostingJournalService',
+    'PostingJournalError',
+    'PostingRunService',
+    'DerivedTablesService',
 ]
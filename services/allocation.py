@@ -0,0 +1,232 @@
+"""
+Lot allocation service - FEFO/FIFO picking from stock balances
+خدمة تخصيص التشغيلات - الصرف حسب تاريخ الانتهاء أو الأقدم استلاماً
+"""
+
+import heapq
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from data import DocumentHeader, Item, Lot, StockBalance
+from services.policy import PolicyService
+
+METHOD_FEFO = 'FEFO'
+METHOD_FIFO = 'FIFO'
+
+
+class AllocationError(Exception):
+    """خطأ في تخصيص الكميات"""
+    pass
+
+
+class LotAllocationService:
+    """Service for allocating issue quantities to lots and locations"""
+
+    def __init__(self):
+        self.policy_service = PolicyService()
+
+    def allocate(self, session: Session, company_id: int, warehouse_id: int,
+                 requests: Iterable[Dict], method: Optional[str] = None,
+                 doc_type: Optional[str] = None, as_of: Optional[date] = None,
+                 allow_expired: bool = False,
+                 allow_partial: bool = False) -> Dict:
+        """
+        Allocate quantities to lot/location/serial splits
+
+        Stock for all requested items is loaded with one query into a heap
+        per item (and per item/location). Requests are then served from the
+        heaps in order, so several lines of the same item never allocate the
+        same stock twice.
+
+        Args:
+            session: Database session
+            company_id: Company ID
+            warehouse_id: Warehouse to pick from
+            requests: Dicts with key, item_id, qty and optional location_id
+            method: FEFO or FIFO (resolved from the FEFO_PICKING policy per
+                item when omitted)
+            doc_type: Document type for policy resolution (optional)
+            as_of: Date used to skip expired lots (defaults to today)
+            allow_expired: Allow picking expired lots
+            allow_partial: Return shortages instead of raising
+
+        Returns:
+            Dict of request key to {'allocations': [...], 'short_qty': Decimal}
+
+        Raises:
+            AllocationError: If stock is insufficient and allow_partial is False
+        """
+        requests = list(requests)
+        if not requests:
+            return {}
+
+        if as_of is None:
+            as_of = date.today()
+
+        item_ids = {request['item_id'] for request in requests}
+        methods = self._resolve_methods(
+            session, company_id, warehouse_id, item_ids, method, doc_type
+        )
+        heaps, remaining, entries = self._build_heaps(
+            session, company_id, warehouse_id, item_ids, methods, as_of, allow_expired
+        )
+
+        results = {}
+        for request in requests:
+            item_id = request['item_id']
+            location_id = request.get('location_id')
+            need = Decimal(request['qty'])
+
+            heap = heaps.get((item_id, location_id), [])
+            allocations = []
+
+            while need > 0 and heap:
+                seq = heap[0][-1]
+
+                # Entries drained through another heap are dropped lazily
+                if remaining[seq] <= 0:
+                    heapq.heappop(heap)
+                    continue
+
+                take = min(remaining[seq], need)
+                remaining[seq] -= take
+                need -= take
+
+                if remaining[seq] <= 0:
+                    heapq.heappop(heap)
+
+                entry = entries[seq]
+                allocations.append({
+                    'item_id': item_id,
+                    'location_id': entry['location_id'],
+                    'lot_id': entry['lot_id'],
+                    'serial_id': entry['serial_id'],
+                    'expiry_date': entry['expiry_date'],
+                    'qty': take,
+                })
+
+            if need > 0 and not allow_partial:
+                raise AllocationError(
+                    f'الصنف رقم {item_id}: الكمية المتاحة للصرف أقل من المطلوب '
+                    f'بمقدار ({need})'
+                )
+
+            results[request['key']] = {
+                'allocations': allocations,
+                'short_qty': need,
+            }
+
+        return results
+
+    def allocate_document(self, session: Session, document: DocumentHeader,
+                          method: Optional[str] = None,
+                          as_of: Optional[date] = None,
+                          allow_expired: bool = False,
+                          allow_partial: bool = False) -> Dict:
+        """
+        Allocate all lines of an issue or transfer document
+
+        Returns:
+            Dict of line_no to {'allocations': [...], 'short_qty': Decimal}
+        """
+        if not document.from_warehouse_id:
+            raise AllocationError('المستند لا يحتوي على مخزن صرف')
+
+        requests = [
+            {
+                'key': line.line_no,
+                'item_id': line.item_id,
+                'qty': line.base_qty,
+                'location_id': line.from_location_id,
+            }
+            for line in document.lines
+        ]
+
+        return self.allocate(
+            session, document.company_id, document.from_warehouse_id, requests,
+            method=method, doc_type=document.doc_type.value, as_of=as_of,
+            allow_expired=allow_expired, allow_partial=allow_partial
+        )
+
+    def _resolve_methods(self, session: Session, company_id: int,
+                         warehouse_id: int, item_ids, method: Optional[str],
+                         doc_type: Optional[str]) -> Dict[int, str]:
+        """Picking method per item"""
+        if method:
+            return {item_id: method for item_id in item_ids}
+
+        items = session.query(Item.id, Item.category_id).filter(Item.id.in_(item_ids)).all()
+        fefo = self.policy_service.get_policy_values(
+            session, 'FEFO_PICKING', company_id, items,
+            warehouse_id=warehouse_id, doc_type=doc_type
+        )
+
+        return {
+            item_id: METHOD_FEFO if fefo.get(item_id) else METHOD_FIFO
+            for item_id in item_ids
+        }
+
+    def _build_heaps(self, session: Session, company_id: int, warehouse_id: int,
+                     item_ids, methods: Dict[int, str], as_of: date,
+                     allow_expired: bool):
+        """
+        Build pick heaps from stock_balance joined to lots
+
+        Returns:
+            Tuple of (heaps keyed by (item_id, location_id) and (item_id, None),
+            remaining qty per entry, entry details)
+        """
+        rows = session.query(
+            StockBalance.item_id,
+            StockBalance.location_id,
+            StockBalance.lot_id,
+            StockBalance.serial_id,
+            StockBalance.on_hand_qty,
+            Lot.expiry_date,
+            Lot.created_at
+        ).outerjoin(
+            Lot, StockBalance.lot_id == Lot.id
+        ).filter(
+            StockBalance.company_id == company_id,
+            StockBalance.warehouse_id == warehouse_id,
+            StockBalance.item_id.in_(item_ids),
+            StockBalance.on_hand_qty > 0
+        ).all()
+
+        heaps: Dict[tuple, List] = {}
+        remaining: List[Decimal] = []
+        entries: List[Dict] = []
+
+        for row in rows:
+            if row.expiry_date and row.expiry_date < as_of and not allow_expired:
+                continue
+
+            received = row.created_at or datetime.min
+            tie_break = (row.lot_id or 0, row.location_id or 0, row.serial_id or 0)
+
+            if methods[row.item_id] == METHOD_FEFO:
+                sort_key = (row.expiry_date or date.max, received) + tie_break
+            else:
+                sort_key = (received,) + tie_break
+
+            seq = len(entries)
+            remaining.append(Decimal(row.on_hand_qty))
+            entries.append({
+                'location_id': row.location_id,
+                'lot_id': row.lot_id,
+                'serial_id': row.serial_id,
+                'expiry_date': row.expiry_date,
+            })
+
+            heap_entry = sort_key + (seq,)
+            heaps.setdefault((row.item_id, None), []).append(heap_entry)
+            if row.location_id is not None:
+                heaps.setdefault((row.item_id, row.location_id), []).append(heap_entry)
+
+        for heap in heaps.values():
+            heapq.heapify(heap)
+
+        return heaps, remaining, entries
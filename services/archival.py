@@ -0,0 +1,206 @@
+"""
+Ledger archival service - Move closed fiscal periods out of the live ledger
+خدمة أرشفة دفتر الحركة - نقل الفترات المالية المقفلة خارج الدفتر الحالي
+"""
+
+from datetime import date, datetime, timedelta
+from typing import Optional, Tuple
+
+from sqlalchemy import delete, func, insert, select, text, union_all, update
+from sqlalchemy.orm import Session
+
+from data import (
+    ClosedPeriod, Company, InventoryLedger, LedgerArchive, session_scope
+)
+
+# Columns copied between inventory_ledger and inventory_ledger_archive
+LEDGER_COLUMNS = [column.name for column in InventoryLedger.__table__.columns]
+
+# Stock key of a period balance row
+PERIOD_BALANCE_KEY = ('warehouse_id', 'location_id', 'item_id', 'lot_id', 'serial_id')
+
+
+class ArchivalError(Exception):
+    """خطأ في أرشفة دفتر الحركة"""
+    pass
+
+
+def fiscal_year_bounds(company: Company, day: date) -> Tuple[date, date]:
+    """
+    Get the fiscal year containing a day
+
+    Fiscal years repeat the company's fiscal_year_start month/day every year.
+
+    Returns:
+        Tuple of (first day, last day) of the fiscal year
+    """
+    def shifted(years: int) -> date:
+        start = company.fiscal_year_start
+        try:
+            return start.replace(year=start.year + years)
+        except ValueError:
+            # 29 February in a non-leap year
+            return start.replace(year=start.year + years, day=28)
+
+    offset = day.year - company.fiscal_year_start.year
+    start = shifted(offset)
+    if start > day:
+        offset -= 1
+        start = shifted(offset)
+
+    return start, shifted(offset + 1) - timedelta(days=1)
+
+
+def last_closed_period(session: Session, company_id: int,
+                       as_of: Optional[date] = None,
+                       archived_only: bool = False) -> Optional[date]:
+    """End date of the latest closed period of a company (optionally on or before a date)"""
+    query = session.query(func.max(ClosedPeriod.period_end)).filter(
+        ClosedPeriod.company_id == company_id
+    )
+
+    if as_of:
+        query = query.filter(ClosedPeriod.period_end <= as_of)
+    if archived_only:
+        query = query.filter(ClosedPeriod.archived_at.isnot(None))
+
+    return query.scalar()
+
+
+def ledger_source(session: Session, company_id: int,
+                  from_date: Optional[date] = None,
+                  to_date: Optional[date] = None):
+    """
+    Ledger rows of a company for a date range
+
+    Returns the live inventory_ledger table when the range does not reach
+    archived periods, the archive when it lies entirely inside them, and a
+    UNION ALL of both otherwise. On PostgreSQL the date filter on the archive
+    lets the planner skip partitions outside the range.
+
+    Returns:
+        Table or subquery with the inventory_ledger columns
+    """
+    archived = last_closed_period(session, company_id, archived_only=True)
+    live = InventoryLedger.__table__
+
+    if archived is None or (from_date and from_date > archived):
+        return live
+
+    archive = LedgerArchive.__table__
+    cold = select(*(archive.c[name] for name in LEDGER_COLUMNS)).where(
+        archive.c.company_id == company_id
+    )
+    if from_date:
+        cold = cold.where(archive.c.posting_date >= from_date)
+    if to_date:
+        cold = cold.where(archive.c.posting_date <= to_date)
+
+    if to_date and to_date <= archived:
+        return cold.subquery('ledger')
+
+    hot = select(*(live.c[name] for name in LEDGER_COLUMNS)).where(
+        live.c.company_id == company_id
+    )
+
+    return union_all(hot, cold).subquery('ledger')
+
+
+class LedgerArchiveService:
+    """
+    Service for archiving closed fiscal periods
+
+    Archiving a closed fiscal year moves its ledger rows to
+    inventory_ledger_archive; its closing balances stay in period_balances.
+    The archive is a table range-partitioned by posting date on PostgreSQL
+    and a plain table on SQLite; either way the live ledger and its indexes
+    only hold open periods.
+    """
+
+    def archive_period(self, company_id: int, period_end: date,
+                       user_id: Optional[int] = None) -> int:
+        """
+        Archive a closed fiscal year
+
+        Args:
+            company_id: Company ID
+            period_end: Last day of the fiscal year to archive
+            user_id: User performing the archival (optional)
+
+        Returns:
+            Number of ledger rows moved to the archive
+
+        Raises:
+            ArchivalError: If the period is not a closed fiscal year or is
+                already archived
+        """
+        with session_scope() as session:
+            company = session.query(Company).filter_by(id=company_id).first()
+            if not company:
+                raise ArchivalError(f'الشركة رقم {company_id} غير موجودة')
+
+            fiscal_end = fiscal_year_bounds(company, period_end)[1]
+            if fiscal_end != period_end:
+                raise ArchivalError(f'التاريخ {period_end} ليس نهاية سنة مالية')
+
+            if period_end >= fiscal_year_bounds(company, date.today())[0]:
+                raise ArchivalError('لا يمكن أرشفة السنة المالية الحالية')
+
+            archived = last_closed_period(session, company_id, archived_only=True)
+            if archived and archived >= period_end:
+                raise ArchivalError(f'الفترة المنتهية في {period_end} مؤرشفة بالفعل')
+
+            closed = session.query(ClosedPeriod).filter_by(
+                company_id=company_id, period_end=period_end
+            ).first()
+            if closed is None:
+                raise ArchivalError(f'يجب إقفال الفترة المنتهية في {period_end} قبل أرشفتها')
+
+            moved = self._move_rows(session, company_id, period_end)
+
+            session.flush()
+            session.execute(
+                update(ClosedPeriod).where(
+                    ClosedPeriod.company_id == company_id,
+                    ClosedPeriod.period_end <= period_end,
+                    ClosedPeriod.archived_at.is_(None)
+                ).values(archived_at=datetime.utcnow())
+            )
+
+            return moved
+
+    def _move_rows(self, session: Session, company_id: int, period_end: date) -> int:
+        """Copy ledger rows up to a date into the archive and delete them"""
+        condition = (
+            (InventoryLedger.company_id == company_id)
+            & (InventoryLedger.posting_date <= period_end)
+        )
+
+        first_date = session.query(func.min(InventoryLedger.posting_date)).filter(condition).scalar()
+        if first_date is None:
+            return 0
+
+        if session.get_bind().dialect.name == 'postgresql':
+            self._ensure_partitions(session, first_date.year, period_end.year)
+
+        live = InventoryLedger.__table__
+        session.execute(
+            insert(LedgerArchive).from_select(
+                LEDGER_COLUMNS,
+                select(*(live.c[name] for name in LEDGER_COLUMNS)).where(condition)
+            )
+        )
+        result = session.execute(
+            delete(InventoryLedger).where(condition).execution_options(synchronize_session=False)
+        )
+
+        return result.rowcount
+
+    def _ensure_partitions(self, session: Session, first_year: int, last_year: int):
+        """Create yearly archive partitions on PostgreSQL"""
+        table = LedgerArchive.__tablename__
+        for year in range(first_year, last_year + 1):
+            session.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {table}_{year} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+            ))
@@ -0,0 +1,291 @@
+"""
+BOM explosion service - Multi-level bill of materials expansion
+خدمة تفجير قوائم المواد - فك قوائم المواد متعددة المستويات
+"""
+
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from data import BOM, BOMLine, ProductionOrder
+
+QTY_QUANTUM = Decimal('0.0001')
+
+
+class BOMError(Exception):
+    """خطأ في قائمة المواد"""
+    pass
+
+
+class BOMExplosionService:
+    """
+    Service for exploding bills of materials
+
+    BOMs of a company are loaded once per service instance. Expansions of
+    each BOM are memoised per (bom_id, version, effective date), so shared
+    sub-assemblies are only expanded once per run.
+    """
+
+    def __init__(self):
+        self._loaded_companies = set()
+        self._boms: Dict[int, Dict] = {}
+        self._boms_by_item: Dict[int, List[Dict]] = defaultdict(list)
+        self._memo: Dict[tuple, Dict[int, Decimal]] = {}
+
+    def load(self, session: Session, company_id: int, reload: bool = False):
+        """Load all BOMs and BOM lines of a company (two queries)"""
+        if company_id in self._loaded_companies and not reload:
+            return
+
+        if reload:
+            self._forget_company(company_id)
+
+        boms = session.query(BOM).filter(BOM.company_id == company_id).all()
+        for bom in boms:
+            entry = {
+                'id': bom.id,
+                'company_id': bom.company_id,
+                'item_id': bom.item_id,
+                'version': bom.version or 1,
+                'effective_date': bom.effective_date,
+                'expiry_date': bom.expiry_date,
+                'base_qty': Decimal(bom.base_qty or 1),
+                'is_active': bom.is_active,
+                'lines': [],
+            }
+            self._boms[bom.id] = entry
+            self._boms_by_item[bom.item_id].append(entry)
+
+        if boms:
+            lines = session.query(
+                BOMLine.bom_id, BOMLine.item_id, BOMLine.base_qty, BOMLine.scrap_percent
+            ).filter(
+                BOMLine.bom_id.in_([bom.id for bom in boms])
+            ).order_by(BOMLine.bom_id, BOMLine.line_no).all()
+
+            for line in lines:
+                bom = self._boms[line.bom_id]
+                scrap_factor = 1 + Decimal(line.scrap_percent or 0) / 100
+                per_unit = Decimal(line.base_qty) * scrap_factor / bom['base_qty']
+                bom['lines'].append((line.item_id, per_unit))
+
+        for entries in self._boms_by_item.values():
+            entries.sort(key=lambda entry: (entry['version'], entry['effective_date']), reverse=True)
+
+        self._loaded_companies.add(company_id)
+
+    def get_bom(self, item_id: int, as_of: date) -> Optional[Dict]:
+        """Get the active BOM of an item at a date (highest version wins)"""
+        for bom in self._boms_by_item.get(item_id, ()):
+            if not bom['is_active']:
+                continue
+            if bom['effective_date'] > as_of:
+                continue
+            if bom['expiry_date'] and bom['expiry_date'] < as_of:
+                continue
+            return bom
+        return None
+
+    def get_bom_by_id(self, session: Session, bom_id: int) -> Dict:
+        """Get a BOM by ID, loading its company on first use"""
+        if bom_id not in self._boms:
+            company_id = session.query(BOM.company_id).filter(BOM.id == bom_id).scalar()
+            if company_id is None:
+                raise BOMError(f'قائمة المواد رقم {bom_id} غير موجودة')
+            self.load(session, company_id, reload=company_id in self._loaded_companies)
+
+        return self._boms[bom_id]
+
+    def explode(self, session: Session, bom_id: int, qty: Decimal,
+                as_of: Optional[date] = None,
+                single_level: bool = False) -> Dict[int, Decimal]:
+        """
+        Explode a BOM into scrap-adjusted component requirements
+
+        Args:
+            session: Database session
+            bom_id: BOM ID to explode
+            qty: Quantity of the finished item to produce
+            as_of: Date selecting sub-assembly BOMs (defaults to today)
+            single_level: Only expand the first level
+
+        Returns:
+            Dict of component item_id to required base quantity. In a
+            multi-level explosion only purchased (leaf) items are returned.
+
+        Raises:
+            BOMError: If the BOM does not exist or contains a cycle
+        """
+        if as_of is None:
+            as_of = date.today()
+
+        bom = self.get_bom_by_id(session, bom_id)
+        per_unit = self._per_unit(bom, as_of, single_level)
+
+        return self._scale(per_unit, Decimal(qty))
+
+    def explode_production_orders(self, session: Session,
+                                  order_ids: Iterable[int],
+                                  single_level: bool = False) -> Dict:
+        """
+        Explode many production orders at once
+
+        Orders sharing a BOM and date are merged and exploded once; shared
+        sub-assemblies across different BOMs come from the memo.
+
+        Args:
+            session: Database session
+            order_ids: Production order IDs
+            single_level: Only expand the first level
+
+        Returns:
+            Dict with 'orders' (order_id to requirements) and 'total'
+            (merged requirements of all orders)
+        """
+        orders = session.query(
+            ProductionOrder.id,
+            ProductionOrder.bom_id,
+            ProductionOrder.planned_qty,
+            ProductionOrder.start_date,
+            ProductionOrder.po_date
+        ).filter(ProductionOrder.id.in_(list(order_ids))).all()
+
+        groups = defaultdict(list)
+        for order in orders:
+            as_of = order.start_date or order.po_date
+            groups[(order.bom_id, as_of)].append(order)
+
+        results = {}
+        total = defaultdict(Decimal)
+
+        for (bom_id, as_of), group in groups.items():
+            bom = self.get_bom_by_id(session, bom_id)
+            per_unit = self._per_unit(bom, as_of, single_level)
+
+            group_qty = sum((Decimal(order.planned_qty) for order in group), Decimal(0))
+            for item_id, qty in per_unit.items():
+                total[item_id] += qty * group_qty
+
+            for order in group:
+                results[order.id] = self._scale(per_unit, Decimal(order.planned_qty))
+
+        return {
+            'orders': results,
+            'total': self._scale(total, Decimal(1)),
+        }
+
+    def where_used(self, session: Session, company_id: int) -> Dict[int, Set[int]]:
+        """Get the reverse index of component item_id to the BOM IDs using it"""
+        self.load(session, company_id)
+
+        index: Dict[int, Set[int]] = defaultdict(set)
+        for bom in self._boms.values():
+            if bom['company_id'] == company_id:
+                for item_id, _ in bom['lines']:
+                    index[item_id].add(bom['id'])
+
+        return index
+
+    def boms_of_company(self, session: Session, company_id: int) -> List[Dict]:
+        """Get all loaded BOMs of a company"""
+        self.load(session, company_id)
+        return [bom for bom in self._boms.values() if bom['company_id'] == company_id]
+
+    def low_level_codes(self, session: Session, company_id: int,
+                        as_of: Optional[date] = None) -> Dict[int, int]:
+        """
+        Get the low-level code (deepest BOM level) of every item in BOMs
+
+        Finished items without a parent get level 0; an item's code is one
+        more than the deepest parent using it.
+        """
+        if as_of is None:
+            as_of = date.today()
+
+        self.load(session, company_id)
+
+        codes: Dict[int, int] = {}
+        for item_id in list(self._boms_by_item):
+            bom = self.get_bom(item_id, as_of)
+            if bom and bom['company_id'] == company_id:
+                codes.setdefault(item_id, 0)
+                self._assign_levels(bom, as_of, 0, codes, [])
+
+        return codes
+
+    def _assign_levels(self, bom: Dict, as_of: date, level: int,
+                       codes: Dict[int, int], path: List[int]):
+        """Push deeper levels down the tree of a BOM"""
+        if bom['id'] in path:
+            raise BOMError(self._cycle_message(path + [bom['id']]))
+
+        path.append(bom['id'])
+        for item_id, _ in bom['lines']:
+            if codes.get(item_id, -1) < level + 1:
+                codes[item_id] = level + 1
+                sub = self.get_bom(item_id, as_of)
+                if sub:
+                    self._assign_levels(sub, as_of, level + 1, codes, path)
+        path.pop()
+
+    def components(self, bom: Dict) -> Dict[int, Decimal]:
+        """Scrap-adjusted first-level requirements for one unit of a loaded BOM"""
+        per_unit = defaultdict(Decimal)
+        for item_id, qty in bom['lines']:
+            per_unit[item_id] += qty
+        return per_unit
+
+    def _per_unit(self, bom: Dict, as_of: date, single_level: bool) -> Dict[int, Decimal]:
+        """Requirements for one unit of the BOM's item"""
+        if single_level:
+            return self.components(bom)
+
+        return self._expand(bom, as_of, [])
+
+    def _expand(self, bom: Dict, as_of: date, path: List[int]) -> Dict[int, Decimal]:
+        """Memoised multi-level expansion of one unit with cycle detection"""
+        key = (bom['id'], bom['version'], as_of)
+        if key in self._memo:
+            return self._memo[key]
+
+        if bom['id'] in path:
+            raise BOMError(self._cycle_message(path + [bom['id']]))
+
+        path.append(bom['id'])
+        result = defaultdict(Decimal)
+
+        for item_id, qty in bom['lines']:
+            sub = self.get_bom(item_id, as_of)
+            if sub is None:
+                result[item_id] += qty
+            else:
+                for leaf_id, leaf_qty in self._expand(sub, as_of, path).items():
+                    result[leaf_id] += qty * leaf_qty
+
+        path.pop()
+        self._memo[key] = dict(result)
+        return self._memo[key]
+
+    def _forget_company(self, company_id: int):
+        """Drop loaded BOMs and memoised expansions of a company"""
+        for bom_id in [bom_id for bom_id, bom in self._boms.items() if bom['company_id'] == company_id]:
+            bom = self._boms.pop(bom_id)
+            self._boms_by_item[bom['item_id']].remove(bom)
+        self._memo.clear()
+        self._loaded_companies.discard(company_id)
+
+    def _cycle_message(self, path: List[int]) -> str:
+        """Describe a BOM cycle"""
+        chain = ' → '.join(str(self._boms[bom_id]['item_id']) for bom_id in path)
+        return f'قائمة المواد تحتوي على حلقة دائرية بين الأصناف: {chain}'
+
+    @staticmethod
+    def _scale(per_unit: Dict[int, Decimal], qty: Decimal) -> Dict[int, Decimal]:
+        """Scale per-unit requirements and round to quantity precision"""
+        return {
+            item_id: (unit_qty * qty).quantize(QTY_QUANTUM)
+            for item_id, unit_qty in per_unit.items()
+        }
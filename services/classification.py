@@ -0,0 +1,182 @@
+"""
+Item classification service - ABC/XYZ batch classification
+خدمة تصنيف الأصناف - تصنيف ABC/XYZ الدوري
+"""
+
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from statistics import mean, pstdev
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, extract, func, insert
+from sqlalchemy.orm import Session
+
+from data import DailyMovement, DocumentType, Item, ItemClassification, ItemType
+
+# Document types counted as consumption
+CONSUMPTION_TYPES = (DocumentType.ISSUE, DocumentType.PRODUCTION_ISSUE)
+
+# Cumulative value share closing classes A and B
+DEFAULT_ABC_LIMITS = (Decimal('0.80'), Decimal('0.95'))
+
+# Coefficient of variation closing classes X and Y
+DEFAULT_XYZ_LIMITS = (0.5, 1.0)
+
+
+def _month_start(day: date, months_back: int = 0) -> date:
+    """First day of the month some months before a day"""
+    index = day.year * 12 + day.month - 1 - months_back
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _month_end(day: date) -> date:
+    """Last day of the month of a day"""
+    return date.fromordinal(_month_start(day, -1).toordinal() - 1)
+
+
+class ItemClassificationService:
+    """
+    Service for ABC/XYZ classification
+
+    Monthly consumption of every item is read with one grouped query over
+    the daily movement cube. ABC classes come from cumulative shares of
+    consumption value, XYZ classes from the coefficient of variation of
+    monthly demand. Results are stored in item_classifications for reports
+    and count planning.
+    """
+
+    def classify(self, session: Session, company_id: int,
+                 months: int = 12, as_of: Optional[date] = None,
+                 abc_limits: Sequence[Decimal] = DEFAULT_ABC_LIMITS,
+                 xyz_limits: Sequence[float] = DEFAULT_XYZ_LIMITS) -> Dict[str, int]:
+        """
+        Classify all active stock items of a company
+
+        Args:
+            session: Database session
+            company_id: Company ID
+            months: Number of months of consumption, ending with the month of as_of
+            as_of: Day within the last month (defaults to today)
+            abc_limits: Cumulative value shares closing classes A and B
+            xyz_limits: Coefficients of variation closing classes X and Y
+
+        Returns:
+            Number of items per combined class (e.g. {'AX': 12, 'CZ': 40})
+        """
+        if as_of is None:
+            as_of = date.today()
+        period_from = _month_start(as_of, months - 1)
+        period_to = _month_end(as_of)
+
+        item_ids = [row.id for row in session.query(Item.id).filter(
+            Item.company_id == company_id,
+            Item.is_active == True,
+            Item.item_type == ItemType.STOCK
+        )]
+
+        demand, values = self._monthly_demand(session, company_id, period_from, period_to, months)
+
+        total_value = sum(values.values(), Decimal(0))
+        ranked = sorted(item_ids, key=lambda item_id: values.get(item_id, Decimal(0)), reverse=True)
+
+        rows = []
+        counts: Dict[str, int] = defaultdict(int)
+        cumulative = Decimal(0)
+
+        for item_id in ranked:
+            value = values.get(item_id, Decimal(0))
+            series = demand.get(item_id, [0.0] * months)
+
+            # Share before the item, so a single dominant item is still A
+            share_before = cumulative / total_value if total_value else Decimal(1)
+            cumulative += value
+            if value <= 0:
+                abc_class = 'C'
+            elif share_before < abc_limits[0]:
+                abc_class = 'A'
+            elif share_before < abc_limits[1]:
+                abc_class = 'B'
+            else:
+                abc_class = 'C'
+
+            average = mean(series)
+            cv = pstdev(series) / average if average > 0 else None
+            if cv is None:
+                xyz_class = 'Z'
+            elif cv <= xyz_limits[0]:
+                xyz_class = 'X'
+            elif cv <= xyz_limits[1]:
+                xyz_class = 'Y'
+            else:
+                xyz_class = 'Z'
+
+            counts[abc_class + xyz_class] += 1
+            rows.append({
+                'company_id': company_id,
+                'item_id': item_id,
+                'abc_class': abc_class,
+                'xyz_class': xyz_class,
+                'consumption_qty': Decimal(str(sum(series))),
+                'consumption_value': value,
+                'value_share': (cumulative / total_value).quantize(Decimal('0.000001')) if total_value else Decimal(0),
+                'demand_cv': Decimal(str(round(cv, 4))) if cv is not None else None,
+                'period_from': period_from,
+                'period_to': period_to,
+            })
+
+        session.execute(delete(ItemClassification).where(ItemClassification.company_id == company_id))
+        if rows:
+            session.execute(insert(ItemClassification), rows)
+
+        return dict(counts)
+
+    def get_classes(self, session: Session, company_id: int,
+                    item_ids: Optional[List[int]] = None) -> Dict[int, Tuple[str, str]]:
+        """Stored (ABC, XYZ) class of items"""
+        query = session.query(
+            ItemClassification.item_id,
+            ItemClassification.abc_class,
+            ItemClassification.xyz_class
+        ).filter(ItemClassification.company_id == company_id)
+
+        if item_ids is not None:
+            query = query.filter(ItemClassification.item_id.in_(item_ids))
+
+        return {row.item_id: (row.abc_class, row.xyz_class) for row in query}
+
+    def _monthly_demand(self, session: Session, company_id: int,
+                        period_from: date, period_to: date,
+                        months: int) -> Tuple[Dict[int, List[float]], Dict[int, Decimal]]:
+        """
+        Monthly consumption series and total consumption value per item
+
+        Returns:
+            (item_id -> list of monthly quantities, item_id -> value)
+        """
+        year = extract('year', DailyMovement.movement_date)
+        month = extract('month', DailyMovement.movement_date)
+
+        query = session.query(
+            DailyMovement.item_id,
+            year.label('year'),
+            month.label('month'),
+            func.sum(DailyMovement.qty_out).label('qty'),
+            func.sum(DailyMovement.value_out).label('value')
+        ).filter(
+            DailyMovement.company_id == company_id,
+            DailyMovement.doc_type.in_(CONSUMPTION_TYPES),
+            DailyMovement.movement_date >= period_from,
+            DailyMovement.movement_date <= period_to
+        ).group_by(DailyMovement.item_id, year, month)
+
+        first = period_from.year * 12 + period_from.month - 1
+        demand: Dict[int, List[float]] = {}
+        values: Dict[int, Decimal] = defaultdict(Decimal)
+
+        for row in query:
+            series = demand.setdefault(row.item_id, [0.0] * months)
+            series[int(row.year) * 12 + int(row.month) - 1 - first] += float(row.qty or 0)
+            values[row.item_id] += Decimal(row.value or 0)
+
+        return demand, values
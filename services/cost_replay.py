@@ -0,0 +1,316 @@
+"""
+Cost replay service - Re-cost ledger entries after back-dated changes
+خدمة إعادة احتساب التكلفة - إعادة تسعير الحركات بعد التعديلات بأثر رجعي
+"""
+
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import Select, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from data import (
+    DailyMovement, DocumentHeader, DocumentStatus, DocumentType,
+    InventoryLedger, PeriodBalance, ScrapDocument, StockBalance, upsert_increment
+)
+from services.archival import last_closed_period
+from services.kpi import KPIService
+from services.movement_cube import CUBE_KEY, CUBE_MEASURES
+from config import COSTING_CONFIG
+
+# (warehouse_id, item_id)
+StockKey = Tuple[int, int]
+
+# (warehouse_id, location_id, item_id, lot_id, serial_id)
+BalanceKey = Tuple[int, Optional[int], int, Optional[int], Optional[int]]
+
+VALUE_QUANTUM = Decimal('0.01')
+
+
+def apply_balance_deltas(session: Session, company_id: int,
+                         deltas: Dict[BalanceKey, Tuple[Decimal, Decimal]]) -> Dict[BalanceKey, Decimal]:
+    """
+    Add quantity and value deltas to stock balances (one bulk update)
+
+    Args:
+        session: Database session
+        company_id: Company ID
+        deltas: Balance key -> (qty change, value change)
+
+    Returns:
+        Balance key -> on-hand quantity after the change
+    """
+    if not deltas:
+        return {}
+
+    existing = {}
+    for row in session.query(
+        StockBalance.id, StockBalance.warehouse_id, StockBalance.location_id,
+        StockBalance.item_id, StockBalance.lot_id, StockBalance.serial_id,
+        StockBalance.on_hand_qty, StockBalance.on_hand_value
+    ).filter(
+        StockBalance.company_id == company_id,
+        StockBalance.warehouse_id.in_({key[0] for key in deltas}),
+        StockBalance.item_id.in_({key[2] for key in deltas})
+    ):
+        key = (row.warehouse_id, row.location_id, row.item_id, row.lot_id, row.serial_id)
+        if key in deltas:
+            existing[key] = row
+
+    now = datetime.utcnow()
+    updates, inserts, quantities = [], [], {}
+
+    for key, (qty_change, value_change) in deltas.items():
+        row = existing.get(key)
+        qty = Decimal(row.on_hand_qty or 0) + qty_change if row else qty_change
+        value = Decimal(row.on_hand_value or 0) + value_change if row else value_change
+        values = {
+            'on_hand_qty': qty,
+            'on_hand_value': value,
+            'avg_cost': value / qty if qty > 0 else Decimal(0),
+            'last_updated': now,
+        }
+        quantities[key] = qty
+
+        if row:
+            updates.append(dict(values, id=row.id))
+        else:
+            warehouse_id, location_id, item_id, lot_id, serial_id = key
+            inserts.append(dict(values, company_id=company_id, warehouse_id=warehouse_id,
+                                location_id=location_id, item_id=item_id,
+                                lot_id=lot_id, serial_id=serial_id))
+
+    if updates:
+        session.execute(update(StockBalance), updates)
+    if inserts:
+        session.execute(insert(StockBalance), inserts)
+
+    return quantities
+
+
+class CostReplayService:
+    """
+    Service for replaying moving-average costs
+
+    After back-dated postings or reversals, the outgoing entries of the
+    affected warehouse/item pairs from that date on are re-costed in
+    posting order at the running average, and transfer receipts follow
+    the re-costed transfer issue. Changed entries are written with one
+    bulk update and the value differences are carried into balances, the
+    movement cube and the stock value KPI. Reversed documents are treated
+    as never posted; production scrap keeps its receipt cost.
+    """
+
+    def __init__(self):
+        self.kpi_service = KPIService()
+
+    def replay(self, session: Session, company_id: int,
+               starts: Dict[StockKey, date]) -> int:
+        """
+        Re-cost entries from a date per warehouse and item
+
+        Args:
+            session: Database session
+            company_id: Company ID
+            starts: (warehouse_id, item_id) -> first day to re-cost
+
+        Returns:
+            Number of ledger entries re-costed
+        """
+        starts = dict(starts)
+        if not starts:
+            return 0
+
+        self._add_transfer_targets(session, company_id, starts)
+
+        first = min(starts.values())
+        warehouse_ids = {key[0] for key in starts}
+        item_ids = {key[1] for key in starts}
+
+        period_end = last_closed_period(session, company_id)
+
+        # Reversed documents posted in the open period cancel out in the
+        # ledger and are left out entirely; older ones are kept at cost
+        cancelled = select(DocumentHeader.id).where(
+            DocumentHeader.company_id == company_id,
+            DocumentHeader.status == DocumentStatus.REVERSED
+        )
+        if period_end:
+            cancelled = cancelled.where(DocumentHeader.posting_date > period_end)
+
+        # Production scrap keeps the cost of the receipt it was scrapped from
+        fixed_cost = select(ScrapDocument.doc_id).where(
+            ScrapDocument.scrap_type == 'PRODUCTION'
+        )
+
+        running = self._opening(session, company_id, first, warehouse_ids, item_ids,
+                                period_end, cancelled)
+
+        precision = COSTING_CONFIG['precision']
+        transfer_values: Dict[Tuple[int, int], Tuple[Decimal, Decimal]] = {}
+        ledger_updates = []
+        balance_deltas: Dict[BalanceKey, Tuple[Decimal, Decimal]] = {}
+        cube_deltas: Dict[tuple, Dict] = {}
+        value_deltas: Dict[int, Decimal] = defaultdict(Decimal)
+
+        def record(row, value_in_change: Decimal, value_out_change: Decimal):
+            key = (row.warehouse_id, row.location_id, row.item_id, row.lot_id, row.serial_id)
+            qty, value = balance_deltas.get(key, (Decimal(0), Decimal(0)))
+            balance_deltas[key] = (qty, value + value_in_change - value_out_change)
+
+            cell_key = (company_id, row.warehouse_id, row.item_id, row.doc_type, row.posting_date)
+            cell = cube_deltas.get(cell_key)
+            if cell is None:
+                cell = dict(zip(CUBE_KEY, cell_key))
+                cell.update({measure: 0 for measure in CUBE_MEASURES})
+                cube_deltas[cell_key] = cell
+            cell['value_in'] += value_in_change
+            cell['value_out'] += value_out_change
+
+            value_deltas[row.warehouse_id] += value_in_change - value_out_change
+
+        rows = session.query(
+            InventoryLedger.id, InventoryLedger.warehouse_id, InventoryLedger.location_id,
+            InventoryLedger.item_id, InventoryLedger.lot_id, InventoryLedger.serial_id,
+            InventoryLedger.doc_type, InventoryLedger.doc_id, InventoryLedger.line_no,
+            InventoryLedger.posting_date, InventoryLedger.qty_in, InventoryLedger.qty_out,
+            InventoryLedger.unit_cost, InventoryLedger.value_in, InventoryLedger.value_out,
+            DocumentHeader.status,
+            InventoryLedger.doc_id.in_(fixed_cost).label('fixed_cost')
+        ).join(
+            DocumentHeader, DocumentHeader.id == InventoryLedger.doc_id
+        ).filter(
+            InventoryLedger.company_id == company_id,
+            InventoryLedger.posting_date >= first,
+            InventoryLedger.warehouse_id.in_(warehouse_ids),
+            InventoryLedger.item_id.in_(item_ids),
+            ~InventoryLedger.doc_id.in_(cancelled)
+        ).order_by(InventoryLedger.posting_date, InventoryLedger.id)
+
+        for row in rows:
+            key = (row.warehouse_id, row.item_id)
+            if key not in starts:
+                continue
+
+            totals = running[key]
+            qty_in = Decimal(row.qty_in or 0)
+            qty_out = Decimal(row.qty_out or 0)
+            value_in = Decimal(row.value_in or 0)
+            value_out = Decimal(row.value_out or 0)
+
+            if (row.posting_date >= starts[key] and row.status != DocumentStatus.REVERSED
+                    and not row.fixed_cost):
+                if qty_out > 0:
+                    cost = round(totals[1] / totals[0], precision) if totals[0] > 0 else Decimal(row.unit_cost or 0)
+                    new_value = (qty_out * cost).quantize(VALUE_QUANTUM)
+                    if row.doc_type == DocumentType.TRANSFER:
+                        transfer_values[(row.doc_id, row.line_no)] = (cost, new_value)
+                    if new_value != value_out:
+                        ledger_updates.append({'id': row.id, 'unit_cost': cost, 'value_out': new_value})
+                        record(row, Decimal(0), new_value - value_out)
+                        value_out = new_value
+
+                elif qty_in > 0 and (row.doc_id, row.line_no) in transfer_values:
+                    cost, new_value = transfer_values[(row.doc_id, row.line_no)]
+                    if new_value != value_in:
+                        ledger_updates.append({'id': row.id, 'unit_cost': cost, 'value_in': new_value})
+                        record(row, new_value - value_in, Decimal(0))
+                        value_in = new_value
+
+            totals[0] += qty_in - qty_out
+            totals[1] += value_in - value_out
+
+        if not ledger_updates:
+            return 0
+
+        session.execute(update(InventoryLedger), ledger_updates)
+        apply_balance_deltas(session, company_id, balance_deltas)
+        upsert_increment(session, DailyMovement, CUBE_KEY, list(cube_deltas.values()), CUBE_MEASURES)
+        self.kpi_service.adjust_stock_value(session, company_id, value_deltas)
+
+        return len(ledger_updates)
+
+    def _add_transfer_targets(self, session: Session, company_id: int,
+                              starts: Dict[StockKey, date]):
+        """Extend the replay to warehouses receiving transfers of replayed stock"""
+        pending = dict(starts)
+        while pending:
+            sources = defaultdict(set)
+            for warehouse_id, item_id in pending:
+                sources[warehouse_id].add(item_id)
+
+            rows = session.query(
+                DocumentHeader.from_warehouse_id,
+                InventoryLedger.warehouse_id,
+                InventoryLedger.item_id,
+                func.min(InventoryLedger.posting_date).label('first')
+            ).join(
+                DocumentHeader, DocumentHeader.id == InventoryLedger.doc_id
+            ).filter(
+                InventoryLedger.company_id == company_id,
+                InventoryLedger.doc_type == DocumentType.TRANSFER,
+                InventoryLedger.qty_in > 0,
+                InventoryLedger.posting_date >= min(pending.values()),
+                DocumentHeader.from_warehouse_id.in_(sources),
+                InventoryLedger.item_id.in_(set().union(*sources.values()))
+            ).group_by(
+                DocumentHeader.from_warehouse_id, InventoryLedger.warehouse_id, InventoryLedger.item_id
+            )
+
+            added = {}
+            for row in rows:
+                source_start = pending.get((row.from_warehouse_id, row.item_id))
+                if source_start is None:
+                    continue
+                key = (row.warehouse_id, row.item_id)
+                start = max(source_start, row.first)
+                if key not in starts or start < starts[key]:
+                    starts[key] = start
+                    added[key] = start
+            pending = added
+
+    def _opening(self, session: Session, company_id: int, first: date,
+                 warehouse_ids, item_ids, period_end: Optional[date],
+                 cancelled: Select) -> Dict[StockKey, list]:
+        """Quantity and value per warehouse and item before a day"""
+        running = defaultdict(lambda: [Decimal(0), Decimal(0)])
+
+        query = session.query(
+            InventoryLedger.warehouse_id,
+            InventoryLedger.item_id,
+            func.sum(InventoryLedger.qty_in - InventoryLedger.qty_out).label('qty'),
+            func.sum(InventoryLedger.value_in - InventoryLedger.value_out).label('value')
+        ).filter(
+            InventoryLedger.company_id == company_id,
+            InventoryLedger.posting_date < first,
+            InventoryLedger.warehouse_id.in_(warehouse_ids),
+            InventoryLedger.item_id.in_(item_ids),
+            ~InventoryLedger.doc_id.in_(cancelled)
+        )
+
+        if period_end:
+            query = query.filter(InventoryLedger.posting_date > period_end)
+
+            for row in session.query(
+                PeriodBalance.warehouse_id,
+                PeriodBalance.item_id,
+                func.sum(PeriodBalance.qty).label('qty'),
+                func.sum(PeriodBalance.value).label('value')
+            ).filter(
+                PeriodBalance.company_id == company_id,
+                PeriodBalance.period_end == period_end,
+                PeriodBalance.warehouse_id.in_(warehouse_ids),
+                PeriodBalance.item_id.in_(item_ids)
+            ).group_by(PeriodBalance.warehouse_id, PeriodBalance.item_id):
+                totals = running[(row.warehouse_id, row.item_id)]
+                totals[0] += Decimal(row.qty or 0)
+                totals[1] += Decimal(row.value or 0)
+
+        for row in query.group_by(InventoryLedger.warehouse_id, InventoryLedger.item_id):
+            totals = running[(row.warehouse_id, row.item_id)]
+            totals[0] += Decimal(row.qty or 0)
+            totals[1] += Decimal(row.value or 0)
+
+        return running
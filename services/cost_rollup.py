@@ -0,0 +1,187 @@
+"""
+Cost rollup service - Standard cost of BOMs from materials and routing labour
+خدمة تجميع التكلفة - التكلفة المعيارية لقوائم المواد من المواد والعمالة
+"""
+
+from collections import deque
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Iterable, Optional, Set
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from data import BOM, Routing, RoutingStep, WorkCenter
+from services.bom import BOMExplosionService
+from services.costing import CostingService
+
+
+class CostRollupService:
+    """
+    Service for rolling up BOM standard costs
+
+    BOM.estimated_cost holds the cost of producing the BOM's base_qty:
+    component costs (average cost for purchased items, rolled cost for
+    sub-assemblies) plus routing labour at the work centers' hourly rates.
+    """
+
+    def __init__(self):
+        self.bom_service = BOMExplosionService()
+        self.costing_service = CostingService()
+
+    def rollup(self, session: Session, company_id: int,
+               as_of: Optional[date] = None) -> Dict[int, Decimal]:
+        """
+        Recompute the estimated cost of every active BOM bottom-up
+
+        Returns:
+            Dict of bom_id to new estimated cost
+        """
+        boms = self.bom_service.boms_of_company(session, company_id)
+        bom_ids = {bom['id'] for bom in boms if bom['is_active']}
+
+        return self._recompute(session, company_id, bom_ids, as_of)
+
+    def recompute_for_items(self, session: Session, company_id: int,
+                            item_ids: Iterable[int],
+                            as_of: Optional[date] = None) -> Dict[int, Decimal]:
+        """
+        Recompute only the BOMs affected by cost changes of some items
+
+        Affected BOMs are found through the where-used index: every BOM using
+        a changed item, then every BOM using those BOMs' items, and so on up
+        to the finished goods. All other BOMs keep their stored cost.
+
+        Args:
+            session: Database session
+            company_id: Company ID
+            item_ids: Items whose cost changed
+            as_of: Date selecting sub-assembly BOMs (defaults to today)
+
+        Returns:
+            Dict of bom_id to new estimated cost
+        """
+        where_used = self.bom_service.where_used(session, company_id)
+
+        affected: Set[int] = set()
+        seen_items = set(item_ids)
+        queue = deque(seen_items)
+
+        while queue:
+            item_id = queue.popleft()
+            for bom_id in where_used.get(item_id, ()):
+                bom = self.bom_service.get_bom_by_id(session, bom_id)
+                if bom_id in affected or not bom['is_active']:
+                    continue
+                affected.add(bom_id)
+                if bom['item_id'] not in seen_items:
+                    seen_items.add(bom['item_id'])
+                    queue.append(bom['item_id'])
+
+        return self._recompute(session, company_id, affected, as_of)
+
+    def _recompute(self, session: Session, company_id: int,
+                   bom_ids: Set[int], as_of: Optional[date]) -> Dict[int, Decimal]:
+        """Recompute a set of BOMs, deepest level first, and store the costs"""
+        if not bom_ids:
+            return {}
+
+        if as_of is None:
+            as_of = date.today()
+
+        boms = {bom_id: self.bom_service.get_bom_by_id(session, bom_id) for bom_id in bom_ids}
+        llc = self.bom_service.low_level_codes(session, company_id, as_of)
+
+        component_ids = {
+            item_id for bom in boms.values() for item_id, _ in bom['lines']
+        }
+        avg_costs = self.costing_service.get_average_costs(session, company_id, component_ids)
+        labour = self._load_labour(session, bom_ids)
+        stored = dict(session.query(BOM.id, BOM.estimated_cost).filter(
+            BOM.company_id == company_id
+        ).all())
+
+        # Unit cost of sub-assemblies computed in this run
+        unit_costs: Dict[int, Decimal] = {}
+        results = {}
+
+        ordered = sorted(
+            boms.values(),
+            key=lambda bom: (llc.get(bom['item_id'], 0), bom['id']),
+            reverse=True
+        )
+
+        for bom in ordered:
+            material = Decimal(0)
+
+            for item_id, per_unit in self.bom_service.components(bom).items():
+                material += per_unit * self._component_cost(
+                    item_id, as_of, unit_costs, stored, avg_costs
+                )
+
+            setup_hours_cost, run_hours_cost = labour.get(bom['id'], (Decimal(0), Decimal(0)))
+            unit_cost = material + run_hours_cost + setup_hours_cost / bom['base_qty']
+
+            unit_costs[bom['id']] = unit_cost
+            results[bom['id']] = round(unit_cost * bom['base_qty'], 2)
+
+        session.execute(
+            update(BOM),
+            [{'id': bom_id, 'estimated_cost': cost} for bom_id, cost in results.items()]
+        )
+
+        return results
+
+    def _component_cost(self, item_id: int, as_of: date,
+                        unit_costs: Dict[int, Decimal],
+                        stored: Dict[int, Optional[Decimal]],
+                        avg_costs: Dict) -> Decimal:
+        """Unit cost of a component: rolled cost for sub-assemblies, else average cost"""
+        sub = self.bom_service.get_bom(item_id, as_of)
+
+        if sub:
+            if sub['id'] in unit_costs:
+                return unit_costs[sub['id']]
+            if stored.get(sub['id']) is not None:
+                return Decimal(stored[sub['id']]) / sub['base_qty']
+
+        return avg_costs.get((item_id, None), Decimal(0))
+
+    def _load_labour(self, session: Session, bom_ids: Set[int]) -> Dict[int, tuple]:
+        """
+        Labour cost per BOM from its active routing (one query)
+
+        Returns:
+            Dict of bom_id to (setup cost per batch, run cost per unit)
+        """
+        rows = session.query(
+            Routing.bom_id,
+            Routing.id.label('routing_id'),
+            RoutingStep.setup_time,
+            RoutingStep.run_time,
+            WorkCenter.cost_per_hour
+        ).join(
+            RoutingStep, RoutingStep.routing_id == Routing.id
+        ).join(
+            WorkCenter, RoutingStep.work_center_id == WorkCenter.id
+        ).filter(
+            Routing.bom_id.in_(bom_ids),
+            Routing.is_active == True  # noqa: E712
+        ).order_by(Routing.bom_id, Routing.id).all()
+
+        labour = {}
+        routing_of_bom = {}
+
+        for row in rows:
+            # Only the first active routing of a BOM counts
+            if routing_of_bom.setdefault(row.bom_id, row.routing_id) != row.routing_id:
+                continue
+
+            rate = Decimal(row.cost_per_hour or 0)
+            setup, run = labour.get(row.bom_id, (Decimal(0), Decimal(0)))
+            labour[row.bom_id] = (
+                setup + Decimal(row.setup_time or 0) * rate,
+                run + Decimal(row.run_time or 0) * rate,
+            )
+
+        return labour
@@ -4,12 +4,13 @@ Costing service - Average cost calculation
 """
 
 from decimal import Decimal
-from typing import Optional
+from typing import Dict, Iterable, Optional, Tuple
 
 from sqlalchemy import func
 from sqlalchemy.orm import Session
 
-from data import StockBalance, InventoryLedger
+from data import StockBalance, InventoryLedger, PeriodBalance
+from services.archival import last_closed_period
 from config import COSTING_CONFIG
 
 
@@ -52,10 +53,62 @@ class CostingService:
             session, company_id, warehouse_id, item_id, lot_id
         )
     
+    def get_average_costs(self, session: Session, company_id: int,
+                          item_ids: Iterable[int],
+                          warehouse_id: Optional[int] = None) -> Dict[Tuple[int, Optional[int]], Decimal]:
+        """
+        Get average costs for many items with one grouped query
+        
+        Args:
+            session: Database session
+            company_id: Company ID
+            item_ids: Item IDs
+            warehouse_id: Warehouse ID (optional, all warehouses when omitted)
+            
+        Returns:
+            Dict keyed by (item_id, lot_id) per lot and (item_id, None) per item
+        """
+        item_ids = set(item_ids)
+        if not item_ids:
+            return {}
+        
+        query = session.query(
+            StockBalance.item_id,
+            StockBalance.lot_id,
+            func.sum(StockBalance.on_hand_qty).label('qty'),
+            func.sum(StockBalance.on_hand_value).label('value')
+        ).filter(
+            StockBalance.company_id == company_id,
+            StockBalance.item_id.in_(item_ids)
+        ).group_by(
+            StockBalance.item_id, StockBalance.lot_id
+        )
+        
+        if warehouse_id:
+            query = query.filter(StockBalance.warehouse_id == warehouse_id)
+        
+        costs = {}
+        totals = {}
+        for row in query.all():
+            qty = Decimal(row.qty or 0)
+            value = Decimal(row.value or 0)
+            
+            if row.lot_id is not None and qty > 0:
+                costs[(row.item_id, row.lot_id)] = self._round_cost(value / qty)
+            
+            item_qty, item_value = totals.get(row.item_id, (Decimal(0), Decimal(0)))
+            totals[row.item_id] = (item_qty + qty, item_value + value)
+        
+        for item_id, (qty, value) in totals.items():
+            if qty > 0:
+                costs[(item_id, None)] = self._round_cost(value / qty)
+        
+        return costs
+    
     def _calculate_from_ledger(self, session: Session, company_id: int,
                                warehouse_id: int, item_id: int,
                                lot_id: Optional[int] = None) -> Decimal:
-        """Calculate average cost from inventory ledger"""
+        """Calculate average cost from the last closed balance and later ledger rows"""
         query = session.query(
             func.sum(InventoryLedger.qty_in - InventoryLedger.qty_out).label('total_qty'),
             func.sum(InventoryLedger.value_in - InventoryLedger.value_out).label('total_value')
@@ -68,10 +121,36 @@ class CostingService:
         if lot_id:
             query = query.filter_by(lot_id=lot_id)
         
+        total_qty = Decimal(0)
+        total_value = Decimal(0)
+        
+        period_end = last_closed_period(session, company_id)
+        if period_end:
+            query = query.filter(InventoryLedger.posting_date > period_end)
+            
+            opening = session.query(
+                func.sum(PeriodBalance.qty).label('total_qty'),
+                func.sum(PeriodBalance.value).label('total_value')
+            ).filter_by(
+                company_id=company_id,
+                period_end=period_end,
+                warehouse_id=warehouse_id,
+                item_id=item_id
+            )
+            
+            if lot_id:
+                opening = opening.filter_by(lot_id=lot_id)
+            
+            opening = opening.first()
+            total_qty += Decimal(opening.total_qty or 0)
+            total_value += Decimal(opening.total_value or 0)
+        
         result = query.first()
+        total_qty += Decimal(result.total_qty or 0)
+        total_value += Decimal(result.total_value or 0)
         
-        if result and result.total_qty and result.total_qty > 0:
-            avg_cost = result.total_value / result.total_qty
+        if total_qty > 0:
+            avg_cost = total_value / total_qty
             return self._round_cost(avg_cost)
         
         return Decimal(0)
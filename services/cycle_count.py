@@ -0,0 +1,204 @@
+"""
+Cycle count planner - Daily counts scheduled by ABC class and movement
+مخطط الجرد الدوري - جدولة جرد يومي حسب تصنيف ABC وحركة الأصناف
+"""
+
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from data import (
+    DailyMovement, DocumentStatus, DocumentType, ItemClassification,
+    ItemCountStat, StockBalance, StockCount, StockCountLine, Warehouse,
+    session_scope
+)
+from services.numbering import DocumentNumberingService
+from services.stock_count import StockCountService
+
+# Target days between counts per ABC class (unclassified items count as C)
+DEFAULT_INTERVALS = {'A': 30, 'B': 90, 'C': 180}
+
+# Days of movement history weighing the schedule
+MOVEMENT_DAYS = 30
+
+
+class CycleCountPlannerService:
+    """
+    Service for planning cycle counts
+
+    Each day, items due for counting in a warehouse are ranked by how far
+    past their class interval they are, raised by their recent movement.
+    Everything is read from precomputed data - ABC classes, the daily
+    movement cube and last count dates kept by count posting - so planning
+    never scans the ledger. The chosen items become a draft stock count
+    with system quantities frozen in one INSERT ... SELECT.
+    """
+
+    def __init__(self):
+        self.numbering_service = DocumentNumberingService()
+        self.stock_count_service = StockCountService()
+
+    def plan(self, session: Session, company_id: int, warehouse_id: int,
+             day: Optional[date] = None, capacity: int = 50,
+             intervals: Dict[str, int] = DEFAULT_INTERVALS) -> List[Dict]:
+        """
+        Rank the items due for counting in a warehouse
+
+        Args:
+            session: Database session
+            company_id: Company ID
+            warehouse_id: Warehouse ID
+            day: Planning day (defaults to today)
+            capacity: Maximum number of items to count
+            intervals: Target days between counts per ABC class
+
+        Returns:
+            List of dicts with item_id, abc_class, last_count_date,
+            days_since, movement_lines and score, highest score first
+        """
+        if day is None:
+            day = date.today()
+
+        stocked = [row.item_id for row in session.query(StockBalance.item_id).filter(
+            StockBalance.company_id == company_id,
+            StockBalance.warehouse_id == warehouse_id
+        ).group_by(StockBalance.item_id).having(func.sum(StockBalance.on_hand_qty) != 0)]
+
+        if not stocked or capacity <= 0:
+            return []
+
+        classes = {
+            row.item_id: row.abc_class for row in session.query(
+                ItemClassification.item_id, ItemClassification.abc_class
+            ).filter(ItemClassification.company_id == company_id)
+        }
+
+        last_counted = {
+            row.item_id: row.last_count_date for row in session.query(
+                ItemCountStat.item_id, ItemCountStat.last_count_date
+            ).filter(
+                ItemCountStat.company_id == company_id,
+                ItemCountStat.warehouse_id == warehouse_id
+            )
+        }
+
+        movement = {
+            row.item_id: int(row.lines or 0) for row in session.query(
+                DailyMovement.item_id,
+                func.sum(DailyMovement.line_count).label('lines')
+            ).filter(
+                DailyMovement.company_id == company_id,
+                DailyMovement.warehouse_id == warehouse_id,
+                DailyMovement.movement_date > day - timedelta(days=MOVEMENT_DAYS),
+                DailyMovement.movement_date <= day
+            ).group_by(DailyMovement.item_id)
+        }
+
+        # Items already waiting in an open count are not planned again
+        pending = {
+            row.item_id for row in session.query(StockCountLine.item_id).join(
+                StockCount, StockCountLine.count_id == StockCount.id
+            ).filter(
+                StockCount.company_id == company_id,
+                StockCount.warehouse_id == warehouse_id,
+                StockCount.status == DocumentStatus.DRAFT
+            ).distinct()
+        }
+
+        max_lines = max(movement.values(), default=0) or 1
+
+        candidates = []
+        for item_id in stocked:
+            if item_id in pending:
+                continue
+
+            abc_class = classes.get(item_id, 'C')
+            interval = intervals.get(abc_class, intervals['C'])
+            last_count_date = last_counted.get(item_id)
+            # Never counted items are treated as two intervals overdue
+            days_since = (day - last_count_date).days if last_count_date else 2 * interval
+
+            if days_since < interval:
+                continue
+
+            lines = movement.get(item_id, 0)
+            candidates.append({
+                'item_id': item_id,
+                'abc_class': abc_class,
+                'last_count_date': last_count_date,
+                'days_since': days_since,
+                'movement_lines': lines,
+                'score': round(days_since / interval * (1 + lines / max_lines), 4),
+            })
+
+        candidates.sort(key=lambda candidate: (-candidate['score'], candidate['item_id']))
+
+        return candidates[:capacity]
+
+    def generate(self, company_id: int, user_id: int,
+                 day: Optional[date] = None, capacity: int = 50,
+                 warehouse_ids: Optional[List[int]] = None,
+                 intervals: Dict[str, int] = DEFAULT_INTERVALS) -> List[int]:
+        """
+        Create the day's cycle counts, one frozen draft count per warehouse
+
+        Args:
+            company_id: Company ID
+            user_id: User creating the counts
+            day: Count date (defaults to today)
+            capacity: Maximum number of items per warehouse
+            warehouse_ids: Warehouses to plan (defaults to all active stocking warehouses)
+            intervals: Target days between counts per ABC class
+
+        Returns:
+            IDs of the created stock counts
+
+        Raises:
+            NumberingError: If the stock count sequence is not defined
+        """
+        if day is None:
+            day = date.today()
+
+        count_ids = []
+        with session_scope() as session:
+            if warehouse_ids is None:
+                warehouse_ids = [row.id for row in session.query(Warehouse.id).filter(
+                    Warehouse.company_id == company_id,
+                    Warehouse.is_active == True,
+                    Warehouse.is_in_transit == False
+                ).order_by(Warehouse.id)]
+
+            plans = {}
+            for warehouse_id in warehouse_ids:
+                planned = self.plan(session, company_id, warehouse_id, day, capacity, intervals)
+                if planned:
+                    plans[warehouse_id] = [candidate['item_id'] for candidate in planned]
+
+            # Numbered before the transaction writes (block reservations use
+            # their own connection); NO_GAPS numbers are locked until commit
+            count_nos = {
+                warehouse_id: self.numbering_service.next_doc_no(
+                    company_id, DocumentType.STOCK_COUNT, session=session
+                )
+                for warehouse_id in plans
+            }
+
+            for warehouse_id, item_ids in plans.items():
+                count = StockCount(
+                    company_id=company_id,
+                    warehouse_id=warehouse_id,
+                    count_no=count_nos[warehouse_id],
+                    count_date=day,
+                    status=DocumentStatus.DRAFT,
+                    notes='جرد دوري',
+                    created_by=user_id
+                )
+                session.add(count)
+                session.flush()
+
+                self.stock_count_service.freeze(session, count.id, item_ids=item_ids)
+                count_ids.append(count.id)
+
+        return count_ids
@@ -0,0 +1,126 @@
+"""
+Derived tables service - Backfill the tables maintained at posting time
+خدمة الجداول المشتقة - إعادة بناء الجداول المحدثة عند الترحيل لقواعد البيانات القائمة
+"""
+
+from typing import List, Optional
+
+from sqlalchemy import exists
+from sqlalchemy.orm import Session
+
+from data import DailyMovement, InventoryLedger, create_all_tables, get_engine
+from services.genealogy import GenealogyService
+from services.inventory_aging import InventoryAgingService
+from services.kpi import KPIService
+from services.movement_cube import MovementCubeService
+from services.reorder_monitor import ReorderMonitorService
+from services.reservation import ReservationService
+from services.serial_registry import SerialRegistryService
+from utils.logging import get_logger
+
+logger = get_logger('derived_tables')
+
+
+class DerivedTablesService:
+    """
+    Service for rebuilding the tables posting keeps up to date
+
+    The serial registry, movement cube, item totals, KPI counters,
+    genealogy graph, reservations and receipt layers are only adjusted by
+    each posting. A database that already held documents when these tables
+    were added starts with them empty; upgrade() creates the missing
+    tables and rebuilds every company whose ledger has no cube rows yet.
+
+    create_all() does not alter tables that already exist: constraints
+    added to them come from the alembic migrations (alembic upgrade head),
+    which should run first. The backfill runs from the command line, not
+    at application startup.
+    """
+
+    def __init__(self):
+        self.serial_registry_service = SerialRegistryService()
+        self.movement_cube_service = MovementCubeService()
+        self.reorder_monitor_service = ReorderMonitorService()
+        self.kpi_service = KPIService()
+        self.genealogy_service = GenealogyService()
+        self.reservation_service = ReservationService()
+        self.aging_service = InventoryAgingService()
+
+    def rebuild(self, company_id: int, workers: Optional[int] = None):
+        """
+        Rebuild all derived tables of a company
+
+        Receipt layers are rebuilt first with their own worker processes;
+        the other tables follow in one transaction, the movement cube before
+        the KPI counters that read it. A company with cube rows has
+        therefore been rebuilt completely.
+
+        Args:
+            company_id: Company ID
+            workers: Worker processes for the receipt layers (defaults to
+                CPU count; 1 runs inline)
+        """
+        self.aging_service.rebuild(company_id, workers)
+
+        with Session(get_engine()) as session:
+            serials = self.serial_registry_service.rebuild(session, company_id)
+            totals = self.reorder_monitor_service.rebuild(session, company_id)
+            links = self.genealogy_service.rebuild(session, company_id)
+            self.reservation_service.rebuild(session, company_id)
+            cells = self.movement_cube_service.rebuild(session, company_id)
+            self.kpi_service.rebuild(session, company_id)
+            session.commit()
+
+        logger.info(
+            f'أعيد بناء الجداول المشتقة للشركة {company_id}: {cells} خلية حركة، '
+            f'{totals} إجمالي صنف، {serials} رقم تسلسلي، {links} رابط تتبع'
+        )
+
+    def upgrade(self, workers: Optional[int] = None) -> List[int]:
+        """
+        Create missing tables and backfill companies posted before them
+
+        Returns:
+            IDs of the companies rebuilt
+        """
+        create_all_tables()
+
+        with Session(get_engine()) as session:
+            company_ids = [
+                row.company_id for row in session.query(InventoryLedger.company_id).filter(
+                    ~exists().where(DailyMovement.company_id == InventoryLedger.company_id)
+                ).distinct().order_by(InventoryLedger.company_id)
+            ]
+
+        for company_id in company_ids:
+            self.rebuild(company_id, workers)
+
+        return company_ids
+
+
+def main(argv=None):
+    """Command line entry point: python -m services.derived_tables"""
+    import argparse
+    from utils.logging import setup_logging
+
+    parser = argparse.ArgumentParser(description='Rebuild the tables maintained at posting time')
+    parser.add_argument('--company', type=int, action='append',
+                        help='Company ID to rebuild (repeatable; default: upgrade only)')
+    parser.add_argument('--workers', type=int, help='Worker processes')
+    args = parser.parse_args(argv)
+
+    setup_logging()
+
+    service = DerivedTablesService()
+    if args.company:
+        create_all_tables()
+        for company_id in args.company:
+            service.rebuild(company_id, args.workers)
+    elif not service.upgrade(args.workers):
+        logger.info('الجداول المشتقة محدثة')
+
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
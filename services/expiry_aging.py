@@ -0,0 +1,230 @@
+"""
+Expiry aging service - Lot stock classified into days-to-expiry buckets
+خدمة أعمار الصلاحية - تصنيف أرصدة التشغيلات حسب الأيام المتبقية للانتهاء
+"""
+
+from bisect import bisect_left
+from datetime import date
+from decimal import Decimal
+from threading import Lock
+from time import monotonic
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session, object_session
+
+from data import DocumentHeader, InventoryLedger, Lot, StockBalance
+
+# Upper bounds (days to expiry, inclusive) of the default buckets
+DEFAULT_BUCKETS = (30, 60, 90, 180, 365)
+
+EXPIRED = 'EXPIRED'
+NO_EXPIRY = 'NO_EXPIRY'
+
+# session.info key of companies whose lot stock changed in the transaction
+PENDING_KEY = 'expiry_aging_companies'
+
+# Seconds a cached result is served; bounds staleness from writes that do
+# not pass through this process's sessions (other processes, bulk SQL)
+CACHE_TTL = 300
+
+# Global result cache: (company_id, warehouse_id, as_of, buckets) -> (expires_at, result)
+_aging_cache: Dict[Tuple, Tuple[float, Dict]] = {}
+_cache_lock = Lock()
+
+
+def invalidate_cache(company_id: Optional[int] = None):
+    """Drop cached aging results (all companies when company_id is None)"""
+    with _cache_lock:
+        if company_id is None:
+            _aging_cache.clear()
+        else:
+            for key in [key for key in _aging_cache if key[0] == company_id]:
+                del _aging_cache[key]
+
+
+def _cached(key: Tuple) -> Optional[Dict]:
+    """Cached result of a key, if not expired"""
+    with _cache_lock:
+        entry = _aging_cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= monotonic():
+            del _aging_cache[key]
+            return None
+        return entry[1]
+
+
+def _store(key: Tuple, result: Dict):
+    """Cache a result, dropping expired and past-day entries"""
+    now = monotonic()
+    today = date.today()
+    with _cache_lock:
+        for stale in [
+            stale for stale, (expires_at, _) in _aging_cache.items()
+            if expires_at <= now or stale[2] < today
+        ]:
+            del _aging_cache[stale]
+        _aging_cache[key] = (now + CACHE_TTL, result)
+
+
+def _mark_changed(target, company_id: int):
+    """
+    Drop a company's results now and again when its transaction ends
+
+    The immediate drop lets the writing session see its own change; the
+    second one discards results other sessions built from the previous
+    committed state while the transaction was open.
+    """
+    invalidate_cache(company_id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(PENDING_KEY, set()).add(company_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _on_commit(session: Session):
+    for company_id in session.info.pop(PENDING_KEY, ()):
+        invalidate_cache(company_id)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _on_rollback(session: Session, previous_transaction):
+    # Results built from the rolled back changes are no longer valid
+    for company_id in session.info.pop(PENDING_KEY, ()):
+        invalidate_cache(company_id)
+
+
+@event.listens_for(Lot, 'after_update')
+@event.listens_for(Lot, 'after_delete')
+def _on_lot_changed(mapper, connection, target):
+    _mark_changed(target, target.company_id)
+
+
+def bucket_labels(buckets: Sequence[int]) -> List[str]:
+    """Labels of the buckets defined by their upper bounds"""
+    labels = [EXPIRED]
+    lower = 0
+    for upper in buckets:
+        labels.append(f'{lower}-{upper}')
+        lower = upper + 1
+    labels.append(f'>{buckets[-1]}')
+    labels.append(NO_EXPIRY)
+    return labels
+
+
+class ExpiryAgingService:
+    """
+    Service for expiry aging of lot stock
+
+    Lot balances are read with one query grouped by expiry date and each
+    distinct date is placed in its bucket once, so the cost depends on the
+    number of expiry dates rather than balance rows. Results are cached
+    per company, warehouse, day and bucket set for CACHE_TTL seconds;
+    posting a document that moves lot stock, or changing a lot, drops the
+    company's cached results when the transaction ends.
+    """
+
+    def apply(self, session: Session, document: DocumentHeader,
+              entries: List[InventoryLedger]):
+        """Mark the company's cached results stale if lot stock moved"""
+        if any(entry.lot_id for entry in entries):
+            session.info.setdefault(PENDING_KEY, set()).add(document.company_id)
+
+    def aging(self, session: Session, company_id: int,
+              warehouse_id: Optional[int] = None,
+              as_of: Optional[date] = None,
+              buckets: Sequence[int] = DEFAULT_BUCKETS,
+              use_cache: bool = True) -> Dict:
+        """
+        Lot stock by days-to-expiry bucket
+
+        Args:
+            session: Database session
+            company_id: Company ID
+            warehouse_id: Warehouse ID (optional, all warehouses if omitted)
+            as_of: Day to age from (defaults to today)
+            buckets: Upper bounds of the buckets in days (at least one)
+            use_cache: Return a cached result when available
+
+        Returns:
+            Dict with as_of and buckets: list of dicts with bucket, qty,
+            value and lots, from expired to no expiry date
+        """
+        if as_of is None:
+            as_of = date.today()
+        buckets = tuple(sorted(buckets))
+
+        key = (company_id, warehouse_id, as_of, buckets)
+        if use_cache:
+            cached = _cached(key)
+            if cached is not None:
+                return cached
+
+        result = self._compute(session, company_id, warehouse_id, as_of, buckets)
+
+        if use_cache:
+            _store(key, result)
+
+        return result
+
+    def expiring_within(self, session: Session, company_id: int, days: int,
+                        warehouse_id: Optional[int] = None) -> Dict:
+        """
+        Stock expiring in the next days (not yet expired)
+
+        Returns:
+            Dict with qty and value
+        """
+        result = self.aging(session, company_id, warehouse_id, buckets=(days,))
+        row = result['buckets'][1]
+
+        return {'qty': row['qty'], 'value': row['value']}
+
+    def _compute(self, session: Session, company_id: int,
+                 warehouse_id: Optional[int], as_of: date,
+                 buckets: Tuple[int, ...]) -> Dict:
+        """Classify lot balances into buckets"""
+        query = session.query(
+            Lot.expiry_date,
+            func.sum(StockBalance.on_hand_qty).label('qty'),
+            func.sum(StockBalance.on_hand_value).label('value'),
+            func.count(func.distinct(StockBalance.lot_id)).label('lots')
+        ).join(
+            Lot, StockBalance.lot_id == Lot.id
+        ).filter(
+            StockBalance.company_id == company_id,
+            StockBalance.on_hand_qty > 0
+        )
+
+        if warehouse_id:
+            query = query.filter(StockBalance.warehouse_id == warehouse_id)
+
+        labels = bucket_labels(buckets)
+        totals = {label: [Decimal(0), Decimal(0), 0] for label in labels}
+
+        for row in query.group_by(Lot.expiry_date):
+            if row.expiry_date is None:
+                label = NO_EXPIRY
+            else:
+                days = (row.expiry_date - as_of).days
+                # Index 0 is EXPIRED; bisect places days 0..buckets[0] in 1
+                label = EXPIRED if days < 0 else labels[1 + bisect_left(buckets, days)]
+
+            bucket = totals[label]
+            bucket[0] += Decimal(row.qty or 0)
+            bucket[1] += Decimal(row.value or 0)
+            bucket[2] += row.lots
+
+        return {
+            'as_of': as_of,
+            'buckets': [
+                {
+                    'bucket': label,
+                    'qty': totals[label][0],
+                    'value': totals[label][1],
+                    'lots': totals[label][2],
+                }
+                for label in labels
+            ],
+        }
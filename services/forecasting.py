@@ -0,0 +1,250 @@
+"""
+Forecasting service - Weekly demand forecasts and reorder parameters
+خدمة التنبؤ بالطلب - توقعات الطلب الأسبوعي ومعاملات إعادة الطلب
+"""
+
+import math
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Integer, cast, delete, func, insert, literal, update
+from sqlalchemy.orm import Session
+
+from data import DailyMovement, DemandForecast, Item, ItemType
+from services.classification import CONSUMPTION_TYPES
+from services.kpi import KPIService
+from utils.logging import get_logger
+
+logger = get_logger('forecasting')
+
+MODEL_MOVING_AVERAGE = 'MOVING_AVERAGE'
+MODEL_EXP_SMOOTHING = 'EXP_SMOOTHING'
+MODEL_CROSTON = 'CROSTON'
+
+# Average weeks between demands above which demand counts as intermittent
+INTERMITTENT_ADI = 1.32
+
+MOVING_AVERAGE_WEEKS = 4
+SMOOTHING_ALPHA = 0.2
+CROSTON_ALPHA = 0.1
+
+QTY_QUANTUM = Decimal('0.0001')
+
+
+def _moving_average(series: List[float], window: int = MOVING_AVERAGE_WEEKS) -> Tuple[float, List[float]]:
+    """Forecast and one-step-ahead errors of a moving average"""
+    errors = []
+    for week in range(window, len(series)):
+        errors.append(series[week] - sum(series[week - window:week]) / window)
+    tail = series[-window:]
+    return sum(tail) / len(tail), errors
+
+
+def _exp_smoothing(series: List[float], alpha: float = SMOOTHING_ALPHA) -> Tuple[float, List[float]]:
+    """Forecast and one-step-ahead errors of simple exponential smoothing"""
+    level = series[0]
+    errors = []
+    for value in series[1:]:
+        errors.append(value - level)
+        level += alpha * (value - level)
+    return level, errors
+
+
+def _croston(series: List[float], alpha: float = CROSTON_ALPHA) -> Tuple[float, List[float]]:
+    """Forecast and one-step-ahead errors of Croston's method"""
+    size = interval = None
+    since = 1
+    errors = []
+    for value in series:
+        if size is not None:
+            errors.append(value - size / interval)
+        if value > 0:
+            if size is None:
+                size, interval = value, float(since)
+            else:
+                size += alpha * (value - size)
+                interval += alpha * (since - interval)
+            since = 1
+        else:
+            since += 1
+    return (size / interval if size is not None else 0.0), errors
+
+
+def _rmse(errors: List[float]) -> float:
+    return math.sqrt(sum(error * error for error in errors) / len(errors)) if errors else 0.0
+
+
+def fit(series: List[float]) -> Tuple[str, float, float]:
+    """
+    Pick and fit a model for one weekly demand series
+
+    Intermittent series use Croston's method; others use whichever of
+    moving average and exponential smoothing has the lower in-sample
+    error.
+
+    Returns:
+        (model, weekly forecast, standard deviation of one-week error)
+    """
+    demand_weeks = sum(1 for value in series if value > 0)
+    if demand_weeks == 0:
+        return MODEL_CROSTON, 0.0, 0.0
+
+    if len(series) / demand_weeks > INTERMITTENT_ADI:
+        forecast, errors = _croston(series)
+        return MODEL_CROSTON, forecast, _rmse(errors)
+
+    candidates = [
+        (MODEL_MOVING_AVERAGE,) + _moving_average(series),
+        (MODEL_EXP_SMOOTHING,) + _exp_smoothing(series),
+    ]
+    model, forecast, errors = min(
+        candidates, key=lambda candidate: _rmse(candidate[2]) if candidate[2] else float('inf')
+    )
+    return model, forecast, _rmse(errors)
+
+
+class ForecastingService:
+    """
+    Service for demand forecasting
+
+    Weekly consumption of all items comes from one grouped query over the
+    daily movement cube. Each series gets a lightweight model and the
+    forecast is turned into proposed safety stock, reorder point, minimum
+    and maximum; proposals are stored in demand_forecasts and written back
+    to items in bulk on request.
+    """
+
+    def forecast(self, session: Session, company_id: int,
+                 weeks: int = 52, as_of: Optional[date] = None,
+                 lead_time_weeks: float = 2, service_z: float = 1.65,
+                 order_cycle_weeks: float = 4) -> int:
+        """
+        Forecast demand and propose reorder parameters for all stock items
+
+        Args:
+            session: Database session
+            company_id: Company ID
+            weeks: Weeks of history, ending the day before as_of
+            as_of: First day after the history (defaults to today)
+            lead_time_weeks: Replenishment lead time
+            service_z: Safety factor for the target service level (1.65 ~ 95%)
+            order_cycle_weeks: Demand covered by one order, above the reorder point
+
+        Returns:
+            Number of items forecast
+        """
+        if as_of is None:
+            as_of = date.today()
+        start = as_of - timedelta(weeks=weeks)
+
+        item_ids = [row.id for row in session.query(Item.id).filter(
+            Item.company_id == company_id,
+            Item.is_active == True,
+            Item.item_type == ItemType.STOCK
+        )]
+
+        demand = self._weekly_demand(session, company_id, start, as_of, weeks)
+        zeros = [0.0] * weeks
+        lead_time_root = math.sqrt(lead_time_weeks)
+
+        def qty(value: float) -> Decimal:
+            return Decimal(str(max(value, 0.0))).quantize(QTY_QUANTUM)
+
+        rows = []
+        for item_id in item_ids:
+            model, weekly, sigma = fit(demand.get(item_id, zeros))
+
+            safety_stock = service_z * sigma * lead_time_root
+            reorder_point = weekly * lead_time_weeks + safety_stock
+
+            rows.append({
+                'company_id': company_id,
+                'item_id': item_id,
+                'model': model,
+                'weekly_demand': qty(weekly),
+                'demand_sigma': qty(sigma),
+                'safety_stock': qty(safety_stock),
+                'reorder_point': qty(reorder_point),
+                'min_qty': qty(safety_stock),
+                'max_qty': qty(reorder_point + weekly * order_cycle_weeks),
+                'weeks': weeks,
+            })
+
+        session.execute(delete(DemandForecast).where(DemandForecast.company_id == company_id))
+        if rows:
+            session.execute(insert(DemandForecast), rows)
+
+        logger.info(f'Demand forecast for company {company_id}: {len(rows)} items')
+
+        return len(rows)
+
+    def apply_proposals(self, session: Session, company_id: int,
+                        item_ids: Optional[List[int]] = None) -> int:
+        """
+        Write proposed reorder parameters back to items (bulk update)
+
+        Returns:
+            Number of items updated
+        """
+        query = session.query(DemandForecast).filter(
+            DemandForecast.company_id == company_id,
+            DemandForecast.applied_at.is_(None)
+        )
+        if item_ids is not None:
+            query = query.filter(DemandForecast.item_id.in_(item_ids))
+
+        proposals = query.all()
+        if not proposals:
+            return 0
+
+        session.execute(update(Item), [
+            {
+                'id': proposal.item_id,
+                'safety_stock': proposal.safety_stock,
+                'reorder_point': proposal.reorder_point,
+                'min_qty': proposal.min_qty,
+                'max_qty': proposal.max_qty,
+            }
+            for proposal in proposals
+        ])
+
+        applied = [proposal.id for proposal in proposals]
+        session.execute(
+            update(DemandForecast).where(DemandForecast.id.in_(applied)).values(
+                applied_at=datetime.utcnow()
+            ).execution_options(synchronize_session=False)
+        )
+
+        KPIService().refresh_below_reorder(
+            session, company_id, [proposal.item_id for proposal in proposals]
+        )
+
+        return len(proposals)
+
+    def _weekly_demand(self, session: Session, company_id: int,
+                       start: date, end: date, weeks: int) -> Dict[int, List[float]]:
+        """Weekly consumption series of all items (one grouped query)"""
+        if session.get_bind().dialect.name == 'postgresql':
+            days = DailyMovement.movement_date - literal(start)
+        else:
+            days = func.julianday(DailyMovement.movement_date) - func.julianday(literal(start))
+        week = cast(days / 7, Integer)
+
+        query = session.query(
+            DailyMovement.item_id,
+            week.label('week'),
+            func.sum(DailyMovement.qty_out).label('qty')
+        ).filter(
+            DailyMovement.company_id == company_id,
+            DailyMovement.doc_type.in_(CONSUMPTION_TYPES),
+            DailyMovement.movement_date >= start,
+            DailyMovement.movement_date < end
+        ).group_by(DailyMovement.item_id, week)
+
+        demand: Dict[int, List[float]] = {}
+        for row in query:
+            series = demand.setdefault(row.item_id, [0.0] * weeks)
+            series[min(int(row.week), weeks - 1)] += float(row.qty or 0)
+
+        return demand
@@ -0,0 +1,251 @@
+"""
+Genealogy service - Lot/serial graph built at posting time
+خدمة شجرة التشغيلات - ربط التشغيلات والأرقام التسلسلية عند الترحيل
+"""
+
+from collections import defaultdict, deque
+from datetime import date
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Integer, String, and_, delete, func, insert, literal, or_, select
+from sqlalchemy.orm import Session
+
+from data import (
+    DocumentHeader, DocumentStatus, DocumentType, GenealogyLink, InventoryLedger,
+    ProductionIssue, ProductionReceipt
+)
+from services.archival import ledger_source
+
+NODE_LOT = 'LOT'
+NODE_SERIAL = 'SERIAL'
+NODE_ORDER = 'PRODUCTION_ORDER'
+NODE_DOCUMENT = 'DOCUMENT'
+
+# Outbound documents that end a forward trace
+SHIPMENT_TYPES = (DocumentType.ISSUE, DocumentType.RETURN_OUT)
+
+TRACE_FORWARD = 'forward'
+TRACE_BACKWARD = 'backward'
+
+Node = Tuple[str, int]
+
+
+class GenealogyService:
+    """
+    Service for lot/serial genealogy
+
+    Posting adds edges to genealogy_links: consumed lots and serials point
+    to the production order consuming them, the order points to the lots
+    and serials it produced, and shipped lots and serials point to the
+    shipping document. Forward and backward traces walk the graph with a
+    recursive query over the indexed edge table, without touching the
+    ledger.
+    """
+
+    def apply(self, session: Session, document: DocumentHeader,
+              entries: List[InventoryLedger]):
+        """Add the genealogy edges of a posted document (or drop those of a reversed one)"""
+        if document.doc_type not in (DocumentType.PRODUCTION_ISSUE,
+                                     DocumentType.PRODUCTION_RECEIPT) + SHIPMENT_TYPES:
+            return
+
+        if document.status == DocumentStatus.REVERSED:
+            session.execute(delete(GenealogyLink).where(GenealogyLink.doc_id == document.id))
+            return
+
+        order_id = self._production_order_id(session, document.doc_type, document.id)
+        rows = [
+            (entry.lot_id, entry.serial_id, entry.posting_date,
+             Decimal(entry.qty_in or 0), Decimal(entry.qty_out or 0))
+            for entry in entries
+        ]
+
+        edges = self._edges(document.company_id, document.doc_type, document.id, order_id, rows)
+        if edges:
+            session.execute(insert(GenealogyLink), edges)
+
+    def trace(self, session: Session, company_id: int, node_type: str, node_id: int,
+              direction: str = TRACE_FORWARD) -> List[Dict]:
+        """
+        Trace a lot, serial, order or document through the genealogy graph
+
+        Args:
+            session: Database session
+            company_id: Company ID
+            node_type: LOT, SERIAL, PRODUCTION_ORDER or DOCUMENT
+            node_id: ID of the starting node
+            direction: 'forward' (where it went) or 'backward' (where it came from)
+
+        Returns:
+            Edges reached from the node, each with its level (1 = direct link)
+        """
+        if direction == TRACE_FORWARD:
+            near_type, near_id = GenealogyLink.from_type, GenealogyLink.from_id
+            far_type, far_id = GenealogyLink.to_type, GenealogyLink.to_id
+        else:
+            near_type, near_id = GenealogyLink.to_type, GenealogyLink.to_id
+            far_type, far_id = GenealogyLink.from_type, GenealogyLink.from_id
+
+        nodes = select(
+            literal(node_type, String(20)).label('node_type'),
+            literal(node_id, Integer).label('node_id')
+        ).cte('trace_nodes', recursive=True)
+
+        # UNION (not UNION ALL) stops at nodes already reached, so cycles terminate
+        nodes = nodes.union(
+            select(far_type, far_id).join(
+                nodes, and_(near_type == nodes.c.node_type, near_id == nodes.c.node_id)
+            ).where(GenealogyLink.company_id == company_id)
+        )
+
+        links = session.query(GenealogyLink).join(
+            nodes, and_(near_type == nodes.c.node_type, near_id == nodes.c.node_id)
+        ).filter(
+            GenealogyLink.company_id == company_id
+        ).all()
+
+        # Level of each edge = distance of its near node from the start
+        adjacency = defaultdict(list)
+        for link in links:
+            near = (link.from_type, link.from_id) if direction == TRACE_FORWARD else (link.to_type, link.to_id)
+            adjacency[near].append(link)
+
+        results = []
+        seen = {(node_type, node_id)}
+        queue = deque([((node_type, node_id), 1)])
+        while queue:
+            near, level = queue.popleft()
+            for link in adjacency.get(near, ()):
+                far = (link.to_type, link.to_id) if direction == TRACE_FORWARD else (link.from_type, link.from_id)
+                results.append({
+                    'level': level,
+                    'from_type': link.from_type,
+                    'from_id': link.from_id,
+                    'to_type': link.to_type,
+                    'to_id': link.to_id,
+                    'doc_id': link.doc_id,
+                    'qty': Decimal(link.qty or 0),
+                    'posting_date': link.posting_date,
+                })
+                if far not in seen:
+                    seen.add(far)
+                    queue.append((far, level + 1))
+
+        return results
+
+    def rebuild(self, session: Session, company_id: int) -> int:
+        """
+        Rebuild the genealogy graph of a company from the ledger and its archive
+
+        Returns:
+            Number of edges written
+        """
+        session.execute(delete(GenealogyLink).where(GenealogyLink.company_id == company_id))
+
+        ledger = ledger_source(session, company_id)
+        query = session.query(
+            ledger.c.doc_type,
+            ledger.c.doc_id,
+            ledger.c.lot_id,
+            ledger.c.serial_id,
+            ledger.c.posting_date,
+            func.sum(ledger.c.qty_in).label('qty_in'),
+            func.sum(ledger.c.qty_out).label('qty_out')
+        ).select_from(ledger).filter(
+            ledger.c.company_id == company_id,
+            ledger.c.doc_type.in_((DocumentType.PRODUCTION_ISSUE,
+                                   DocumentType.PRODUCTION_RECEIPT) + SHIPMENT_TYPES),
+            or_(ledger.c.lot_id.isnot(None), ledger.c.serial_id.isnot(None))
+        ).group_by(
+            ledger.c.doc_type, ledger.c.doc_id, ledger.c.lot_id,
+            ledger.c.serial_id, ledger.c.posting_date
+        )
+
+        by_document = defaultdict(list)
+        for row in query:
+            by_document[(row.doc_type, row.doc_id)].append(
+                (row.lot_id, row.serial_id, row.posting_date,
+                 Decimal(row.qty_in or 0), Decimal(row.qty_out or 0))
+            )
+
+        orders = {
+            (DocumentType.PRODUCTION_ISSUE, link.doc_id): link.production_order_id
+            for link in session.query(ProductionIssue)
+        }
+        orders.update({
+            (DocumentType.PRODUCTION_RECEIPT, link.doc_id): link.production_order_id
+            for link in session.query(ProductionReceipt)
+        })
+
+        reversed_docs = {
+            row.id for row in session.query(DocumentHeader.id).filter(
+                DocumentHeader.company_id == company_id,
+                DocumentHeader.status == DocumentStatus.REVERSED
+            )
+        }
+
+        edges = []
+        for (doc_type, doc_id), rows in by_document.items():
+            if doc_id in reversed_docs:
+                continue
+            edges.extend(self._edges(company_id, doc_type, doc_id,
+                                     orders.get((doc_type, doc_id)), rows))
+
+        if edges:
+            session.execute(insert(GenealogyLink), edges)
+
+        return len(edges)
+
+    def _production_order_id(self, session: Session, doc_type: DocumentType,
+                             doc_id: int) -> Optional[int]:
+        """Production order linked to a production issue or receipt"""
+        if doc_type == DocumentType.PRODUCTION_ISSUE:
+            link_model = ProductionIssue
+        elif doc_type == DocumentType.PRODUCTION_RECEIPT:
+            link_model = ProductionReceipt
+        else:
+            return None
+
+        return session.query(link_model.production_order_id).filter(
+            link_model.doc_id == doc_id
+        ).scalar()
+
+    def _edges(self, company_id: int, doc_type: DocumentType, doc_id: int,
+               order_id: Optional[int], rows) -> List[Dict]:
+        """
+        Edges of one document
+
+        Args:
+            rows: Tuples of (lot_id, serial_id, posting_date, qty_in, qty_out)
+        """
+        if doc_type in SHIPMENT_TYPES:
+            hub, outbound = (NODE_DOCUMENT, doc_id), True
+        elif order_id is not None:
+            hub, outbound = (NODE_ORDER, order_id), doc_type == DocumentType.PRODUCTION_ISSUE
+        else:
+            return []
+
+        quantities: Dict[Tuple[Node, date], Decimal] = defaultdict(Decimal)
+        for lot_id, serial_id, posting_date, qty_in, qty_out in rows:
+            qty = qty_out if outbound else qty_in
+            if lot_id:
+                quantities[((NODE_LOT, lot_id), posting_date)] += qty
+            if serial_id:
+                quantities[((NODE_SERIAL, serial_id), posting_date)] += qty
+
+        edges = []
+        for (node, posting_date), qty in quantities.items():
+            source, target = (node, hub) if outbound else (hub, node)
+            edges.append({
+                'company_id': company_id,
+                'from_type': source[0],
+                'from_id': source[1],
+                'to_type': target[0],
+                'to_id': target[1],
+                'doc_id': doc_id,
+                'qty': qty,
+                'posting_date': posting_date,
+            })
+
+        return edges
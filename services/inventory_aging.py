@@ -0,0 +1,400 @@
+"""
+Inventory aging service - Receipt-dated FIFO layers for days-on-hand
+خدمة أعمار المخزون - طبقات استلام مؤرخة (الوارد أولاً) لحساب أيام التخزين
+"""
+
+import os
+from bisect import bisect_left
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from decimal import Decimal
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import case, delete, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from data import (
+    DocumentHeader, DocumentStatus, DocumentType, InventoryLedger, Item, ReceiptLayer,
+    StockBalance, get_engine, get_engine_url, init_db
+)
+from services.archival import ledger_source
+from services.expiry_aging import bucket_labels
+from utils.logging import get_logger
+
+logger = get_logger('inventory_aging')
+
+# Upper bounds (days on hand, inclusive) of the default buckets
+DEFAULT_BUCKETS = (30, 90, 180, 365)
+
+StockKey = Tuple[int, int]  # (warehouse_id, item_id)
+
+
+def _take(layers: List[Dict], qty: Decimal) -> List[Tuple[date, Decimal]]:
+    """
+    Consume quantity from the oldest layers
+
+    Layers are dicts with receipt_date and qty_remaining, oldest first;
+    consumed ones are left with zero. Issues beyond the layered quantity
+    (negative stock) consume nothing further.
+
+    Returns:
+        Consumed slices as (receipt_date, qty)
+    """
+    slices = []
+    for layer in layers:
+        if qty <= 0:
+            break
+        if layer['qty_remaining'] <= 0:
+            continue
+        taken = min(layer['qty_remaining'], qty)
+        layer['qty_remaining'] -= taken
+        qty -= taken
+        slices.append((layer['receipt_date'], taken))
+    return slices
+
+
+def _movements(rows) -> Tuple[Dict[StockKey, Decimal], List[Tuple[StockKey, Decimal]]]:
+    """
+    Split a document's ledger rows into outgoing totals and incoming rows
+
+    Args:
+        rows: Tuples of (warehouse_id, item_id, qty_in, qty_out)
+    """
+    outs: Dict[StockKey, Decimal] = defaultdict(Decimal)
+    ins: List[Tuple[StockKey, Decimal]] = []
+    for warehouse_id, item_id, qty_in, qty_out in rows:
+        if qty_out and qty_out > 0:
+            outs[(warehouse_id, item_id)] += Decimal(qty_out)
+        if qty_in and qty_in > 0:
+            ins.append(((warehouse_id, item_id), Decimal(qty_in)))
+    return outs, ins
+
+
+def _incoming(doc_type: DocumentType, posting_date: date, qty: Decimal,
+              moved: deque) -> List[Tuple[date, Decimal]]:
+    """
+    Receipt dates of an incoming quantity
+
+    Transfers carry the receipt dates of the quantity they moved out;
+    any other receipt starts a layer dated on its posting date.
+    """
+    if doc_type != DocumentType.TRANSFER:
+        return [(posting_date, qty)]
+
+    slices = []
+    while qty > 0 and moved:
+        receipt_date, available = moved[0]
+        taken = min(available, qty)
+        slices.append((receipt_date, taken))
+        qty -= taken
+        if taken == available:
+            moved.popleft()
+        else:
+            moved[0] = (receipt_date, available - taken)
+    if qty > 0:
+        slices.append((posting_date, qty))
+    return slices
+
+
+def _replay_partition(args) -> List[Dict]:
+    """Worker entry point: replay the ledger of some items on the parent's database"""
+    db_url, company_id, item_ids = args
+    init_db(url=db_url)
+    with Session(get_engine()) as session:
+        return InventoryAgingService().replay(session, company_id, item_ids)
+
+
+class InventoryAgingService:
+    """
+    Service for inventory aging by receipt date
+
+    receipt_layers holds the remaining quantity of each receipt per
+    warehouse and item. Posting adds a layer for every receipt, consumes
+    the oldest layers for every issue, and moves layers with their
+    original dates on transfers, so aging reads the layers in one grouped
+    scan instead of replaying the ledger. Values use the current average
+    cost of the warehouse and item.
+
+    A reversal replays the ledger of its items without the reversed
+    documents, so consumed slices come back with their original receipt
+    dates; the posting service calls replay_items() once for all items of
+    a reversed batch.
+    """
+
+    def apply(self, session: Session, document: DocumentHeader,
+              entries: List[InventoryLedger]):
+        """Update the receipt layers for a posted document (reversals: replay_items)"""
+        if document.status == DocumentStatus.REVERSED:
+            return
+
+        outs, ins = _movements([
+            (entry.warehouse_id, entry.item_id, entry.qty_in, entry.qty_out)
+            for entry in entries
+        ])
+        if not outs and not ins:
+            return
+
+        moved: Dict[int, deque] = defaultdict(deque)  # item_id -> consumed slices
+
+        if outs:
+            layers = defaultdict(list)
+            for layer in session.query(
+                ReceiptLayer.id, ReceiptLayer.warehouse_id, ReceiptLayer.item_id,
+                ReceiptLayer.receipt_date, ReceiptLayer.qty_remaining
+            ).filter(
+                ReceiptLayer.company_id == document.company_id,
+                ReceiptLayer.item_id.in_({item_id for _, item_id in outs}),
+                ReceiptLayer.warehouse_id.in_({warehouse_id for warehouse_id, _ in outs})
+            ).order_by(ReceiptLayer.receipt_date, ReceiptLayer.id):
+                layers[(layer.warehouse_id, layer.item_id)].append({
+                    'id': layer.id,
+                    'receipt_date': layer.receipt_date,
+                    'qty_remaining': Decimal(layer.qty_remaining),
+                    'original': Decimal(layer.qty_remaining),
+                })
+
+            for key, qty in outs.items():
+                moved[key[1]].extend(_take(layers[key], qty))
+
+            changed = [
+                layer for key in outs for layer in layers[key]
+                if layer['qty_remaining'] != layer['original']
+            ]
+            exhausted = [layer['id'] for layer in changed if layer['qty_remaining'] <= 0]
+            reduced = [
+                {'id': layer['id'], 'qty_remaining': layer['qty_remaining']}
+                for layer in changed if layer['qty_remaining'] > 0
+            ]
+
+            if exhausted:
+                session.execute(delete(ReceiptLayer).where(ReceiptLayer.id.in_(exhausted)))
+            if reduced:
+                session.execute(update(ReceiptLayer), reduced)
+
+        new_layers = []
+        for (warehouse_id, item_id), qty in ins:
+            for receipt_date, slice_qty in _incoming(document.doc_type, entries[0].posting_date,
+                                                     qty, moved[item_id]):
+                new_layers.append({
+                    'company_id': document.company_id,
+                    'warehouse_id': warehouse_id,
+                    'item_id': item_id,
+                    'receipt_date': receipt_date,
+                    'doc_id': document.id,
+                    'qty_remaining': slice_qty,
+                })
+
+        if new_layers:
+            session.execute(insert(ReceiptLayer), new_layers)
+
+    def aging(self, session: Session, company_id: int,
+              group_by: str = 'warehouse',
+              as_of: Optional[date] = None,
+              buckets: Sequence[int] = DEFAULT_BUCKETS,
+              warehouse_id: Optional[int] = None) -> List[Dict]:
+        """
+        Aged quantity and valuation in one scan of the layers
+
+        Args:
+            session: Database session
+            company_id: Company ID
+            group_by: 'warehouse' or 'category'
+            as_of: Day to age from (defaults to today)
+            buckets: Upper bounds of the buckets in days on hand (at least one)
+            warehouse_id: Warehouse ID (optional)
+
+        Returns:
+            One dict per group with group_id, qty, value and buckets: list of
+            dicts with bucket, qty and value
+        """
+        if as_of is None:
+            as_of = date.today()
+        buckets = tuple(sorted(buckets))
+        labels = bucket_labels(buckets)[1:-1]  # No expired / no-expiry buckets here
+
+        cost = session.query(
+            StockBalance.warehouse_id,
+            StockBalance.item_id,
+            case(
+                (func.sum(StockBalance.on_hand_qty) > 0,
+                 func.sum(StockBalance.on_hand_value) / func.sum(StockBalance.on_hand_qty)),
+                else_=0
+            ).label('unit_cost')
+        ).filter(
+            StockBalance.company_id == company_id
+        ).group_by(StockBalance.warehouse_id, StockBalance.item_id).subquery()
+
+        group_column = ReceiptLayer.warehouse_id if group_by == 'warehouse' else Item.category_id
+
+        query = session.query(
+            group_column.label('group_id'),
+            ReceiptLayer.receipt_date,
+            func.sum(ReceiptLayer.qty_remaining).label('qty'),
+            func.sum(ReceiptLayer.qty_remaining * func.coalesce(cost.c.unit_cost, 0)).label('value')
+        ).join(
+            Item, ReceiptLayer.item_id == Item.id
+        ).outerjoin(
+            cost, (cost.c.warehouse_id == ReceiptLayer.warehouse_id)
+            & (cost.c.item_id == ReceiptLayer.item_id)
+        ).filter(
+            ReceiptLayer.company_id == company_id,
+            ReceiptLayer.receipt_date <= as_of
+        )
+
+        if warehouse_id:
+            query = query.filter(ReceiptLayer.warehouse_id == warehouse_id)
+
+        groups: Dict[Optional[int], Dict[str, List[Decimal]]] = {}
+        for row in query.group_by(group_column, ReceiptLayer.receipt_date):
+            days = (as_of - row.receipt_date).days
+            label = labels[bisect_left(buckets, days)]
+
+            totals = groups.setdefault(
+                row.group_id, {name: [Decimal(0), Decimal(0)] for name in labels}
+            )
+            totals[label][0] += Decimal(row.qty or 0)
+            totals[label][1] += Decimal(row.value or 0)
+
+        results = []
+        for group_id, totals in groups.items():
+            results.append({
+                'group_id': group_id,
+                'qty': sum(qty for qty, _ in totals.values()),
+                'value': sum(value for _, value in totals.values()),
+                'buckets': [
+                    {'bucket': name, 'qty': totals[name][0], 'value': totals[name][1]}
+                    for name in labels
+                ],
+            })
+
+        return results
+
+    def replay(self, session: Session, company_id: int,
+               item_ids: Optional[List[int]] = None) -> List[Dict]:
+        """
+        Compute the layers of some items by replaying the ledger and its archive
+
+        Reversed documents and their reversal entries are left out.
+
+        Returns:
+            Layer rows ready for insert
+        """
+        ledger = ledger_source(session, company_id)
+        query = session.query(
+            ledger.c.doc_id,
+            ledger.c.doc_type,
+            ledger.c.posting_date,
+            ledger.c.warehouse_id,
+            ledger.c.item_id,
+            ledger.c.qty_in,
+            ledger.c.qty_out
+        ).select_from(ledger).filter(
+            ledger.c.company_id == company_id,
+            ~ledger.c.doc_id.in_(select(DocumentHeader.id).where(
+                DocumentHeader.company_id == company_id,
+                DocumentHeader.status == DocumentStatus.REVERSED
+            ))
+        )
+
+        if item_ids is not None:
+            query = query.filter(ledger.c.item_id.in_(item_ids))
+
+        layers: Dict[StockKey, List[Dict]] = defaultdict(list)
+
+        def flush(doc_id, doc_type, posting_date, rows):
+            outs, ins = _movements(rows)
+            moved: Dict[int, deque] = defaultdict(deque)
+            for key, qty in outs.items():
+                moved[key[1]].extend(_take(layers[key], qty))
+                layers[key] = [layer for layer in layers[key] if layer['qty_remaining'] > 0]
+            for key, qty in ins:
+                for receipt_date, slice_qty in _incoming(doc_type, posting_date, qty, moved[key[1]]):
+                    layers[key].append({
+                        'receipt_date': receipt_date,
+                        'qty_remaining': slice_qty,
+                        'doc_id': doc_id,
+                    })
+                layers[key].sort(key=lambda layer: layer['receipt_date'])
+
+        current, rows = None, []
+        for row in query.order_by(ledger.c.posting_date, ledger.c.id).yield_per(5000):
+            if current and current[0] != row.doc_id:
+                flush(*current, rows)
+                rows = []
+            current = (row.doc_id, row.doc_type, row.posting_date)
+            rows.append((row.warehouse_id, row.item_id, row.qty_in, row.qty_out))
+        if current:
+            flush(*current, rows)
+
+        return [
+            {
+                'company_id': company_id,
+                'warehouse_id': warehouse_id,
+                'item_id': item_id,
+                'receipt_date': layer['receipt_date'],
+                'doc_id': layer['doc_id'],
+                'qty_remaining': layer['qty_remaining'],
+            }
+            for (warehouse_id, item_id), item_layers in layers.items()
+            for layer in item_layers
+            if layer['qty_remaining'] > 0
+        ]
+
+    def rebuild(self, company_id: int, workers: Optional[int] = None) -> int:
+        """
+        Rebuild all layers of a company from the ledger
+
+        Items are split into partitions replayed by parallel worker
+        processes; the layers are then written in one transaction.
+
+        Args:
+            company_id: Company ID
+            workers: Worker processes (defaults to CPU count; 1 runs inline)
+
+        Returns:
+            Number of layers written
+        """
+        with Session(get_engine()) as session:
+            item_ids = [row.id for row in session.query(Item.id).filter(
+                Item.company_id == company_id
+            ).order_by(Item.id)]
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = max(1, min(workers, len(item_ids)))
+
+        db_url = get_engine_url()
+        partitions = [(db_url, company_id, item_ids[index::workers]) for index in range(workers)]
+
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(_replay_partition, partitions))
+        else:
+            with Session(get_engine()) as session:
+                results = [self.replay(session, company_id, item_ids)]
+
+        rows = [row for partition in results for row in partition]
+
+        with Session(get_engine()) as session:
+            session.execute(delete(ReceiptLayer).where(ReceiptLayer.company_id == company_id))
+            if rows:
+                session.execute(insert(ReceiptLayer), rows)
+            session.commit()
+
+        logger.info(f'أعيد بناء طبقات الاستلام للشركة {company_id}: {len(rows)} طبقة')
+
+        return len(rows)
+
+    def replay_items(self, session: Session, company_id: int, item_ids):
+        """Replace the layers of some items with a replay of their ledger"""
+        if not item_ids:
+            return
+
+        rows = self.replay(session, company_id, list(item_ids))
+        session.execute(delete(ReceiptLayer).where(
+            ReceiptLayer.company_id == company_id,
+            ReceiptLayer.item_id.in_(item_ids)
+        ))
+        if rows:
+            session.execute(insert(ReceiptLayer), rows)
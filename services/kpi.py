@@ -0,0 +1,229 @@
+"""
+KPI service - Dashboard counters maintained at posting time
+خدمة مؤشرات الأداء - عدادات لوحة التحكم المحدثة عند الترحيل
+"""
+
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import delete, func, insert, or_
+from sqlalchemy.orm import Session
+
+from data import (
+    BelowReorderItem, DailyMovement, DocumentHeader, DocumentStatus,
+    InventoryLedger, KPICounter, StockBalance, upsert_increment
+)
+from services.reorder_monitor import ReorderMonitorService
+
+KPI_STOCK_VALUE = 'STOCK_VALUE'
+KPI_MOVEMENT_LINES = 'MOVEMENT_LINES'
+KPI_MOVEMENT_DOCS = 'MOVEMENT_DOCS'
+KPI_BELOW_REORDER = 'BELOW_REORDER'
+
+# scope_id of company-wide counters and period of running totals
+COMPANY_SCOPE = 0
+RUNNING = ''
+
+COUNTER_KEY = ('company_id', 'scope_id', 'name', 'period')
+
+
+class KPIService:
+    """
+    Service for dashboard KPIs
+
+    Counters are adjusted by each posted document: running stock value per
+    warehouse and company, ledger lines and documents per day, and the set
+    of items at or below their reorder point. Reading the dashboard is then
+    a single lookup of a handful of counter rows.
+
+    Below-reorder membership reads the item totals kept by
+    ReorderMonitorService, so those must be up to date first (posting
+    applies the reorder monitor before the KPIs).
+    """
+
+    def __init__(self):
+        self.reorder_monitor_service = ReorderMonitorService()
+
+    def apply(self, session: Session, document: DocumentHeader,
+              entries: List[InventoryLedger]):
+        """Adjust counters for a posted or reversed document's ledger entries"""
+        if not entries:
+            return
+
+        deltas: Dict[tuple, Decimal] = defaultdict(Decimal)
+
+        for entry in entries:
+            value = Decimal(entry.value_in or 0) - Decimal(entry.value_out or 0)
+            day = entry.posting_date.isoformat()
+
+            for scope_id in (entry.warehouse_id, COMPANY_SCOPE):
+                deltas[(scope_id, KPI_STOCK_VALUE, RUNNING)] += value
+                deltas[(scope_id, KPI_MOVEMENT_LINES, day)] += 1
+
+        # Documents count on their original posting date while POSTED, as in rebuild
+        docs = -1 if document.status == DocumentStatus.REVERSED else 1
+        deltas[(COMPANY_SCOPE, KPI_MOVEMENT_DOCS, document.posting_date.isoformat())] += docs
+
+        changed = self.update_below_reorder(
+            session, document.company_id, {entry.item_id for entry in entries}
+        )
+        if changed:
+            deltas[(COMPANY_SCOPE, KPI_BELOW_REORDER, RUNNING)] += changed
+
+        self._increment(session, document.company_id, deltas)
+
+    def update_below_reorder(self, session: Session, company_id: int,
+                             item_ids: Iterable[int]) -> int:
+        """
+        Refresh below-reorder membership of some items
+
+        Returns:
+            Change in the number of items below reorder point
+        """
+        item_ids = set(item_ids)
+        if not item_ids:
+            return 0
+
+        below = self.reorder_monitor_service.below_reorder_point(session, company_id, item_ids)
+        current = {
+            row.item_id for row in session.query(BelowReorderItem.item_id).filter(
+                BelowReorderItem.company_id == company_id,
+                BelowReorderItem.item_id.in_(item_ids)
+            )
+        }
+
+        entering = below - current
+        leaving = current - below
+
+        if entering:
+            session.execute(insert(BelowReorderItem), [
+                {'company_id': company_id, 'item_id': item_id} for item_id in entering
+            ])
+        if leaving:
+            session.execute(delete(BelowReorderItem).where(
+                BelowReorderItem.company_id == company_id,
+                BelowReorderItem.item_id.in_(leaving)
+            ))
+
+        return len(entering) - len(leaving)
+
+    def refresh_below_reorder(self, session: Session, company_id: int,
+                              item_ids: Iterable[int]) -> int:
+        """
+        Re-check items after their reorder points changed
+
+        Returns:
+            Change in the number of items below reorder point
+        """
+        changed = self.update_below_reorder(session, company_id, item_ids)
+        if changed:
+            self._increment(session, company_id, {
+                (COMPANY_SCOPE, KPI_BELOW_REORDER, RUNNING): Decimal(changed)
+            })
+        return changed
+
+    def adjust_stock_value(self, session: Session, company_id: int,
+                           deltas: Dict[int, Decimal]):
+        """Add value changes per warehouse to the stock value counters"""
+        counters: Dict[tuple, Decimal] = defaultdict(Decimal)
+        for warehouse_id, delta in deltas.items():
+            if delta:
+                for scope_id in (warehouse_id, COMPANY_SCOPE):
+                    counters[(scope_id, KPI_STOCK_VALUE, RUNNING)] += delta
+        if counters:
+            self._increment(session, company_id, counters)
+
+    def get_dashboard_kpis(self, session: Session, company_id: int,
+                           day: Optional[date] = None) -> Dict:
+        """
+        Read the company-wide dashboard KPIs (one query)
+
+        Returns:
+            Dict with inventory_value, movements_today, documents_today and
+            below_reorder
+        """
+        if day is None:
+            day = date.today()
+
+        rows = session.query(KPICounter.name, KPICounter.value).filter(
+            KPICounter.company_id == company_id,
+            KPICounter.scope_id == COMPANY_SCOPE,
+            or_(KPICounter.period == RUNNING, KPICounter.period == day.isoformat())
+        ).all()
+        values = {row.name: Decimal(row.value or 0) for row in rows}
+
+        return {
+            'inventory_value': values.get(KPI_STOCK_VALUE, Decimal(0)),
+            'movements_today': int(values.get(KPI_MOVEMENT_LINES, 0)),
+            'documents_today': int(values.get(KPI_MOVEMENT_DOCS, 0)),
+            'below_reorder': int(values.get(KPI_BELOW_REORDER, 0)),
+        }
+
+    def rebuild(self, session: Session, company_id: int):
+        """
+        Recompute all counters of a company from balances and the movement cube
+
+        Use after loading data outside posting or after changing reorder
+        points in bulk.
+        """
+        session.execute(delete(KPICounter).where(KPICounter.company_id == company_id))
+        session.execute(delete(BelowReorderItem).where(BelowReorderItem.company_id == company_id))
+
+        counters = defaultdict(Decimal)
+
+        for row in session.query(
+            StockBalance.warehouse_id,
+            func.sum(StockBalance.on_hand_value).label('value')
+        ).filter(
+            StockBalance.company_id == company_id
+        ).group_by(StockBalance.warehouse_id):
+            for scope_id in (row.warehouse_id, COMPANY_SCOPE):
+                counters[(scope_id, KPI_STOCK_VALUE, RUNNING)] += Decimal(row.value or 0)
+
+        for row in session.query(
+            DailyMovement.warehouse_id,
+            DailyMovement.movement_date,
+            func.sum(DailyMovement.line_count).label('lines')
+        ).filter(
+            DailyMovement.company_id == company_id
+        ).group_by(DailyMovement.warehouse_id, DailyMovement.movement_date):
+            for scope_id in (row.warehouse_id, COMPANY_SCOPE):
+                counters[(scope_id, KPI_MOVEMENT_LINES, row.movement_date.isoformat())] += row.lines or 0
+
+        for row in session.query(
+            DocumentHeader.posting_date,
+            func.count(DocumentHeader.id).label('docs')
+        ).filter(
+            DocumentHeader.company_id == company_id,
+            DocumentHeader.status == DocumentStatus.POSTED,
+            DocumentHeader.posting_date.isnot(None)
+        ).group_by(DocumentHeader.posting_date):
+            counters[(COMPANY_SCOPE, KPI_MOVEMENT_DOCS, row.posting_date.isoformat())] += row.docs
+
+        below = self.reorder_monitor_service.below_reorder_point(session, company_id)
+        if below:
+            session.execute(insert(BelowReorderItem), [
+                {'company_id': company_id, 'item_id': item_id} for item_id in below
+            ])
+        counters[(COMPANY_SCOPE, KPI_BELOW_REORDER, RUNNING)] += len(below)
+
+        self._increment(session, company_id, counters)
+
+    def _increment(self, session: Session, company_id: int, deltas: Dict[tuple, Decimal]):
+        """Add deltas to counter rows (one upsert statement)"""
+        upsert_increment(
+            session, KPICounter, COUNTER_KEY,
+            [
+                {
+                    'company_id': company_id,
+                    'scope_id': scope_id,
+                    'name': name,
+                    'period': period,
+                    'value': delta,
+                }
+                for (scope_id, name, period), delta in deltas.items()
+            ],
+            ('value',)
+        )
@@ -0,0 +1,226 @@
+"""
+MRP service - Material requirements planning run
+خدمة تخطيط الاحتياجات من المواد
+"""
+
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from data import Item, ItemType, ProductionOrder, StockBalance
+from services.bom import BOMExplosionService, QTY_QUANTUM
+
+ACTION_PURCHASE = 'PURCHASE'
+ACTION_PRODUCE = 'PRODUCE'
+
+# Production orders that are still expected to deliver
+OPEN_ORDER_STATUSES = ('DRAFT', 'RELEASED', 'IN_PROGRESS')
+
+
+class MRPService:
+    """
+    Service for running material requirements planning
+
+    All inputs (items, balances, BOMs and open production orders) are loaded
+    once. Items are then netted in low-level-code order so that every
+    parent's planned orders are exploded into its components' time buckets
+    before the components themselves are netted.
+    """
+
+    def __init__(self):
+        self.bom_service = BOMExplosionService()
+
+    def run(self, session: Session, company_id: int,
+            start_date: Optional[date] = None,
+            horizon: int = 12, period_days: int = 7,
+            demand: Optional[Iterable[Tuple[int, date, Decimal]]] = None,
+            warehouse_id: Optional[int] = None,
+            lead_time_periods: int = 0) -> Dict:
+        """
+        Run MRP for a company
+
+        Args:
+            session: Database session
+            company_id: Company ID
+            start_date: First day of the first period (defaults to today)
+            horizon: Number of periods
+            period_days: Length of a period in days
+            demand: Independent demand as (item_id, due_date, qty) tuples
+            warehouse_id: Net against one warehouse only (optional)
+            lead_time_periods: Periods between releasing and receiving an order
+
+        Returns:
+            Dict with 'periods' (period start dates) and 'planned_orders'
+            (dicts with item_id, action, period, period_start, release_period
+            and qty)
+        """
+        if start_date is None:
+            start_date = date.today()
+
+        periods = [start_date + timedelta(days=period_days * i) for i in range(horizon)]
+
+        def bucket(day: Optional[date]) -> Optional[int]:
+            index = max((day - start_date).days // period_days, 0) if day else 0
+            return index if index < horizon else None
+
+        items = {
+            row.id: row
+            for row in session.query(
+                Item.id, Item.safety_stock, Item.item_type
+            ).filter(
+                Item.company_id == company_id,
+                Item.is_active == True  # noqa: E712
+            )
+        }
+
+        on_hand = self._load_on_hand(session, company_id, warehouse_id)
+        llc = self.bom_service.low_level_codes(session, company_id, start_date)
+
+        gross: Dict[int, List[Decimal]] = defaultdict(lambda: [Decimal(0)] * horizon)
+        receipts: Dict[int, List[Decimal]] = defaultdict(lambda: [Decimal(0)] * horizon)
+
+        for item_id, due_date, qty in demand or ():
+            index = bucket(due_date)
+            if index is not None:
+                gross[item_id][index] += Decimal(qty)
+
+        self._load_open_orders(
+            session, company_id, warehouse_id, bucket, periods, gross, receipts
+        )
+
+        # Items with requirements, scheduled receipts or a safety stock gap
+        candidates = set(gross) | set(receipts) | {
+            item_id for item_id, item in items.items()
+            if item.item_type == ItemType.STOCK
+            and on_hand.get(item_id, Decimal(0)) < Decimal(item.safety_stock or 0)
+        }
+
+        planned_orders = []
+        processed = set()
+
+        # Components only appear in gross once their parents are netted, so
+        # re-check the gross keys after each level
+        while True:
+            pending = sorted(
+                (set(gross) | candidates) - processed,
+                key=lambda item_id: (llc.get(item_id, 0), item_id)
+            )
+            if not pending:
+                break
+
+            level = llc.get(pending[0], 0)
+            for item_id in pending:
+                if llc.get(item_id, 0) != level:
+                    break
+                processed.add(item_id)
+
+                item = items.get(item_id)
+                if item is None:
+                    continue
+
+                planned_orders.extend(self._net_item(
+                    item, on_hand.get(item_id, Decimal(0)),
+                    gross[item_id], receipts[item_id], periods,
+                    lead_time_periods, gross
+                ))
+
+        return {
+            'periods': periods,
+            'planned_orders': planned_orders,
+        }
+
+    def _net_item(self, item, on_hand: Decimal, gross: List[Decimal],
+                  receipts: List[Decimal], periods: List[date],
+                  lead_time_periods: int,
+                  all_gross: Dict[int, List[Decimal]]) -> List[Dict]:
+        """Net one item lot-for-lot and explode its planned production"""
+        planned = []
+        projected = Decimal(on_hand) - Decimal(item.safety_stock or 0)
+
+        for index in range(len(periods)):
+            projected += receipts[index] - gross[index]
+            if projected >= 0:
+                continue
+
+            qty = (-projected).quantize(QTY_QUANTUM)
+            projected = Decimal(0)
+            release = max(index - lead_time_periods, 0)
+
+            bom = self.bom_service.get_bom(item.id, periods[release])
+            action = ACTION_PRODUCE if bom else ACTION_PURCHASE
+
+            if bom:
+                for component_id, per_unit in self.bom_service.components(bom).items():
+                    all_gross[component_id][release] += per_unit * qty
+
+            planned.append({
+                'item_id': item.id,
+                'action': action,
+                'period': index,
+                'period_start': periods[index],
+                'release_period': release,
+                'qty': qty,
+            })
+
+        return planned
+
+    def _load_on_hand(self, session: Session, company_id: int,
+                      warehouse_id: Optional[int]) -> Dict[int, Decimal]:
+        """On-hand quantity per item with one grouped query"""
+        query = session.query(
+            StockBalance.item_id,
+            func.sum(StockBalance.on_hand_qty).label('qty')
+        ).filter(
+            StockBalance.company_id == company_id
+        ).group_by(StockBalance.item_id)
+
+        if warehouse_id:
+            query = query.filter(StockBalance.warehouse_id == warehouse_id)
+
+        return {row.item_id: Decimal(row.qty or 0) for row in query}
+
+    def _load_open_orders(self, session: Session, company_id: int,
+                          warehouse_id: Optional[int], bucket, periods: List[date],
+                          gross: Dict[int, List[Decimal]],
+                          receipts: Dict[int, List[Decimal]]):
+        """Add open production orders as scheduled receipts and component demand"""
+        query = session.query(
+            ProductionOrder.id,
+            ProductionOrder.item_id,
+            ProductionOrder.bom_id,
+            ProductionOrder.planned_qty,
+            ProductionOrder.produced_qty,
+            ProductionOrder.po_date,
+            ProductionOrder.start_date,
+            ProductionOrder.completion_date
+        ).filter(
+            ProductionOrder.company_id == company_id,
+            ProductionOrder.status.in_(OPEN_ORDER_STATUSES)
+        )
+
+        if warehouse_id:
+            query = query.filter(ProductionOrder.warehouse_id == warehouse_id)
+
+        for order in query:
+            remaining = Decimal(order.planned_qty) - Decimal(order.produced_qty or 0)
+            if remaining <= 0:
+                continue
+
+            start = order.start_date or order.po_date
+            due = bucket(order.completion_date or start)
+            if due is not None:
+                receipts[order.item_id][due] += remaining
+
+            release = bucket(start)
+            if release is None:
+                continue
+
+            components = self.bom_service.explode(
+                session, order.bom_id, remaining, as_of=start, single_level=True
+            )
+            for component_id, qty in components.items():
+                gross[component_id][release] += qty
@@ -0,0 +1,186 @@
+"""
+Document numbering service - Hi-lo block allocation from DocumentSequence
+خدمة ترقيم المستندات - حجز كتل من الأرقام من تسلسل المستندات
+"""
+
+import threading
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from data import DocumentSequence, DocumentType, get_engine
+from config import SEQUENCE_CONFIG
+
+GAP_POLICY_ALLOW_GAPS = 'ALLOW_GAPS'
+GAP_POLICY_NO_GAPS = 'NO_GAPS'
+
+# Blocks reserved by this process: (company_id, doc_type) -> block state
+_blocks: Dict[Tuple[int, DocumentType], Dict] = {}
+_blocks_lock = threading.Lock()
+
+
+class NumberingError(Exception):
+    """خطأ في ترقيم المستندات"""
+    pass
+
+
+class DocumentNumberingService:
+    """Service for allocating document numbers"""
+
+    def next_doc_no(self, company_id: int, doc_type: DocumentType,
+                    session: Optional[Session] = None) -> str:
+        """
+        Allocate the next document number
+
+        With the ALLOW_GAPS policy numbers come from a block reserved by this
+        process, so the sequence row is only touched once per block. Numbers
+        left in a block when the process exits are lost. On SQLite, allocate
+        before the caller's transaction writes anything, since the block is
+        reserved on a separate connection.
+
+        With the NO_GAPS policy the sequence row is incremented inside the
+        caller's transaction and stays locked until it commits, so a rolled
+        back document gives its number back.
+
+        Args:
+            company_id: Company ID
+            doc_type: Document type
+            session: Caller's session (required for NO_GAPS)
+
+        Returns:
+            Formatted document number
+
+        Raises:
+            NumberingError: If the sequence is not defined
+        """
+        if self.get_gap_policy(doc_type) == GAP_POLICY_NO_GAPS:
+            if session is None:
+                raise NumberingError('الترقيم بدون فجوات يتطلب جلسة المستند')
+
+            end, prefix, padding = self._reserve(session, company_id, doc_type, 1)
+            return self._format(prefix, padding, end - 1)
+
+        key = (company_id, doc_type)
+
+        with _blocks_lock:
+            block = _blocks.get(key)
+
+            if block is None or block['next'] >= block['end']:
+                block = self._reserve_block(company_id, doc_type)
+                _blocks[key] = block
+
+            number = block['next']
+            block['next'] += 1
+
+        return self._format(block['prefix'], block['padding'], number)
+
+    def get_gap_policy(self, doc_type: DocumentType) -> str:
+        """Get the gap policy for a document type"""
+        policies = SEQUENCE_CONFIG.get('doc_type_policies', {})
+        return policies.get(doc_type.value, SEQUENCE_CONFIG['gap_policy'])
+
+    def release_unused(self):
+        """
+        Give back unused numbers of this process's blocks
+
+        A block is only returned when no other process reserved numbers after
+        it, otherwise its remaining numbers stay as a gap.
+        """
+        with _blocks_lock:
+            blocks = list(_blocks.items())
+            _blocks.clear()
+
+        session = Session(get_engine())
+        try:
+            for (company_id, doc_type), block in blocks:
+                if block['next'] >= block['end']:
+                    continue
+
+                session.execute(
+                    update(DocumentSequence)
+                    .where(
+                        DocumentSequence.company_id == company_id,
+                        DocumentSequence.doc_type == doc_type,
+                        DocumentSequence.next_number == block['end']
+                    )
+                    .values(next_number=block['next'])
+                    .execution_options(synchronize_session=False)
+                )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def _reserve_block(self, company_id: int, doc_type: DocumentType) -> Dict:
+        """Reserve a block of numbers in its own short transaction"""
+        size = max(int(SEQUENCE_CONFIG['block_size']), 1)
+
+        # Own session: the scoped session may be in the middle of a document
+        session = Session(get_engine())
+        try:
+            end, prefix, padding = self._reserve(session, company_id, doc_type, size)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        return {
+            'next': end - size,
+            'end': end,
+            'prefix': prefix,
+            'padding': padding,
+        }
+
+    def _reserve(self, session: Session, company_id: int,
+                 doc_type: DocumentType, size: int) -> Tuple[int, str, int]:
+        """
+        Advance the sequence row by size with a single atomic UPDATE
+
+        Returns:
+            Tuple of (new next_number, prefix, padding); the reserved numbers
+            are [next_number - size, next_number)
+        """
+        stmt = (
+            update(DocumentSequence)
+            .where(
+                DocumentSequence.company_id == company_id,
+                DocumentSequence.doc_type == doc_type
+            )
+            .values(next_number=DocumentSequence.next_number + size)
+            .execution_options(synchronize_session=False)
+        )
+
+        if session.get_bind().dialect.update_returning:
+            row = session.execute(
+                stmt.returning(
+                    DocumentSequence.next_number,
+                    DocumentSequence.prefix,
+                    DocumentSequence.padding
+                )
+            ).first()
+        else:
+            # The UPDATE holds the row's write lock, so reading it back in
+            # the same transaction sees our own increment
+            result = session.execute(stmt)
+            row = None
+            if result.rowcount:
+                row = session.query(
+                    DocumentSequence.next_number,
+                    DocumentSequence.prefix,
+                    DocumentSequence.padding
+                ).filter_by(company_id=company_id, doc_type=doc_type).first()
+
+        if row is None:
+            raise NumberingError(f'تسلسل المستندات غير معرّف لنوع المستند {doc_type.value}')
+
+        return row.next_number, row.prefix, row.padding
+
+    @staticmethod
+    def _format(prefix: str, padding: int, number: int) -> str:
+        """Format a document number"""
+        return f"{prefix}{str(number).zfill(padding)}"
@@ -0,0 +1,238 @@
+"""
+Period close service - Frozen period balances and posting lock
+خدمة إقفال الفترات - تجميد أرصدة الفترة ومنع الترحيل في الفترات المقفلة
+"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import Date, delete, func, insert, literal, or_, select, union_all
+from sqlalchemy.orm import Session
+
+from data import (
+    ClosedPeriod, Company, InventoryLedger, PeriodBalance, session_scope
+)
+from services.archival import (
+    PERIOD_BALANCE_KEY, fiscal_year_bounds, last_closed_period, ledger_source
+)
+
+
+class PeriodCloseError(Exception):
+    """خطأ في إقفال الفترة"""
+    pass
+
+
+class PeriodCloseService:
+    """
+    Service for closing inventory periods
+
+    Closing a period stores the closing quantity and value of every stock key
+    in period_balances. Postings dated inside a closed period are rejected,
+    and balances at a date start from the nearest closed period.
+    """
+
+    def close_period(self, company_id: int, period_end: date,
+                     user_id: Optional[int] = None,
+                     session: Optional[Session] = None) -> int:
+        """
+        Close the period ending on a date
+
+        The period runs from the day after the previous close (or the start
+        of the fiscal year for the first close) to period_end.
+
+        Args:
+            company_id: Company ID
+            period_end: Last day of the period
+            user_id: User closing the period (optional)
+            session: Caller's session (optional; the caller commits)
+
+        Returns:
+            Number of period balance rows written
+
+        Raises:
+            PeriodCloseError: If the period cannot be closed
+        """
+        if session is None:
+            with session_scope() as session:
+                return self._close(session, company_id, period_end, user_id)
+
+        return self._close(session, company_id, period_end, user_id)
+
+    def reopen_period(self, company_id: int, period_end: date):
+        """
+        Reopen the latest closed period
+
+        Raises:
+            PeriodCloseError: If the period is not the latest or is archived
+        """
+        with session_scope() as session:
+            closed = session.query(ClosedPeriod).filter_by(
+                company_id=company_id, period_end=period_end
+            ).first()
+
+            if not closed:
+                raise PeriodCloseError(f'الفترة المنتهية في {period_end} غير مقفلة')
+
+            if last_closed_period(session, company_id) != period_end:
+                raise PeriodCloseError('يمكن إعادة فتح آخر فترة مقفلة فقط')
+
+            if closed.archived_at:
+                raise PeriodCloseError('لا يمكن إعادة فتح فترة مؤرشفة')
+
+            session.execute(delete(PeriodBalance).where(
+                PeriodBalance.company_id == company_id,
+                PeriodBalance.period_end == period_end
+            ))
+            session.delete(closed)
+
+    def is_closed(self, session: Session, company_id: int, posting_date: date) -> bool:
+        """Check if a date falls inside a closed period"""
+        closed = last_closed_period(session, company_id)
+        return closed is not None and posting_date <= closed
+
+    def balances_as_of(self, session: Session, company_id: int, as_of: date,
+                       warehouse_id: Optional[int] = None,
+                       item_ids: Optional[Iterable[int]] = None) -> Dict[Tuple[int, int], Tuple[Decimal, Decimal]]:
+        """
+        Stock quantity and value at the end of a day
+
+        Starts from the nearest period closed on or before the date and adds
+        the ledger movements after it, so only open-period rows are read.
+
+        Returns:
+            Dict of (warehouse_id, item_id) to (qty, value)
+        """
+        period_end = last_closed_period(session, company_id, as_of=as_of)
+        item_ids = set(item_ids) if item_ids is not None else None
+
+        totals: Dict[Tuple[int, int], Tuple[Decimal, Decimal]] = {}
+
+        def add(rows):
+            for row in rows:
+                key = (row.warehouse_id, row.item_id)
+                qty, value = totals.get(key, (Decimal(0), Decimal(0)))
+                totals[key] = (qty + Decimal(row.qty or 0), value + Decimal(row.value or 0))
+
+        if period_end:
+            opening = session.query(
+                PeriodBalance.warehouse_id,
+                PeriodBalance.item_id,
+                func.sum(PeriodBalance.qty).label('qty'),
+                func.sum(PeriodBalance.value).label('value')
+            ).filter(
+                PeriodBalance.company_id == company_id,
+                PeriodBalance.period_end == period_end
+            ).group_by(PeriodBalance.warehouse_id, PeriodBalance.item_id)
+
+            if warehouse_id:
+                opening = opening.filter(PeriodBalance.warehouse_id == warehouse_id)
+            if item_ids is not None:
+                opening = opening.filter(PeriodBalance.item_id.in_(item_ids))
+
+            add(opening)
+
+        from_date = period_end + timedelta(days=1) if period_end else None
+        ledger = ledger_source(session, company_id, from_date, as_of)
+
+        movements = session.query(
+            ledger.c.warehouse_id,
+            ledger.c.item_id,
+            func.sum(ledger.c.qty_in - ledger.c.qty_out).label('qty'),
+            func.sum(ledger.c.value_in - ledger.c.value_out).label('value')
+        ).select_from(ledger).filter(
+            ledger.c.company_id == company_id,
+            ledger.c.posting_date <= as_of
+        ).group_by(ledger.c.warehouse_id, ledger.c.item_id)
+
+        if from_date:
+            movements = movements.filter(ledger.c.posting_date >= from_date)
+        if warehouse_id:
+            movements = movements.filter(ledger.c.warehouse_id == warehouse_id)
+        if item_ids is not None:
+            movements = movements.filter(ledger.c.item_id.in_(item_ids))
+
+        add(movements)
+
+        return totals
+
+    def _close(self, session: Session, company_id: int, period_end: date,
+               user_id: Optional[int]) -> int:
+        """Validate, roll up and record a period close"""
+        company = session.query(Company).filter_by(id=company_id).first()
+        if not company:
+            raise PeriodCloseError(f'الشركة رقم {company_id} غير موجودة')
+
+        if period_end >= date.today():
+            raise PeriodCloseError('لا يمكن إقفال فترة لم تنتهِ بعد')
+
+        previous_end = last_closed_period(session, company_id)
+        if previous_end and period_end <= previous_end:
+            raise PeriodCloseError(f'الفترات مقفلة بالفعل حتى {previous_end}')
+
+        if previous_end:
+            period_start = previous_end + timedelta(days=1)
+        else:
+            period_start = fiscal_year_bounds(company, period_end)[0]
+
+        rows = self._roll_up(session, company_id, previous_end, period_end)
+
+        session.add(ClosedPeriod(
+            company_id=company_id,
+            period_start=period_start,
+            period_end=period_end,
+            closed_by=user_id
+        ))
+        session.flush()
+
+        return rows
+
+    def _roll_up(self, session: Session, company_id: int,
+                 previous_end: Optional[date], period_end: date) -> int:
+        """
+        Write closing balances of a period in one INSERT ... SELECT
+
+        Closing balance = previous closing balance + ledger movements after
+        the previous period end up to this period end.
+        """
+        movements = select(
+            *(getattr(InventoryLedger, column) for column in PERIOD_BALANCE_KEY),
+            (InventoryLedger.qty_in - InventoryLedger.qty_out).label('qty'),
+            (InventoryLedger.value_in - InventoryLedger.value_out).label('value')
+        ).where(
+            InventoryLedger.company_id == company_id,
+            InventoryLedger.posting_date <= period_end
+        )
+
+        if previous_end:
+            movements = movements.where(InventoryLedger.posting_date > previous_end)
+            opening = select(
+                *(getattr(PeriodBalance, column) for column in PERIOD_BALANCE_KEY),
+                PeriodBalance.qty,
+                PeriodBalance.value
+            ).where(
+                PeriodBalance.company_id == company_id,
+                PeriodBalance.period_end == previous_end
+            )
+            combined = union_all(opening, movements).subquery()
+        else:
+            combined = movements.subquery()
+
+        keys = [combined.c[column] for column in PERIOD_BALANCE_KEY]
+        qty = func.sum(combined.c.qty)
+        value = func.sum(combined.c.value)
+
+        result = session.execute(
+            insert(PeriodBalance).from_select(
+                ['company_id', 'period_end'] + list(PERIOD_BALANCE_KEY) + ['qty', 'value'],
+                select(
+                    literal(company_id),
+                    literal(period_end, Date),
+                    *keys,
+                    qty,
+                    value
+                ).group_by(*keys).having(or_(qty != 0, value != 0))
+            )
+        )
+
+        return result.rowcount
@@ -3,7 +3,7 @@ Policy resolution service - Hierarchical policy resolution
 خدمة حل السياسات - حل السياسات الهرمية
 """
 
-from typing import Optional
+from typing import Dict, Iterable, Optional, Tuple
 
 from sqlalchemy.orm import Session
 
@@ -98,6 +98,78 @@ class PolicyService:
         # Default values for known policies
         return self._get_default_policy_value(policy_name)
     
+    def get_policy_values(self, session: Session, policy_name: str,
+                          company_id: int,
+                          items: Iterable[Tuple[int, Optional[int]]],
+                          warehouse_id: Optional[int] = None,
+                          doc_type: Optional[str] = None) -> Dict[int, bool]:
+        """
+        Resolve a policy for many items at once
+        
+        Loads every rule of the policy with one query and applies the same
+        hierarchy as get_policy_value in memory.
+        
+        Args:
+            session: Database session
+            policy_name: Name of the policy
+            company_id: Company ID
+            items: Iterable of (item_id, category_id) pairs
+            warehouse_id: Warehouse ID (optional)
+            doc_type: Document type (optional)
+            
+        Returns:
+            Dict of item_id to policy value
+        """
+        by_item = {}
+        by_category = {}
+        fallback = None
+        fallback_rank = None
+        
+        # Rank of the scopes that do not depend on the item
+        ranks = {
+            PolicyScope.DOCTYPE: 0,
+            PolicyScope.WAREHOUSE: 1,
+            PolicyScope.COMPANY: 2,
+            PolicyScope.GLOBAL: 3,
+        }
+        
+        for policy in session.query(Policy).filter_by(policy_name=policy_name).order_by(Policy.id):
+            scope = policy.scope_type
+            
+            if scope == PolicyScope.ITEM:
+                by_item.setdefault(policy.item_id, policy.policy_value)
+                continue
+            if scope == PolicyScope.CATEGORY:
+                by_category.setdefault(policy.category_id, policy.policy_value)
+                continue
+            
+            if scope == PolicyScope.DOCTYPE:
+                matches = doc_type and policy.company_id == company_id and policy.doc_type == doc_type
+            elif scope == PolicyScope.WAREHOUSE:
+                matches = warehouse_id and policy.warehouse_id == warehouse_id
+            elif scope == PolicyScope.COMPANY:
+                matches = policy.company_id == company_id
+            else:
+                matches = True
+            
+            if matches and (fallback_rank is None or ranks[scope] < fallback_rank):
+                fallback = policy.policy_value
+                fallback_rank = ranks[scope]
+        
+        if fallback is None:
+            fallback = self._get_default_policy_value(policy_name)
+        
+        values = {}
+        for item_id, category_id in items:
+            if item_id in by_item:
+                values[item_id] = by_item[item_id]
+            elif category_id and category_id in by_category:
+                values[item_id] = by_category[category_id]
+            else:
+                values[item_id] = fallback
+        
+        return values
+    
     def _get_default_policy_value(self, policy_name: str) -> bool:
         """Get default value for a policy if not configured"""
         defaults = {
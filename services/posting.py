@@ -3,17 +3,30 @@ Posting service - Handle document posting to inventory ledger
 خدمة الترحيل - ترحيل المستندات إلى دفتر الحركة
 """
 
+from collections import defaultdict
 from datetime import datetime, date
 from decimal import Decimal
-from typing import List, Optional
+from typing import Dict, List, Optional
 
-from sqlalchemy.orm import Session
+from sqlalchemy import insert
+from sqlalchemy.orm import Session, selectinload
 
 from data import (
     DocumentHeader, DocumentLine, DocumentStatus, DocumentType,
     InventoryLedger, StockBalance, session_scope
 )
+from services.archival import last_closed_period
+from services.cost_replay import CostReplayService, apply_balance_deltas
 from services.costing import CostingService
+from services.expiry_aging import ExpiryAgingService
+from services.genealogy import GenealogyService
+from services.inventory_aging import InventoryAgingService
+from services.kpi import KPIService
+from services.movement_cube import MovementCubeService
+from services.posting_journal import PostingJournalError, PostingJournalService
+from services.reorder_monitor import ReorderMonitorService
+from services.reservation import ReservationService
+from services.serial_registry import SerialRegistryService
 from services.validation import ValidationService
 
 
@@ -28,15 +41,32 @@ class PostingService:
     def __init__(self):
         self.costing_service = CostingService()
         self.validation_service = ValidationService()
+        self.movement_cube_service = MovementCubeService()
+        self.kpi_service = KPIService()
+        self.reorder_monitor_service = ReorderMonitorService()
+        self.genealogy_service = GenealogyService()
+        self.serial_registry_service = SerialRegistryService()
+        self.expiry_aging_service = ExpiryAgingService()
+        self.inventory_aging_service = InventoryAgingService()
+        self.reservation_service = ReservationService()
+        self.cost_replay_service = CostReplayService()
+        self.journal_service = PostingJournalService()
+        self._ledger_entries: List[InventoryLedger] = []
     
-    def post_document(self, document_id: int, user_id: int, posting_date: Optional[date] = None) -> bool:
+    def post_document(self, document_id: int, user_id: int, posting_date: Optional[date] = None,
+                      token: Optional[str] = None) -> bool:
         """
         Post a document to the inventory ledger
         
+        The attempt is recorded in the posting journal. Passing the same
+        token again (e.g. a double-clicked post button) returns the earlier
+        outcome instead of posting twice.
+        
         Args:
             document_id: Document ID to post
             user_id: User performing the posting
             posting_date: Date to post the document (defaults to today)
+            token: Idempotency token of the request (optional)
             
         Returns:
             True if posting successful
@@ -47,44 +77,302 @@ class PostingService:
         if posting_date is None:
             posting_date = date.today()
         
-        with session_scope() as session:
-            # Get document with lines
-            document = session.query(DocumentHeader).filter_by(id=document_id).first()
+        try:
+            journal_id = self.journal_service.begin(document_id, user_id, token)
+        except PostingJournalError as error:
+            raise PostingError(str(error))
+        
+        if journal_id is None:
+            # Already posted by an earlier request with this token
+            return True
+        
+        try:
+            with session_scope() as session:
+                # Lock the header so a concurrent posting waits and then sees POSTED
+                document = session.query(DocumentHeader).filter_by(
+                    id=document_id
+                ).with_for_update().first()
+                
+                if not document:
+                    raise PostingError(f'المستند رقم {document_id} غير موجود')
+                
+                self._post(document, posting_date, user_id, session)
+                self.journal_service.complete(session, journal_id)
+                
+                session.commit()
+        except Exception as error:
+            self.journal_service.fail(journal_id, error)
+            raise
+        
+        return True
+    
+    def post_documents(self, document_ids: List[int], user_id: int,
+                       posting_date: Optional[date] = None,
+                       session: Optional[Session] = None) -> int:
+        """
+        Post several documents in one transaction
+        
+        Documents and their lines are loaded with one query each. When a
+        session is given the documents are posted inside it and the caller
+        commits; otherwise a new transaction is committed here.
+        
+        Args:
+            document_ids: Document IDs to post, in posting order
+            user_id: User performing the posting
+            posting_date: Date to post the documents (defaults to today)
+            session: Caller's session (optional)
+            
+        Returns:
+            Number of documents posted
             
+        Raises:
+            PostingError: If any document fails; nothing is posted
+        """
+        if posting_date is None:
+            posting_date = date.today()
+        
+        if session is None:
+            with session_scope() as session:
+                return self._post_documents(document_ids, posting_date, user_id, session)
+        
+        return self._post_documents(document_ids, posting_date, user_id, session)
+    
+    def _post_documents(self, document_ids: List[int], posting_date: date,
+                        user_id: int, session: Session) -> int:
+        """Load and post a batch of documents"""
+        documents = session.query(DocumentHeader).options(
+            selectinload(DocumentHeader.lines)
+        ).filter(
+            DocumentHeader.id.in_(document_ids)
+        ).all()
+        documents_by_id = {document.id: document for document in documents}
+        
+        for document_id in document_ids:
+            document = documents_by_id.get(document_id)
             if not document:
                 raise PostingError(f'المستند رقم {document_id} غير موجود')
             
-            # Validate document can be posted
-            self._validate_can_post(document)
+            self._post(document, posting_date, user_id, session)
+        
+        return len(document_ids)
+    
+    def reverse_document(self, document_id: int, user_id: int,
+                         reversal_date: Optional[date] = None) -> bool:
+        """
+        Reverse a posted document (see reverse_documents)
+        
+        Returns:
+            True if reversal successful
+        """
+        self.reverse_documents([document_id], user_id, reversal_date)
+        return True
+    
+    def reverse_documents(self, document_ids: List[int], user_id: int,
+                          reversal_date: Optional[date] = None,
+                          session: Optional[Session] = None) -> int:
+        """
+        Reverse several posted documents in one transaction
+        
+        Every ledger entry of the documents gets a negating entry with the
+        same warehouse, location, item, lot, serial and unit cost. All
+        entries are written with one bulk insert and balances with one bulk
+        update, then later outgoing entries of the affected items are
+        re-costed. The documents move to REVERSED.
+        
+        Args:
+            document_ids: Posted document IDs
+            user_id: User performing the reversal
+            reversal_date: Posting date of the reversal entries (defaults to
+                each document's own posting date)
+            session: Caller's session (optional)
             
-            # Validate document lines
-            self.validation_service.validate_document(document, session)
+        Returns:
+            Number of documents reversed
             
-            # Post based on document type
-            if document.doc_type == DocumentType.GRN_RECEIPT:
-                self._post_receipt(document, posting_date, user_id, session)
-            elif document.doc_type == DocumentType.ISSUE:
-                self._post_issue(document, posting_date, user_id, session)
-            elif document.doc_type == DocumentType.TRANSFER:
-                self._post_transfer(document, posting_date, user_id, session)
-            elif document.doc_type == DocumentType.ADJUSTMENT:
-                self._post_adjustment(document, posting_date, user_id, session)
-            elif document.doc_type == DocumentType.RETURN_IN:
-                self._post_return_in(document, posting_date, user_id, session)
-            elif document.doc_type == DocumentType.RETURN_OUT:
-                self._post_return_out(document, posting_date, user_id, session)
-            else:
-                raise PostingError(f'نوع المستند {document.doc_type} غير مدعوم للترحيل')
+        Raises:
+            PostingError: If any document cannot be reversed; nothing is reversed
+        """
+        if session is None:
+            with session_scope() as session:
+                return self._reverse_documents(document_ids, reversal_date, user_id, session)
+        
+        return self._reverse_documents(document_ids, reversal_date, user_id, session)
+    
+    def _reverse_documents(self, document_ids: List[int], reversal_date: Optional[date],
+                           user_id: int, session: Session) -> int:
+        """Reverse a batch of posted documents"""
+        documents = session.query(DocumentHeader).filter(
+            DocumentHeader.id.in_(document_ids)
+        ).all()
+        documents_by_id = {document.id: document for document in documents}
+        
+        dates = {}
+        for document_id in document_ids:
+            document = documents_by_id.get(document_id)
+            if not document:
+                raise PostingError(f'المستند رقم {document_id} غير موجود')
             
-            # Update document status
-            document.status = DocumentStatus.POSTED
-            document.posting_date = posting_date
-            document.posted_by = user_id
-            document.posted_at = datetime.utcnow()
+            if document.status != DocumentStatus.POSTED:
+                raise PostingError(f'لا يمكن عكس المستند {document.doc_no}: غير مُرحّل')
             
-            session.commit()
+            # The original entries must still be in the open period
+            self._validate_posting_period(document, document.posting_date, session)
             
-            return True
+            dates[document_id] = reversal_date or document.posting_date
+            if dates[document_id] < document.posting_date:
+                raise PostingError(
+                    f'تاريخ العكس {dates[document_id]} يسبق تاريخ ترحيل المستند {document.doc_no}'
+                )
+        
+        originals = session.query(InventoryLedger).filter(
+            InventoryLedger.doc_type.in_({document.doc_type for document in documents}),
+            InventoryLedger.doc_id.in_(documents_by_id)
+        ).order_by(InventoryLedger.id).all()
+        
+        rows = []
+        entries: Dict[int, List[InventoryLedger]] = defaultdict(list)
+        balance_deltas: Dict[int, Dict[tuple, tuple]] = defaultdict(dict)
+        starts: Dict[int, Dict[tuple, date]] = defaultdict(dict)
+        
+        for original in originals:
+            posting_date = dates[original.doc_id]
+            row = {
+                'posting_date': posting_date,
+                'company_id': original.company_id,
+                'warehouse_id': original.warehouse_id,
+                'location_id': original.location_id,
+                'item_id': original.item_id,
+                'qty_in': -Decimal(original.qty_in or 0),
+                'qty_out': -Decimal(original.qty_out or 0),
+                'unit_cost': original.unit_cost,
+                'value_in': -Decimal(original.value_in or 0),
+                'value_out': -Decimal(original.value_out or 0),
+                'lot_id': original.lot_id,
+                'serial_id': original.serial_id,
+                'doc_type': original.doc_type,
+                'doc_id': original.doc_id,
+                'doc_no': original.doc_no,
+                'line_no': original.line_no,
+                'created_by': user_id,
+            }
+            rows.append(row)
+            # Not added to the session; passed to the derived table updates
+            entries[original.doc_id].append(InventoryLedger(**row))
+            
+            deltas = balance_deltas[original.company_id]
+            key = (original.warehouse_id, original.location_id, original.item_id,
+                   original.lot_id, original.serial_id)
+            qty, value = deltas.get(key, (Decimal(0), Decimal(0)))
+            deltas[key] = (
+                qty + row['qty_in'] - row['qty_out'],
+                value + row['value_in'] - row['value_out']
+            )
+            
+            # Reversed documents count as never posted, so later entries are
+            # re-costed from the original posting date
+            company_starts = starts[original.company_id]
+            stock_key = (original.warehouse_id, original.item_id)
+            if stock_key not in company_starts or original.posting_date < company_starts[stock_key]:
+                company_starts[stock_key] = original.posting_date
+        
+        if rows:
+            session.execute(insert(InventoryLedger), rows)
+        
+        for company_id, deltas in balance_deltas.items():
+            quantities = apply_balance_deltas(session, company_id, deltas)
+            self._validate_reversed_stock(session, company_id, deltas, quantities)
+        
+        for document_id in document_ids:
+            document = documents_by_id[document_id]
+            document.status = DocumentStatus.REVERSED
+            self._after_post(document, entries[document_id], session)
+        
+        # Replays run once per company for the whole batch
+        for company_id, company_starts in starts.items():
+            self.inventory_aging_service.replay_items(
+                session, company_id, {item_id for _, item_id in company_starts}
+            )
+            self.cost_replay_service.replay(session, company_id, company_starts)
+        
+        return len(document_ids)
+    
+    def _validate_reversed_stock(self, session: Session, company_id: int,
+                                 deltas: Dict[tuple, tuple], quantities: Dict[tuple, Decimal]):
+        """Reject reversals that leave a balance negative where that is blocked"""
+        for key, qty in quantities.items():
+            if qty >= 0 or deltas[key][0] >= 0:
+                continue
+            
+            warehouse_id, _, item_id, _, _ = key
+            block_negative = self.validation_service.policy_service.get_policy_value(
+                session=session,
+                policy_name='BLOCK_NEGATIVE_STOCK',
+                company_id=company_id,
+                warehouse_id=warehouse_id,
+                item_id=item_id
+            )
+            if block_negative:
+                raise PostingError(
+                    f'لا يمكن العكس: رصيد الصنف {item_id} في المخزن {warehouse_id} يصبح سالباً ({qty})'
+                )
+    
+    def _post(self, document: DocumentHeader, posting_date: date,
+              user_id: int, session: Session):
+        """Validate and post a loaded document"""
+        # Validate document can be posted
+        self._validate_can_post(document)
+        self._validate_posting_period(document, posting_date, session)
+        
+        # Validate document lines
+        self.validation_service.validate_document(document, session)
+        
+        self._ledger_entries = []
+        
+        # Post based on document type
+        if document.doc_type == DocumentType.GRN_RECEIPT:
+            self._post_receipt(document, posting_date, user_id, session)
+        elif document.doc_type == DocumentType.ISSUE:
+            self._post_issue(document, posting_date, user_id, session)
+        elif document.doc_type == DocumentType.TRANSFER:
+            self._post_transfer(document, posting_date, user_id, session)
+        elif document.doc_type == DocumentType.ADJUSTMENT:
+            self._post_adjustment(document, posting_date, user_id, session)
+        elif document.doc_type == DocumentType.RETURN_IN:
+            self._post_return_in(document, posting_date, user_id, session)
+        elif document.doc_type == DocumentType.RETURN_OUT:
+            self._post_return_out(document, posting_date, user_id, session)
+        elif document.doc_type in (DocumentType.PRODUCTION_ISSUE, DocumentType.SCRAP):
+            self._post_issue(document, posting_date, user_id, session)
+        elif document.doc_type == DocumentType.PRODUCTION_RECEIPT:
+            self._post_receipt(document, posting_date, user_id, session)
+        else:
+            raise PostingError(f'نوع المستند {document.doc_type} غير مدعوم للترحيل')
+        
+        # Update document status
+        document.status = DocumentStatus.POSTED
+        document.posting_date = posting_date
+        document.posted_by = user_id
+        document.posted_at = datetime.utcnow()
+        
+        self._after_post(document, self._ledger_entries, session)
+    
+    def _add_ledger_entry(self, session: Session, ledger: InventoryLedger):
+        """Add a ledger entry of the document being posted"""
+        session.add(ledger)
+        self._ledger_entries.append(ledger)
+    
+    def _after_post(self, document: DocumentHeader,
+                    entries: List[InventoryLedger], session: Session):
+        """Maintain tables derived from the ledger in the posting transaction"""
+        self.serial_registry_service.apply(session, document, entries)
+        self.movement_cube_service.apply(session, entries)
+        # Item totals first: the KPI below-reorder refresh reads them
+        self.reorder_monitor_service.apply(session, document, entries)
+        self.kpi_service.apply(session, document, entries)
+        self.genealogy_service.apply(session, document, entries)
+        self.expiry_aging_service.apply(session, document, entries)
+        self.inventory_aging_service.apply(session, document, entries)
+        self.reservation_service.apply(session, document, entries)
     
     def _validate_can_post(self, document: DocumentHeader):
         """Validate document can be posted"""
@@ -94,9 +382,22 @@ class PostingService:
         if document.status == DocumentStatus.CANCELLED:
             raise PostingError('لا يمكن ترحيل مستند ملغي')
         
+        if document.status == DocumentStatus.REVERSED:
+            raise PostingError('لا يمكن ترحيل مستند معكوس')
+        
         if not document.lines:
             raise PostingError('المستند لا يحتوي على بنود')
     
+    def _validate_posting_period(self, document: DocumentHeader,
+                                 posting_date: date, session: Session):
+        """Reject posting dates inside a closed period"""
+        closed_through = last_closed_period(session, document.company_id)
+        
+        if closed_through and posting_date <= closed_through:
+            raise PostingError(
+                f'لا يمكن الترحيل بتاريخ {posting_date}: الفترة مقفلة حتى {closed_through}'
+            )
+    
     def _post_receipt(self, document: DocumentHeader, posting_date: date, 
                      user_id: int, session: Session):
         """Post a receipt document (GRN)"""
@@ -123,7 +424,7 @@ class PostingService:
                 line_no=line.line_no,
                 created_by=user_id
             )
-            session.add(ledger)
+            self._add_ledger_entry(session, ledger)
             
             # Update stock balance
             self._update_stock_balance(
@@ -144,14 +445,18 @@ class PostingService:
         warehouse_id = document.from_warehouse_id
         
         for line in document.lines:
-            # Get current average cost
-            avg_cost = self.costing_service.get_average_cost(
-                session=session,
-                company_id=document.company_id,
-                warehouse_id=warehouse_id,
-                item_id=line.item_id,
-                lot_id=line.lot_id
-            )
+            if document.doc_type == DocumentType.SCRAP and line.unit_cost is not None:
+                # Production scrap leaves at the cost it was just received at
+                avg_cost = Decimal(line.unit_cost)
+            else:
+                # Get current average cost
+                avg_cost = self.costing_service.get_average_cost(
+                    session=session,
+                    company_id=document.company_id,
+                    warehouse_id=warehouse_id,
+                    item_id=line.item_id,
+                    lot_id=line.lot_id
+                )
             
             value_out = line.base_qty * avg_cost
             
@@ -175,7 +480,7 @@ class PostingService:
                 line_no=line.line_no,
                 created_by=user_id
             )
-            session.add(ledger)
+            self._add_ledger_entry(session, ledger)
             
             # Update stock balance
             self._update_stock_balance(
@@ -225,7 +530,7 @@ class PostingService:
                 line_no=line.line_no,
                 created_by=user_id
             )
-            session.add(ledger_out)
+            self._add_ledger_entry(session, ledger_out)
             
             # Receipt to destination warehouse
             ledger_in = InventoryLedger(
@@ -247,7 +552,7 @@ class PostingService:
                 line_no=line.line_no,
                 created_by=user_id
             )
-            session.add(ledger_in)
+            self._add_ledger_entry(session, ledger_in)
             
             # Update stock balances
             self._update_stock_balance(
@@ -291,7 +596,7 @@ class PostingService:
                     line_no=line.line_no,
                     created_by=user_id
                 )
-                session.add(ledger)
+                self._add_ledger_entry(session, ledger)
                 
                 self._update_stock_balance(
                     session, document.company_id, warehouse_id,
@@ -326,7 +631,7 @@ class PostingService:
                     line_no=line.line_no,
                     created_by=user_id
                 )
-                session.add(ledger)
+                self._add_ledger_entry(session, ledger)
                 
                 self._update_stock_balance(
                     session, document.company_id, warehouse_id,
@@ -351,21 +656,15 @@ class PostingService:
                              serial_id: Optional[int],
                              qty_change: Decimal, value_change: Decimal):
         """Update stock balance after posting"""
-        # Find existing balance
-        query = session.query(StockBalance).filter_by(
+        # Find existing balance (exact key, so balances match the ledger)
+        balance = session.query(StockBalance).filter_by(
             company_id=company_id,
             warehouse_id=warehouse_id,
-            item_id=item_id
-        )
-        
-        if location_id:
-            query = query.filter_by(location_id=location_id)
-        if lot_id:
-            query = query.filter_by(lot_id=lot_id)
-        if serial_id:
-            query = query.filter_by(serial_id=serial_id)
-        
-        balance = query.first()
+            location_id=location_id,
+            item_id=item_id,
+            lot_id=lot_id,
+            serial_id=serial_id
+        ).first()
         
         if balance:
             # Update existing balance
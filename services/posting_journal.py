@@ -0,0 +1,156 @@
+"""
+Posting journal service - Posting attempts and idempotency tokens
+خدمة سجل الترحيل - محاولات الترحيل ورموز منع التكرار
+"""
+
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+
+from sqlalchemy import func, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from data import DocumentHeader, PostingJournal, session_scope
+
+JOURNAL_STARTED = 'STARTED'
+JOURNAL_POSTED = 'POSTED'
+JOURNAL_FAILED = 'FAILED'
+
+# A STARTED attempt older than this is taken to have died with its process
+STALE_AFTER = timedelta(minutes=10)
+
+
+class PostingJournalError(Exception):
+    """خطأ في سجل الترحيل"""
+    pass
+
+
+class PostingJournalService:
+    """
+    Service for the posting journal
+
+    An attempt is recorded in its own transaction before a document is
+    posted and marked POSTED inside the posting transaction, so the journal
+    says POSTED exactly when the posting committed. An attempt left STARTED
+    belongs to a process that died; its posting was rolled back as a whole
+    and the document can be posted again. Repeating a request with the same
+    idempotency token returns the earlier outcome instead of posting twice.
+    """
+
+    def begin(self, document_id: int, user_id: int,
+              token: Optional[str] = None) -> Optional[int]:
+        """
+        Record a new posting attempt
+
+        Args:
+            document_id: Document ID
+            user_id: User posting the document
+            token: Idempotency token of the request (optional)
+
+        Returns:
+            Journal ID of the attempt, or None if an earlier attempt with
+            the same token already posted the document
+
+        Raises:
+            PostingJournalError: If the document does not exist or the same
+                request is still being posted
+        """
+        with session_scope() as session:
+            company_id = session.query(DocumentHeader.company_id).filter(
+                DocumentHeader.id == document_id
+            ).scalar()
+            if company_id is None:
+                raise PostingJournalError(f'المستند رقم {document_id} غير موجود')
+
+            attempts = session.query(PostingJournal).filter(
+                PostingJournal.doc_id == document_id
+            ).order_by(PostingJournal.attempt.desc()).all()
+
+            if token:
+                for attempt in attempts:
+                    if attempt.token != token:
+                        continue
+                    if attempt.status == JOURNAL_POSTED:
+                        return None
+                    if attempt.status == JOURNAL_STARTED:
+                        if datetime.utcnow() - attempt.started_at < STALE_AFTER:
+                            raise PostingJournalError('طلب ترحيل هذا المستند قيد التنفيذ بالفعل')
+                        attempt.status = JOURNAL_FAILED
+                        attempt.error = 'انقطع الترحيل قبل اكتماله'
+                    # The retry takes over the token (unique per journal row)
+                    attempt.token = None
+                    session.flush()
+                    break
+
+            journal = PostingJournal(
+                company_id=company_id,
+                doc_id=document_id,
+                attempt=attempts[0].attempt + 1 if attempts else 1,
+                token=token,
+                status=JOURNAL_STARTED,
+                user_id=user_id
+            )
+            session.add(journal)
+
+            try:
+                session.flush()
+            except IntegrityError:
+                # Another request took the same attempt number first
+                raise PostingJournalError('طلب ترحيل هذا المستند قيد التنفيذ بالفعل')
+
+            return journal.id
+
+    def complete(self, session: Session, journal_id: int):
+        """Mark an attempt posted, inside the posting transaction"""
+        session.execute(
+            update(PostingJournal).where(PostingJournal.id == journal_id).values(
+                status=JOURNAL_POSTED, finished_at=datetime.utcnow()
+            ).execution_options(synchronize_session=False)
+        )
+
+    def fail(self, journal_id: int, error: Exception):
+        """Mark an attempt failed (own transaction)"""
+        with session_scope() as session:
+            session.execute(
+                update(PostingJournal).where(PostingJournal.id == journal_id).values(
+                    status=JOURNAL_FAILED, error=str(error)[:2000], finished_at=datetime.utcnow()
+                ).execution_options(synchronize_session=False)
+            )
+
+    def record_posted(self, session: Session, document_ids: Iterable[int],
+                      user_id: int, run_id: Optional[int] = None):
+        """Journal documents posted together in the caller's transaction (one insert)"""
+        document_ids = list(document_ids)
+        if not document_ids:
+            return
+
+        last_attempts = dict(session.query(
+            PostingJournal.doc_id, func.max(PostingJournal.attempt)
+        ).filter(
+            PostingJournal.doc_id.in_(document_ids)
+        ).group_by(PostingJournal.doc_id).all())
+
+        companies = dict(session.query(DocumentHeader.id, DocumentHeader.company_id).filter(
+            DocumentHeader.id.in_(document_ids)
+        ).all())
+
+        now = datetime.utcnow()
+        session.execute(insert(PostingJournal), [
+            {
+                'company_id': companies[document_id],
+                'doc_id': document_id,
+                'attempt': last_attempts.get(document_id, 0) + 1,
+                'run_id': run_id,
+                'status': JOURNAL_POSTED,
+                'user_id': user_id,
+                'started_at': now,
+                'finished_at': now,
+            }
+            for document_id in document_ids
+        ])
+
+    def attempts(self, session: Session, document_id: int) -> List[PostingJournal]:
+        """Posting attempts of a document, oldest first"""
+        return session.query(PostingJournal).filter(
+            PostingJournal.doc_id == document_id
+        ).order_by(PostingJournal.attempt).all()
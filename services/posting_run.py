@@ -0,0 +1,193 @@
+"""
+Posting run service - Checkpointed, resumable batch posting
+خدمة دفعات الترحيل - ترحيل دفعات كبيرة مع نقاط حفظ واستئناف
+"""
+
+import json
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from data import DocumentHeader, DocumentStatus, PostingRun, session_scope
+from services.posting import PostingError, PostingService
+from services.posting_journal import PostingJournalService
+
+RUN_RUNNING = 'RUNNING'
+RUN_COMPLETED = 'COMPLETED'
+RUN_FAILED = 'FAILED'
+
+# Documents posted per transaction (and per checkpoint)
+RUN_CHUNK_SIZE = 200
+
+
+class PostingRunService:
+    """
+    Service for batch posting runs
+
+    A run stores its document list and posts it in chunks. Each chunk is
+    one transaction that also journals its documents and advances the
+    run's checkpoint, so progress and postings cannot disagree. After a
+    crash or a failed document, resume() continues from the checkpoint and
+    only the remaining documents are loaded and validated. Starting a run
+    again with the same token resumes that run instead of creating another.
+    """
+
+    def __init__(self):
+        self.posting_service = PostingService()
+        self.journal_service = PostingJournalService()
+
+    def start(self, document_ids: List[int], user_id: int,
+              posting_date: Optional[date] = None, token: Optional[str] = None,
+              chunk_size: int = RUN_CHUNK_SIZE) -> Dict:
+        """
+        Create a posting run and post its documents
+
+        Args:
+            document_ids: Document IDs to post, in posting order
+            user_id: User performing the posting
+            posting_date: Date to post the documents (defaults to today)
+            token: Idempotency token of the request (optional)
+            chunk_size: Documents per transaction
+
+        Returns:
+            Run status (see status)
+
+        Raises:
+            PostingError, ValidationError: If a document fails; chunks
+                before it stay posted and the run can be resumed
+        """
+        if posting_date is None:
+            posting_date = date.today()
+
+        with session_scope() as session:
+            run = None
+            if token:
+                run = session.query(PostingRun).filter(PostingRun.token == token).first()
+
+            if run is None:
+                run = PostingRun(
+                    company_id=session.query(DocumentHeader.company_id).filter(
+                        DocumentHeader.id == document_ids[0]
+                    ).scalar() if document_ids else None,
+                    token=token,
+                    user_id=user_id,
+                    posting_date=posting_date,
+                    document_ids=json.dumps(list(document_ids)),
+                    total=len(document_ids),
+                    next_index=0,
+                    status=RUN_RUNNING
+                )
+                session.add(run)
+                session.flush()
+
+            run_id = run.id
+
+        return self.resume(run_id, chunk_size)
+
+    def resume(self, run_id: int, chunk_size: int = RUN_CHUNK_SIZE) -> Dict:
+        """
+        Continue a run from its checkpoint
+
+        Documents of the remaining chunks that were posted outside the run
+        in the meantime are skipped.
+
+        Returns:
+            Run status (see status)
+
+        Raises:
+            PostingError: If the run does not exist
+            PostingError, ValidationError: If a document fails
+        """
+        with session_scope() as session:
+            run = self._get_run(session, run_id)
+            if run.status == RUN_COMPLETED:
+                return self._status(run)
+
+            document_ids = json.loads(run.document_ids)
+            index = run.next_index
+            user_id = run.user_id
+            posting_date = run.posting_date
+
+            run.status = RUN_RUNNING
+            run.error = None
+
+        while index < len(document_ids):
+            chunk = document_ids[index:index + chunk_size]
+
+            in_progress = False
+            try:
+                with session_scope() as session:
+                    run = session.query(PostingRun).filter(
+                        PostingRun.id == run_id
+                    ).with_for_update().one()
+                    if run.next_index != index:
+                        in_progress = True
+                        raise PostingError('دفعة الترحيل قيد التنفيذ من جلسة أخرى')
+
+                    posted = {
+                        row.id for row in session.query(DocumentHeader.id).filter(
+                            DocumentHeader.id.in_(chunk),
+                            DocumentHeader.status == DocumentStatus.POSTED
+                        )
+                    }
+                    pending = [document_id for document_id in chunk if document_id not in posted]
+
+                    if pending:
+                        self.posting_service.post_documents(pending, user_id, posting_date, session=session)
+                        self.journal_service.record_posted(session, pending, user_id, run_id)
+
+                    run.next_index = index + len(chunk)
+            except Exception as error:
+                # Leave a run advanced by another session as it is
+                if not in_progress:
+                    self._fail(run_id, error)
+                raise
+
+            index += len(chunk)
+
+        with session_scope() as session:
+            run = self._get_run(session, run_id)
+            run.status = RUN_COMPLETED
+            run.finished_at = datetime.utcnow()
+            return self._status(run)
+
+    def status(self, run_id: int) -> Dict:
+        """
+        Progress of a run
+
+        Returns:
+            Dict with run_id, status, total, done and error
+        """
+        with session_scope() as session:
+            return self._status(self._get_run(session, run_id))
+
+    def unfinished_runs(self, session: Session, user_id: Optional[int] = None) -> List[Dict]:
+        """Runs that stopped before completing (to offer resuming them)"""
+        query = session.query(PostingRun).filter(PostingRun.status != RUN_COMPLETED)
+        if user_id is not None:
+            query = query.filter(PostingRun.user_id == user_id)
+
+        return [self._status(run) for run in query.order_by(PostingRun.id)]
+
+    def _fail(self, run_id: int, error: Exception):
+        """Record why a run stopped (own transaction)"""
+        with session_scope() as session:
+            run = self._get_run(session, run_id)
+            run.status = RUN_FAILED
+            run.error = str(error)[:2000]
+
+    def _status(self, run: PostingRun) -> Dict:
+        return {
+            'run_id': run.id,
+            'status': run.status,
+            'total': run.total,
+            'done': run.next_index,
+            'error': run.error,
+        }
+
+    def _get_run(self, session: Session, run_id: int) -> PostingRun:
+        run = session.query(PostingRun).filter_by(id=run_id).first()
+        if not run:
+            raise PostingError(f'دفعة الترحيل رقم {run_id} غير موجودة')
+        return run
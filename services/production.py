@@ -0,0 +1,276 @@
+"""
+Production service - Backflush posting of production orders
+خدمة الإنتاج - الترحيل التلقائي لصرف المكونات واستلام الإنتاج التام
+"""
+
+from datetime import date
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from data import (
+    DocumentHeader, DocumentLine, DocumentType, InventoryLedger, Item,
+    ProductionIssue, ProductionOrder, ProductionReceipt, ScrapDocument,
+    TrackingType, session_scope
+)
+from services.allocation import LotAllocationService
+from services.bom import BOMExplosionService
+from services.numbering import DocumentNumberingService
+from services.posting import PostingService
+
+# Production orders that can report output
+BACKFLUSH_STATUSES = ('RELEASED', 'IN_PROGRESS')
+
+COST_QUANTUM = Decimal('0.0001')
+
+
+class ProductionError(Exception):
+    """خطأ في أمر الإنتاج"""
+    pass
+
+
+class ProductionService:
+    """Service for reporting production output"""
+
+    def __init__(self):
+        self.posting_service = PostingService()
+        self.numbering_service = DocumentNumberingService()
+        self.bom_service = BOMExplosionService()
+        self.allocation_service = LotAllocationService()
+
+    def backflush(self, order_id: int, completed_qty: Decimal, user_id: int,
+                  scrap_qty: Decimal = Decimal(0),
+                  posting_date: Optional[date] = None,
+                  lot_id: Optional[int] = None) -> Dict[str, Optional[int]]:
+        """
+        Report output of a production order and post it in one transaction
+
+        Components for the completed and scrapped quantity are exploded from
+        the order's BOM through all levels (sub-assemblies with an active BOM
+        are consumed as their components, including BOM scrap allowances) and
+        split over lots/locations with the allocation service. The component
+        issue is posted first; the finished good is then received at the
+        value the issue actually consumed, and scrapped units are written off
+        from the same receipt at that unit cost. Serial-tracked finished
+        goods cannot be backflushed.
+
+        Args:
+            order_id: Production order ID
+            completed_qty: Good quantity produced
+            user_id: User performing the posting
+            scrap_qty: Quantity of the finished item scrapped
+            posting_date: Posting date (defaults to today)
+            lot_id: Lot of the finished item (for lot-tracked items)
+
+        Returns:
+            Dict with issue_doc_id, receipt_doc_id and scrap_doc_id (None when
+            there was no scrap)
+
+        Raises:
+            ProductionError: If the order cannot be backflushed, its item is
+                serial tracked, or a lot or serial tracked component is short
+            NumberingError: If a document sequence is not defined
+        """
+        if posting_date is None:
+            posting_date = date.today()
+
+        completed_qty = Decimal(completed_qty)
+        scrap_qty = Decimal(scrap_qty or 0)
+
+        if completed_qty < 0 or scrap_qty < 0 or completed_qty + scrap_qty <= 0:
+            raise ProductionError('الكمية المنتجة يجب أن تكون أكبر من صفر')
+
+        with session_scope() as session:
+            order = self._get_open_order(session, order_id)
+            output_qty = completed_qty + scrap_qty
+
+            # Numbered before the transaction writes (block reservations use
+            # their own connection); NO_GAPS numbers are locked until commit
+            doc_types = [DocumentType.PRODUCTION_ISSUE, DocumentType.PRODUCTION_RECEIPT]
+            if scrap_qty > 0:
+                doc_types.append(DocumentType.SCRAP)
+            doc_nos = {
+                doc_type: self.numbering_service.next_doc_no(order.company_id, doc_type, session=session)
+                for doc_type in doc_types
+            }
+
+            requirements = self.bom_service.explode(
+                session, order.bom_id, output_qty,
+                as_of=order.start_date or order.po_date
+            )
+            if not requirements:
+                raise ProductionError(f'قائمة المواد لأمر الإنتاج {order.po_no} لا تحتوي على مكونات')
+
+            base_uoms = dict(session.query(Item.id, Item.base_uom_id).filter(
+                Item.id.in_(set(requirements) | {order.item_id})
+            ).all())
+
+            issue = self._new_document(order, DocumentType.PRODUCTION_ISSUE,
+                                       doc_nos, posting_date, user_id)
+            issue.from_warehouse_id = order.warehouse_id
+            issue.lines = self._issue_lines(session, order, requirements, base_uoms)
+
+            receipt = self._new_document(order, DocumentType.PRODUCTION_RECEIPT,
+                                         doc_nos, posting_date, user_id)
+            receipt.to_warehouse_id = order.warehouse_id
+
+            session.add_all([issue, receipt])
+            session.flush()
+
+            # Linked before posting so posting can trace lots through the order
+            session.add_all([
+                ProductionIssue(production_order_id=order.id, doc_id=issue.id),
+                ProductionReceipt(production_order_id=order.id, doc_id=receipt.id),
+            ])
+
+            self.posting_service.post_documents([issue.id], user_id, posting_date, session=session)
+
+            consumed = session.query(
+                func.coalesce(func.sum(InventoryLedger.value_out), 0)
+            ).filter(
+                InventoryLedger.doc_id == issue.id,
+                InventoryLedger.doc_type == DocumentType.PRODUCTION_ISSUE
+            ).scalar()
+            unit_cost = (Decimal(consumed) / output_qty).quantize(COST_QUANTUM)
+
+            receipt.lines.append(DocumentLine(
+                line_no=1,
+                item_id=order.item_id,
+                qty=output_qty,
+                uom_id=base_uoms[order.item_id],
+                base_qty=output_qty,
+                lot_id=lot_id,
+                unit_cost=unit_cost,
+                total_cost=Decimal(consumed)
+            ))
+            to_post = [receipt]
+
+            scrap = None
+            if scrap_qty > 0:
+                scrap = self._new_document(order, DocumentType.SCRAP,
+                                           doc_nos, posting_date, user_id)
+                scrap.from_warehouse_id = order.warehouse_id
+                scrap.lines.append(DocumentLine(
+                    line_no=1,
+                    item_id=order.item_id,
+                    qty=scrap_qty,
+                    uom_id=base_uoms[order.item_id],
+                    base_qty=scrap_qty,
+                    lot_id=lot_id,
+                    unit_cost=unit_cost,
+                    total_cost=(scrap_qty * unit_cost).quantize(COST_QUANTUM)
+                ))
+                session.add(scrap)
+                to_post.append(scrap)
+
+            session.flush()
+            if scrap:
+                session.add(ScrapDocument(production_order_id=order.id, doc_id=scrap.id,
+                                          scrap_type='PRODUCTION'))
+
+            self.posting_service.post_documents(
+                [document.id for document in to_post], user_id, posting_date, session=session
+            )
+
+            order.produced_qty = Decimal(order.produced_qty or 0) + completed_qty
+            order.scrap_qty = Decimal(order.scrap_qty or 0) + scrap_qty
+            if order.start_date is None:
+                order.start_date = posting_date
+
+            if order.produced_qty >= order.planned_qty:
+                order.status = 'COMPLETED'
+                order.completion_date = posting_date
+            else:
+                order.status = 'IN_PROGRESS'
+
+            return {
+                'issue_doc_id': issue.id,
+                'receipt_doc_id': receipt.id,
+                'scrap_doc_id': scrap.id if scrap else None,
+            }
+
+    def _issue_lines(self, session: Session, order: ProductionOrder,
+                     requirements: Dict[int, Decimal],
+                     base_uoms: Dict[int, int]) -> List[DocumentLine]:
+        """Component lines split over lots and locations"""
+        allocations = self.allocation_service.allocate(
+            session, order.company_id, order.warehouse_id,
+            [
+                {'key': item_id, 'item_id': item_id, 'qty': qty}
+                for item_id, qty in requirements.items() if qty > 0
+            ],
+            doc_type=DocumentType.PRODUCTION_ISSUE.value,
+            allow_partial=True
+        )
+
+        tracked = {
+            row.id: row.name_ar for row in session.query(Item.id, Item.name_ar).filter(
+                Item.id.in_(set(requirements)),
+                Item.tracking_type != TrackingType.NONE
+            )
+        }
+
+        lines = []
+        for item_id, result in allocations.items():
+            splits = [
+                (allocation['location_id'], allocation['lot_id'],
+                 allocation['serial_id'], allocation['qty'])
+                for allocation in result['allocations']
+            ]
+            if result['short_qty'] > 0:
+                # A tracked component cannot be issued without a lot or serial
+                if item_id in tracked:
+                    raise ProductionError(
+                        f'المكون {tracked[item_id]}: الكمية المتاحة أقل من المطلوب '
+                        f'بمقدار ({result["short_qty"]})'
+                    )
+                # Untracked shortages stay on an unallocated line for the negative stock policy
+                splits.append((None, None, None, result['short_qty']))
+
+            for location_id, lot_id, serial_id, qty in splits:
+                lines.append(DocumentLine(
+                    line_no=len(lines) + 1,
+                    item_id=item_id,
+                    qty=qty,
+                    uom_id=base_uoms[item_id],
+                    base_qty=qty,
+                    from_location_id=location_id,
+                    lot_id=lot_id,
+                    serial_id=serial_id
+                ))
+
+        return lines
+
+    def _new_document(self, order: ProductionOrder, doc_type: DocumentType,
+                      doc_nos: Dict[DocumentType, str], posting_date: date,
+                      user_id: int) -> DocumentHeader:
+        """Create an empty production document header"""
+        return DocumentHeader(
+            company_id=order.company_id,
+            doc_type=doc_type,
+            doc_no=doc_nos[doc_type],
+            doc_date=posting_date,
+            reference_no=order.po_no,
+            notes=f'أمر إنتاج {order.po_no}',
+            created_by=user_id
+        )
+
+    def _get_open_order(self, session: Session, order_id: int) -> ProductionOrder:
+        """Get a production order that can report output"""
+        order = session.query(ProductionOrder).filter_by(id=order_id).first()
+
+        if not order:
+            raise ProductionError(f'أمر الإنتاج رقم {order_id} غير موجود')
+
+        if order.status not in BACKFLUSH_STATUSES:
+            raise ProductionError(f'أمر الإنتاج {order.po_no} غير مُطلق أو مُغلق')
+
+        # Output is received as one line; serials need one line per unit
+        if order.item.tracking_type == TrackingType.SERIAL:
+            raise ProductionError(
+                f'أمر الإنتاج {order.po_no}: لا يمكن الترحيل التلقائي لصنف يتتبع بالرقم التسلسلي'
+            )
+
+        return order
@@ -0,0 +1,299 @@
+"""
+Reconciliation service - Verify and rebuild stock balances from the ledger
+خدمة المطابقة - مطابقة أرصدة المخزون مع دفتر الحركة وإعادة بنائها
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import case, delete, func, insert, select, union_all
+from sqlalchemy.orm import Session
+
+from data import InventoryLedger, PeriodBalance, StockBalance, Warehouse
+from data.database import get_engine, get_engine_url, init_db
+from services.archival import last_closed_period
+from services.kpi import KPIService
+from services.reorder_monitor import ReorderMonitorService
+from services.serial_registry import SerialRegistryService
+from utils.logging import get_logger
+
+logger = get_logger('reconciliation')
+
+QTY_TOLERANCE = Decimal('0.0001')
+VALUE_TOLERANCE = Decimal('0.01')
+
+# Columns identifying one stock balance row
+BALANCE_KEY = ('company_id', 'warehouse_id', 'location_id', 'item_id', 'lot_id', 'serial_id')
+
+
+def _ledger_totals(warehouse_id: int, period_end: Optional[date] = None):
+    """
+    Expected quantity and value per balance key of one warehouse (GROUP BY)
+
+    When the company has closed periods, totals start from the last closed
+    balance and add only the ledger rows posted after it.
+    """
+    movements = select(
+        *(getattr(InventoryLedger, column) for column in BALANCE_KEY),
+        (InventoryLedger.qty_in - InventoryLedger.qty_out).label('qty'),
+        (InventoryLedger.value_in - InventoryLedger.value_out).label('value')
+    ).where(
+        InventoryLedger.warehouse_id == warehouse_id
+    )
+
+    if period_end:
+        movements = movements.where(InventoryLedger.posting_date > period_end)
+        opening = select(
+            *(getattr(PeriodBalance, column) for column in BALANCE_KEY),
+            PeriodBalance.qty,
+            PeriodBalance.value
+        ).where(
+            PeriodBalance.warehouse_id == warehouse_id,
+            PeriodBalance.period_end == period_end
+        )
+        combined = union_all(opening, movements).subquery()
+    else:
+        combined = movements.subquery()
+
+    return select(
+        *(combined.c[column] for column in BALANCE_KEY),
+        func.sum(combined.c.qty).label('qty'),
+        func.sum(combined.c.value).label('value')
+    ).group_by(
+        *(combined.c[column] for column in BALANCE_KEY)
+    )
+
+
+def _check_partition(args) -> List[Dict]:
+    """Worker entry point: compare one warehouse on the parent's database"""
+    db_url, warehouse_id = args
+    init_db(url=db_url)
+    with Session(get_engine()) as session:
+        return StockReconciliationService().check_warehouse(session, warehouse_id)
+
+
+class StockReconciliationService:
+    """
+    Service for reconciling stock_balance with inventory_ledger
+
+    Each warehouse is a partition: the ledger is aggregated per balance key
+    in the database and compared with that warehouse's balance rows.
+    Partitions are checked in parallel worker processes.
+    """
+
+    def __init__(self):
+        self.kpi_service = KPIService()
+        self.reorder_monitor_service = ReorderMonitorService()
+        self.serial_registry_service = SerialRegistryService()
+
+    def check_warehouse(self, session: Session, warehouse_id: int) -> List[Dict]:
+        """
+        Compare the balances of one warehouse with its ledger
+
+        Returns:
+            List of drift dicts with the balance key, ledger_qty, ledger_value,
+            balance_qty and balance_value
+        """
+        expected = {
+            tuple(getattr(row, column) for column in BALANCE_KEY): row
+            for row in session.execute(_ledger_totals(
+                warehouse_id, self._last_closed(session, warehouse_id)
+            ))
+        }
+        actual = self._balances(session, warehouse_id)
+
+        drift = []
+        for key in expected.keys() | actual.keys():
+            ledger = expected.get(key)
+
+            ledger_qty = Decimal(ledger.qty or 0) if ledger else Decimal(0)
+            ledger_value = Decimal(ledger.value or 0) if ledger else Decimal(0)
+            balance_qty, balance_value = actual.get(key, (Decimal(0), Decimal(0)))
+
+            if (abs(ledger_qty - balance_qty) > QTY_TOLERANCE
+                    or abs(ledger_value - balance_value) > VALUE_TOLERANCE):
+                entry = dict(zip(BALANCE_KEY, key))
+                entry.update({
+                    'ledger_qty': ledger_qty,
+                    'ledger_value': ledger_value,
+                    'balance_qty': balance_qty,
+                    'balance_value': balance_value,
+                })
+                drift.append(entry)
+
+        drift.sort(key=lambda entry: (entry['item_id'], entry['location_id'] or 0,
+                                      entry['lot_id'] or 0, entry['serial_id'] or 0))
+        return drift
+
+    def rebuild_warehouse(self, session: Session, warehouse_id: int) -> int:
+        """
+        Rewrite the balances of one warehouse from its ledger
+
+        The warehouse's rows are deleted and re-inserted with one
+        INSERT ... SELECT over the grouped ledger. Tables derived from the
+        balances (item totals, stock value and below-reorder counters, the
+        serial registry) are then refreshed for the items whose balances
+        changed. The caller commits.
+
+        Returns:
+            Number of balance rows written
+        """
+        company_id = session.query(Warehouse.company_id).filter(
+            Warehouse.id == warehouse_id
+        ).scalar()
+        before = self._balances(session, warehouse_id)
+
+        totals = _ledger_totals(
+            warehouse_id, last_closed_period(session, company_id)
+        ).subquery()
+        avg_cost = case((totals.c.qty > 0, totals.c.value / totals.c.qty), else_=0)
+
+        session.execute(delete(StockBalance).where(StockBalance.warehouse_id == warehouse_id))
+        result = session.execute(
+            insert(StockBalance).from_select(
+                list(BALANCE_KEY) + ['on_hand_qty', 'on_hand_value', 'avg_cost', 'last_updated'],
+                select(
+                    *(totals.c[column] for column in BALANCE_KEY),
+                    totals.c.qty,
+                    totals.c.value,
+                    avg_cost,
+                    func.current_timestamp()
+                )
+            )
+        )
+
+        after = self._balances(session, warehouse_id)
+        item_ids = {
+            key[BALANCE_KEY.index('item_id')]
+            for key in before.keys() | after.keys()
+            if before.get(key) != after.get(key)
+        }
+        if item_ids:
+            value_change = (sum((value for _, value in after.values()), Decimal(0))
+                            - sum((value for _, value in before.values()), Decimal(0)))
+            self.reorder_monitor_service.rebuild(session, company_id, item_ids)
+            self.kpi_service.adjust_stock_value(session, company_id, {warehouse_id: value_change})
+            self.kpi_service.refresh_below_reorder(session, company_id, item_ids)
+            self.serial_registry_service.rebuild(session, company_id, item_ids)
+
+        return result.rowcount
+
+    def _balances(self, session: Session, warehouse_id: int) -> Dict[tuple, tuple]:
+        """(quantity, value) per balance key of one warehouse"""
+        return {
+            tuple(getattr(row, column) for column in BALANCE_KEY): (
+                Decimal(row.on_hand_qty or 0), Decimal(row.on_hand_value or 0)
+            )
+            for row in session.query(
+                *(getattr(StockBalance, column) for column in BALANCE_KEY),
+                StockBalance.on_hand_qty,
+                StockBalance.on_hand_value
+            ).filter(StockBalance.warehouse_id == warehouse_id)
+        }
+
+    def _last_closed(self, session: Session, warehouse_id: int) -> Optional[date]:
+        """Last closed period end of a warehouse's company"""
+        company_id = session.query(Warehouse.company_id).filter(
+            Warehouse.id == warehouse_id
+        ).scalar()
+        return last_closed_period(session, company_id) if company_id else None
+
+    def reconcile(self, company_id: Optional[int] = None,
+                  warehouse_ids: Optional[Iterable[int]] = None,
+                  rebuild: bool = False,
+                  workers: Optional[int] = None) -> Dict[int, List[Dict]]:
+        """
+        Check (and optionally rebuild) stock balances per warehouse
+
+        Checks run in a process pool, one warehouse per task. Rebuilds are
+        done afterwards in this process, one transaction per drifted
+        warehouse, since SQLite allows a single writer only.
+
+        Args:
+            company_id: Limit to one company (optional)
+            warehouse_ids: Limit to some warehouses (optional)
+            rebuild: Rewrite balances of warehouses with drift
+            workers: Worker processes (defaults to CPU count; 1 runs inline)
+
+        Returns:
+            Dict of warehouse_id to its drift list (warehouses without
+            drift are omitted)
+        """
+        with Session(get_engine()) as session:
+            query = session.query(Warehouse.id)
+            if company_id:
+                query = query.filter(Warehouse.company_id == company_id)
+            if warehouse_ids is not None:
+                query = query.filter(Warehouse.id.in_(list(warehouse_ids)))
+            partitions = [row.id for row in query.order_by(Warehouse.id)]
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(partitions))
+
+        if workers > 1:
+            db_url = get_engine_url()
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = dict(zip(partitions, pool.map(
+                    _check_partition, [(db_url, warehouse_id) for warehouse_id in partitions]
+                )))
+        else:
+            with Session(get_engine()) as session:
+                results = {
+                    warehouse_id: self.check_warehouse(session, warehouse_id)
+                    for warehouse_id in partitions
+                }
+
+        drifted = {warehouse_id: drift for warehouse_id, drift in results.items() if drift}
+
+        if rebuild:
+            for warehouse_id in drifted:
+                with Session(get_engine()) as session:
+                    rows = self.rebuild_warehouse(session, warehouse_id)
+                    session.commit()
+                logger.info(f'أعيد بناء أرصدة المخزن {warehouse_id}: {rows} سجل')
+
+        return drifted
+
+
+def main(argv=None):
+    """Command line entry point: python -m services.reconciliation"""
+    import argparse
+    from utils.logging import setup_logging
+
+    parser = argparse.ArgumentParser(description='Reconcile stock balances with the inventory ledger')
+    parser.add_argument('--company', type=int, help='Company ID')
+    parser.add_argument('--warehouse', type=int, action='append', help='Warehouse ID (repeatable)')
+    parser.add_argument('--workers', type=int, help='Worker processes')
+    parser.add_argument('--rebuild', action='store_true', help='Rewrite balances with drift')
+    args = parser.parse_args(argv)
+
+    setup_logging()
+
+    drifted = StockReconciliationService().reconcile(
+        company_id=args.company,
+        warehouse_ids=args.warehouse,
+        rebuild=args.rebuild,
+        workers=args.workers
+    )
+
+    for warehouse_id, drift in drifted.items():
+        for entry in drift:
+            logger.warning(
+                f"مخزن {warehouse_id} صنف {entry['item_id']} موقع {entry['location_id']} "
+                f"تشغيلة {entry['lot_id']} مسلسل {entry['serial_id']}: "
+                f"الدفتر ({entry['ledger_qty']} / {entry['ledger_value']}) "
+                f"الرصيد ({entry['balance_qty']} / {entry['balance_value']})"
+            )
+
+    if not drifted:
+        logger.info('الأرصدة مطابقة لدفتر الحركة')
+
+    return 1 if drifted and not args.rebuild else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
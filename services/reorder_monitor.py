@@ -0,0 +1,286 @@
+"""
+Reorder monitor service - Threshold crossings detected at posting time
+خدمة مراقبة إعادة الطلب - رصد تجاوز حدود المخزون عند الترحيل
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import delete, event, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from data import (
+    DocumentHeader, InventoryLedger, Item, ItemStockTotal, ReorderEvent,
+    StockBalance, UOM, upsert_increment
+)
+from utils.logging import get_logger
+
+logger = get_logger('reorder_monitor')
+
+# Item column of each monitored threshold
+THRESHOLDS = {
+    'REORDER_POINT': 'reorder_point',
+    'MIN_QTY': 'min_qty',
+    'SAFETY_STOCK': 'safety_stock',
+}
+
+DIRECTION_BELOW = 'BELOW'
+DIRECTION_RECOVERED = 'RECOVERED'
+
+# session.info key holding events raised in the current transaction
+PENDING_KEY = 'reorder_events'
+
+_subscribers: List[Callable[[Dict], None]] = []
+
+
+class ReorderMonitorService:
+    """
+    Service for monitoring reorder thresholds
+
+    Posting keeps item_stock_totals (on-hand of each item over all
+    warehouses) up to date. When a posting moves an item to or below its
+    reorder point, minimum or safety stock - or back above it - a
+    reorder_events row is queued and, once the transaction commits,
+    subscribers are called with the event so the UI can alert without
+    polling.
+    """
+
+    @staticmethod
+    def subscribe(callback: Callable[[Dict], None]):
+        """Call a function with each committed reorder event"""
+        if callback not in _subscribers:
+            _subscribers.append(callback)
+
+    @staticmethod
+    def unsubscribe(callback: Callable[[Dict], None]):
+        """Stop calling a subscribed function"""
+        if callback in _subscribers:
+            _subscribers.remove(callback)
+
+    def apply(self, session: Session, document: DocumentHeader,
+              entries: List[InventoryLedger]):
+        """Update item totals and queue threshold crossings of a posted document"""
+        deltas: Dict[int, Decimal] = defaultdict(Decimal)
+        for entry in entries:
+            deltas[entry.item_id] += Decimal(entry.qty_in or 0) - Decimal(entry.qty_out or 0)
+
+        deltas = {item_id: delta for item_id, delta in deltas.items() if delta}
+        if not deltas:
+            return
+
+        upsert_increment(
+            session, ItemStockTotal, ('company_id', 'item_id'),
+            [
+                {'company_id': document.company_id, 'item_id': item_id, 'on_hand_qty': delta}
+                for item_id, delta in deltas.items()
+            ],
+            ('on_hand_qty',)
+        )
+
+        rows = session.query(
+            ItemStockTotal.item_id,
+            ItemStockTotal.on_hand_qty,
+            Item.reorder_point,
+            Item.min_qty,
+            Item.safety_stock
+        ).join(
+            Item, Item.id == ItemStockTotal.item_id
+        ).filter(
+            ItemStockTotal.company_id == document.company_id,
+            ItemStockTotal.item_id.in_(deltas)
+        )
+
+        events = []
+        for row in rows:
+            after = Decimal(row.on_hand_qty or 0)
+            before = after - deltas[row.item_id]
+
+            for threshold, column in THRESHOLDS.items():
+                limit = Decimal(getattr(row, column) or 0)
+                if limit <= 0 or (before <= limit) == (after <= limit):
+                    continue
+
+                events.append({
+                    'company_id': document.company_id,
+                    'item_id': row.item_id,
+                    'threshold': threshold,
+                    'direction': DIRECTION_BELOW if after <= limit else DIRECTION_RECOVERED,
+                    'threshold_qty': limit,
+                    'qty_before': before,
+                    'qty_after': after,
+                    'document_id': document.id,
+                })
+
+        if events:
+            session.execute(insert(ReorderEvent), events)
+            session.info.setdefault(PENDING_KEY, []).extend(events)
+
+    def below_reorder_point(self, session: Session, company_id: int,
+                            item_ids: Optional[Iterable[int]] = None) -> Set[int]:
+        """
+        Items whose total on-hand is at or below their reorder point
+
+        Args:
+            session: Database session
+            company_id: Company ID
+            item_ids: Items to check (all stocked items when omitted)
+
+        Returns:
+            Set of item IDs
+        """
+        query = session.query(ItemStockTotal.item_id).join(
+            Item, Item.id == ItemStockTotal.item_id
+        ).filter(
+            ItemStockTotal.company_id == company_id,
+            Item.reorder_point > 0,
+            ItemStockTotal.on_hand_qty <= Item.reorder_point
+        )
+
+        if item_ids is not None:
+            item_ids = list(item_ids)
+            if not item_ids:
+                return set()
+            query = query.filter(ItemStockTotal.item_id.in_(item_ids))
+
+        return {row.item_id for row in query}
+
+    def reorder_list(self, session: Session, company_id: int) -> List[Dict]:
+        """
+        Items at or below reorder point with suggested order quantities
+
+        Returns:
+            List of dicts with item, current and threshold quantities and
+            order_qty (up to max_qty, at least up to the reorder point)
+        """
+        query = session.query(
+            Item.id,
+            Item.code,
+            Item.name_ar,
+            Item.name_en,
+            Item.reorder_point,
+            Item.min_qty,
+            Item.max_qty,
+            Item.safety_stock,
+            UOM.code.label('uom'),
+            ItemStockTotal.on_hand_qty
+        ).join(
+            Item, Item.id == ItemStockTotal.item_id
+        ).join(
+            UOM, Item.base_uom_id == UOM.id
+        ).filter(
+            ItemStockTotal.company_id == company_id,
+            Item.reorder_point > 0,
+            ItemStockTotal.on_hand_qty <= Item.reorder_point
+        ).order_by(Item.code)
+
+        results = []
+        for row in query.all():
+            current = Decimal(row.on_hand_qty or 0)
+            target = max(Decimal(row.max_qty or 0), Decimal(row.reorder_point))
+
+            results.append({
+                'item_id': row.id,
+                'item_code': row.code,
+                'item_name_ar': row.name_ar,
+                'item_name_en': row.name_en,
+                'uom': row.uom,
+                'current_qty': current,
+                'reorder_point': Decimal(row.reorder_point),
+                'min_qty': Decimal(row.min_qty or 0),
+                'max_qty': Decimal(row.max_qty or 0),
+                'safety_stock': Decimal(row.safety_stock or 0),
+                'order_qty': max(target - current, Decimal(0)),
+            })
+
+        return results
+
+    def pending_events(self, session: Session, company_id: int,
+                       limit: Optional[int] = None) -> List[ReorderEvent]:
+        """Unprocessed reorder events of a company, oldest first"""
+        query = session.query(ReorderEvent).filter(
+            ReorderEvent.company_id == company_id,
+            ReorderEvent.processed_at.is_(None)
+        ).order_by(ReorderEvent.id)
+
+        if limit:
+            query = query.limit(limit)
+
+        return query.all()
+
+    def mark_processed(self, session: Session, event_ids: List[int],
+                       user_id: Optional[int] = None) -> int:
+        """
+        Remove events from the pending queue
+
+        Returns:
+            Number of events marked
+        """
+        if not event_ids:
+            return 0
+
+        result = session.execute(
+            update(ReorderEvent).where(
+                ReorderEvent.id.in_(event_ids),
+                ReorderEvent.processed_at.is_(None)
+            ).values(processed_at=datetime.utcnow(), processed_by=user_id)
+        )
+
+        return result.rowcount
+
+    def rebuild(self, session: Session, company_id: int,
+                item_ids: Optional[Iterable[int]] = None) -> int:
+        """
+        Recompute item totals of a company from stock balances
+
+        Args:
+            session: Database session
+            company_id: Company ID
+            item_ids: Limit to some items (e.g. after their balances were
+                rebuilt); all items when omitted
+
+        Returns:
+            Number of item total rows written
+        """
+        totals = delete(ItemStockTotal).where(ItemStockTotal.company_id == company_id)
+        balances = select(
+            StockBalance.company_id,
+            StockBalance.item_id,
+            func.sum(StockBalance.on_hand_qty)
+        ).where(
+            StockBalance.company_id == company_id
+        ).group_by(StockBalance.company_id, StockBalance.item_id)
+
+        if item_ids is not None:
+            item_ids = list(item_ids)
+            totals = totals.where(ItemStockTotal.item_id.in_(item_ids))
+            balances = balances.where(StockBalance.item_id.in_(item_ids))
+
+        session.execute(totals)
+        result = session.execute(
+            insert(ItemStockTotal).from_select(['company_id', 'item_id', 'on_hand_qty'], balances)
+        )
+
+        return result.rowcount
+
+
+@event.listens_for(Session, 'after_commit')
+def _dispatch_events(session: Session):
+    """Call subscribers with the events of a committed transaction"""
+    events = session.info.pop(PENDING_KEY, None)
+    if not events:
+        return
+
+    for reorder_event in events:
+        for callback in list(_subscribers):
+            try:
+                callback(reorder_event)
+            except Exception as e:
+                logger.error(f'Reorder subscriber failed: {e}')
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_events(session: Session, previous_transaction):
+    """Drop events of a rolled back transaction"""
+    session.info.pop(PENDING_KEY, None)
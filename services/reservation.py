@@ -0,0 +1,309 @@
+"""
+Reservation service - Stock held by submitted and approved documents
+خدمة الحجز - الكميات المحجوزة للمستندات المقدمة والمعتمدة
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert
+from sqlalchemy.orm import Session, selectinload
+
+from data import (
+    DocumentHeader, DocumentStatus, InventoryLedger, ReservedStock,
+    StockBalance, StockReservation, upsert_increment
+)
+from services.validation import ISSUING_TYPES
+
+# lot_key of reservations not tied to a lot
+NO_LOT = 0
+
+RESERVED_KEY = ('company_id', 'warehouse_id', 'item_id', 'lot_key')
+
+# (item_id, warehouse_id, lot_id or None)
+AvailabilityKey = Tuple[int, int, Optional[int]]
+
+
+class ReservationError(Exception):
+    """خطأ في حجز المخزون"""
+    pass
+
+
+class ReservationService:
+    """
+    Service for stock reservations and available-to-promise
+
+    Submitting an issuing document reserves its quantities; approving keeps
+    them, and posting or cancelling releases them. Totals per warehouse,
+    item and lot are kept in reserved_stock by incremental upserts, so
+    available = on hand - reserved is two indexed lookups.
+
+    Item-level availability counts every reservation of the item; lot-level
+    availability counts only reservations made for that lot.
+    """
+
+    def submit(self, session: Session, document_id: int, user_id: int) -> DocumentHeader:
+        """
+        Submit a draft document, reserving its stock
+
+        Raises:
+            ReservationError: If the document is not a draft or stock is short
+        """
+        document = self._get_document(session, document_id)
+        if document.status != DocumentStatus.DRAFT:
+            raise ReservationError(f'لا يمكن تقديم المستند {document.doc_no}: ليس مسودة')
+
+        self.reserve(session, document)
+
+        document.status = DocumentStatus.SUBMITTED
+        document.submitted_by = user_id
+        document.submitted_at = datetime.utcnow()
+
+        return document
+
+    def approve(self, session: Session, document_id: int, user_id: int) -> DocumentHeader:
+        """
+        Approve a submitted document (its reservation is kept)
+
+        Raises:
+            ReservationError: If the document is not submitted or stock is short
+        """
+        document = self._get_document(session, document_id)
+        if document.status != DocumentStatus.SUBMITTED:
+            raise ReservationError(f'لا يمكن اعتماد المستند {document.doc_no}: لم يتم تقديمه')
+
+        if not self._is_reserved(session, document.id):
+            self.reserve(session, document)
+
+        document.status = DocumentStatus.APPROVED
+        document.approved_by = user_id
+        document.approved_at = datetime.utcnow()
+
+        return document
+
+    def cancel(self, session: Session, document_id: int) -> DocumentHeader:
+        """
+        Cancel an unposted document, releasing its reservation
+
+        Raises:
+            ReservationError: If the document is posted
+        """
+        document = self._get_document(session, document_id)
+        if document.status in (DocumentStatus.POSTED, DocumentStatus.REVERSED):
+            raise ReservationError(f'لا يمكن إلغاء المستند {document.doc_no}: مُرحّل')
+
+        self.release(session, document)
+        document.status = DocumentStatus.CANCELLED
+
+        return document
+
+    def reserve(self, session: Session, document: DocumentHeader, check: bool = True):
+        """
+        Reserve the stock a document will issue
+
+        Args:
+            session: Database session
+            document: Document with lines
+            check: Reject the reservation if any quantity is not available
+
+        Raises:
+            ReservationError: If check is set and stock is short
+        """
+        demand = self._demand(document)
+        if not demand:
+            return
+
+        if check:
+            shortages = self.shortages(session, document)
+            if shortages:
+                short = shortages[0]
+                raise ReservationError(
+                    f'الكمية المتاحة للصنف {short["item_id"]} غير كافية: '
+                    f'المطلوب {short["required"]}، المتاح {short["available"]}'
+                )
+
+        rows = [
+            {
+                'company_id': document.company_id,
+                'warehouse_id': warehouse_id,
+                'item_id': item_id,
+                'lot_key': lot_key,
+                'qty': qty,
+            }
+            for (warehouse_id, item_id, lot_key), qty in demand.items()
+        ]
+        session.execute(insert(StockReservation), [dict(row, doc_id=document.id) for row in rows])
+        upsert_increment(session, ReservedStock, RESERVED_KEY, [
+            {
+                'company_id': row['company_id'],
+                'warehouse_id': row['warehouse_id'],
+                'item_id': row['item_id'],
+                'lot_key': row['lot_key'],
+                'reserved_qty': row['qty'],
+            }
+            for row in rows
+        ], ('reserved_qty',))
+
+    def release(self, session: Session, document: DocumentHeader):
+        """Release a document's reservation, if any"""
+        rows = session.query(StockReservation).filter(
+            StockReservation.doc_id == document.id
+        ).all()
+        if not rows:
+            return
+
+        upsert_increment(session, ReservedStock, RESERVED_KEY, [
+            {
+                'company_id': row.company_id,
+                'warehouse_id': row.warehouse_id,
+                'item_id': row.item_id,
+                'lot_key': row.lot_key,
+                'reserved_qty': -row.qty,
+            }
+            for row in rows
+        ], ('reserved_qty',))
+
+        session.execute(delete(StockReservation).where(StockReservation.doc_id == document.id))
+
+    def apply(self, session: Session, document: DocumentHeader,
+              entries: List[InventoryLedger]):
+        """Release the reservation of a posted document"""
+        # Only submitted documents can hold a reservation
+        if document.submitted_at is not None:
+            self.release(session, document)
+
+    def available(self, session: Session, item_id: int, warehouse_id: int,
+                  lot_id: Optional[int] = None) -> Decimal:
+        """Quantity available to promise (on hand less reserved)"""
+        key = (item_id, warehouse_id, lot_id)
+        return self.available_bulk(session, [key])[key]
+
+    def available_bulk(self, session: Session,
+                       keys: Iterable[AvailabilityKey]) -> Dict[AvailabilityKey, Decimal]:
+        """
+        Quantities available to promise for many keys (two grouped queries)
+
+        Args:
+            session: Database session
+            keys: (item_id, warehouse_id, lot_id) tuples; lot_id None for
+                the whole item
+
+        Returns:
+            Dict of key -> available quantity
+        """
+        keys = set(keys)
+        if not keys:
+            return {}
+
+        item_ids = {key[0] for key in keys}
+        warehouse_ids = {key[1] for key in keys}
+
+        on_hand = defaultdict(Decimal)
+        for row in session.query(
+            StockBalance.item_id,
+            StockBalance.warehouse_id,
+            StockBalance.lot_id,
+            func.sum(StockBalance.on_hand_qty).label('qty')
+        ).filter(
+            StockBalance.item_id.in_(item_ids),
+            StockBalance.warehouse_id.in_(warehouse_ids)
+        ).group_by(StockBalance.item_id, StockBalance.warehouse_id, StockBalance.lot_id):
+            qty = Decimal(row.qty or 0)
+            on_hand[(row.item_id, row.warehouse_id, None)] += qty
+            if row.lot_id:
+                on_hand[(row.item_id, row.warehouse_id, row.lot_id)] += qty
+
+        reserved = defaultdict(Decimal)
+        for row in session.query(
+            ReservedStock.item_id,
+            ReservedStock.warehouse_id,
+            ReservedStock.lot_key,
+            ReservedStock.reserved_qty
+        ).filter(
+            ReservedStock.item_id.in_(item_ids),
+            ReservedStock.warehouse_id.in_(warehouse_ids)
+        ):
+            qty = Decimal(row.reserved_qty or 0)
+            reserved[(row.item_id, row.warehouse_id, None)] += qty
+            if row.lot_key != NO_LOT:
+                reserved[(row.item_id, row.warehouse_id, row.lot_key)] += qty
+
+        return {key: on_hand[key] - reserved[key] for key in keys}
+
+    def shortages(self, session: Session, document: DocumentHeader) -> List[Dict]:
+        """
+        Check a whole document against available stock
+
+        The document's own reservation, if any, counts as available to it.
+
+        Returns:
+            List of dicts with item_id, warehouse_id, lot_id, required and
+            available, one per short key (empty if the document fits)
+        """
+        demand = self._demand(document)
+        if not demand:
+            return []
+
+        required: Dict[AvailabilityKey, Decimal] = defaultdict(Decimal)
+        for (warehouse_id, item_id, lot_key), qty in demand.items():
+            required[(item_id, warehouse_id, None)] += qty
+            if lot_key != NO_LOT:
+                required[(item_id, warehouse_id, lot_key)] += qty
+
+        available = self.available_bulk(session, required)
+
+        for row in session.query(StockReservation).filter(StockReservation.doc_id == document.id):
+            for key in ((row.item_id, row.warehouse_id, None), (row.item_id, row.warehouse_id, row.lot_key)):
+                if key in available:
+                    available[key] += row.qty
+
+        return [
+            {
+                'item_id': key[0],
+                'warehouse_id': key[1],
+                'lot_id': key[2],
+                'required': qty,
+                'available': available[key],
+            }
+            for key, qty in sorted(required.items(), key=lambda pair: (pair[0][0], pair[0][1], pair[0][2] or 0))
+            if qty > available[key]
+        ]
+
+    def rebuild(self, session: Session, company_id: int):
+        """Recreate all reservations of a company from its open documents"""
+        session.execute(delete(StockReservation).where(StockReservation.company_id == company_id))
+        session.execute(delete(ReservedStock).where(ReservedStock.company_id == company_id))
+
+        documents = session.query(DocumentHeader).options(
+            selectinload(DocumentHeader.lines)
+        ).filter(
+            DocumentHeader.company_id == company_id,
+            DocumentHeader.status.in_((DocumentStatus.SUBMITTED, DocumentStatus.APPROVED))
+        ).order_by(DocumentHeader.id).all()
+
+        for document in documents:
+            self.reserve(session, document, check=False)
+
+    def _demand(self, document: DocumentHeader) -> Dict[Tuple[int, int, int], Decimal]:
+        """Quantities a document issues per (warehouse, item, lot_key)"""
+        if document.doc_type.value not in ISSUING_TYPES or not document.from_warehouse_id:
+            return {}
+
+        demand = defaultdict(Decimal)
+        for line in document.lines:
+            demand[(document.from_warehouse_id, line.item_id, line.lot_id or NO_LOT)] += Decimal(line.base_qty)
+
+        return {key: qty for key, qty in demand.items() if qty > 0}
+
+    def _is_reserved(self, session: Session, document_id: int) -> bool:
+        return session.query(StockReservation.id).filter(
+            StockReservation.doc_id == document_id
+        ).first() is not None
+
+    def _get_document(self, session: Session, document_id: int) -> DocumentHeader:
+        document = session.query(DocumentHeader).filter_by(id=document_id).first()
+        if not document:
+            raise ReservationError(f'المستند رقم {document_id} غير موجود')
+        return document
@@ -0,0 +1,227 @@
+"""
+Capacity scheduling service - Finite-capacity scheduling of production orders
+خدمة جدولة الطاقة الإنتاجية - جدولة أوامر الإنتاج بطاقة محدودة
+"""
+
+import heapq
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from data import ProductionOrder, Routing, RoutingStep, WorkCenter
+
+# Production orders that take work-center capacity
+SCHEDULABLE_STATUSES = ('RELEASED', 'IN_PROGRESS')
+
+
+class SchedulingError(Exception):
+    """خطأ في جدولة الطاقة الإنتاجية"""
+    pass
+
+
+class _WorkCenterCalendar:
+    """Remaining hours per day of one work center"""
+
+    def __init__(self, capacity_per_day: Optional[Decimal], start_date: date,
+                 non_working_weekdays: Iterable[int]):
+        self.capacity = Decimal(capacity_per_day or 0)
+        self.start_date = start_date
+        self.non_working_weekdays = set(non_working_weekdays)
+        self.remaining: List[Decimal] = []
+        # Days before this index are fully booked
+        self.first_free = 0
+
+    def _ensure(self, day: int):
+        while len(self.remaining) <= day:
+            current = self.start_date + timedelta(days=len(self.remaining))
+            if current.weekday() in self.non_working_weekdays:
+                self.remaining.append(Decimal(0))
+            else:
+                self.remaining.append(self.capacity)
+
+    def book(self, earliest: int, hours: Decimal) -> tuple:
+        """
+        Book hours starting no earlier than a day
+
+        Returns:
+            Tuple of (first day used, last day used)
+        """
+        # Unconstrained work center or nothing to book
+        if self.capacity <= 0 or hours <= 0:
+            return earliest, earliest
+
+        day = max(earliest, self.first_free)
+        first_day = None
+
+        while True:
+            self._ensure(day)
+            available = self.remaining[day]
+
+            if available > 0:
+                if first_day is None:
+                    first_day = day
+                take = min(available, hours)
+                self.remaining[day] -= take
+                hours -= take
+
+            while self.first_free < len(self.remaining) and self.remaining[self.first_free] <= 0:
+                self.first_free += 1
+
+            if hours <= 0:
+                return first_day, day
+
+            day += 1
+
+
+class CapacitySchedulerService:
+    """Service for scheduling production orders on work centers"""
+
+    def schedule(self, session: Session, company_id: int,
+                 start_date: Optional[date] = None,
+                 non_working_weekdays: Iterable[int] = (),
+                 write_back: bool = True) -> List[Dict]:
+        """
+        Schedule all released production orders with finite capacity
+
+        Orders are taken from a priority queue (earliest requested completion
+        first, then order date) and their routing steps are booked in
+        sequence into day buckets of each work center. A step starts no
+        earlier than the day the previous step finishes.
+
+        Args:
+            session: Database session
+            company_id: Company ID
+            start_date: First schedulable day (defaults to today)
+            non_working_weekdays: Weekdays without capacity (0 = Monday)
+            write_back: Store the planned start and end dates on the orders
+                (start_date and planned_end_date; the requested completion
+                date is left unchanged)
+
+        Returns:
+            List of dicts with order_id, start_date, planned_end_date and steps
+
+        Raises:
+            SchedulingError: If every weekday is a non-working day
+        """
+        if start_date is None:
+            start_date = date.today()
+
+        non_working_weekdays = set(non_working_weekdays)
+        if set(range(7)) <= non_working_weekdays:
+            raise SchedulingError("لا توجد أيام عمل في الأسبوع لجدولة أوامر الإنتاج")
+
+        orders = session.query(
+            ProductionOrder.id,
+            ProductionOrder.bom_id,
+            ProductionOrder.po_date,
+            ProductionOrder.completion_date,
+            ProductionOrder.planned_qty,
+            ProductionOrder.produced_qty
+        ).filter(
+            ProductionOrder.company_id == company_id,
+            ProductionOrder.status.in_(SCHEDULABLE_STATUSES)
+        ).all()
+
+        if not orders:
+            return []
+
+        steps_by_bom = self._load_steps(session, {order.bom_id for order in orders})
+
+        calendars = {
+            work_center.id: _WorkCenterCalendar(
+                work_center.capacity_per_day, start_date, non_working_weekdays
+            )
+            for work_center in session.query(
+                WorkCenter.id, WorkCenter.capacity_per_day
+            ).filter(WorkCenter.company_id == company_id)
+        }
+
+        queue = [
+            (order.completion_date or date.max, order.po_date, order.id, order)
+            for order in orders
+        ]
+        heapq.heapify(queue)
+
+        results = []
+        while queue:
+            order = heapq.heappop(queue)[-1]
+            qty = Decimal(order.planned_qty) - Decimal(order.produced_qty or 0)
+
+            ready = max((order.po_date - start_date).days, 0)
+            first_day = None
+            step_results = []
+
+            for step in steps_by_bom.get(order.bom_id, ()):
+                hours = Decimal(step.setup_time or 0) + Decimal(step.run_time or 0) * max(qty, Decimal(0))
+                calendar = calendars.get(step.work_center_id)
+
+                if calendar is None:
+                    step_start, step_end = ready, ready
+                else:
+                    step_start, step_end = calendar.book(ready, hours)
+
+                if first_day is None:
+                    first_day = step_start
+                ready = step_end
+
+                step_results.append({
+                    'step_no': step.step_no,
+                    'work_center_id': step.work_center_id,
+                    'hours': hours,
+                    'start_date': start_date + timedelta(days=step_start),
+                    'end_date': start_date + timedelta(days=step_end),
+                })
+
+            if first_day is None:
+                first_day = ready
+
+            results.append({
+                'order_id': order.id,
+                'start_date': start_date + timedelta(days=first_day),
+                'planned_end_date': start_date + timedelta(days=ready),
+                'steps': step_results,
+            })
+
+        if write_back:
+            session.execute(
+                update(ProductionOrder),
+                [
+                    {
+                        'id': result['order_id'],
+                        'start_date': result['start_date'],
+                        'planned_end_date': result['planned_end_date'],
+                    }
+                    for result in results
+                ]
+            )
+
+        return results
+
+    def _load_steps(self, session: Session, bom_ids) -> Dict[int, List]:
+        """Routing steps of the first active routing per BOM (one query)"""
+        rows = session.query(
+            Routing.bom_id,
+            Routing.id.label('routing_id'),
+            RoutingStep.step_no,
+            RoutingStep.work_center_id,
+            RoutingStep.setup_time,
+            RoutingStep.run_time
+        ).join(
+            RoutingStep, RoutingStep.routing_id == Routing.id
+        ).filter(
+            Routing.bom_id.in_(bom_ids),
+            Routing.is_active == True  # noqa: E712
+        ).order_by(Routing.bom_id, Routing.id, RoutingStep.step_no).all()
+
+        steps_by_bom: Dict[int, List] = {}
+        routing_of_bom = {}
+
+        for row in rows:
+            if routing_of_bom.setdefault(row.bom_id, row.routing_id) != row.routing_id:
+                continue
+            steps_by_bom.setdefault(row.bom_id, []).append(row)
+
+        return steps_by_bom
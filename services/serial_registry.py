@@ -0,0 +1,249 @@
+"""
+Serial registry service - Current state of each serial number
+خدمة سجل الأرقام التسلسلية - الحالة الحالية لكل رقم تسلسلي
+"""
+
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import delete, insert, select, true, false, update
+from sqlalchemy.orm import Session
+
+from data import DocumentHeader, InventoryLedger, Serial, SerialStatus, StockBalance
+
+
+class SerialRegistryError(Exception):
+    """خطأ في سجل الأرقام التسلسلية"""
+    pass
+
+
+class SerialRegistryService:
+    """
+    Service for the serial number registry
+
+    serial_status holds one row per serial with its warehouse, location
+    and whether it is in stock. Posting moves serials out with a
+    conditional UPDATE (only rows still in stock in the issuing warehouse
+    match), so a serial cannot be issued twice even by concurrent
+    postings; a second receipt of a serial already in stock is rejected.
+    Databases holding serial stock from before the registry need one
+    rebuild().
+    """
+
+    def apply(self, session: Session, document: DocumentHeader,
+              entries: List[InventoryLedger]):
+        """
+        Move the serials of a posted document
+
+        Raises:
+            SerialRegistryError: If a serial is issued while not in stock in
+                the warehouse, or received while already in stock
+        """
+        outs: Dict[int, Set[int]] = defaultdict(set)  # warehouse -> serials
+        ins: Dict[int, InventoryLedger] = {}
+
+        # Reversal entries carry negative quantities and move the other way
+        for entry in entries:
+            if not entry.serial_id:
+                continue
+            qty_in = entry.qty_in or 0
+            qty_out = entry.qty_out or 0
+            if qty_out > 0 or qty_in < 0:
+                outs[entry.warehouse_id].add(entry.serial_id)
+            if qty_in > 0 or qty_out < 0:
+                ins[entry.serial_id] = entry
+
+        if not outs and not ins:
+            return
+
+        issued = set().union(*outs.values()) if outs else set()
+
+        for warehouse_id, serial_ids in outs.items():
+            missing = self.unavailable(session, warehouse_id, serial_ids)
+            if missing:
+                raise SerialRegistryError(
+                    f'الأرقام التسلسلية غير متوفرة في المخزن: {self._numbers(session, missing)}'
+                )
+
+            # Matches only rows still in stock, so a concurrent issue of the
+            # same serial leaves this update short
+            result = session.execute(
+                update(SerialStatus).where(
+                    SerialStatus.serial_id.in_(serial_ids),
+                    SerialStatus.warehouse_id == warehouse_id,
+                    SerialStatus.in_stock == true()
+                ).values(in_stock=False, last_doc_id=document.id).execution_options(
+                    synchronize_session=False
+                )
+            )
+            if result.rowcount != len(serial_ids):
+                raise SerialRegistryError('تم صرف بعض الأرقام التسلسلية بمستند آخر')
+
+        if not ins:
+            return
+
+        existing = {
+            row.serial_id: row
+            for row in session.query(
+                SerialStatus.id, SerialStatus.serial_id, SerialStatus.in_stock
+            ).filter(
+                SerialStatus.serial_id.in_(ins)
+            ).with_for_update()
+        }
+
+        duplicates = {
+            serial_id for serial_id, row in existing.items()
+            if row.in_stock and serial_id not in issued
+        }
+        if duplicates:
+            raise SerialRegistryError(
+                f'الأرقام التسلسلية موجودة بالمخزون بالفعل: {self._numbers(session, duplicates)}'
+            )
+
+        updates, inserts = [], []
+        for serial_id, entry in ins.items():
+            values = {
+                'in_stock': True,
+                'warehouse_id': entry.warehouse_id,
+                'location_id': entry.location_id,
+                'last_doc_id': document.id,
+            }
+            if serial_id in existing:
+                updates.append(dict(values, id=existing[serial_id].id))
+            else:
+                inserts.append(dict(values, company_id=document.company_id,
+                                    serial_id=serial_id, item_id=entry.item_id))
+
+        if updates:
+            session.execute(update(SerialStatus), updates)
+        if inserts:
+            session.execute(insert(SerialStatus), inserts)
+
+    def unavailable(self, session: Session, warehouse_id: int,
+                    serial_ids: Iterable[int]) -> Set[int]:
+        """Serials of a batch that are not in stock in a warehouse (one query)"""
+        serial_ids = set(serial_ids)
+        if not serial_ids:
+            return set()
+
+        return serial_ids - self._in_stock(session, serial_ids, warehouse_id)
+
+    def lookup(self, session: Session, company_id: int,
+               serial_numbers: Iterable[str],
+               item_id: Optional[int] = None) -> Dict[str, Dict]:
+        """
+        Look up a batch of scanned serial numbers (one query)
+
+        Returns:
+            Dict of serial number to serial_id, item_id, in_stock,
+            warehouse_id and location_id; unknown numbers are omitted
+        """
+        serial_numbers = set(serial_numbers)
+        if not serial_numbers:
+            return {}
+
+        query = session.query(
+            Serial.id,
+            Serial.serial_number,
+            Serial.item_id,
+            SerialStatus.in_stock,
+            SerialStatus.warehouse_id,
+            SerialStatus.location_id
+        ).outerjoin(
+            SerialStatus, SerialStatus.serial_id == Serial.id
+        ).filter(
+            Serial.company_id == company_id,
+            Serial.serial_number.in_(serial_numbers)
+        )
+
+        if item_id:
+            query = query.filter(Serial.item_id == item_id)
+
+        return {
+            row.serial_number: {
+                'serial_id': row.id,
+                'item_id': row.item_id,
+                'in_stock': bool(row.in_stock),
+                'warehouse_id': row.warehouse_id,
+                'location_id': row.location_id,
+            }
+            for row in query
+        }
+
+    def rebuild(self, session: Session, company_id: int,
+                item_ids: Optional[Iterable[int]] = None) -> int:
+        """
+        Rebuild the registry of a company from stock balances
+
+        Args:
+            session: Database session
+            company_id: Company ID
+            item_ids: Limit to the serials of some items (e.g. after their
+                balances were rebuilt); all serials when omitted
+
+        Returns:
+            Number of serials in stock
+        """
+        registry = delete(SerialStatus).where(SerialStatus.company_id == company_id)
+        balances = select(
+            StockBalance.company_id,
+            StockBalance.serial_id,
+            StockBalance.item_id,
+            true(),
+            StockBalance.warehouse_id,
+            StockBalance.location_id
+        ).where(
+            StockBalance.company_id == company_id,
+            StockBalance.serial_id.isnot(None),
+            StockBalance.on_hand_qty > 0
+        )
+        serials = select(
+            Serial.company_id,
+            Serial.id,
+            Serial.item_id,
+            false()
+        ).where(
+            Serial.company_id == company_id,
+            Serial.id.notin_(
+                select(SerialStatus.serial_id).where(SerialStatus.company_id == company_id)
+            )
+        )
+
+        if item_ids is not None:
+            item_ids = list(item_ids)
+            registry = registry.where(SerialStatus.item_id.in_(item_ids))
+            balances = balances.where(StockBalance.item_id.in_(item_ids))
+            serials = serials.where(Serial.item_id.in_(item_ids))
+
+        session.execute(registry)
+        in_stock = session.execute(
+            insert(SerialStatus).from_select(
+                ['company_id', 'serial_id', 'item_id', 'in_stock', 'warehouse_id', 'location_id'],
+                balances
+            )
+        )
+        session.execute(
+            insert(SerialStatus).from_select(['company_id', 'serial_id', 'item_id', 'in_stock'], serials)
+        )
+
+        return in_stock.rowcount
+
+    def _in_stock(self, session: Session, serial_ids: Set[int],
+                  warehouse_id: int) -> Set[int]:
+        """Serials of a set that are in stock in a warehouse"""
+        return {
+            row.serial_id for row in session.query(SerialStatus.serial_id).filter(
+                SerialStatus.serial_id.in_(serial_ids),
+                SerialStatus.warehouse_id == warehouse_id,
+                SerialStatus.in_stock == true()
+            )
+        }
+
+    def _numbers(self, session: Session, serial_ids: Set[int]) -> str:
+        """Serial numbers of some serial IDs, for error messages"""
+        numbers = [
+            row.serial_number for row in session.query(Serial.serial_number).filter(
+                Serial.id.in_(serial_ids)
+            ).order_by(Serial.serial_number)
+        ]
+        return ', '.join(numbers[:20]) + (' ...' if len(numbers) > 20 else '')
@@ -0,0 +1,462 @@
+"""
+Stock count service - Freeze, count import, variances and adjustment
+خدمة الجرد - تجميد الأرصدة واستيراد الجرد وحساب الفروقات والتسوية
+"""
+
+import csv
+from collections import defaultdict
+from datetime import datetime, date
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func, insert, literal, select, update, null
+from sqlalchemy.orm import Session
+
+from data import (
+    StockCount, StockCountLine, StockBalance, DocumentHeader, DocumentLine,
+    DocumentStatus, DocumentType, Item, Barcode, Location, Lot, Serial,
+    ItemCountStat, session_scope
+)
+from services.posting import PostingService
+from services.costing import CostingService
+from services.numbering import DocumentNumberingService
+from config import EXCEL_CONFIG
+
+
+class StockCountError(Exception):
+    """خطأ في الجرد"""
+    pass
+
+
+class StockCountService:
+    """Service for running stock counts"""
+
+    def __init__(self):
+        self.posting_service = PostingService()
+        self.numbering_service = DocumentNumberingService()
+        self.costing_service = CostingService()
+
+    def freeze(self, session: Session, count_id: int,
+               item_ids: Optional[Iterable[int]] = None,
+               location_ids: Optional[Iterable[int]] = None,
+               include_zero: bool = False) -> int:
+        """
+        Freeze system quantities into the count lines
+
+        Lines are copied from stock_balance with a single INSERT ... SELECT.
+        Counted quantities start empty until counts are imported.
+
+        Args:
+            session: Database session
+            count_id: Stock count ID
+            item_ids: Restrict the count to these items (optional)
+            location_ids: Restrict the count to these locations (optional)
+            include_zero: Also freeze balances with zero on hand
+
+        Returns:
+            Number of lines frozen
+
+        Raises:
+            StockCountError: If the count is not an empty draft
+        """
+        count = self._get_open_count(session, count_id)
+
+        if session.query(StockCountLine.id).filter_by(count_id=count_id).first():
+            raise StockCountError(f'الجرد {count.count_no} مُجمّد بالفعل')
+
+        key_columns = (
+            StockBalance.item_id,
+            StockBalance.location_id,
+            StockBalance.lot_id,
+            StockBalance.serial_id,
+        )
+        system_qty = func.sum(StockBalance.on_hand_qty)
+
+        query = select(
+            literal(count_id),
+            func.row_number().over(order_by=key_columns),
+            *key_columns,
+            system_qty,
+            null(),
+            literal(0),
+        ).where(
+            StockBalance.company_id == count.company_id,
+            StockBalance.warehouse_id == count.warehouse_id
+        ).group_by(*key_columns)
+
+        if item_ids is not None:
+            query = query.where(StockBalance.item_id.in_(list(item_ids)))
+
+        if location_ids is not None:
+            query = query.where(StockBalance.location_id.in_(list(location_ids)))
+
+        if not include_zero:
+            query = query.having(system_qty != 0)
+
+        result = session.execute(
+            insert(StockCountLine).from_select(
+                ['count_id', 'line_no', 'item_id', 'location_id', 'lot_id',
+                 'serial_id', 'system_qty', 'counted_qty', 'variance_qty'],
+                query
+            )
+        )
+
+        return result.rowcount
+
+    def load_scanner_file(self, file_path: str) -> List[Dict]:
+        """
+        Read a scanner export file (CSV)
+
+        Expected columns: barcode or item_code, and optionally location_code,
+        lot_number, serial_number and qty. Rows without qty count as one scan.
+
+        Returns:
+            List of row dicts
+        """
+        rows = []
+        with open(file_path, 'r', encoding=EXCEL_CONFIG['csv_encoding'], newline='') as f:
+            for row in csv.DictReader(f):
+                rows.append({
+                    key.strip().lower(): (value or '').strip()
+                    for key, value in row.items() if key
+                })
+        return rows
+
+    def import_counts(self, session: Session, count_id: int,
+                      rows: Iterable[Dict], replace: bool = False) -> Dict:
+        """
+        Apply counted quantities in bulk
+
+        Codes are resolved with one query per code type, repeated scans of
+        the same key are summed, existing lines are updated with one bulk
+        UPDATE and stock found outside the frozen lines is added with one
+        bulk INSERT.
+
+        Args:
+            session: Database session
+            count_id: Stock count ID
+            rows: Rows as returned by load_scanner_file
+            replace: Replace counted quantities instead of adding to them
+
+        Returns:
+            Dict with updated/added line counts and unknown rows (unresolved
+            codes or unreadable quantities)
+        """
+        count = self._get_open_count(session, count_id)
+        rows = list(rows)
+
+        barcodes = {row.get('barcode') for row in rows if row.get('barcode')}
+        item_codes = {row.get('item_code') for row in rows if row.get('item_code')}
+        location_codes = {row.get('location_code') for row in rows if row.get('location_code')}
+        lot_numbers = {row.get('lot_number') for row in rows if row.get('lot_number')}
+        serial_numbers = {row.get('serial_number') for row in rows if row.get('serial_number')}
+
+        barcode_map = {}
+        if barcodes:
+            barcode_map = dict(session.query(Barcode.barcode, Barcode.item_id).join(
+                Item, Barcode.item_id == Item.id
+            ).filter(
+                Item.company_id == count.company_id,
+                Barcode.barcode.in_(barcodes)
+            ).all())
+
+        item_map = {}
+        if item_codes:
+            item_map = dict(session.query(Item.code, Item.id).filter(
+                Item.company_id == count.company_id,
+                Item.code.in_(item_codes)
+            ).all())
+
+        location_map = {}
+        if location_codes:
+            location_map = dict(session.query(Location.code, Location.id).filter(
+                Location.warehouse_id == count.warehouse_id,
+                Location.code.in_(location_codes)
+            ).all())
+
+        lot_map = {}
+        if lot_numbers:
+            lot_map = {
+                (row.item_id, row.lot_number): row.id
+                for row in session.query(Lot.id, Lot.item_id, Lot.lot_number).filter(
+                    Lot.company_id == count.company_id,
+                    Lot.lot_number.in_(lot_numbers)
+                )
+            }
+
+        serial_map = {}
+        if serial_numbers:
+            serial_map = {
+                (row.item_id, row.serial_number): row.id
+                for row in session.query(Serial.id, Serial.item_id, Serial.serial_number).filter(
+                    Serial.company_id == count.company_id,
+                    Serial.serial_number.in_(serial_numbers)
+                )
+            }
+
+        # Sum scans per count key
+        counted = defaultdict(Decimal)
+        unknown = []
+
+        for row in rows:
+            item_id = barcode_map.get(row.get('barcode')) or item_map.get(row.get('item_code'))
+            location_id = location_map.get(row.get('location_code'))
+            lot_id = lot_map.get((item_id, row.get('lot_number')))
+            serial_id = serial_map.get((item_id, row.get('serial_number')))
+
+            if (not item_id
+                    or (row.get('location_code') and not location_id)
+                    or (row.get('lot_number') and not lot_id)
+                    or (row.get('serial_number') and not serial_id)):
+                unknown.append(row)
+                continue
+
+            try:
+                qty = Decimal(row.get('qty') or 1)
+            except (InvalidOperation, TypeError, ValueError):
+                qty = None
+            if qty is None or not qty.is_finite():
+                unknown.append(row)
+                continue
+
+            counted[(item_id, location_id, lot_id, serial_id)] += qty
+
+        # Match against frozen lines
+        existing = {}
+        max_line_no = 0
+        for line in session.query(
+            StockCountLine.id, StockCountLine.line_no,
+            StockCountLine.item_id, StockCountLine.location_id,
+            StockCountLine.lot_id, StockCountLine.serial_id,
+            StockCountLine.counted_qty
+        ).filter(StockCountLine.count_id == count_id):
+            existing[(line.item_id, line.location_id, line.lot_id, line.serial_id)] = line
+            max_line_no = max(max_line_no, line.line_no)
+
+        updates = []
+        additions = []
+
+        for key, qty in counted.items():
+            line = existing.get(key)
+
+            if line:
+                if not replace and line.counted_qty is not None:
+                    qty += line.counted_qty
+                updates.append({'id': line.id, 'counted_qty': qty})
+            else:
+                max_line_no += 1
+                item_id, location_id, lot_id, serial_id = key
+                additions.append({
+                    'count_id': count_id,
+                    'line_no': max_line_no,
+                    'item_id': item_id,
+                    'location_id': location_id,
+                    'lot_id': lot_id,
+                    'serial_id': serial_id,
+                    'system_qty': Decimal(0),
+                    'counted_qty': qty,
+                    'variance_qty': Decimal(0),
+                })
+
+        if updates:
+            session.execute(update(StockCountLine), updates)
+        if additions:
+            session.execute(insert(StockCountLine), additions)
+
+        return {
+            'updated': len(updates),
+            'added': len(additions),
+            'unknown': unknown,
+        }
+
+    def compute_variances(self, session: Session, count_id: int,
+                          uncounted_as_zero: bool = False) -> int:
+        """
+        Compute variance_qty for all lines with a single UPDATE
+
+        Args:
+            session: Database session
+            count_id: Stock count ID
+            uncounted_as_zero: Treat lines never counted as counted zero
+                (full count) instead of matching the system quantity
+
+        Returns:
+            Number of lines updated
+        """
+        result = session.execute(
+            update(StockCountLine)
+            .where(StockCountLine.count_id == count_id)
+            .values(variance_qty=self._variance(uncounted_as_zero))
+            .execution_options(synchronize_session=False)
+        )
+
+        return result.rowcount
+
+    @staticmethod
+    def _variance(uncounted_as_zero: bool):
+        """SQL expression of a count line's variance"""
+        fallback = literal(0) if uncounted_as_zero else StockCountLine.system_qty
+        return func.coalesce(StockCountLine.counted_qty, fallback) - StockCountLine.system_qty
+
+    def post_count(self, count_id: int, user_id: int,
+                   posting_date: Optional[date] = None,
+                   uncounted_as_zero: bool = False,
+                   reason_code_id: Optional[int] = None) -> Optional[int]:
+        """
+        Post a stock count as a single adjustment document
+
+        Variances are computed, one ADJUSTMENT document is created from the
+        non-zero variance lines and posted through the batch posting path in
+        the same transaction that closes the count.
+
+        Args:
+            count_id: Stock count ID
+            user_id: User performing the posting
+            posting_date: Posting date (defaults to today)
+            uncounted_as_zero: Treat lines never counted as counted zero
+            reason_code_id: Reason code for the adjustment (optional)
+
+        Returns:
+            Adjustment document ID, or None if there were no variances
+
+        Raises:
+            NumberingError: If the adjustment sequence is not defined
+        """
+        if posting_date is None:
+            posting_date = date.today()
+
+        with session_scope() as session:
+            count = self._get_open_count(session, count_id)
+
+            # Numbered before the transaction writes (block reservations use
+            # their own connection), and only when there is something to adjust
+            doc_no = None
+            if session.query(StockCountLine.id).filter(
+                StockCountLine.count_id == count_id,
+                self._variance(uncounted_as_zero) != 0
+            ).first() is not None:
+                doc_no = self.numbering_service.next_doc_no(
+                    count.company_id, DocumentType.ADJUSTMENT, session=session
+                )
+
+            self.compute_variances(session, count_id, uncounted_as_zero)
+
+            variances = session.query(StockCountLine).filter(
+                StockCountLine.count_id == count_id,
+                StockCountLine.variance_qty != 0
+            ).order_by(StockCountLine.line_no).all()
+
+            document_id = None
+
+            if variances:
+                avg_costs = self.costing_service.get_average_costs(
+                    session, count.company_id,
+                    {line.item_id for line in variances if line.variance_qty > 0},
+                    warehouse_id=count.warehouse_id
+                )
+
+                base_uoms = dict(session.query(Item.id, Item.base_uom_id).filter(
+                    Item.id.in_({line.item_id for line in variances})
+                ).all())
+
+                document = DocumentHeader(
+                    company_id=count.company_id,
+                    doc_type=DocumentType.ADJUSTMENT,
+                    doc_no=doc_no,
+                    doc_date=posting_date,
+                    from_warehouse_id=count.warehouse_id,
+                    to_warehouse_id=count.warehouse_id,
+                    reference_no=count.count_no,
+                    reason_code_id=reason_code_id,
+                    notes=f'تسوية جرد {count.count_no}',
+                    created_by=user_id
+                )
+
+                for line_no, line in enumerate(variances, start=1):
+                    unit_cost = None
+                    total_cost = None
+                    if line.variance_qty > 0:
+                        unit_cost = avg_costs.get((line.item_id, line.lot_id),
+                                                  avg_costs.get((line.item_id, None), Decimal(0)))
+                        total_cost = round(line.variance_qty * unit_cost, 2)
+
+                    document.lines.append(DocumentLine(
+                        line_no=line_no,
+                        item_id=line.item_id,
+                        qty=line.variance_qty,
+                        uom_id=base_uoms[line.item_id],
+                        base_qty=line.variance_qty,
+                        from_location_id=line.location_id,
+                        to_location_id=line.location_id,
+                        lot_id=line.lot_id,
+                        serial_id=line.serial_id,
+                        unit_cost=unit_cost,
+                        total_cost=total_cost
+                    ))
+
+                session.add(document)
+                session.flush()
+                document_id = document.id
+
+                self.posting_service.post_documents(
+                    [document_id], user_id, posting_date, session=session
+                )
+
+            count.status = DocumentStatus.POSTED
+            count.posted_by = user_id
+            count.posted_at = datetime.utcnow()
+
+            self._record_count(session, count, posting_date)
+
+            return document_id
+
+    def _record_count(self, session: Session, count: StockCount, count_date: date):
+        """Update the last count date of the counted items (for cycle count planning)"""
+        item_ids = {
+            row.item_id for row in session.query(StockCountLine.item_id).filter(
+                StockCountLine.count_id == count.id
+            ).distinct()
+        }
+        if not item_ids:
+            return
+
+        existing = {
+            row.item_id: row for row in session.query(
+                ItemCountStat.id, ItemCountStat.item_id, ItemCountStat.count_times
+            ).filter(
+                ItemCountStat.company_id == count.company_id,
+                ItemCountStat.warehouse_id == count.warehouse_id,
+                ItemCountStat.item_id.in_(item_ids)
+            )
+        }
+
+        if existing:
+            session.execute(update(ItemCountStat), [
+                {'id': row.id, 'last_count_date': count_date, 'count_times': (row.count_times or 0) + 1}
+                for row in existing.values()
+            ])
+
+        new_items = item_ids - set(existing)
+        if new_items:
+            session.execute(insert(ItemCountStat), [
+                {
+                    'company_id': count.company_id,
+                    'warehouse_id': count.warehouse_id,
+                    'item_id': item_id,
+                    'last_count_date': count_date,
+                    'count_times': 1,
+                }
+                for item_id in new_items
+            ])
+
+    def _get_open_count(self, session: Session, count_id: int) -> StockCount:
+        """Get a count that can still be changed"""
+        count = session.query(StockCount).filter_by(id=count_id).first()
+
+        if not count:
+            raise StockCountError(f'الجرد رقم {count_id} غير موجود')
+
+        if count.status in (DocumentStatus.POSTED, DocumentStatus.CANCELLED):
+            raise StockCountError(f'الجرد {count.count_no} مُرحّل أو ملغي')
+
+        return count
@@ -0,0 +1,247 @@
+"""
+UOM conversion service - Per-item conversion graphs with cached closure
+خدمة تحويل وحدات القياس - مخططات التحويل لكل صنف مع ذاكرة مؤقتة
+"""
+
+from collections import deque
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from data import Item, ItemUOMConversion, DocumentLine
+
+# Quantity precision of DocumentLine.base_qty (Numeric(18, 4))
+QTY_QUANTUM = Decimal('0.0001')
+
+# session.info key of items whose conversions changed in the transaction
+PENDING_KEY = 'uom_conversion_items'
+
+# Global conversion cache: item_id -> {from_uom_id: {to_uom_id: factor}}
+_factor_cache: Dict[int, Dict[int, Dict[int, Decimal]]] = {}
+
+
+class UOMConversionError(Exception):
+    """خطأ في تحويل وحدة القياس"""
+    pass
+
+
+def invalidate_cache(item_id: Optional[int] = None):
+    """Drop cached conversion matrices (all items when item_id is None)"""
+    if item_id is None:
+        _factor_cache.clear()
+    else:
+        _factor_cache.pop(item_id, None)
+
+
+def _mark_changed(target, item_id: int):
+    """
+    Drop an item's matrix now and again when its transaction ends
+
+    The immediate drop lets the writing session see its own change; the
+    second one discards matrices other sessions built from the previous
+    committed state while the transaction was open.
+    """
+    invalidate_cache(item_id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(PENDING_KEY, set()).add(item_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _on_commit(session: Session):
+    for item_id in session.info.pop(PENDING_KEY, ()):
+        invalidate_cache(item_id)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _on_rollback(session: Session, previous_transaction):
+    # Matrices built from the rolled back changes are no longer valid
+    for item_id in session.info.pop(PENDING_KEY, ()):
+        invalidate_cache(item_id)
+
+
+@event.listens_for(ItemUOMConversion, 'after_insert')
+@event.listens_for(ItemUOMConversion, 'after_update')
+@event.listens_for(ItemUOMConversion, 'after_delete')
+def _on_conversion_changed(mapper, connection, target):
+    _mark_changed(target, target.item_id)
+
+
+@event.listens_for(Item.base_uom_id, 'set')
+def _on_base_uom_changed(target, value, oldvalue, initiator):
+    if target.id is not None and value != oldvalue:
+        _mark_changed(target, target.id)
+
+
+class UOMConversionService:
+    """Service for converting quantities between units of measure"""
+
+    def get_factor(self, session: Session, item_id: int,
+                   from_uom_id: int, to_uom_id: int) -> Decimal:
+        """
+        Get the factor converting one unit of from_uom into to_uom
+
+        Args:
+            session: Database session
+            item_id: Item ID
+            from_uom_id: Source UOM ID
+            to_uom_id: Target UOM ID
+
+        Returns:
+            Conversion factor as Decimal
+
+        Raises:
+            UOMConversionError: If no conversion path exists
+        """
+        if from_uom_id == to_uom_id:
+            return Decimal(1)
+
+        matrix = self._get_matrices(session, [item_id])[item_id]
+        factor = matrix.get(from_uom_id, {}).get(to_uom_id)
+
+        if factor is None:
+            raise UOMConversionError(
+                f'لا يوجد تحويل من الوحدة {from_uom_id} إلى الوحدة {to_uom_id} '
+                f'للصنف رقم {item_id}'
+            )
+
+        return factor
+
+    def to_base_qty(self, session: Session, item_id: int, uom_id: int,
+                    qty: Decimal) -> Decimal:
+        """Convert a quantity to the item's base UOM"""
+        base_uom_id = self._get_base_uoms(session, [item_id])[item_id]
+        factor = self.get_factor(session, item_id, uom_id, base_uom_id)
+        return self._round_qty(Decimal(qty) * factor)
+
+    def convert_lines(self, session: Session, lines: Iterable[DocumentLine]) -> List[DocumentLine]:
+        """
+        Fill base_qty for a whole set of document lines
+
+        Conversion matrices for all items in the set are loaded with a single
+        query, then every line is converted from memory.
+
+        Args:
+            session: Database session
+            lines: Document lines to convert
+
+        Returns:
+            The converted lines
+
+        Raises:
+            UOMConversionError: If a line's UOM cannot be converted
+        """
+        lines = list(lines)
+        if not lines:
+            return lines
+
+        item_ids = {line.item_id for line in lines}
+        matrices = self._get_matrices(session, item_ids)
+        base_uoms = self._get_base_uoms(session, item_ids)
+
+        for line in lines:
+            base_uom_id = base_uoms[line.item_id]
+
+            if line.uom_id == base_uom_id:
+                factor = Decimal(1)
+            else:
+                factor = matrices[line.item_id].get(line.uom_id, {}).get(base_uom_id)
+                if factor is None:
+                    raise UOMConversionError(
+                        f'البند {line.line_no}: لا يوجد تحويل من الوحدة {line.uom_id} '
+                        f'إلى الوحدة الأساسية للصنف رقم {line.item_id}'
+                    )
+
+            line.base_qty = self._round_qty(Decimal(line.qty) * factor)
+
+        return lines
+
+    def convert_document(self, session: Session, document) -> List[DocumentLine]:
+        """Fill base_qty for all lines of a document"""
+        return self.convert_lines(session, document.lines)
+
+    def _get_matrices(self, session: Session,
+                      item_ids: Iterable[int]) -> Dict[int, Dict[int, Dict[int, Decimal]]]:
+        """Get conversion matrices, loading missing items in one query"""
+        item_ids = set(item_ids)
+        missing = [item_id for item_id in item_ids if item_id not in _factor_cache]
+
+        if missing:
+            edges: Dict[int, List[ItemUOMConversion]] = {item_id: [] for item_id in missing}
+            conversions = session.query(ItemUOMConversion).filter(
+                ItemUOMConversion.item_id.in_(missing)
+            ).all()
+
+            for conversion in conversions:
+                edges[conversion.item_id].append(conversion)
+
+            for item_id in missing:
+                _factor_cache[item_id] = self._build_matrix(edges[item_id])
+
+        return {item_id: _factor_cache[item_id] for item_id in item_ids}
+
+    def _get_base_uoms(self, session: Session, item_ids: Iterable[int]) -> Dict[int, int]:
+        """Get base UOM per item"""
+        item_ids = set(item_ids)
+        rows = session.query(Item.id, Item.base_uom_id).filter(
+            Item.id.in_(item_ids)
+        ).all()
+
+        base_uoms = {row.id: row.base_uom_id for row in rows}
+        for item_id in item_ids - set(base_uoms):
+            raise UOMConversionError(f'الصنف رقم {item_id} غير موجود')
+
+        return base_uoms
+
+    @staticmethod
+    def _build_matrix(conversions: List[ItemUOMConversion]) -> Dict[int, Dict[int, Decimal]]:
+        """
+        Build the transitive closure of an item's conversion graph
+
+        Each conversion is an edge usable in both directions. Every connected
+        component is walked once from an arbitrary root to get each UOM's
+        factor relative to that root; any pair in the component is then a
+        ratio of two root factors.
+        """
+        graph: Dict[int, List[tuple]] = {}
+        for conversion in conversions:
+            factor = Decimal(conversion.conversion_factor)
+            if factor == 0:
+                continue
+            graph.setdefault(conversion.from_uom_id, []).append((conversion.to_uom_id, factor))
+            graph.setdefault(conversion.to_uom_id, []).append((conversion.from_uom_id, 1 / factor))
+
+        matrix: Dict[int, Dict[int, Decimal]] = {}
+        visited = set()
+
+        for root in graph:
+            if root in visited:
+                continue
+
+            # Factor converting one unit of each UOM into the root UOM
+            to_root = {root: Decimal(1)}
+            queue = deque([root])
+            visited.add(root)
+
+            while queue:
+                uom_id = queue.popleft()
+                for next_uom_id, factor in graph[uom_id]:
+                    if next_uom_id not in to_root:
+                        # 1 next = (1 / factor) uom = to_root[uom] / factor root
+                        to_root[next_uom_id] = to_root[uom_id] / factor
+                        visited.add(next_uom_id)
+                        queue.append(next_uom_id)
+
+            for from_uom_id, from_factor in to_root.items():
+                row = matrix.setdefault(from_uom_id, {})
+                for to_uom_id, to_factor in to_root.items():
+                    row[to_uom_id] = from_factor / to_factor
+
+        return matrix
+
+    @staticmethod
+    def _round_qty(qty: Decimal) -> Decimal:
+        """Round quantity to base_qty precision"""
+        return qty.quantize(QTY_QUANTUM)
@@ -4,15 +4,19 @@ Validation service - Document and business rule validation
 """
 
 from decimal import Decimal
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from sqlalchemy.orm import Session
 
 from data import (
-    DocumentHeader, DocumentLine, Item, StockBalance,
+    DocumentHeader, DocumentLine, DocumentType, Item, Serial, StockBalance,
     TrackingType, ItemType
 )
 from services.policy import PolicyService
+from services.serial_registry import SerialRegistryService
+
+# Documents that take stock out of from_warehouse_id
+ISSUING_TYPES = ('ISSUE', 'TRANSFER', 'RETURN_IN', 'PRODUCTION_ISSUE', 'SCRAP')
 
 
 class ValidationError(Exception):
@@ -24,7 +28,12 @@ class ValidationService:
     """Service for validating documents and business rules"""
     
     def __init__(self):
+        # Imported here: the reservation service reads ISSUING_TYPES from this module
+        from services.reservation import ReservationService
+        
         self.policy_service = PolicyService()
+        self.serial_registry = SerialRegistryService()
+        self.reservation_service = ReservationService()
     
     def validate_document(self, document: DocumentHeader, session: Session):
         """
@@ -40,14 +49,25 @@ class ValidationService:
         if not document.lines:
             raise ValidationError('المستند لا يحتوي على بنود')
         
+        items = {
+            item.id: item for item in session.query(Item).filter(
+                Item.id.in_({line.item_id for line in document.lines})
+            )
+        }
+        
         for line in document.lines:
-            self.validate_line(document, line, session)
+            self.validate_line(document, line, session, items.get(line.item_id))
+        
+        if document.doc_type.value in ISSUING_TYPES:
+            self._validate_serials(document, session)
+            self._validate_reserved_stock(document, session, items)
     
     def validate_line(self, document: DocumentHeader, line: DocumentLine, 
-                     session: Session):
+                     session: Session, item: Optional[Item] = None):
         """Validate a document line"""
         # Get item
-        item = session.query(Item).filter_by(id=line.item_id).first()
+        if item is None:
+            item = session.query(Item).filter_by(id=line.item_id).first()
         if not item:
             raise ValidationError(f'الصنف رقم {line.item_id} غير موجود')
         
@@ -57,18 +77,22 @@ class ValidationService:
         
         # Validate stock item for inventory transactions
         if item.item_type != ItemType.STOCK:
-            if document.doc_type.value in ['GRN_RECEIPT', 'ISSUE', 'TRANSFER']:
+            if document.doc_type.value in ['GRN_RECEIPT', 'ISSUE', 'TRANSFER',
+                                           'PRODUCTION_ISSUE', 'PRODUCTION_RECEIPT']:
                 raise ValidationError(f'الصنف {item.name_ar} ليس صنف مخزني')
         
-        # Validate quantity
-        if line.base_qty <= 0:
+        # Validate quantity (adjustments carry the sign of the change)
+        if document.doc_type == DocumentType.ADJUSTMENT:
+            if line.base_qty == 0:
+                raise ValidationError(f'كمية التسوية يجب ألا تساوي صفر للصنف {item.name_ar}')
+        elif line.base_qty <= 0:
             raise ValidationError(f'الكمية يجب أن تكون أكبر من صفر للصنف {item.name_ar}')
         
         # Validate tracking
         self._validate_tracking(item, line)
         
-        # Validate negative stock
-        if document.doc_type.value in ['ISSUE', 'TRANSFER', 'RETURN_IN']:
+        # Validate negative stock (serials are checked per document)
+        if document.doc_type.value in ISSUING_TYPES and not line.serial_id:
             self._validate_negative_stock(document, line, item, session)
     
     def _validate_tracking(self, item: Item, line: DocumentLine):
@@ -85,27 +109,60 @@ class ValidationService:
             if not line.lot_id:
                 raise ValidationError(f'الصنف {item.name_ar} يتطلب رقم تشغيلة وتاريخ انتهاء')
     
+    def _validate_serials(self, document: DocumentHeader, session: Session):
+        """Validate all issued serials are in stock with one registry query"""
+        serial_ids = {line.serial_id for line in document.lines if line.serial_id}
+        if not serial_ids:
+            return
+        
+        missing = self.serial_registry.unavailable(
+            session, document.from_warehouse_id, serial_ids
+        )
+        if missing:
+            numbers = [
+                row.serial_number for row in session.query(Serial.serial_number).filter(
+                    Serial.id.in_(missing)
+                ).order_by(Serial.serial_number).limit(20)
+            ]
+            raise ValidationError(
+                f'الأرقام التسلسلية غير متوفرة في المخزن ({len(missing)}): {", ".join(numbers)}'
+            )
+    
+    def _validate_reserved_stock(self, document: DocumentHeader, session: Session,
+                                 items: Dict[int, Item]):
+        """Validate the document leaves stock reserved by other documents untouched"""
+        for shortage in self.reservation_service.shortages(session, document):
+            block_negative = self.policy_service.get_policy_value(
+                session=session,
+                policy_name='BLOCK_NEGATIVE_STOCK',
+                company_id=document.company_id,
+                warehouse_id=shortage['warehouse_id'],
+                item_id=shortage['item_id']
+            )
+            
+            if block_negative:
+                item = items[shortage['item_id']]
+                raise ValidationError(
+                    f'الصنف {item.name_ar}: الكمية المتاحة بعد الحجوزات ({shortage["available"]}) '
+                    f'أقل من الكمية المطلوبة ({shortage["required"]})'
+                )
+    
     def _validate_negative_stock(self, document: DocumentHeader, 
                                  line: DocumentLine, item: Item,
                                  session: Session):
         """Validate against negative stock policy"""
         warehouse_id = document.from_warehouse_id
         
-        # Get current stock
-        query = session.query(StockBalance).filter_by(
+        # Get current stock (same exact key the posting updates, so a line
+        # without a location or lot is checked against that balance only)
+        balance = session.query(StockBalance).filter_by(
             company_id=document.company_id,
             warehouse_id=warehouse_id,
-            item_id=line.item_id
-        )
-        
-        if line.lot_id:
-            query = query.filter_by(lot_id=line.lot_id)
-        if line.serial_id:
-            query = query.filter_by(serial_id=line.serial_id)
-        if line.from_location_id:
-            query = query.filter_by(location_id=line.from_location_id)
-        
-        balance = query.first()
+            location_id=line.from_location_id,
+            item_id=line.item_id,
+            lot_id=line.lot_id,
+            serial_id=line.serial_id
+        ).first()
         current_qty = balance.on_hand_qty if balance else Decimal(0)
         
         # Check if issuing more than available
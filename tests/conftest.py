@@ -0,0 +1,75 @@
+"""
+Shared fixtures - In-memory SQLite database with a small company
+أدوات الاختبار المشتركة - قاعدة بيانات مؤقتة في الذاكرة
+"""
+
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+from data import (
+    Company, Item, Location, TrackingType, UOM, User, Warehouse,
+    create_all_tables, get_engine, init_db, session_scope
+)
+from services import expiry_aging, uom
+from services.numbering import DocumentNumberingService
+
+
+@pytest.fixture
+def db():
+    """
+    Fresh in-memory database with one company
+
+    Two warehouses (the first with one location), base and pack UOMs, a
+    user, three untracked items, a lot-tracked and a serial-tracked item.
+    """
+    init_db(url='sqlite://')
+    create_all_tables()
+
+    with session_scope() as session:
+        company = Company(code='C1', name_ar='شركة', name_en='Company',
+                          fiscal_year_start=date(2024, 1, 1), fiscal_year_end=date(2024, 12, 31))
+        session.add(company)
+        session.flush()
+
+        warehouses = [
+            Warehouse(company_id=company.id, code=f'W{number}', name_ar=f'مخزن {number}',
+                      name_en=f'Warehouse {number}')
+            for number in (1, 2)
+        ]
+        uoms = [UOM(code=code, name_ar=code, name_en=code) for code in ('PCS', 'BOX', 'CTN')]
+        user = User(username='tester', password_hash='-', full_name_ar='مختبر', full_name_en='Tester')
+        session.add_all(warehouses + uoms + [user])
+        session.flush()
+
+        location = Location(warehouse_id=warehouses[0].id, code='A-01')
+        session.add(location)
+
+        def item(code, tracking_type=TrackingType.NONE):
+            return Item(company_id=company.id, code=code, name_ar=code, name_en=code,
+                        base_uom_id=uoms[0].id, tracking_type=tracking_type)
+
+        items = [item(f'I{number}') for number in (1, 2, 3)]
+        lot_item = item('LOT', TrackingType.LOT)
+        serial_item = item('SER', TrackingType.SERIAL)
+        session.add_all(items + [lot_item, serial_item])
+        session.flush()
+
+        ids = SimpleNamespace(
+            company_id=company.id,
+            warehouse_ids=[warehouse.id for warehouse in warehouses],
+            location_id=location.id,
+            uom_ids={uom_row.code: uom_row.id for uom_row in uoms},
+            user_id=user.id,
+            item_ids=[row.id for row in items],
+            lot_item_id=lot_item.id,
+            serial_item_id=serial_item.id,
+        )
+
+    yield ids
+
+    DocumentNumberingService().release_unused()
+    uom.invalidate_cache()
+    expiry_aging.invalidate_cache()
+    get_engine().dispose()
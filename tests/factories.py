@@ -0,0 +1,85 @@
+"""
+Test data builders
+أدوات إنشاء بيانات الاختبار
+"""
+
+from datetime import date
+from decimal import Decimal
+
+from data import BOM, BOMLine, DocumentHeader, DocumentLine, DocumentSequence, Lot, Serial
+
+
+def add_document(session, company_id, doc_type, lines, from_warehouse_id=None,
+                 to_warehouse_id=None, doc_no=None, user_id=1):
+    """
+    Add a draft document with lines given as DocumentLine keyword dicts
+
+    uom_id defaults to 1 (PCS) and qty to base_qty.
+
+    Returns:
+        Document ID
+    """
+    document = DocumentHeader(
+        company_id=company_id,
+        doc_type=doc_type,
+        doc_no=doc_no or f'{doc_type.value}-{session.query(DocumentHeader).count() + 1}',
+        doc_date=date.today(),
+        from_warehouse_id=from_warehouse_id,
+        to_warehouse_id=to_warehouse_id,
+        created_by=user_id
+    )
+    for line_no, line in enumerate(lines, start=1):
+        line = dict(line)
+        line.setdefault('uom_id', 1)
+        line.setdefault('qty', line['base_qty'])
+        document.lines.append(DocumentLine(line_no=line_no, **line))
+
+    session.add(document)
+    session.flush()
+    return document.id
+
+
+def receipt_line(item_id, qty, unit_cost, **extra):
+    """GRN line keywords with total cost"""
+    qty, unit_cost = Decimal(qty), Decimal(unit_cost)
+    return dict(item_id=item_id, base_qty=qty, unit_cost=unit_cost, total_cost=qty * unit_cost, **extra)
+
+
+def add_lot(session, company_id, item_id, lot_number, expiry_date=None):
+    """Add a lot and return its ID"""
+    lot = Lot(company_id=company_id, item_id=item_id, lot_number=lot_number, expiry_date=expiry_date)
+    session.add(lot)
+    session.flush()
+    return lot.id
+
+
+def add_serials(session, company_id, item_id, numbers):
+    """Add serials and return their IDs in order"""
+    serials = [Serial(company_id=company_id, item_id=item_id, serial_number=number) for number in numbers]
+    session.add_all(serials)
+    session.flush()
+    return [serial.id for serial in serials]
+
+
+def add_sequence(session, company_id, doc_type, prefix):
+    """Define a document number sequence starting at 1"""
+    session.add(DocumentSequence(company_id=company_id, doc_type=doc_type, prefix=prefix,
+                                 next_number=1, padding=4))
+
+
+def add_bom(session, company_id, item_id, components, bom_no='B1', base_qty=1):
+    """
+    Add an active BOM of an item and return its ID
+
+    Components are (item_id, qty) or (item_id, qty, scrap_percent) tuples
+    in base units per base_qty of the item.
+    """
+    bom = BOM(company_id=company_id, item_id=item_id, bom_no=bom_no,
+              effective_date=date(2020, 1, 1), base_qty=Decimal(base_qty), uom_id=1)
+    for line_no, (component_id, qty, *scrap) in enumerate(components, start=1):
+        bom.lines.append(BOMLine(line_no=line_no, item_id=component_id, qty=Decimal(qty),
+                                 uom_id=1, base_qty=Decimal(qty),
+                                 scrap_percent=Decimal(scrap[0]) if scrap else None))
+    session.add(bom)
+    session.flush()
+    return bom.id
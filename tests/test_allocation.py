@@ -0,0 +1,99 @@
+"""
+Tests for FIFO/FEFO lot and serial allocation
+اختبارات تخصيص التشغيلات والأرقام التسلسلية
+"""
+
+from datetime import date, timedelta
+
+import pytest
+
+from data import DocumentType, session_scope
+from services import AllocationError, LotAllocationService, PostingService
+from services.allocation import METHOD_FEFO, METHOD_FIFO
+from tests.factories import add_document, add_lot, add_serials, receipt_line
+
+TODAY = date.today()
+
+
+@pytest.fixture
+def lots(db):
+    """Lot A (older, expires later), lot B (newer, expires sooner), expired lot C"""
+    with session_scope() as session:
+        lot_ids = [
+            add_lot(session, db.company_id, db.lot_item_id, 'A', TODAY + timedelta(days=90)),
+            add_lot(session, db.company_id, db.lot_item_id, 'B', TODAY + timedelta(days=30)),
+            add_lot(session, db.company_id, db.lot_item_id, 'C', TODAY - timedelta(days=1)),
+        ]
+        receipt_id = add_document(session, db.company_id, DocumentType.GRN_RECEIPT, [
+            receipt_line(db.lot_item_id, qty, 1, lot_id=lot_id)
+            for lot_id, qty in zip(lot_ids, (10, 10, 5))
+        ], to_warehouse_id=db.warehouse_ids[0])
+    PostingService().post_document(receipt_id, db.user_id)
+    db.lot_ids = lot_ids
+    return db
+
+
+def allocate(db, requests, **options):
+    with session_scope() as session:
+        return LotAllocationService().allocate(
+            session, db.company_id, db.warehouse_ids[0],
+            [dict(key=key, item_id=item_id, qty=qty) for key, item_id, qty in requests],
+            **options
+        )
+
+
+def splits(result):
+    return [(allocation['lot_id'], allocation['qty']) for allocation in result['allocations']]
+
+
+def test_fifo_takes_oldest_lot_first(lots):
+    lot_a, lot_b, _ = lots.lot_ids
+
+    result = allocate(lots, [(1, lots.lot_item_id, 12)], method=METHOD_FIFO)
+
+    assert splits(result[1]) == [(lot_a, 10), (lot_b, 2)]
+    assert result[1]['short_qty'] == 0
+
+
+def test_fefo_takes_earliest_expiry_first(lots):
+    lot_a, lot_b, _ = lots.lot_ids
+
+    result = allocate(lots, [(1, lots.lot_item_id, 12)], method=METHOD_FEFO)
+
+    assert splits(result[1]) == [(lot_b, 10), (lot_a, 2)]
+
+
+def test_expired_lots_only_when_allowed(lots):
+    lot_c = lots.lot_ids[2]
+
+    with pytest.raises(AllocationError):
+        allocate(lots, [(1, lots.lot_item_id, 25)], method=METHOD_FEFO)
+
+    result = allocate(lots, [(1, lots.lot_item_id, 25)], method=METHOD_FEFO, allow_expired=True)
+    assert splits(result[1])[0] == (lot_c, 5)
+
+
+def test_lines_of_one_item_do_not_share_stock(lots):
+    lot_a, lot_b, _ = lots.lot_ids
+
+    result = allocate(lots, [(1, lots.lot_item_id, 8), (2, lots.lot_item_id, 15)],
+                      method=METHOD_FIFO, allow_partial=True)
+
+    assert splits(result[1]) == [(lot_a, 8)]
+    assert splits(result[2]) == [(lot_a, 2), (lot_b, 10)]
+    assert result[2]['short_qty'] == 3
+
+
+def test_serials_are_allocated_one_by_one(db):
+    with session_scope() as session:
+        serial_ids = add_serials(session, db.company_id, db.serial_item_id, ['S1', 'S2', 'S3'])
+        receipt_id = add_document(session, db.company_id, DocumentType.GRN_RECEIPT, [
+            receipt_line(db.serial_item_id, 1, 7, serial_id=serial_id) for serial_id in serial_ids
+        ], to_warehouse_id=db.warehouse_ids[0])
+    PostingService().post_document(receipt_id, db.user_id)
+
+    result = allocate(db, [(1, db.serial_item_id, 2)])
+
+    allocated = [allocation['serial_id'] for allocation in result[1]['allocations']]
+    assert allocated == serial_ids[:2]
+    assert all(allocation['qty'] == 1 for allocation in result[1]['allocations'])
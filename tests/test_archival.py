@@ -0,0 +1,78 @@
+"""
+Tests for ledger archival of closed fiscal years
+اختبارات أرشفة دفتر الحركة للسنوات المالية المقفلة
+"""
+
+from datetime import date
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import func, select
+
+from data import DocumentType, InventoryLedger, LedgerArchive, session_scope
+from services import ArchivalError, LedgerArchiveService, PeriodCloseService, PostingService
+from services.archival import ledger_source
+from tests.factories import add_document, receipt_line
+
+YEAR_END = date(2024, 12, 31)
+TODAY = date.today()
+
+
+def receive(db, qty, posting_date):
+    with session_scope() as session:
+        receipt_id = add_document(session, db.company_id, DocumentType.GRN_RECEIPT,
+                                  [receipt_line(db.item_ids[0], qty, 2)],
+                                  to_warehouse_id=db.warehouse_ids[0])
+    PostingService().post_document(receipt_id, db.user_id, posting_date)
+
+
+@pytest.fixture
+def archived(db):
+    """10 received in the archived 2024 fiscal year, 3 in 2025 and 4 today"""
+    receive(db, 10, date(2024, 6, 1))
+    receive(db, 3, date(2025, 3, 1))
+    PeriodCloseService().close_period(db.company_id, YEAR_END, db.user_id)
+    receive(db, 4, TODAY)
+
+    assert LedgerArchiveService().archive_period(db.company_id, YEAR_END, db.user_id) == 1
+    return db
+
+
+def ledger_qty(db, from_date=None, to_date=None):
+    with session_scope() as session:
+        ledger = ledger_source(session, db.company_id, from_date, to_date)
+        return session.execute(select(func.sum(ledger.c.qty_in))).scalar()
+
+
+def test_archived_rows_leave_the_live_ledger(archived):
+    db = archived
+    with session_scope() as session:
+        assert session.query(InventoryLedger).count() == 2
+        assert session.query(LedgerArchive.posting_date).scalar() == date(2024, 6, 1)
+
+        # Ranges after the archive read the live table only
+        assert ledger_source(session, db.company_id, date(2025, 1, 1)) is InventoryLedger.__table__
+
+    assert ledger_qty(db, date(2025, 1, 1)) == Decimal(7)
+    assert ledger_qty(db, to_date=YEAR_END) == Decimal(10)
+    assert ledger_qty(db) == Decimal(17)
+
+
+def test_balances_read_through_the_archive(archived):
+    db = archived
+    with session_scope() as session:
+        balances = PeriodCloseService().balances_as_of(session, db.company_id, TODAY)
+
+    assert balances[(db.warehouse_ids[0], db.item_ids[0])] == (Decimal(17), Decimal(34))
+
+
+def test_only_closed_past_fiscal_years_are_archived(archived):
+    db = archived
+    service = LedgerArchiveService()
+
+    with pytest.raises(ArchivalError):
+        service.archive_period(db.company_id, YEAR_END)
+    with pytest.raises(ArchivalError):
+        service.archive_period(db.company_id, date(2025, 6, 30))
+    with pytest.raises(ArchivalError):
+        service.archive_period(db.company_id, date(2025, 12, 31))
@@ -0,0 +1,95 @@
+"""
+Tests for multi-level BOM explosion
+اختبارات تفجير قوائم المواد متعددة المستويات
+"""
+
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from data import ProductionOrder, session_scope
+from services import BOMError, BOMExplosionService
+from tests.factories import add_bom
+
+
+@pytest.fixture
+def boms(db):
+    """I1 = 2 x I2 + 1 x I3 (10% scrap); I2 = 3 x I3 + 0.5 x LOT"""
+    finished, assembly, part = db.item_ids
+    with session_scope() as session:
+        db.bom_id = add_bom(session, db.company_id, finished,
+                            [(assembly, 2), (part, 1, 10)])
+        db.sub_bom_id = add_bom(session, db.company_id, assembly,
+                                [(part, 3), (db.lot_item_id, '0.5')], bom_no='B2')
+    return db
+
+
+def test_explosion_returns_leaf_requirements(boms):
+    db = boms
+    finished, assembly, part = db.item_ids
+    service = BOMExplosionService()
+
+    with session_scope() as session:
+        multi = service.explode(session, db.bom_id, Decimal(10))
+        single = service.explode(session, db.bom_id, Decimal(10), single_level=True)
+
+    assert multi == {part: Decimal(71), db.lot_item_id: Decimal(10)}
+    assert single == {assembly: Decimal(20), part: Decimal(11)}
+
+
+def test_production_orders_share_one_explosion(boms):
+    db = boms
+    with session_scope() as session:
+        orders = [
+            ProductionOrder(company_id=db.company_id, warehouse_id=db.warehouse_ids[0],
+                            po_no=f'PO{qty}', po_date=date.today(), item_id=db.item_ids[0],
+                            bom_id=db.bom_id, planned_qty=Decimal(qty), created_by=db.user_id)
+            for qty in (4, 6)
+        ]
+        session.add_all(orders)
+        session.flush()
+        order_ids = [order.id for order in orders]
+
+        result = BOMExplosionService().explode_production_orders(session, order_ids)
+
+    part = db.item_ids[2]
+    assert [result['orders'][order_id][part] for order_id in order_ids] == [Decimal('28.4'), Decimal('42.6')]
+    assert result['total'] == {part: Decimal(71), db.lot_item_id: Decimal(10)}
+
+
+def test_low_level_codes_follow_deepest_use(boms):
+    db = boms
+    finished, assembly, part = db.item_ids
+    with session_scope() as session:
+        codes = BOMExplosionService().low_level_codes(session, db.company_id)
+
+    assert codes == {finished: 0, assembly: 1, part: 2, db.lot_item_id: 2}
+
+
+def test_cycles_are_rejected(boms):
+    db = boms
+    with session_scope() as session:
+        add_bom(session, db.company_id, db.item_ids[2], [(db.item_ids[0], 1)], bom_no='B3')
+
+    service = BOMExplosionService()
+    with session_scope() as session:
+        with pytest.raises(BOMError):
+            service.explode(session, db.bom_id, Decimal(1))
+        with pytest.raises(BOMError):
+            service.low_level_codes(session, db.company_id)
+
+
+def test_reload_drops_memoised_expansions(boms):
+    db = boms
+    part = db.item_ids[2]
+    service = BOMExplosionService()
+    with session_scope() as session:
+        assert service.explode(session, db.bom_id, Decimal(1))[part] == Decimal('7.1')
+
+        add_bom(session, db.company_id, part, [(db.lot_item_id, 1)], bom_no='B3')
+        # Loaded BOMs and expansions are kept until the company is reloaded
+        assert service.explode(session, db.bom_id, Decimal(1))[part] == Decimal('7.1')
+
+        service.load(session, db.company_id, reload=True)
+        assert service.explode(session, db.bom_id, Decimal(1)) == {db.lot_item_id: Decimal('8.1')}
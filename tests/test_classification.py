@@ -0,0 +1,62 @@
+"""
+Tests for ABC/XYZ item classification
+اختبارات تصنيف الأصناف ABC/XYZ
+"""
+
+from datetime import date
+from decimal import Decimal
+
+from data import DailyMovement, DocumentType, ItemClassification, session_scope
+from services import ItemClassificationService
+
+JANUARY = date(2024, 1, 10)
+FEBRUARY = date(2024, 2, 10)
+
+
+def consume(session, db, item_id, day, qty, value, doc_type=DocumentType.ISSUE):
+    session.add(DailyMovement(company_id=db.company_id, warehouse_id=db.warehouse_ids[0],
+                              item_id=item_id, doc_type=doc_type, movement_date=day,
+                              qty_out=Decimal(qty), value_out=Decimal(value), line_count=1))
+
+
+def test_class_limits_close_their_class(db):
+    first, second, third = db.item_ids
+    with session_scope() as session:
+        consume(session, db, first, JANUARY, 10, 400)
+        consume(session, db, first, FEBRUARY, 10, 400)
+        consume(session, db, second, JANUARY, 1, 40)
+        consume(session, db, second, FEBRUARY, 3, 110)
+        consume(session, db, third, FEBRUARY, 2, 50)
+        # Receipts and months outside the window are not consumption
+        consume(session, db, third, FEBRUARY, 9, 900, DocumentType.GRN_RECEIPT)
+        consume(session, db, third, date(2023, 12, 10), 9, 900)
+
+        counts = ItemClassificationService().classify(session, db.company_id, months=2,
+                                                      as_of=date(2024, 2, 15))
+        classes = ItemClassificationService().get_classes(session, db.company_id)
+
+    # Value shares before each item are 0, 0.80 and 0.95; the coefficients
+    # of variation are 0, 0.5 and 1.0
+    assert classes == {
+        first: ('A', 'X'),
+        second: ('B', 'X'),
+        third: ('C', 'Y'),
+        db.lot_item_id: ('C', 'Z'),
+        db.serial_item_id: ('C', 'Z'),
+    }
+    assert counts == {'AX': 1, 'BX': 1, 'CY': 1, 'CZ': 2}
+
+
+def test_results_replace_previous_run(db):
+    with session_scope() as session:
+        consume(session, db, db.item_ids[0], FEBRUARY, 5, 50)
+        service = ItemClassificationService()
+        service.classify(session, db.company_id, months=2, as_of=date(2024, 2, 15))
+        service.classify(session, db.company_id, months=2, as_of=date(2024, 2, 15))
+
+        row = session.query(ItemClassification).filter_by(item_id=db.item_ids[0]).one()
+        assert (row.consumption_qty, row.consumption_value, row.value_share) == (
+            Decimal(5), Decimal(50), Decimal(1)
+        )
+        assert (row.period_from, row.period_to) == (date(2024, 1, 1), date(2024, 2, 29))
+        assert session.query(ItemClassification).count() == 5
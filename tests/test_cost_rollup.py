@@ -0,0 +1,79 @@
+"""
+Tests for the standard cost rollup
+اختبارات تجميع التكلفة المعيارية
+"""
+
+from decimal import Decimal
+
+import pytest
+
+from data import BOM, DocumentType, Routing, RoutingStep, WorkCenter, session_scope
+from services import CostRollupService, PostingService
+from tests.factories import add_bom, add_document, add_lot, receipt_line
+
+
+def receive(db, lines):
+    with session_scope() as session:
+        receipt_id = add_document(session, db.company_id, DocumentType.GRN_RECEIPT, lines,
+                                  to_warehouse_id=db.warehouse_ids[0])
+    PostingService().post_document(receipt_id, db.user_id)
+
+
+@pytest.fixture
+def costed(db):
+    """
+    I1 = 2 x I2 + 1 x I3; a batch of 2 x I2 = 6 x I3 + 2 x LOT with an hour
+    of setup and half an hour per unit at 20 an hour; SER = 1 x LOT
+    """
+    finished, assembly, part = db.item_ids
+    with session_scope() as session:
+        lot_id = add_lot(session, db.company_id, db.lot_item_id, 'L1')
+    receive(db, [receipt_line(part, 10, 4), receipt_line(db.lot_item_id, 10, 10, lot_id=lot_id)])
+
+    with session_scope() as session:
+        db.bom_id = add_bom(session, db.company_id, finished, [(assembly, 2), (part, 1)])
+        db.sub_bom_id = add_bom(session, db.company_id, assembly, [(part, 6), (db.lot_item_id, 2)],
+                                bom_no='B2', base_qty=2)
+        db.other_bom_id = add_bom(session, db.company_id, db.serial_item_id, [(db.lot_item_id, 1)],
+                                  bom_no='B3')
+
+        work_center = WorkCenter(company_id=db.company_id, code='ASM', name_ar='ASM', name_en='ASM',
+                                 cost_per_hour=Decimal(20))
+        session.add(work_center)
+        session.flush()
+        routing = Routing(company_id=db.company_id, bom_id=db.sub_bom_id, routing_no='R1')
+        routing.steps.append(RoutingStep(step_no=1, work_center_id=work_center.id, operation_name='OP1',
+                                         setup_time=Decimal(1), run_time=Decimal('0.5')))
+        session.add(routing)
+    return db
+
+
+def stored_costs(db):
+    with session_scope() as session:
+        return dict(session.query(BOM.id, BOM.estimated_cost))
+
+
+def test_rollup_adds_materials_and_labour_bottom_up(costed):
+    db = costed
+    with session_scope() as session:
+        results = CostRollupService().rollup(session, db.company_id)
+
+    # Sub-assembly unit: 3 x 4 + 1 x 10 + 20 / 2 setup + 10 run = 42
+    assert results == {db.bom_id: Decimal(88), db.sub_bom_id: Decimal(84), db.other_bom_id: Decimal(10)}
+    assert stored_costs(db) == results
+
+
+def test_item_cost_change_recomputes_where_used_boms_only(costed):
+    db = costed
+    with session_scope() as session:
+        CostRollupService().rollup(session, db.company_id)
+        session.get(BOM, db.other_bom_id).estimated_cost = Decimal(999)
+
+    # Average cost of the part becomes 7
+    receive(db, [receipt_line(db.item_ids[2], 10, 10)])
+
+    with session_scope() as session:
+        results = CostRollupService().recompute_for_items(session, db.company_id, [db.item_ids[2]])
+
+    assert results == {db.bom_id: Decimal(109), db.sub_bom_id: Decimal(102)}
+    assert stored_costs(db)[db.other_bom_id] == Decimal(999)
@@ -0,0 +1,87 @@
+"""
+Tests for the cycle count planner
+اختبارات مخطط الجرد الدوري
+"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+
+from data import (
+    DocumentType, ItemClassification, ItemCountStat, StockCountLine, session_scope
+)
+from services import CycleCountPlannerService, PostingService
+from tests.factories import add_document, add_sequence, receipt_line
+
+TODAY = date.today()
+
+
+def post(db, doc_type, lines, **warehouses):
+    with session_scope() as session:
+        document_id = add_document(session, db.company_id, doc_type, lines, **warehouses)
+    PostingService().post_document(document_id, db.user_id)
+
+
+@pytest.fixture
+def planned(db):
+    """
+    I1 (class A) counted 10 days ago, I2 (class B) 180 days ago, I3
+    (unclassified) never; I3 moved three times in the last month, I2 once
+    """
+    warehouse_id = db.warehouse_ids[0]
+    post(db, DocumentType.GRN_RECEIPT, [receipt_line(item_id, 10, 1) for item_id in db.item_ids],
+         to_warehouse_id=warehouse_id)
+    for _ in range(2):
+        post(db, DocumentType.ISSUE, [dict(item_id=db.item_ids[2], base_qty=Decimal(1))],
+             from_warehouse_id=warehouse_id)
+
+    with session_scope() as session:
+        for item_id, abc_class in zip(db.item_ids, 'AB'):
+            session.add(ItemClassification(company_id=db.company_id, item_id=item_id, abc_class=abc_class,
+                                           xyz_class='X', period_from=TODAY, period_to=TODAY))
+        for item_id, days_ago in zip(db.item_ids, (10, 180)):
+            session.add(ItemCountStat(company_id=db.company_id, warehouse_id=warehouse_id, item_id=item_id,
+                                      last_count_date=TODAY - timedelta(days=days_ago), count_times=1))
+        add_sequence(session, db.company_id, DocumentType.STOCK_COUNT, 'CC')
+    return db
+
+
+def plan(db, **options):
+    with session_scope() as session:
+        return [
+            (candidate['item_id'], candidate['days_since'], candidate['movement_lines'], candidate['score'])
+            for candidate in CycleCountPlannerService().plan(
+                session, db.company_id, db.warehouse_ids[0], TODAY, **options
+            )
+        ]
+
+
+def test_overdue_items_are_ranked_by_overdue_ratio_and_movement(planned):
+    db = planned
+    first, second, third = db.item_ids
+
+    # Both are two intervals overdue; the busier item comes first
+    assert plan(db) == [
+        (third, 360, 3, 4.0),
+        (second, 180, 1, 2.6667),
+    ]
+    assert plan(db, capacity=1) == [(third, 360, 3, 4.0)]
+    # Shorter intervals bring the recently counted class A item due
+    assert [row[0] for row in plan(db, intervals={'A': 10, 'B': 90, 'C': 180})] == [third, second, first]
+
+
+def test_generated_count_freezes_planned_items_once(planned):
+    db = planned
+    count_ids = CycleCountPlannerService().generate(db.company_id, db.user_id, TODAY)
+
+    assert len(count_ids) == 1
+    with session_scope() as session:
+        lines = session.query(StockCountLine.item_id, StockCountLine.system_qty).filter_by(
+            count_id=count_ids[0]
+        ).order_by(StockCountLine.item_id).all()
+    assert lines == [(db.item_ids[1], Decimal(10)), (db.item_ids[2], Decimal(8))]
+
+    # Items waiting in the draft count are not planned again
+    assert plan(db) == []
+    assert CycleCountPlannerService().generate(db.company_id, db.user_id, TODAY) == []
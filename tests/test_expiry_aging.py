@@ -0,0 +1,105 @@
+"""
+Tests for expiry aging buckets and their cache
+اختبارات أعمار الصلاحية والذاكرة المؤقتة لها
+"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import update
+
+from data import DocumentType, Lot, StockBalance, session_scope
+from services import ExpiryAgingService, PostingService, expiry_aging
+from tests.factories import add_document, add_lot, receipt_line
+
+TODAY = date.today()
+
+
+def receive(db, lot_id, qty):
+    with session_scope() as session:
+        receipt_id = add_document(session, db.company_id, DocumentType.GRN_RECEIPT,
+                                  [receipt_line(db.lot_item_id, qty, 2, lot_id=lot_id)],
+                                  to_warehouse_id=db.warehouse_ids[0])
+    PostingService().post_document(receipt_id, db.user_id)
+
+
+def buckets(db, session=None):
+    if session is not None:
+        result = ExpiryAgingService().aging(session, db.company_id, buckets=(30, 90))
+    else:
+        with session_scope() as session:
+            result = ExpiryAgingService().aging(session, db.company_id, buckets=(30, 90))
+    return {row['bucket']: row['qty'] for row in result['buckets'] if row['qty']}
+
+
+def test_lots_are_placed_in_buckets(db):
+    with session_scope() as session:
+        expired = add_lot(session, db.company_id, db.lot_item_id, 'L1', TODAY - timedelta(days=1))
+        soon = add_lot(session, db.company_id, db.lot_item_id, 'L2', TODAY + timedelta(days=30))
+        later = add_lot(session, db.company_id, db.lot_item_id, 'L3', TODAY + timedelta(days=31))
+        undated = add_lot(session, db.company_id, db.lot_item_id, 'L4')
+    for lot_id, qty in ((expired, 1), (soon, 2), (later, 3), (undated, 4)):
+        receive(db, lot_id, qty)
+
+    assert buckets(db) == {
+        expiry_aging.EXPIRED: Decimal(1),
+        '0-30': Decimal(2),
+        '31-90': Decimal(3),
+        expiry_aging.NO_EXPIRY: Decimal(4),
+    }
+
+
+def test_posting_lot_stock_drops_cached_results(db):
+    with session_scope() as session:
+        lot_id = add_lot(session, db.company_id, db.lot_item_id, 'L1', TODAY + timedelta(days=10))
+    receive(db, lot_id, 5)
+    assert buckets(db) == {'0-30': Decimal(5)}
+
+    receive(db, lot_id, 2)
+    assert buckets(db) == {'0-30': Decimal(7)}
+
+
+def test_lot_change_is_seen_in_and_after_its_transaction(db):
+    with session_scope() as session:
+        lot_id = add_lot(session, db.company_id, db.lot_item_id, 'L1', TODAY + timedelta(days=10))
+    receive(db, lot_id, 5)
+    assert buckets(db) == {'0-30': Decimal(5)}
+
+    with session_scope() as session:
+        session.get(Lot, lot_id).expiry_date = TODAY + timedelta(days=60)
+        session.flush()
+        assert buckets(db, session) == {'31-90': Decimal(5)}
+    assert buckets(db) == {'31-90': Decimal(5)}
+
+
+def test_rolled_back_lot_change_drops_cached_results(db):
+    with session_scope() as session:
+        lot_id = add_lot(session, db.company_id, db.lot_item_id, 'L1', TODAY + timedelta(days=10))
+    receive(db, lot_id, 5)
+
+    with pytest.raises(RuntimeError):
+        with session_scope() as session:
+            session.get(Lot, lot_id).expiry_date = TODAY + timedelta(days=60)
+            session.flush()
+            # Cached from the uncommitted change
+            assert buckets(db, session) == {'31-90': Decimal(5)}
+            raise RuntimeError
+
+    assert buckets(db) == {'0-30': Decimal(5)}
+
+
+def test_cached_results_expire(db, monkeypatch):
+    with session_scope() as session:
+        lot_id = add_lot(session, db.company_id, db.lot_item_id, 'L1', TODAY + timedelta(days=10))
+    receive(db, lot_id, 5)
+    assert buckets(db) == {'0-30': Decimal(5)}
+
+    # Bulk SQL bypasses the posting hooks, so the cached result is served until it expires
+    with session_scope() as session:
+        session.execute(update(StockBalance).values(on_hand_qty=Decimal(3)))
+    assert buckets(db) == {'0-30': Decimal(5)}
+
+    now = expiry_aging.monotonic()
+    monkeypatch.setattr(expiry_aging, 'monotonic', lambda: now + expiry_aging.CACHE_TTL + 1)
+    assert buckets(db) == {'0-30': Decimal(3)}
@@ -0,0 +1,58 @@
+"""
+Tests for demand forecasting and reorder proposals
+اختبارات التنبؤ بالطلب ومقترحات إعادة الطلب
+"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+
+from data import DailyMovement, DemandForecast, DocumentType, Item, session_scope
+from services import ForecastingService
+from services.forecasting import MODEL_CROSTON, MODEL_EXP_SMOOTHING, MODEL_MOVING_AVERAGE, fit
+
+AS_OF = date(2024, 3, 4)
+
+
+@pytest.mark.parametrize('series, model', [
+    ([0.0] * 12, MODEL_CROSTON),
+    ([0.0, 0.0, 4.0] * 4, MODEL_CROSTON),
+    # A level shift is followed faster by the moving average
+    ([10.0] * 8 + [20.0] * 8, MODEL_MOVING_AVERAGE),
+    # Noise around a stable level is smoothed better by exponential smoothing
+    ([12.0, 8.0, 12.0, 8.0, 10.0, 14.0, 6.0, 10.0] * 2, MODEL_EXP_SMOOTHING),
+])
+def test_fit_selects_model(series, model):
+    assert fit(series)[0] == model
+
+
+def test_intermittent_forecast_is_size_over_interval():
+    assert fit([0.0, 0.0, 4.0] * 4)[1] == pytest.approx(4 / 3)
+
+
+def test_forecast_proposes_and_applies_reorder_parameters(db):
+    item_id = db.item_ids[0]
+    with session_scope() as session:
+        for week in range(8):
+            session.add(DailyMovement(company_id=db.company_id, warehouse_id=db.warehouse_ids[0],
+                                      item_id=item_id, doc_type=DocumentType.ISSUE,
+                                      movement_date=AS_OF - timedelta(weeks=8 - week),
+                                      qty_out=Decimal(10), value_out=Decimal(20), line_count=1))
+
+        service = ForecastingService()
+        assert service.forecast(session, db.company_id, weeks=8, as_of=AS_OF) == 5
+
+        proposal = session.query(DemandForecast).filter_by(item_id=item_id).one()
+        assert (proposal.model, proposal.weekly_demand, proposal.safety_stock) == (
+            MODEL_MOVING_AVERAGE, Decimal(10), Decimal(0)
+        )
+
+        assert service.apply_proposals(session, db.company_id, [item_id]) == 1
+        # Applied proposals are not applied again
+        assert service.apply_proposals(session, db.company_id, [item_id]) == 0
+
+        item = session.get(Item, item_id)
+        session.refresh(item)
+        # Two weeks of lead time, then four weeks of order cycle on top
+        assert (item.reorder_point, item.min_qty, item.max_qty) == (Decimal(20), Decimal(0), Decimal(60))
@@ -0,0 +1,105 @@
+"""
+Tests for lot/serial genealogy edges and traces
+اختبارات شجرة التشغيلات والأرقام التسلسلية
+"""
+
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from data import (
+    DocumentType, GenealogyLink, ProductionIssue, ProductionOrder, ProductionReceipt, session_scope
+)
+from services import GenealogyService, PostingService
+from services.genealogy import NODE_DOCUMENT, NODE_LOT, NODE_ORDER, NODE_SERIAL, TRACE_BACKWARD
+from tests.factories import add_bom, add_document, add_lot, add_serials, receipt_line
+
+
+def post(db, doc_type, lines, link_model=None, **warehouses):
+    with session_scope() as session:
+        document_id = add_document(session, db.company_id, doc_type, lines, **warehouses)
+        if link_model:
+            session.add(link_model(production_order_id=db.order_id, doc_id=document_id))
+    PostingService().post_document(document_id, db.user_id)
+    return document_id
+
+
+@pytest.fixture
+def traced(db):
+    """4 of lot L1 consumed by an order producing serials S1 and S2; S1 shipped"""
+    warehouse_id = db.warehouse_ids[0]
+    with session_scope() as session:
+        db.lot_id = add_lot(session, db.company_id, db.lot_item_id, 'L1')
+        db.serial_ids = add_serials(session, db.company_id, db.serial_item_id, ['S1', 'S2'])
+        bom_id = add_bom(session, db.company_id, db.serial_item_id, [(db.lot_item_id, 2)])
+        order = ProductionOrder(company_id=db.company_id, warehouse_id=warehouse_id, po_no='PO1',
+                                po_date=date.today(), item_id=db.serial_item_id, bom_id=bom_id,
+                                planned_qty=Decimal(2), status='RELEASED', created_by=db.user_id)
+        session.add(order)
+        session.flush()
+        db.order_id = order.id
+
+    post(db, DocumentType.GRN_RECEIPT, [receipt_line(db.lot_item_id, 10, 2, lot_id=db.lot_id)],
+         to_warehouse_id=warehouse_id)
+    post(db, DocumentType.PRODUCTION_ISSUE,
+         [dict(item_id=db.lot_item_id, base_qty=Decimal(4), lot_id=db.lot_id)],
+         ProductionIssue, from_warehouse_id=warehouse_id)
+    post(db, DocumentType.PRODUCTION_RECEIPT,
+         [receipt_line(db.serial_item_id, 1, 4, serial_id=serial_id) for serial_id in db.serial_ids],
+         ProductionReceipt, to_warehouse_id=warehouse_id)
+    db.shipment_id = post(db, DocumentType.ISSUE,
+                          [dict(item_id=db.serial_item_id, base_qty=Decimal(1), serial_id=db.serial_ids[0])],
+                          from_warehouse_id=warehouse_id)
+    return db
+
+
+def trace(db, node, direction='forward'):
+    with session_scope() as session:
+        return sorted(
+            (edge['level'], edge['from_type'], edge['from_id'], edge['to_type'], edge['to_id'], edge['qty'])
+            for edge in GenealogyService().trace(session, db.company_id, *node, direction=direction)
+        )
+
+
+def edges(db):
+    with session_scope() as session:
+        return sorted(
+            (link.from_type, link.from_id, link.to_type, link.to_id, link.doc_id, link.qty)
+            for link in session.query(GenealogyLink)
+        )
+
+
+def test_lot_is_traced_forward_to_the_shipment(traced):
+    db = traced
+    first, second = db.serial_ids
+
+    assert trace(db, (NODE_LOT, db.lot_id)) == [
+        (1, NODE_LOT, db.lot_id, NODE_ORDER, db.order_id, Decimal(4)),
+        (2, NODE_ORDER, db.order_id, NODE_SERIAL, first, Decimal(1)),
+        (2, NODE_ORDER, db.order_id, NODE_SERIAL, second, Decimal(1)),
+        (3, NODE_SERIAL, first, NODE_DOCUMENT, db.shipment_id, Decimal(1)),
+    ]
+
+
+def test_shipment_is_traced_back_to_the_lot(traced):
+    db = traced
+    first = db.serial_ids[0]
+
+    assert trace(db, (NODE_DOCUMENT, db.shipment_id), TRACE_BACKWARD) == [
+        (1, NODE_SERIAL, first, NODE_DOCUMENT, db.shipment_id, Decimal(1)),
+        (2, NODE_ORDER, db.order_id, NODE_SERIAL, first, Decimal(1)),
+        (3, NODE_LOT, db.lot_id, NODE_ORDER, db.order_id, Decimal(4)),
+    ]
+
+
+def test_reversal_drops_edges_and_rebuild_matches(traced):
+    db = traced
+    PostingService().reverse_document(db.shipment_id, db.user_id)
+
+    assert trace(db, (NODE_SERIAL, db.serial_ids[0])) == []
+
+    incremental = edges(db)
+    with session_scope() as session:
+        assert GenealogyService().rebuild(session, db.company_id) == 3
+    assert edges(db) == incremental
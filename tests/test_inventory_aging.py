@@ -0,0 +1,83 @@
+"""
+Tests for receipt-dated inventory aging
+اختبارات أعمار المخزون حسب تاريخ الاستلام
+"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+
+from data import DocumentType, ReceiptLayer, session_scope
+from services import InventoryAgingService, PostingService
+from tests.factories import add_document, receipt_line
+
+TODAY = date.today()
+OLD = TODAY - timedelta(days=100)
+RECENT = TODAY - timedelta(days=10)
+
+
+def post(db, doc_type, lines, posting_date, **warehouses):
+    with session_scope() as session:
+        document_id = add_document(session, db.company_id, doc_type, lines, **warehouses)
+    PostingService().post_document(document_id, db.user_id, posting_date)
+
+
+@pytest.fixture
+def layered(db):
+    """10 received 100 days ago and 5 ten days ago at 4; 8 issued, then 3 transferred"""
+    source_id, target_id = db.warehouse_ids
+    item_id = db.item_ids[0]
+    post(db, DocumentType.GRN_RECEIPT, [receipt_line(item_id, 10, 4)], OLD, to_warehouse_id=source_id)
+    post(db, DocumentType.GRN_RECEIPT, [receipt_line(item_id, 5, 4)], RECENT, to_warehouse_id=source_id)
+    post(db, DocumentType.ISSUE, [dict(item_id=item_id, base_qty=Decimal(8))],
+         TODAY - timedelta(days=5), from_warehouse_id=source_id)
+    post(db, DocumentType.TRANSFER, [dict(item_id=item_id, base_qty=Decimal(3))],
+         TODAY, from_warehouse_id=source_id, to_warehouse_id=target_id)
+    return db
+
+
+def layers(db):
+    with session_scope() as session:
+        return sorted(
+            (row.warehouse_id, row.receipt_date, row.qty_remaining)
+            for row in session.query(ReceiptLayer).filter_by(company_id=db.company_id)
+            if row.qty_remaining
+        )
+
+
+def test_issues_consume_oldest_layers_and_transfers_keep_dates(layered):
+    db = layered
+    source_id, target_id = db.warehouse_ids
+
+    assert layers(db) == [
+        (source_id, RECENT, Decimal(4)),
+        (target_id, OLD, Decimal(2)),
+        (target_id, RECENT, Decimal(1)),
+    ]
+
+
+def test_aging_buckets_by_warehouse(layered):
+    db = layered
+    source_id, target_id = db.warehouse_ids
+    with session_scope() as session:
+        results = InventoryAgingService().aging(session, db.company_id, buckets=(30, 90))
+
+    aged = {
+        row['group_id']: {bucket['bucket']: (bucket['qty'], bucket['value'])
+                          for bucket in row['buckets'] if bucket['qty']}
+        for row in results
+    }
+    assert aged == {
+        source_id: {'0-30': (Decimal(4), Decimal(16))},
+        target_id: {'0-30': (Decimal(1), Decimal(4)), '>90': (Decimal(2), Decimal(8))},
+    }
+
+
+def test_rebuild_matches_posted_layers(layered):
+    db = layered
+    applied = layers(db)
+
+    InventoryAgingService().rebuild(db.company_id, workers=1)
+
+    assert layers(db) == applied
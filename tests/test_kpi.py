@@ -0,0 +1,72 @@
+"""
+Tests for dashboard KPI counters
+اختبارات عدادات مؤشرات الأداء
+"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+
+from data import DocumentType, Item, KPICounter, session_scope
+from services import KPIService, PostingService
+from tests.factories import add_document, receipt_line
+
+
+def counters(company_id):
+    with session_scope() as session:
+        return {
+            (row.scope_id, row.name, row.period): row.value
+            for row in session.query(KPICounter).filter(
+                KPICounter.company_id == company_id, KPICounter.value != 0
+            )
+        }
+
+
+def test_reversal_counters_match_rebuild(db):
+    posted_on = date.today() - timedelta(days=1)
+    with session_scope() as session:
+        receipt_id = add_document(session, db.company_id, DocumentType.GRN_RECEIPT,
+                                  [receipt_line(db.item_ids[0], 10, 2)],
+                                  to_warehouse_id=db.warehouse_ids[0])
+        kept_id = add_document(session, db.company_id, DocumentType.GRN_RECEIPT,
+                               [receipt_line(db.item_ids[1], 5, 3)],
+                               to_warehouse_id=db.warehouse_ids[0])
+    PostingService().post_documents([receipt_id, kept_id], db.user_id, posted_on)
+    PostingService().reverse_document(receipt_id, db.user_id, date.today())
+
+    applied = counters(db.company_id)
+    with session_scope() as session:
+        KPIService().rebuild(session, db.company_id)
+
+    assert applied == counters(db.company_id)
+    with session_scope() as session:
+        kpis = KPIService().get_dashboard_kpis(session, db.company_id, posted_on)
+    assert kpis['documents_today'] == 1
+    assert kpis['inventory_value'] == 15
+
+
+def test_below_reorder_follows_item_totals(db):
+    with session_scope() as session:
+        session.get(Item, db.item_ids[0]).reorder_point = Decimal(5)
+        receipt_id = add_document(session, db.company_id, DocumentType.GRN_RECEIPT,
+                                  [receipt_line(db.item_ids[0], 10, 2)],
+                                  to_warehouse_id=db.warehouse_ids[0])
+        # Stock in the second warehouse counts towards the item total
+        other_id = add_document(session, db.company_id, DocumentType.GRN_RECEIPT,
+                                [receipt_line(db.item_ids[0], 2, 2)],
+                                to_warehouse_id=db.warehouse_ids[1])
+        issue_id = add_document(session, db.company_id, DocumentType.ISSUE,
+                                [dict(item_id=db.item_ids[0], base_qty=Decimal(7))],
+                                from_warehouse_id=db.warehouse_ids[0])
+
+    def below_reorder():
+        with session_scope() as session:
+            return KPIService().get_dashboard_kpis(session, db.company_id)['below_reorder']
+
+    PostingService().post_documents([receipt_id, other_id], db.user_id)
+    assert below_reorder() == 0
+
+    PostingService().post_document(issue_id, db.user_id)
+    assert below_reorder() == 1
+
+    PostingService().reverse_document(issue_id, db.user_id)
+    assert below_reorder() == 0
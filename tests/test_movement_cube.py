@@ -0,0 +1,59 @@
+"""
+Tests for the daily movement cube
+اختبارات مكعب الحركة اليومي
+"""
+
+from decimal import Decimal
+
+from data import DailyMovement, DocumentType, session_scope
+from services import MovementCubeService, PostingService
+from tests.factories import add_document, receipt_line
+
+
+def post(db, doc_type, lines, **warehouses):
+    with session_scope() as session:
+        document_id = add_document(session, db.company_id, doc_type, lines, **warehouses)
+    PostingService().post_document(document_id, db.user_id)
+    return document_id
+
+
+def totals(db):
+    with session_scope() as session:
+        result = MovementCubeService().daily_totals(session, db.company_id)
+    return tuple(result[key] for key in ('qty_in', 'qty_out', 'value_in', 'value_out', 'lines', 'items'))
+
+
+def cells(db):
+    with session_scope() as session:
+        return sorted(
+            (row.warehouse_id, row.item_id, row.doc_type.value, row.qty_in, row.qty_out,
+             row.value_in, row.value_out, row.line_count)
+            for row in session.query(DailyMovement).filter_by(company_id=db.company_id)
+        )
+
+
+def test_posting_and_reversal_update_the_cube(db):
+    post(db, DocumentType.GRN_RECEIPT, [receipt_line(db.item_ids[0], 10, 2), receipt_line(db.item_ids[1], 5, 3)],
+         to_warehouse_id=db.warehouse_ids[0])
+    issue_id = post(db, DocumentType.ISSUE, [dict(item_id=db.item_ids[0], base_qty=Decimal(4))],
+                    from_warehouse_id=db.warehouse_ids[0])
+
+    assert totals(db) == (Decimal(15), Decimal(4), Decimal(35), Decimal(8), 3, 2)
+
+    # The reversal negates the issue in its own cell
+    PostingService().reverse_document(issue_id, db.user_id)
+    assert totals(db) == (Decimal(15), Decimal(0), Decimal(35), Decimal(0), 4, 2)
+
+
+def test_rebuild_matches_incremental_cube(db):
+    post(db, DocumentType.GRN_RECEIPT, [receipt_line(db.item_ids[0], 10, 2)],
+         to_warehouse_id=db.warehouse_ids[0])
+    issue_id = post(db, DocumentType.ISSUE, [dict(item_id=db.item_ids[0], base_qty=Decimal(4))],
+                    from_warehouse_id=db.warehouse_ids[0])
+    PostingService().reverse_document(issue_id, db.user_id)
+    incremental = cells(db)
+
+    with session_scope() as session:
+        assert MovementCubeService().rebuild(session, db.company_id) == 2
+
+    assert cells(db) == incremental
@@ -0,0 +1,87 @@
+"""
+Tests for the MRP netting run
+اختبارات تشغيل تخطيط الاحتياجات من المواد
+"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+
+from data import DocumentType, Item, ProductionOrder, session_scope
+from services import MRPService, PostingService
+from services.mrp import ACTION_PRODUCE, ACTION_PURCHASE
+from tests.factories import add_bom, add_document, receipt_line
+
+START = date(2024, 1, 1)
+NEXT_PERIOD = START + timedelta(days=7)
+
+
+@pytest.fixture
+def planned(db):
+    """I1 = 2 x I2 + 1 x I3; I2 = 3 x I3"""
+    finished, assembly, part = db.item_ids
+    with session_scope() as session:
+        db.bom_id = add_bom(session, db.company_id, finished, [(assembly, 2), (part, 1)])
+        add_bom(session, db.company_id, assembly, [(part, 3)], bom_no='B2')
+    return db
+
+
+def run(db, demand, **options):
+    with session_scope() as session:
+        result = MRPService().run(session, db.company_id, START, horizon=4, demand=demand, **options)
+    return [
+        (order['item_id'], order['action'], order['period'], order['release_period'], order['qty'])
+        for order in result['planned_orders']
+    ]
+
+
+def test_components_are_netted_after_all_parents(planned):
+    db = planned
+    finished, assembly, part = db.item_ids
+    with session_scope() as session:
+        session.get(Item, part).safety_stock = Decimal(5)
+        receipt_id = add_document(session, db.company_id, DocumentType.GRN_RECEIPT,
+                                  [receipt_line(assembly, 5, 1)], to_warehouse_id=db.warehouse_ids[0])
+    PostingService().post_document(receipt_id, db.user_id)
+
+    orders = run(db, [(finished, NEXT_PERIOD, 10)], lead_time_periods=1)
+
+    # The part is used by both the finished item and the sub-assembly; it is
+    # planned once, for both requirements, topped up to its safety stock
+    assert orders == [
+        (finished, ACTION_PRODUCE, 1, 0, Decimal(10)),
+        (assembly, ACTION_PRODUCE, 0, 0, Decimal(15)),
+        (part, ACTION_PURCHASE, 0, 0, Decimal(60)),
+    ]
+
+
+def test_open_orders_are_receipts_and_component_demand(planned):
+    db = planned
+    finished, assembly, part = db.item_ids
+    with session_scope() as session:
+        session.add(ProductionOrder(company_id=db.company_id, warehouse_id=db.warehouse_ids[0],
+                                    po_no='PO1', po_date=START, completion_date=NEXT_PERIOD,
+                                    item_id=finished, bom_id=db.bom_id, planned_qty=Decimal(4),
+                                    status='RELEASED', created_by=db.user_id))
+
+    orders = run(db, [(finished, NEXT_PERIOD, 10)])
+
+    assert orders == [
+        (finished, ACTION_PRODUCE, 1, 1, Decimal(6)),
+        (assembly, ACTION_PRODUCE, 0, 0, Decimal(8)),
+        (assembly, ACTION_PRODUCE, 1, 1, Decimal(12)),
+        (part, ACTION_PURCHASE, 0, 0, Decimal(28)),
+        (part, ACTION_PURCHASE, 1, 1, Decimal(42)),
+    ]
+
+
+def test_closed_orders_and_demand_beyond_horizon_are_ignored(planned):
+    db = planned
+    finished = db.item_ids[0]
+    with session_scope() as session:
+        session.add(ProductionOrder(company_id=db.company_id, warehouse_id=db.warehouse_ids[0],
+                                    po_no='PO1', po_date=START, item_id=finished, bom_id=db.bom_id,
+                                    planned_qty=Decimal(4), status='COMPLETED', created_by=db.user_id))
+
+    assert run(db, [(finished, START + timedelta(days=28), 10)]) == []
@@ -0,0 +1,71 @@
+"""
+Tests for document numbering gap policies
+اختبارات سياسات ترقيم المستندات
+"""
+
+import pytest
+
+from config import SEQUENCE_CONFIG
+from data import DocumentSequence, DocumentType, session_scope
+from services import DocumentNumberingService, NumberingError
+from tests.factories import add_sequence
+
+DOC_TYPE = DocumentType.GRN_RECEIPT
+
+
+@pytest.fixture
+def sequence(db, monkeypatch):
+    monkeypatch.setitem(SEQUENCE_CONFIG, 'block_size', 5)
+    with session_scope() as session:
+        add_sequence(session, db.company_id, DOC_TYPE, 'GRN')
+    return db
+
+
+def next_number(db):
+    with session_scope() as session:
+        return session.query(DocumentSequence.next_number).filter_by(
+            company_id=db.company_id, doc_type=DOC_TYPE
+        ).scalar()
+
+
+def test_allow_gaps_reserves_blocks(sequence):
+    service = DocumentNumberingService()
+
+    numbers = [service.next_doc_no(sequence.company_id, DOC_TYPE) for _ in range(6)]
+
+    assert numbers == [f'GRN000{number}' for number in range(1, 7)]
+    # Two blocks of five: the sequence row was touched twice
+    assert next_number(sequence) == 11
+
+    # The unused rest of the last block goes back while no one reserved after it
+    service.release_unused()
+    assert next_number(sequence) == 7
+
+
+def test_no_gaps_returns_rolled_back_numbers(sequence, monkeypatch):
+    monkeypatch.setitem(SEQUENCE_CONFIG, 'doc_type_policies', {DOC_TYPE.value: 'NO_GAPS'})
+    service = DocumentNumberingService()
+
+    with session_scope() as session:
+        assert service.next_doc_no(sequence.company_id, DOC_TYPE, session=session) == 'GRN0001'
+
+    with pytest.raises(RuntimeError):
+        with session_scope() as session:
+            assert service.next_doc_no(sequence.company_id, DOC_TYPE, session=session) == 'GRN0002'
+            raise RuntimeError('abort')
+
+    with session_scope() as session:
+        assert service.next_doc_no(sequence.company_id, DOC_TYPE, session=session) == 'GRN0002'
+    assert next_number(sequence) == 3
+
+
+def test_no_gaps_requires_session(sequence, monkeypatch):
+    monkeypatch.setitem(SEQUENCE_CONFIG, 'doc_type_policies', {DOC_TYPE.value: 'NO_GAPS'})
+
+    with pytest.raises(NumberingError):
+        DocumentNumberingService().next_doc_no(sequence.company_id, DOC_TYPE)
+
+
+def test_missing_sequence_raises(db):
+    with pytest.raises(NumberingError):
+        DocumentNumberingService().next_doc_no(db.company_id, DOC_TYPE)
@@ -0,0 +1,80 @@
+"""
+Tests for period close and reopen
+اختبارات إقفال الفترات وإعادة فتحها
+"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+
+from data import DocumentType, PeriodBalance, session_scope
+from services import PeriodCloseError, PeriodCloseService, PostingError, PostingService
+from tests.factories import add_document, receipt_line
+
+TODAY = date.today()
+PERIOD_END = TODAY - timedelta(days=5)
+
+
+def receive(db, qty, posting_date):
+    with session_scope() as session:
+        receipt_id = add_document(session, db.company_id, DocumentType.GRN_RECEIPT,
+                                  [receipt_line(db.item_ids[0], qty, 2)],
+                                  to_warehouse_id=db.warehouse_ids[0])
+    PostingService().post_document(receipt_id, db.user_id, posting_date)
+    return receipt_id
+
+
+@pytest.fixture
+def closed(db):
+    """Receipt of 10 before the close, period closed 5 days ago, receipt of 4 after"""
+    db.closed_receipt_id = receive(db, 10, PERIOD_END - timedelta(days=5))
+    PeriodCloseService().close_period(db.company_id, PERIOD_END, db.user_id)
+    receive(db, 4, TODAY)
+    return db
+
+
+def balance(db, as_of):
+    with session_scope() as session:
+        return PeriodCloseService().balances_as_of(session, db.company_id, as_of)[
+            (db.warehouse_ids[0], db.item_ids[0])
+        ]
+
+
+def test_close_freezes_balances_and_blocks_posting(closed):
+    with session_scope() as session:
+        frozen = session.query(PeriodBalance).filter_by(period_end=PERIOD_END).one()
+        assert (frozen.qty, frozen.value) == (Decimal(10), Decimal(20))
+
+    assert balance(closed, PERIOD_END) == (Decimal(10), Decimal(20))
+    assert balance(closed, TODAY) == (Decimal(14), Decimal(28))
+
+    with pytest.raises(PostingError):
+        receive(closed, 1, PERIOD_END)
+    with pytest.raises(PostingError):
+        PostingService().reverse_document(closed.closed_receipt_id, closed.user_id, TODAY)
+
+
+def test_close_rejects_open_and_already_closed_periods(closed):
+    with pytest.raises(PeriodCloseError):
+        PeriodCloseService().close_period(closed.company_id, TODAY)
+    with pytest.raises(PeriodCloseError):
+        PeriodCloseService().close_period(closed.company_id, PERIOD_END - timedelta(days=1))
+
+
+def test_reopen_only_latest_period(closed):
+    later_end = TODAY - timedelta(days=1)
+    PeriodCloseService().close_period(closed.company_id, later_end)
+
+    with pytest.raises(PeriodCloseError):
+        PeriodCloseService().reopen_period(closed.company_id, PERIOD_END)
+
+    PeriodCloseService().reopen_period(closed.company_id, later_end)
+    PeriodCloseService().reopen_period(closed.company_id, PERIOD_END)
+
+    with session_scope() as session:
+        assert session.query(PeriodBalance).count() == 0
+        assert not PeriodCloseService().is_closed(session, closed.company_id, PERIOD_END)
+
+    receive(closed, 1, PERIOD_END)
+    assert balance(closed, TODAY) == (Decimal(15), Decimal(30))
@@ -0,0 +1,94 @@
+"""
+Tests for idempotent posting and resumable posting runs
+اختبارات الترحيل المتكرر الآمن ودفعات الترحيل القابلة للاستئناف
+"""
+
+from decimal import Decimal
+
+import pytest
+
+from data import DocumentLine, DocumentType, InventoryLedger, PostingJournal, StockBalance, session_scope
+from services import PostingService, PostingRunService, ValidationError
+from services.posting_journal import JOURNAL_FAILED, JOURNAL_POSTED
+from services.posting_run import RUN_COMPLETED, RUN_FAILED
+from tests.factories import add_document, receipt_line
+
+
+def add_receipt(db, qty):
+    with session_scope() as session:
+        return add_document(session, db.company_id, DocumentType.GRN_RECEIPT,
+                            [receipt_line(db.item_ids[0], qty, 1)],
+                            to_warehouse_id=db.warehouse_ids[0])
+
+
+def add_issue(db, qty):
+    with session_scope() as session:
+        return add_document(session, db.company_id, DocumentType.ISSUE,
+                            [dict(item_id=db.item_ids[0], base_qty=Decimal(qty))],
+                            from_warehouse_id=db.warehouse_ids[0])
+
+
+def on_hand(db):
+    with session_scope() as session:
+        return session.query(StockBalance.on_hand_qty).filter_by(item_id=db.item_ids[0]).scalar()
+
+
+def journal(document_id):
+    with session_scope() as session:
+        return [
+            (row.attempt, row.status, row.run_id)
+            for row in session.query(PostingJournal).filter_by(doc_id=document_id).order_by(PostingJournal.attempt)
+        ]
+
+
+def test_repeated_token_posts_once(db):
+    receipt_id = add_receipt(db, 10)
+
+    assert PostingService().post_document(receipt_id, db.user_id, token='request-1')
+    assert PostingService().post_document(receipt_id, db.user_id, token='request-1')
+
+    with session_scope() as session:
+        assert session.query(InventoryLedger).filter_by(doc_id=receipt_id).count() == 1
+    assert on_hand(db) == Decimal(10)
+    assert journal(receipt_id) == [(1, JOURNAL_POSTED, None)]
+
+
+def test_failed_attempt_can_be_retried_with_its_token(db):
+    issue_id = add_issue(db, 5)
+
+    with pytest.raises(ValidationError):
+        PostingService().post_document(issue_id, db.user_id, token='request-2')
+
+    PostingService().post_document(add_receipt(db, 8), db.user_id)
+    PostingService().post_document(issue_id, db.user_id, token='request-2')
+
+    assert on_hand(db) == Decimal(3)
+    assert journal(issue_id) == [(1, JOURNAL_FAILED, None), (2, JOURNAL_POSTED, None)]
+
+
+def test_run_resumes_after_failed_chunk(db):
+    first_id = add_receipt(db, 10)
+    short_id = add_issue(db, 50)
+    last_id = add_receipt(db, 5)
+    document_ids = [first_id, short_id, last_id]
+
+    with pytest.raises(ValidationError):
+        PostingRunService().start(document_ids, db.user_id, token='run-1', chunk_size=1)
+
+    with session_scope() as session:
+        run_id = PostingRunService().unfinished_runs(session, db.user_id)[0]['run_id']
+    status = PostingRunService().status(run_id)
+    assert (status['status'], status['done']) == (RUN_FAILED, 1)
+    assert on_hand(db) == Decimal(10)
+
+    with session_scope() as session:
+        line = session.query(DocumentLine).filter_by(header_id=short_id).one()
+        line.qty = line.base_qty = Decimal(4)
+
+    # Starting again with the token resumes the same run from its checkpoint
+    status = PostingRunService().start(document_ids, db.user_id, token='run-1', chunk_size=1)
+
+    assert (status['run_id'], status['status'], status['done']) == (run_id, RUN_COMPLETED, 3)
+    assert on_hand(db) == Decimal(11)
+    assert journal(first_id) == [(1, JOURNAL_POSTED, run_id)]
+    assert journal(short_id) == [(1, JOURNAL_POSTED, run_id)]
@@ -0,0 +1,205 @@
+"""
+Tests for production order backflush
+اختبارات الترحيل التلقائي لأوامر الإنتاج
+"""
+
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from config import SEQUENCE_CONFIG
+from data import (
+    DocumentHeader, DocumentLine, DocumentType, InventoryLedger,
+    ProductionOrder, StockBalance, session_scope
+)
+from services import (
+    NumberingError, PostingService, ProductionError, ProductionService, ValidationError
+)
+from tests.factories import add_bom, add_document, add_sequence, add_serials, receipt_line
+
+PRODUCTION_TYPES = {
+    DocumentType.PRODUCTION_ISSUE: 'PI',
+    DocumentType.PRODUCTION_RECEIPT: 'PR',
+    DocumentType.SCRAP: 'SC',
+}
+
+
+def add_order(session, db, components, planned_qty=10, item_id=None):
+    """Released production order (of the first item by default) from (item_id, qty per unit) components"""
+    item_id = item_id or db.item_ids[0]
+    bom_id = add_bom(session, db.company_id, item_id, components)
+
+    order = ProductionOrder(company_id=db.company_id, warehouse_id=db.warehouse_ids[0],
+                            po_no='PO1', po_date=date.today(), item_id=item_id,
+                            bom_id=bom_id, planned_qty=Decimal(planned_qty),
+                            status='RELEASED', created_by=db.user_id)
+    session.add(order)
+    session.flush()
+    return order.id
+
+
+@pytest.fixture
+def sequences(db):
+    with session_scope() as session:
+        for doc_type, prefix in PRODUCTION_TYPES.items():
+            add_sequence(session, db.company_id, doc_type, prefix)
+    return db
+
+
+def receive(db, lines):
+    with session_scope() as session:
+        receipt_id = add_document(session, db.company_id, DocumentType.GRN_RECEIPT, lines,
+                                  to_warehouse_id=db.warehouse_ids[0])
+    PostingService().post_document(receipt_id, db.user_id)
+
+
+def test_backflush_receives_at_consumed_cost(sequences):
+    db = sequences
+    receive(db, [receipt_line(db.item_ids[1], 100, 3), receipt_line(db.item_ids[2], 50, 10)])
+    with session_scope() as session:
+        order_id = add_order(session, db, [(db.item_ids[1], 2), (db.item_ids[2], 1)])
+
+    result = ProductionService().backflush(order_id, Decimal(8), db.user_id, scrap_qty=Decimal(2))
+
+    with session_scope() as session:
+        receipt_value = session.query(InventoryLedger.value_in).filter(
+            InventoryLedger.doc_id == result['receipt_doc_id']
+        ).scalar()
+        finished = session.query(StockBalance).filter_by(item_id=db.item_ids[0]).one()
+        order = session.get(ProductionOrder, order_id)
+
+        # 10 units x (2 x 3 + 1 x 10)
+        assert Decimal(receipt_value) == Decimal(160)
+        assert finished.on_hand_qty == Decimal(8)
+        assert finished.on_hand_value == Decimal(128)
+        assert order.produced_qty == Decimal(8)
+        assert order.status == 'IN_PROGRESS'
+
+
+def test_backflush_without_scrap_uses_no_scrap_number(sequences):
+    db = sequences
+    receive(db, [receipt_line(db.item_ids[1], 100, 1)])
+    with session_scope() as session:
+        order_id = add_order(session, db, [(db.item_ids[1], 1)])
+
+    ProductionService().backflush(order_id, Decimal(5), db.user_id)
+    result = ProductionService().backflush(order_id, Decimal(1), db.user_id, scrap_qty=Decimal(1))
+
+    with session_scope() as session:
+        scrap = session.get(DocumentHeader, result['scrap_doc_id'])
+        assert scrap.doc_no == 'SC0001'
+
+
+def test_backflush_no_gaps_numbers(sequences, monkeypatch):
+    db = sequences
+    monkeypatch.setitem(SEQUENCE_CONFIG, 'doc_type_policies',
+                        {doc_type.value: 'NO_GAPS' for doc_type in PRODUCTION_TYPES})
+    receive(db, [receipt_line(db.item_ids[1], 10, 1)])
+    with session_scope() as session:
+        order_id = add_order(session, db, [(db.item_ids[1], 1)])
+
+    # Fails after taking its numbers: they are given back by the rollback
+    with pytest.raises(ValidationError):
+        ProductionService().backflush(order_id, Decimal(50), db.user_id)
+
+    first = ProductionService().backflush(order_id, Decimal(2), db.user_id)
+    second = ProductionService().backflush(order_id, Decimal(2), db.user_id)
+
+    with session_scope() as session:
+        numbers = [session.get(DocumentHeader, result['issue_doc_id']).doc_no
+                   for result in (first, second)]
+    assert numbers == ['PI0001', 'PI0002']
+
+
+def test_backflush_without_sequence_raises(db):
+    receive(db, [receipt_line(db.item_ids[1], 10, 1)])
+    with session_scope() as session:
+        order_id = add_order(session, db, [(db.item_ids[1], 1)])
+
+    with pytest.raises(NumberingError):
+        ProductionService().backflush(order_id, Decimal(1), db.user_id)
+
+
+def test_backflush_issues_allocated_serials(sequences):
+    db = sequences
+    with session_scope() as session:
+        serial_ids = add_serials(session, db.company_id, db.serial_item_id, ['S1', 'S2', 'S3'])
+    receive(db, [receipt_line(db.serial_item_id, 1, 7, serial_id=serial_id) for serial_id in serial_ids])
+    with session_scope() as session:
+        order_id = add_order(session, db, [(db.serial_item_id, 1)])
+
+    result = ProductionService().backflush(order_id, Decimal(2), db.user_id)
+
+    with session_scope() as session:
+        issued = {
+            line.serial_id for line in session.query(DocumentLine).filter(
+                DocumentLine.header_id == result['issue_doc_id']
+            )
+        }
+    assert len(issued) == 2 and issued <= set(serial_ids)
+
+
+def test_tracked_component_shortage_names_component(sequences):
+    db = sequences
+    with session_scope() as session:
+        serial_ids = add_serials(session, db.company_id, db.serial_item_id, ['S1'])
+    receive(db, [receipt_line(db.serial_item_id, 1, 7, serial_id=serial_ids[0])])
+    with session_scope() as session:
+        order_id = add_order(session, db, [(db.serial_item_id, 1)])
+
+    with pytest.raises(ProductionError, match='SER'):
+        ProductionService().backflush(order_id, Decimal(3), db.user_id)
+
+
+def test_backflush_explodes_sub_assemblies(sequences):
+    db = sequences
+    receive(db, [receipt_line(db.item_ids[1], 100, 2)])
+    with session_scope() as session:
+        # The second item is a sub-assembly made of 3 units of the first component
+        add_bom(session, db.company_id, db.item_ids[2], [(db.item_ids[1], 3)], bom_no='B2')
+        order_id = add_order(session, db, [(db.item_ids[1], 2), (db.item_ids[2], 1)])
+
+    result = ProductionService().backflush(order_id, Decimal(4), db.user_id)
+
+    with session_scope() as session:
+        issued = session.query(InventoryLedger.item_id, InventoryLedger.qty_out).filter(
+            InventoryLedger.doc_id == result['issue_doc_id']
+        ).all()
+        receipt_value = session.query(InventoryLedger.value_in).filter(
+            InventoryLedger.doc_id == result['receipt_doc_id']
+        ).scalar()
+
+    # 4 x (2 + 1 x 3) units at 2
+    assert [(item_id, Decimal(qty)) for item_id, qty in issued] == [(db.item_ids[1], Decimal(20))]
+    assert Decimal(receipt_value) == Decimal(40)
+
+
+def test_scrap_is_written_off_at_receipt_cost(sequences):
+    db = sequences
+    # Earlier stock of the finished item at a different cost
+    receive(db, [receipt_line(db.item_ids[0], 10, 100), receipt_line(db.item_ids[1], 100, 3)])
+    with session_scope() as session:
+        order_id = add_order(session, db, [(db.item_ids[1], 2)])
+
+    result = ProductionService().backflush(order_id, Decimal(8), db.user_id, scrap_qty=Decimal(2))
+
+    with session_scope() as session:
+        scrap_value = session.query(InventoryLedger.value_out).filter(
+            InventoryLedger.doc_id == result['scrap_doc_id']
+        ).scalar()
+        finished = session.query(StockBalance).filter_by(item_id=db.item_ids[0]).one()
+
+        # 10 units received at 2 x 3; the 2 scrapped leave at 6, not the average
+        assert Decimal(scrap_value) == Decimal(12)
+        assert (finished.on_hand_qty, finished.on_hand_value) == (Decimal(18), Decimal(1048))
+
+
+def test_backflush_rejects_serial_tracked_product(sequences):
+    db = sequences
+    receive(db, [receipt_line(db.item_ids[1], 10, 1)])
+    with session_scope() as session:
+        order_id = add_order(session, db, [(db.item_ids[1], 1)], item_id=db.serial_item_id)
+
+    with pytest.raises(ProductionError):
+        ProductionService().backflush(order_id, Decimal(1), db.user_id)
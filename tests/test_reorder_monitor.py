@@ -0,0 +1,108 @@
+"""
+Tests for reorder threshold events and the reorder report
+اختبارات أحداث حدود إعادة الطلب وتقرير إعادة الطلب
+"""
+
+from decimal import Decimal
+
+import pytest
+
+from data import DocumentType, Item, session_scope
+from reports.inventory_reports import InventoryReports
+from services import PostingService, ReorderMonitorService, ValidationError
+from tests.factories import add_document, receipt_line
+
+
+@pytest.fixture
+def monitored(db):
+    """First item with reorder point 8, minimum 5, safety stock 2 and maximum 20; 10 received"""
+    with session_scope() as session:
+        item = session.get(Item, db.item_ids[0])
+        item.reorder_point, item.min_qty, item.safety_stock, item.max_qty = (
+            Decimal(8), Decimal(5), Decimal(2), Decimal(20)
+        )
+    post(db, DocumentType.GRN_RECEIPT, [receipt_line(db.item_ids[0], 10, 2)],
+         to_warehouse_id=db.warehouse_ids[0])
+
+    with session_scope() as session:
+        service = ReorderMonitorService()
+        service.mark_processed(session, [event.id for event in service.pending_events(session, db.company_id)])
+
+    events = []
+    ReorderMonitorService.subscribe(events.append)
+    db.events = events
+    yield db
+    ReorderMonitorService.unsubscribe(events.append)
+
+
+def post(db, doc_type, lines, **warehouses):
+    with session_scope() as session:
+        document_id = add_document(session, db.company_id, doc_type, lines, **warehouses)
+    PostingService().post_document(document_id, db.user_id)
+    return document_id
+
+
+def issue(db, qty):
+    return post(db, DocumentType.ISSUE, [dict(item_id=db.item_ids[0], base_qty=Decimal(qty))],
+                from_warehouse_id=db.warehouse_ids[0])
+
+
+def crossings(events):
+    return sorted((event['threshold'], event['direction'], event['qty_after']) for event in events)
+
+
+def test_crossings_are_published_after_commit(monitored):
+    db = monitored
+    issue_id = issue(db, 5)
+
+    assert crossings(db.events) == [
+        ('MIN_QTY', 'BELOW', Decimal(5)),
+        ('REORDER_POINT', 'BELOW', Decimal(5)),
+    ]
+
+    # Staying on the same side of every threshold raises nothing
+    db.events.clear()
+    issue(db, 1)
+    assert db.events == []
+
+    PostingService().reverse_document(issue_id, db.user_id)
+    assert crossings(db.events) == [
+        ('MIN_QTY', 'RECOVERED', Decimal(9)),
+        ('REORDER_POINT', 'RECOVERED', Decimal(9)),
+    ]
+
+
+def test_failed_posting_publishes_nothing(monitored):
+    db = monitored
+
+    with pytest.raises(ValidationError):
+        issue(db, 50)
+
+    assert db.events == []
+    with session_scope() as session:
+        assert ReorderMonitorService().pending_events(session, db.company_id) == []
+
+
+def test_pending_events_until_processed(monitored):
+    db = monitored
+    issue(db, 9)
+
+    with session_scope() as session:
+        service = ReorderMonitorService()
+        pending = service.pending_events(session, db.company_id)
+        assert sorted(event.threshold for event in pending) == ['MIN_QTY', 'REORDER_POINT', 'SAFETY_STOCK']
+
+        assert service.mark_processed(session, [event.id for event in pending], db.user_id) == 3
+        assert service.pending_events(session, db.company_id) == []
+
+
+def test_reorder_report_orders_up_to_maximum(monitored):
+    db = monitored
+    issue(db, 4)
+
+    with session_scope() as session:
+        rows = InventoryReports.reorder_report(session, db.company_id)
+
+    assert [(row['item_code'], row['current_qty'], row['shortage'], row['order_qty']) for row in rows] == [
+        ('I1', 6.0, 14.0, 14.0)
+    ]
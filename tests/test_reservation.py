@@ -0,0 +1,103 @@
+"""
+Tests for stock reservations and available-to-promise
+اختبارات حجز المخزون والكميات المتاحة
+"""
+
+from decimal import Decimal
+
+import pytest
+
+from data import DocumentType, session_scope
+from services import PostingService, ReservationService, ValidationError
+from tests.factories import add_document, add_lot, receipt_line
+
+
+@pytest.fixture
+def stocked(db):
+    """100 units of the first item received into the first warehouse"""
+    with session_scope() as session:
+        receipt_id = add_document(session, db.company_id, DocumentType.GRN_RECEIPT,
+                                  [receipt_line(db.item_ids[0], 100, 5)],
+                                  to_warehouse_id=db.warehouse_ids[0])
+    PostingService().post_document(receipt_id, db.user_id)
+    return db
+
+
+def add_issue(db, qty):
+    with session_scope() as session:
+        return add_document(session, db.company_id, DocumentType.ISSUE,
+                            [dict(item_id=db.item_ids[0], base_qty=Decimal(qty))],
+                            from_warehouse_id=db.warehouse_ids[0])
+
+
+def available(db):
+    with session_scope() as session:
+        return ReservationService().available(session, db.item_ids[0], db.warehouse_ids[0])
+
+
+def test_submit_reserves_stock(stocked):
+    issue_id = add_issue(stocked, 60)
+
+    with session_scope() as session:
+        ReservationService().submit(session, issue_id, stocked.user_id)
+
+    assert available(stocked) == Decimal(40)
+
+
+def test_second_issue_of_reserved_stock_is_rejected(stocked):
+    reserved_id = add_issue(stocked, 60)
+    with session_scope() as session:
+        ReservationService().submit(session, reserved_id, stocked.user_id)
+
+    # A draft posted directly may only take what is not promised elsewhere
+    other_id = add_issue(stocked, 50)
+    with pytest.raises(ValidationError):
+        PostingService().post_document(other_id, stocked.user_id)
+
+    fitting_id = add_issue(stocked, 40)
+    PostingService().post_document(fitting_id, stocked.user_id)
+
+    # The reserved document can still post its full quantity
+    PostingService().post_document(reserved_id, stocked.user_id)
+    assert available(stocked) == Decimal(0)
+
+
+def test_cancel_releases_reservation(stocked):
+    issue_id = add_issue(stocked, 60)
+    with session_scope() as session:
+        ReservationService().submit(session, issue_id, stocked.user_id)
+    with session_scope() as session:
+        ReservationService().cancel(session, issue_id)
+
+    assert available(stocked) == Decimal(100)
+
+
+def test_bulk_availability_per_lot(db):
+    with session_scope() as session:
+        lot_a = add_lot(session, db.company_id, db.lot_item_id, 'A')
+        lot_b = add_lot(session, db.company_id, db.lot_item_id, 'B')
+        receipt_id = add_document(session, db.company_id, DocumentType.GRN_RECEIPT, [
+            receipt_line(db.lot_item_id, 10, 1, lot_id=lot_a),
+            receipt_line(db.lot_item_id, 20, 1, lot_id=lot_b),
+        ], to_warehouse_id=db.warehouse_ids[0])
+    PostingService().post_document(receipt_id, db.user_id)
+
+    with session_scope() as session:
+        issue_id = add_document(session, db.company_id, DocumentType.ISSUE,
+                                [dict(item_id=db.lot_item_id, base_qty=Decimal(4), lot_id=lot_a)],
+                                from_warehouse_id=db.warehouse_ids[0])
+        ReservationService().submit(session, issue_id, db.user_id)
+
+    warehouse_id = db.warehouse_ids[0]
+    with session_scope() as session:
+        result = ReservationService().available_bulk(session, [
+            (db.lot_item_id, warehouse_id, None),
+            (db.lot_item_id, warehouse_id, lot_a),
+            (db.lot_item_id, warehouse_id, lot_b),
+        ])
+
+    assert result == {
+        (db.lot_item_id, warehouse_id, None): Decimal(26),
+        (db.lot_item_id, warehouse_id, lot_a): Decimal(6),
+        (db.lot_item_id, warehouse_id, lot_b): Decimal(20),
+    }
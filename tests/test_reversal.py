@@ -0,0 +1,132 @@
+"""
+Tests for reversal of posted documents
+اختبارات عكس المستندات المرحلة
+"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+
+from data import DocumentType, InventoryLedger, ReceiptLayer, SerialStatus, StockBalance, session_scope
+from services import InventoryAgingService, KPIService, PostingService
+from tests.factories import add_document, add_serials, receipt_line
+
+TODAY = date.today()
+
+
+def post(db, doc_type, lines, posting_date, **warehouses):
+    with session_scope() as session:
+        document_id = add_document(session, db.company_id, doc_type, lines, **warehouses)
+    PostingService().post_document(document_id, db.user_id, posting_date)
+    return document_id
+
+
+def layers(db):
+    with session_scope() as session:
+        return sorted(
+            (row.warehouse_id, row.receipt_date, row.qty_remaining)
+            for row in session.query(ReceiptLayer).filter_by(company_id=db.company_id)
+        )
+
+
+def test_reversed_issue_restores_balance_and_receipt_dates(db):
+    warehouse_id = db.warehouse_ids[0]
+    received_on = TODAY - timedelta(days=20)
+    post(db, DocumentType.GRN_RECEIPT, [receipt_line(db.item_ids[0], 10, 4)],
+         received_on, to_warehouse_id=warehouse_id)
+    post(db, DocumentType.GRN_RECEIPT, [receipt_line(db.item_ids[0], 5, 4)],
+         TODAY - timedelta(days=10), to_warehouse_id=warehouse_id)
+    issue_id = post(db, DocumentType.ISSUE, [dict(item_id=db.item_ids[0], base_qty=Decimal(12))],
+                    TODAY - timedelta(days=5), from_warehouse_id=warehouse_id)
+
+    PostingService().reverse_document(issue_id, db.user_id, TODAY)
+
+    with session_scope() as session:
+        balance = session.query(StockBalance).filter_by(item_id=db.item_ids[0]).one()
+        assert (balance.on_hand_qty, balance.on_hand_value) == (Decimal(15), Decimal(60))
+        kpis = KPIService().get_dashboard_kpis(session, db.company_id)
+        assert kpis['inventory_value'] == Decimal(60)
+
+    # The issued slices come back on their receipt dates, not the reversal date
+    assert layers(db) == [
+        (warehouse_id, received_on, Decimal(10)),
+        (warehouse_id, TODAY - timedelta(days=10), Decimal(5)),
+    ]
+    applied = layers(db)
+    InventoryAgingService().rebuild(db.company_id, workers=1)
+    assert layers(db) == applied
+
+
+def test_reversed_transfer_restores_source_layers(db):
+    source_id, target_id = db.warehouse_ids
+    received_on = TODAY - timedelta(days=30)
+    post(db, DocumentType.GRN_RECEIPT, [receipt_line(db.item_ids[0], 8, 1)],
+         received_on, to_warehouse_id=source_id)
+    transfer_id = post(db, DocumentType.TRANSFER, [dict(item_id=db.item_ids[0], base_qty=Decimal(3))],
+                       TODAY - timedelta(days=2), from_warehouse_id=source_id,
+                       to_warehouse_id=target_id)
+
+    PostingService().reverse_document(transfer_id, db.user_id, TODAY)
+
+    assert layers(db) == [(source_id, received_on, Decimal(8))]
+
+
+def test_reversed_serial_issue_returns_serial_to_stock(db):
+    warehouse_id = db.warehouse_ids[0]
+    with session_scope() as session:
+        serial_id, = add_serials(session, db.company_id, db.serial_item_id, ['S1'])
+    post(db, DocumentType.GRN_RECEIPT, [receipt_line(db.serial_item_id, 1, 9, serial_id=serial_id)],
+         TODAY, to_warehouse_id=warehouse_id)
+    issue_id = post(db, DocumentType.ISSUE,
+                    [dict(item_id=db.serial_item_id, base_qty=Decimal(1), serial_id=serial_id)],
+                    TODAY, from_warehouse_id=warehouse_id)
+
+    with session_scope() as session:
+        assert not session.query(SerialStatus).filter_by(serial_id=serial_id).one().in_stock
+
+    PostingService().reverse_document(issue_id, db.user_id, TODAY)
+
+    with session_scope() as session:
+        status = session.query(SerialStatus).filter_by(serial_id=serial_id).one()
+        assert status.in_stock and status.warehouse_id == warehouse_id
+
+
+def test_batch_reversal_replays_layers_once(db, monkeypatch):
+    warehouse_id = db.warehouse_ids[0]
+    received_on = TODAY - timedelta(days=20)
+    post(db, DocumentType.GRN_RECEIPT, [receipt_line(db.item_ids[0], 10, 4)],
+         received_on, to_warehouse_id=warehouse_id)
+    issue_ids = [
+        post(db, DocumentType.ISSUE, [dict(item_id=db.item_ids[0], base_qty=Decimal(qty))],
+             TODAY - timedelta(days=days), from_warehouse_id=warehouse_id)
+        for qty, days in ((3, 10), (4, 5))
+    ]
+
+    replays = []
+    replay = InventoryAgingService.replay
+    monkeypatch.setattr(InventoryAgingService, 'replay',
+                        lambda self, *args: replays.append(args) or replay(self, *args))
+
+    PostingService().reverse_documents(issue_ids, db.user_id, TODAY)
+
+    assert len(replays) == 1
+    assert layers(db) == [(warehouse_id, received_on, Decimal(10))]
+
+
+def test_reversed_back_dated_issue_recosts_later_issues(db):
+    warehouse_id = db.warehouse_ids[0]
+    post(db, DocumentType.GRN_RECEIPT, [receipt_line(db.item_ids[0], 10, 4)],
+         TODAY - timedelta(days=20), to_warehouse_id=warehouse_id)
+    early_id = post(db, DocumentType.ISSUE, [dict(item_id=db.item_ids[0], base_qty=Decimal(3))],
+                    TODAY - timedelta(days=10), from_warehouse_id=warehouse_id)
+    post(db, DocumentType.GRN_RECEIPT, [receipt_line(db.item_ids[0], 10, 10)],
+         TODAY - timedelta(days=8), to_warehouse_id=warehouse_id)
+    late_id = post(db, DocumentType.ISSUE, [dict(item_id=db.item_ids[0], base_qty=Decimal(4))],
+                   TODAY - timedelta(days=5), from_warehouse_id=warehouse_id)
+
+    PostingService().reverse_document(early_id, db.user_id, TODAY)
+
+    with session_scope() as session:
+        # Without the early issue the average before the late one is 140 / 20
+        assert session.query(InventoryLedger.value_out).filter_by(doc_id=late_id).scalar() == Decimal(28)
+        balance = session.query(StockBalance).filter_by(item_id=db.item_ids[0]).one()
+        assert (balance.on_hand_qty, balance.on_hand_value) == (Decimal(16), Decimal(112))
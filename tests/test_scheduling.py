@@ -0,0 +1,110 @@
+"""
+Tests for finite-capacity scheduling of production orders
+اختبارات جدولة أوامر الإنتاج بطاقة محدودة
+"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+
+from data import BOM, ProductionOrder, Routing, RoutingStep, WorkCenter, session_scope
+from services import CapacitySchedulerService, SchedulingError
+
+MONDAY = date(2024, 1, 1)
+FRIDAY = MONDAY + timedelta(days=4)
+
+
+def add_work_center(session, db, code, capacity_per_day):
+    work_center = WorkCenter(company_id=db.company_id, code=code, name_ar=code, name_en=code,
+                             capacity_per_day=Decimal(capacity_per_day))
+    session.add(work_center)
+    session.flush()
+    return work_center.id
+
+
+def add_order(session, db, po_no, steps, planned_qty=10, po_date=MONDAY, completion_date=None):
+    """Released order whose routing has (work_center_id, setup hours, run hours per unit) steps"""
+    bom = BOM(company_id=db.company_id, item_id=db.item_ids[0], bom_no=f'B-{po_no}',
+              effective_date=date(2020, 1, 1), base_qty=Decimal(1), uom_id=1)
+    session.add(bom)
+    session.flush()
+
+    routing = Routing(company_id=db.company_id, bom_id=bom.id, routing_no=f'R-{po_no}')
+    for step_no, (work_center_id, setup_time, run_time) in enumerate(steps, start=1):
+        routing.steps.append(RoutingStep(step_no=step_no, work_center_id=work_center_id,
+                                         operation_name=f'OP{step_no}',
+                                         setup_time=Decimal(setup_time), run_time=Decimal(run_time)))
+    order = ProductionOrder(company_id=db.company_id, warehouse_id=db.warehouse_ids[0],
+                            po_no=po_no, po_date=po_date, item_id=db.item_ids[0], bom_id=bom.id,
+                            planned_qty=Decimal(planned_qty), completion_date=completion_date,
+                            status='RELEASED', created_by=db.user_id)
+    session.add_all([routing, order])
+    session.flush()
+    return order.id
+
+
+def schedule(db, **options):
+    with session_scope() as session:
+        results = CapacitySchedulerService().schedule(session, db.company_id, MONDAY, **options)
+    return {result['order_id']: result for result in results}
+
+
+def test_capacity_spills_over_and_steps_chain(db):
+    due = MONDAY + timedelta(days=30)
+    with session_scope() as session:
+        cutting = add_work_center(session, db, 'CUT', 8)
+        assembly = add_work_center(session, db, 'ASM', 8)
+        # 2 + 10 x 1 = 12 hours of cutting, then 4 hours of assembly
+        order_id = add_order(session, db, 'PO1', [(cutting, 2, 1), (assembly, 4, 0)],
+                             completion_date=due)
+
+    result = schedule(db)[order_id]
+
+    assert [(step['start_date'], step['end_date']) for step in result['steps']] == [
+        (MONDAY, MONDAY + timedelta(days=1)),
+        (MONDAY + timedelta(days=1), MONDAY + timedelta(days=1)),
+    ]
+    assert (result['start_date'], result['planned_end_date']) == (MONDAY, MONDAY + timedelta(days=1))
+
+    with session_scope() as session:
+        order = session.get(ProductionOrder, order_id)
+        assert (order.start_date, order.planned_end_date) == (MONDAY, MONDAY + timedelta(days=1))
+        # The requested date is not overwritten by the schedule
+        assert order.completion_date == due
+
+
+def test_earliest_due_order_books_capacity_first(db):
+    with session_scope() as session:
+        cutting = add_work_center(session, db, 'CUT', 8)
+        late_id = add_order(session, db, 'PO1', [(cutting, 0, 1)], planned_qty=8,
+                            completion_date=MONDAY + timedelta(days=20))
+        urgent_id = add_order(session, db, 'PO2', [(cutting, 0, 1)], planned_qty=8,
+                              completion_date=MONDAY + timedelta(days=5))
+
+    results = schedule(db)
+
+    assert results[urgent_id]['planned_end_date'] == MONDAY
+    assert results[late_id]['start_date'] == MONDAY + timedelta(days=1)
+
+    # Scheduling again reads the unchanged requested dates
+    assert schedule(db)[urgent_id]['planned_end_date'] == MONDAY
+
+
+def test_non_working_days_are_skipped(db):
+    with session_scope() as session:
+        cutting = add_work_center(session, db, 'CUT', 8)
+        order_id = add_order(session, db, 'PO1', [(cutting, 2, 1)], po_date=FRIDAY)
+
+    result = schedule(db, non_working_weekdays=(5, 6))[order_id]
+
+    assert (result['start_date'], result['planned_end_date']) == (FRIDAY, FRIDAY + timedelta(days=3))
+
+
+def test_week_without_working_days_is_rejected(db):
+    with session_scope() as session:
+        cutting = add_work_center(session, db, 'CUT', 8)
+        add_order(session, db, 'PO1', [(cutting, 2, 1)])
+
+    with pytest.raises(SchedulingError):
+        schedule(db, non_working_weekdays=range(7))
@@ -0,0 +1,108 @@
+"""
+Tests for stock count freeze, count import and variance posting
+اختبارات تجميد الجرد واستيراد الكميات وترحيل الفروقات
+"""
+
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from data import (
+    DocumentType, ItemCountStat, StockBalance, StockCount, StockCountLine, session_scope
+)
+from services import PostingService, StockCountError, StockCountService
+from tests.factories import add_document, add_sequence, receipt_line
+
+
+@pytest.fixture
+def counted(db):
+    """10 of the first item on the location and 4 of the second, with a draft count"""
+    with session_scope() as session:
+        add_sequence(session, db.company_id, DocumentType.ADJUSTMENT, 'ADJ')
+        receipt_id = add_document(session, db.company_id, DocumentType.GRN_RECEIPT, [
+            receipt_line(db.item_ids[0], 10, 3, to_location_id=db.location_id),
+            receipt_line(db.item_ids[1], 4, 5),
+        ], to_warehouse_id=db.warehouse_ids[0])
+    PostingService().post_document(receipt_id, db.user_id)
+
+    with session_scope() as session:
+        count = StockCount(company_id=db.company_id, warehouse_id=db.warehouse_ids[0],
+                           count_no='CNT1', count_date=date.today(), created_by=db.user_id)
+        session.add(count)
+        session.flush()
+        db.count_id = count.id
+    return db
+
+
+def lines(db):
+    with session_scope() as session:
+        return [
+            (line.item_id, line.location_id, line.system_qty, line.counted_qty, line.variance_qty)
+            for line in session.query(StockCountLine).filter_by(count_id=db.count_id).order_by(StockCountLine.line_no)
+        ]
+
+
+def on_hand(db, item_id):
+    with session_scope() as session:
+        return session.query(StockBalance.on_hand_qty).filter_by(item_id=item_id).scalar()
+
+
+def test_freeze_copies_balances_once(counted):
+    db = counted
+    with session_scope() as session:
+        assert StockCountService().freeze(session, db.count_id) == 2
+
+    assert lines(db) == [
+        (db.item_ids[0], db.location_id, Decimal(10), None, Decimal(0)),
+        (db.item_ids[1], None, Decimal(4), None, Decimal(0)),
+    ]
+
+    with pytest.raises(StockCountError):
+        with session_scope() as session:
+            StockCountService().freeze(session, db.count_id)
+
+
+def test_imported_counts_post_variances(counted):
+    db = counted
+    service = StockCountService()
+    with session_scope() as session:
+        service.freeze(session, db.count_id)
+        result = service.import_counts(session, db.count_id, [
+            {'item_code': 'I1', 'location_code': 'A-01', 'qty': '6'},
+            {'item_code': 'I1', 'location_code': 'A-01', 'qty': '1'},
+            {'item_code': 'I3', 'qty': '2'},
+            {'item_code': 'NOPE', 'qty': '1'},
+            {'item_code': 'I2', 'qty': 'x'},
+        ])
+
+    assert (result['updated'], result['added'], len(result['unknown'])) == (1, 1, 2)
+
+    document_id = service.post_count(db.count_id, db.user_id)
+
+    assert document_id is not None
+    # Scans are summed (7 of 10); the uncounted second item keeps its system quantity
+    assert [line[-1] for line in lines(db)] == [Decimal(-3), Decimal(0), Decimal(2)]
+    assert on_hand(db, db.item_ids[0]) == Decimal(7)
+    assert on_hand(db, db.item_ids[1]) == Decimal(4)
+    assert on_hand(db, db.item_ids[2]) == Decimal(2)
+
+    with session_scope() as session:
+        stats = session.query(ItemCountStat).filter_by(warehouse_id=db.warehouse_ids[0]).count()
+        assert stats == 3
+
+    with pytest.raises(StockCountError):
+        service.post_count(db.count_id, db.user_id)
+
+
+def test_full_count_zeroes_uncounted_lines(counted):
+    db = counted
+    service = StockCountService()
+    with session_scope() as session:
+        service.freeze(session, db.count_id)
+        service.import_counts(session, db.count_id, [{'item_code': 'I1', 'location_code': 'A-01', 'qty': '10'}])
+
+    service.post_count(db.count_id, db.user_id, uncounted_as_zero=True)
+
+    assert on_hand(db, db.item_ids[0]) == Decimal(10)
+    assert on_hand(db, db.item_ids[1]) == Decimal(0)
@@ -0,0 +1,89 @@
+"""
+Tests for UOM conversion closure and cache invalidation
+اختبارات تحويل وحدات القياس والذاكرة المؤقتة
+"""
+
+from decimal import Decimal
+
+import pytest
+
+from data import DocumentLine, ItemUOMConversion, session_scope
+from services import UOMConversionError, UOMConversionService
+
+# Factors are ratios of root factors; compare them at conversion precision
+FACTOR_QUANTUM = Decimal('0.000001')
+
+
+def add_conversion(session, item_id, from_uom_id, to_uom_id, factor):
+    session.add(ItemUOMConversion(item_id=item_id, from_uom_id=from_uom_id,
+                                  to_uom_id=to_uom_id, conversion_factor=Decimal(factor)))
+    session.flush()
+
+
+@pytest.fixture
+def packs(db):
+    """First item: 1 BOX = 12 PCS and 1 CTN = 4 BOX"""
+    uoms = db.uom_ids
+    with session_scope() as session:
+        add_conversion(session, db.item_ids[0], uoms['BOX'], uoms['PCS'], 12)
+        add_conversion(session, db.item_ids[0], uoms['CTN'], uoms['BOX'], 4)
+    return db
+
+
+def factor(db, from_code, to_code, item_id=None):
+    with session_scope() as session:
+        return UOMConversionService().get_factor(
+            session, item_id or db.item_ids[0], db.uom_ids[from_code], db.uom_ids[to_code]
+        ).quantize(FACTOR_QUANTUM)
+
+
+def test_closure_follows_chained_and_reverse_edges(packs):
+    assert factor(packs, 'CTN', 'PCS') == Decimal(48)
+    assert factor(packs, 'PCS', 'CTN') == (Decimal(1) / 48).quantize(FACTOR_QUANTUM)
+    assert factor(packs, 'BOX', 'CTN') == Decimal('0.25')
+
+
+def test_convert_lines_fills_base_qty(packs):
+    uoms = packs.uom_ids
+    lines = [
+        DocumentLine(line_no=1, item_id=packs.item_ids[0], qty=Decimal(2), uom_id=uoms['CTN']),
+        DocumentLine(line_no=2, item_id=packs.item_ids[0], qty=Decimal(5), uom_id=uoms['PCS']),
+    ]
+    with session_scope() as session:
+        UOMConversionService().convert_lines(session, lines)
+
+    assert [line.base_qty for line in lines] == [Decimal(96), Decimal(5)]
+
+
+def test_unconnected_uom_raises(packs):
+    with pytest.raises(UOMConversionError):
+        factor(packs, 'BOX', 'PCS', item_id=packs.item_ids[1])
+
+
+def test_committed_conversion_change_is_seen(packs):
+    assert factor(packs, 'BOX', 'PCS') == Decimal(12)
+
+    with session_scope() as session:
+        conversion = session.query(ItemUOMConversion).filter_by(
+            item_id=packs.item_ids[0], from_uom_id=packs.uom_ids['BOX']
+        ).one()
+        conversion.conversion_factor = Decimal(10)
+
+    assert factor(packs, 'CTN', 'PCS') == Decimal(40)
+
+
+def test_rolled_back_conversion_is_forgotten(packs):
+    uoms = packs.uom_ids
+    item_id = packs.item_ids[1]
+
+    with pytest.raises(RuntimeError):
+        with session_scope() as session:
+            add_conversion(session, item_id, uoms['BOX'], uoms['PCS'], 6)
+            # Cached inside the transaction from the uncommitted row
+            assert UOMConversionService().get_factor(
+                session, item_id, uoms['BOX'], uoms['PCS']
+            ).quantize(FACTOR_QUANTUM) == Decimal(6)
+            raise RuntimeError('abort')
+
+    with pytest.raises(UOMConversionError):
+        factor(packs, 'BOX', 'PCS', item_id=item_id)
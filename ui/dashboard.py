@@ -10,6 +10,8 @@ from PySide6.QtCore import Qt
 from decimal import Decimal
 
 from data import session_scope, Item
+from services.expiry_aging import ExpiryAgingService
+from services.kpi import KPIService
 from utils.logging import get_logger
 
 logger = get_logger('dashboard')
@@ -78,6 +80,15 @@ class DashboardWidget(QWidget):
         )
         kpi_layout.addWidget(self.reorder_card)
         
+        # Stock Expiring Soon Card
+        self.expiring_card = self.create_kpi_card(
+            'قيمة تنتهي خلال 30 يوم',
+            'Expiring in 30 Days',
+            '0.00',
+            '#8b5cf6'
+        )
+        kpi_layout.addWidget(self.expiring_card)
+        
         layout.addLayout(kpi_layout)
         
         # Charts placeholder
@@ -188,10 +199,16 @@ class DashboardWidget(QWidget):
                 
                 self.total_items_card.value_label.setText(str(total_items))
                 
-                # TODO: Calculate other KPIs from stock ledger
-                # - Total inventory value
-                # - Today's movements
-                # - Items below reorder point
+                # Counters maintained at posting time
+                kpis = KPIService().get_dashboard_kpis(session, self.company_id)
+                
+                self.inventory_value_card.value_label.setText(f"{kpis['inventory_value']:,.2f}")
+                self.movements_card.value_label.setText(str(kpis['movements_today']))
+                self.reorder_card.value_label.setText(str(kpis['below_reorder']))
+                
+                # Cached until a posting moves lot stock
+                expiring = ExpiryAgingService().expiring_within(session, self.company_id, 30)
+                self.expiring_card.value_label.setText(f"{expiring['value']:,.2f}")
                 
                 logger.info(f'Dashboard data loaded: {total_items} items')
                 
@@ -11,9 +11,12 @@ from PySide6.QtCore import Qt, QSize, Signal
 from PySide6.QtGui import QAction, QIcon, QKeySequence
 from datetime import datetime
 
+from data import session_scope, Item
+from services.reorder_monitor import ReorderMonitorService
 from utils.logging import get_logger
 from ui.dashboard import DashboardWidget
 from ui.company_selector import CompanySelectorDialog
+from ui.widgets.notification import show_warning
 
 logger = get_logger('main_window')
 
@@ -24,6 +27,7 @@ class MainWindow(QMainWindow):
     # Signals
     company_changed = Signal(int)
     warehouse_changed = Signal(int)
+    reorder_alert = Signal(dict)
     
     def __init__(self, user, company_id, warehouse_id):
         super().__init__()
@@ -41,6 +45,12 @@ class MainWindow(QMainWindow):
         # Load dashboard as default
         self.load_dashboard()
         
+        # Reorder alerts are raised by posting; the queued signal brings
+        # them to the GUI thread whichever thread posted the document
+        self.reorder_alert.connect(self.show_reorder_alert, Qt.QueuedConnection)
+        self._reorder_subscriber = self.reorder_alert.emit
+        ReorderMonitorService.subscribe(self._reorder_subscriber)
+        
         # Window settings
         self.setWindowTitle('نظام إدارة المخزون - Inventory Management System')
         self.resize(1400, 900)
@@ -358,6 +368,23 @@ class MainWindow(QMainWindow):
         if current_widget and hasattr(current_widget, 'refresh'):
             current_widget.refresh()
         
+    def show_reorder_alert(self, reorder_event):
+        """Warn when an item of the current company drops to a stock threshold"""
+        if (reorder_event['company_id'] != self.current_company_id
+                or reorder_event['direction'] != 'BELOW'):
+            return
+        
+        with session_scope() as session:
+            item = session.query(Item).filter_by(id=reorder_event['item_id']).first()
+            item_name = f'{item.code} - {item.name_ar}' if item else str(reorder_event['item_id'])
+        
+        qty = f"{reorder_event['qty_after']:,.2f}"
+        show_warning(
+            self,
+            f'{item_name}: الرصيد {qty} وصل إلى حد {reorder_event["threshold"]}\n'
+            f'Stock {qty} reached {reorder_event["threshold"]}'
+        )
+        
     def show_about(self):
         """Show about dialog"""
         QMessageBox.about(
@@ -382,6 +409,7 @@ class MainWindow(QMainWindow):
         
         if reply == QMessageBox.Yes:
             logger.info('إغلاق النافذة الرئيسية')
+            ReorderMonitorService.unsubscribe(self._reorder_subscriber)
             event.accept()
         else:
             event.ignore()
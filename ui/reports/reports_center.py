@@ -134,6 +134,9 @@ class ReportsCenterScreen(QWidget):
             ('ملخص الحركة / Movement Summary', 'movement_summary'),
             ('تقرير إعادة الطلب / Reorder Report', 'reorder_report'),
             ('تتبع الدفعات / Lot Traceability', 'lot_traceability'),
+            ('أعمار الصلاحية / Expiry Aging', 'expiry_aging'),
+            ('أعمار المخزون / Inventory Aging', 'inventory_aging'),
+            ('تصنيف ABC/XYZ / ABC/XYZ Classification', 'abc_xyz_report'),
         ]
         
         for name, report_id in reports: